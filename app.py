@@ -8,16 +8,24 @@ import time
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'src')))
 
 from src.ui.streamlit_helpers import (
-    process_uploaded_pdf,
-    process_multiple_pdfs,
+    submit_ingest_job,
+    get_ingest_jobs,
+    ensure_ingest_workers,
     get_processed_pdfs,
     generate_answer_ui,
     format_sources,
     clear_chat_history,
     check_db_status,
-    clear_database
+    clear_database,
+    warm_up_vector_store,
+    page_image_url
 )
-from src.utils.chat_history import ChatHistoryManager
+from src.utils.chat_history import (ChatHistoryManager, anonymous_session_id, load_session_secret,
+                                    new_anonymous_token, user_session_id)
+from src.config import settings
+from src.pipeline.tenants import tenant_for_user
+from src.pipeline.rebuild import spawn_rebuild_daemon
+from src.ingestion.job_queue import STAGES as INGEST_STAGES, STAGE_LABELS
 
 # 起動時に古い一時ファイルをクリーンアップ
 def cleanup_temp_files_on_startup():
@@ -47,6 +55,40 @@ def cleanup_temp_files_on_startup():
 # 起動時にクリーンアップ実行
 cleanup_temp_files_on_startup()
 
+
+@st.cache_resource(show_spinner=False)
+def prepare_directories_on_startup():
+    """プロセスごとに1回だけ保存先ディレクトリを作成（設定モジュールはインポート時に作成しない）"""
+    settings.ensure_directories()
+
+
+prepare_directories_on_startup()
+
+
+@st.cache_resource(show_spinner=False)
+def start_ingest_workers_on_startup():
+    """プロセスごとに1回だけ、取り込みワーカーが動いていなければ起動"""
+    return ensure_ingest_workers()
+
+
+start_ingest_workers_on_startup()
+
+
+@st.cache_resource(show_spinner=False)
+def warm_up_on_startup(tenant: str = None):
+    """プロセスごと・テナントごとに1回だけベクトルストアをウォームアップ（最初の検索の遅延を防ぐ）"""
+    return warm_up_vector_store(tenant=tenant)
+
+
+def invalidate_pipeline_cache():
+    """
+    取り込み・クリア後に呼び出し、次回のDB準備時にウォームアップをやり直す
+
+    ドキュメント数やコレクションのハンドルは、コレクションのバージョン番号で自動的に無効化されます。
+    """
+    warm_up_on_startup.clear()
+
+
 # ページ設定
 st.set_page_config(
     page_title="Mini-Notebook RAG",
@@ -73,23 +115,145 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+
+def resolve_history_session_id() -> str:
+    """
+    履歴を分割するIDを決定
+
+    ログインユーザーがいればユーザー単位（"user:<メール>"）、いなければURLの ?session= の
+    署名付きトークンでブラウザセッション単位（"anon:<uuid>"）に分割します（リロードしても同じ履歴を表示するため）。
+    署名が一致しないトークン（"user:..." の指定など）は受け付けず、新しいトークンを発行します。
+    """
+    user = getattr(st, "user", None)
+    if user is not None and getattr(user, "is_logged_in", False) and user.get("email"):
+        return user_session_id(user.get("email"))
+
+    secret = load_session_secret(
+        os.path.join(os.path.dirname(settings.storage.chat_history_path), "session_secret"),
+        settings.app.session_secret
+    )
+    session_id = anonymous_session_id(st.query_params.get("session"), secret)
+    if session_id is None:
+        token = new_anonymous_token(secret)
+        st.query_params["session"] = token
+        session_id = anonymous_session_id(token, secret)
+    return session_id
+
+
+def resolve_tenant_id() -> str:
+    """
+    テナントを決定（ログインユーザーのサーバー側の割り当て、未ログイン・割り当てなしは既定のテナント）
+
+    URLの ?tenant= では他のテナントの検索・取り込み・クリアができないよう、切り替えを受け付けません。
+    """
+    user = getattr(st, "user", None)
+    email = None
+    if user is not None and getattr(user, "is_logged_in", False):
+        email = user.get("email")
+    tenant = tenant_for_user(email)
+
+    requested = st.query_params.get("tenant")
+    if requested and requested != tenant:
+        st.warning("URLでテナントを切り替えることはできません（テナントはログインユーザーごとに割り当てられます）")
+        del st.query_params["tenant"]
+    return tenant
+
+
+def load_older_messages():
+    """表示中の最も古いメッセージより前の履歴を1ページ分読み込む"""
+    page_size = settings.app.chat_page_size
+    first_id = next((m['id'] for m in st.session_state.messages if 'id' in m), None)
+    if first_id is None:
+        st.session_state.has_older_messages = False
+        return
+
+    older = st.session_state.chat_manager.get_messages_before(first_id, page_size)
+    st.session_state.messages = older + st.session_state.messages
+    st.session_state.has_older_messages = len(older) == page_size
+
+
+def append_session_message(message: dict):
+    """セッションにメッセージを追加（メモリ上の件数は上限で打ち切り、古いものはDBから再読込可能）"""
+    st.session_state.messages.append(message)
+    overflow = len(st.session_state.messages) - settings.app.max_chat_history
+    if overflow > 0:
+        del st.session_state.messages[:overflow]
+        st.session_state.has_older_messages = True
+
+
 # チャット履歴マネージャーの初期化
 if 'chat_manager' not in st.session_state:
-    st.session_state.chat_manager = ChatHistoryManager(max_messages=50)
+    st.session_state.chat_manager = ChatHistoryManager(
+        max_messages=settings.app.max_chat_history,
+        session_id=resolve_history_session_id()
+    )
 
 # セッション状態の初期化
+if 'tenant' not in st.session_state:
+    st.session_state.tenant = resolve_tenant_id()
 if 'messages' not in st.session_state:
-    # 永続化された履歴をロード
-    st.session_state.messages = st.session_state.chat_manager.load_history()
+    # 永続化された履歴は直近の1ページのみロード（古い履歴は必要に応じて追加読み込み）
+    chat_manager = st.session_state.chat_manager
+    st.session_state.messages = chat_manager.get_recent_messages(settings.app.chat_page_size)
+    st.session_state.has_older_messages = (
+        chat_manager.get_message_count() > len(st.session_state.messages)
+    )
 if 'pdf_uploaded' not in st.session_state:
     st.session_state.pdf_uploaded = False
 if 'pdf_processed' not in st.session_state:
     st.session_state.pdf_processed = False
+if 'completed_jobs' not in st.session_state:
+    # 表示済みの完了ジョブ（以前のセッションで完了したものは通知しない）
+    st.session_state.completed_jobs = {
+        job['id'] for job in get_ingest_jobs(owner=st.session_state.chat_manager.session_id)
+        if job['status'] == 'done'
+    }
 if 'current_pdf' not in st.session_state:
     st.session_state.current_pdf = None
 if 'db_ready' not in st.session_state:
-    db_status = check_db_status()
+    db_status = check_db_status(tenant=st.session_state.tenant)
     st.session_state.db_ready = db_status['exists'] and db_status['document_count'] > 0
+    if st.session_state.db_ready:
+        warm_up_on_startup(st.session_state.tenant)
+
+
+def _ingest_job_panel():
+    """このセッションの取り込みジョブの進捗を表示し、完了したらDBの状態を更新"""
+    jobs = get_ingest_jobs(owner=st.session_state.chat_manager.session_id)
+    if not jobs:
+        return
+
+    st.header("⏳ 取り込みジョブ")
+    newly_done = False
+    for job in jobs:
+        if job['status'] == 'done':
+            ocr_pages = job['stage_timings'].get('ocr_pages')
+            ocr_note = f"（OCR {ocr_pages}ページ）" if ocr_pages else ""
+            st.caption(f"✅ {job['filename']}: {job['chunks_count']}チャンク{ocr_note}")
+            if job['id'] not in st.session_state.completed_jobs:
+                st.session_state.completed_jobs.add(job['id'])
+                newly_done = True
+        elif job['status'] == 'failed':
+            st.caption(f"❌ {job['filename']}: {job['error'] or job['message']}")
+        else:
+            label = STAGE_LABELS.get(job['stage'], job['stage'])
+            stage_index = INGEST_STAGES.index(job['stage']) if job['stage'] in INGEST_STAGES else 0
+            overall = (stage_index + job['progress']) / len(INGEST_STAGES) if job['status'] == 'running' else 0.0
+            st.progress(min(overall, 1.0), text=f"{job['filename']} — {job['message'] or label}")
+
+    if newly_done:
+        st.session_state.pdf_processed = True
+        st.session_state.db_ready = True
+        invalidate_pipeline_cache()
+        # ドキュメント数などを更新するためアプリ全体を再実行
+        st.rerun()
+
+
+def render_ingest_jobs():
+    """処理中のジョブがある間だけ、進捗表示を数秒ごとに自動更新"""
+    jobs = get_ingest_jobs(owner=st.session_state.chat_manager.session_id)
+    pending = any(job['status'] in ('queued', 'running') for job in jobs)
+    st.fragment(_ingest_job_panel, run_every=settings.ingestion.ui_poll_seconds if pending else None)()
 
 
 def main():
@@ -120,18 +284,14 @@ def main():
                 st.session_state.pdf_uploaded = True
                 st.session_state.current_pdf = uploaded_file.name
 
-                # 処理ボタン
+                # 処理ボタン（ジョブを登録するだけで、処理はワーカーが行う）
                 if st.button("PDFを処理", type="primary", use_container_width=True):
-                    with st.spinner('PDFを処理中...'):
-                        result = process_uploaded_pdf(uploaded_file)
-
-                        if result['success']:
-                            st.success(result['message'])
-                            st.session_state.pdf_processed = True
-                            st.session_state.db_ready = True
-                        else:
-                            st.error(result['message'])
-                            st.session_state.pdf_processed = False
+                    result = submit_ingest_job(uploaded_file, owner=st.session_state.chat_manager.session_id,
+                                               tenant=st.session_state.tenant)
+                    if result['success']:
+                        st.toast(result['message'])
+                    else:
+                        st.error(result['message'])
         else:
             # PDFアップローダー（複数）
             uploaded_files = st.file_uploader(
@@ -146,22 +306,17 @@ def main():
 
                 # 処理ボタン
                 if st.button("すべて処理", type="primary", use_container_width=True):
-                    with st.spinner(f'{len(uploaded_files)}ファイルを処理中...'):
-                        result = process_multiple_pdfs(uploaded_files)
-
-                        if result['success']:
-                            st.success(result['message'])
-                            st.session_state.pdf_processed = True
-                            st.session_state.db_ready = True
-
-                            # 詳細表示
-                            with st.expander("処理詳細"):
-                                for r in result['results']:
-                                    status = "✅" if r['success'] else "❌"
-                                    st.caption(f"{status} {r['filename']}: {r['chunks_count']}チャンク")
-                        else:
-                            st.error(result['message'])
-                            st.session_state.pdf_processed = False
+                    owner = st.session_state.chat_manager.session_id
+                    results = [submit_ingest_job(f, owner=owner, tenant=st.session_state.tenant)
+                               for f in uploaded_files]
+                    submitted = [r for r in results if r['success']]
+                    st.toast(f"{len(submitted)}/{len(uploaded_files)}ファイルを取り込みキューに追加しました")
+                    for r in results:
+                        if not r['success']:
+                            st.error(f"{r['filename']}: {r['message']}")
+
+        # 取り込みジョブの進捗（処理中のジョブがある間だけ定期的に更新）
+        render_ingest_jobs()
 
         # ステータス表示
         st.header("📊 Status")
@@ -183,14 +338,22 @@ def main():
             st.caption(f"現在のPDF: {st.session_state.current_pdf}")
 
         # データベース情報
-        db_status = check_db_status()
+        db_status = check_db_status(tenant=st.session_state.tenant)
         if db_status['exists'] and db_status['document_count'] > 0:
             st.info(f"📦 保存チャンク数: {db_status['document_count']}")
+            if db_status.get('embedding_model'):
+                st.caption(f"🧭 埋め込みモデル: {db_status['embedding_model']}"
+                           f"（{db_status.get('embedding_dimensions') or '?'}次元）")
+            if db_status.get('model_mismatch'):
+                st.warning(f"保存済みの埋め込みは {db_status['embedding_model']} で作成されています"
+                           f"（設定: {settings.embedding.model}）。`python migrate_embeddings.py` で移行してください")
+        if st.session_state.tenant != settings.tenants.default_tenant:
+            st.caption(f"🏢 テナント: {st.session_state.tenant}")
 
         # チャット履歴情報
         msg_count = st.session_state.chat_manager.get_message_count()
         if msg_count > 0:
-            st.info(f"💬 チャット履歴: {msg_count}/50メッセージ")
+            st.info(f"💬 チャット履歴: {msg_count}/{settings.app.max_chat_history}メッセージ")
 
         # 設定
         st.header("⚙️ Settings")
@@ -223,6 +386,15 @@ def main():
             help="回答生成に実際に使用するチャンク数"
         )
 
+        mmr_lambda = st.slider(
+            "関連度と多様性のバランス",
+            min_value=0.0,
+            max_value=1.0,
+            value=settings.retrieval.mmr_lambda,
+            step=0.1,
+            help="1.0でリランキング順の上位をそのまま使用。小さいほど内容の重なるチャンクを避けて選びます（MMR）"
+        )
+
         show_sources = st.checkbox(
             "ソース参照を表示",
             value=True,
@@ -235,18 +407,25 @@ def main():
         if st.button("🗑️ チャット履歴をクリア", use_container_width=True):
             clear_chat_history(st.session_state)
             st.session_state.chat_manager.clear_history()
+            st.session_state.has_older_messages = False
             st.rerun()
 
         if st.button("💥 データベースをクリア", use_container_width=True, type="secondary"):
-            result = clear_database()
+            result = clear_database(tenant=st.session_state.tenant)
             if result['success']:
                 st.success(result['message'])
                 st.session_state.db_ready = False
                 st.session_state.pdf_processed = False
+                invalidate_pipeline_cache()
                 st.rerun()
             else:
                 st.error(result['message'])
 
+        if st.button("🔄 インデックスを再構築", use_container_width=True,
+                     help="処理済みデータから新しい版を作り、検証後に切り替えます（再構築中も質問できます）"):
+            spawn_rebuild_daemon(st.session_state.tenant)
+            st.success("バックグラウンドで再構築を開始しました。完了すると自動で切り替わります。")
+
     # メインエリア
     if not st.session_state.db_ready:
         st.info("👈 サイドバーからPDFをアップロードして、処理を開始してください。")
@@ -264,6 +443,12 @@ def main():
         - "忍耐について聖書は何と言っていますか？"
         """)
     else:
+        # 古い履歴の追加読み込み
+        if st.session_state.has_older_messages:
+            if st.button("⬆️ 以前の履歴を読み込む"):
+                load_older_messages()
+                st.rerun()
+
         # チャット履歴を表示
         for message in st.session_state.messages:
             with st.chat_message(message['role']):
@@ -279,6 +464,7 @@ def main():
                                     page, src_file, url, text, chunks = source
                                     with st.expander(f"🔗 {text}"):
                                         st.markdown(f"[PDFを開く]({url})")
+                                        st.markdown(f"[🖼️ ページ画像を表示]({page_image_url(src_file, page)})")
                                         st.caption("**参照チャンク:**")
                                         for idx, chunk in enumerate(chunks, 1):
                                             st.caption(f"{idx}. {chunk}")
@@ -294,11 +480,12 @@ def main():
         # チャット入力
         if prompt := st.chat_input("質問を入力してください..."):
             # ユーザーメッセージを追加（セッションと永続化）
-            st.session_state.messages.append({
+            message_id = st.session_state.chat_manager.add_message('user', prompt)
+            append_session_message({
+                'id': message_id,
                 'role': 'user',
                 'content': prompt
             })
-            st.session_state.chat_manager.add_message('user', prompt)
 
             # ユーザーメッセージを表示
             with st.chat_message('user'):
@@ -311,7 +498,11 @@ def main():
                         prompt,
                         n_results=n_results,
                         initial_k=initial_k,
-                        final_k=final_k
+                        final_k=final_k,
+                        mmr_lambda=mmr_lambda,
+                        # 追加質問の書き換え用に、この質問より前の会話を渡す
+                        history=st.session_state.messages[:-1],
+                        tenant=st.session_state.tenant
                     )
 
                     if response['success']:
@@ -327,6 +518,7 @@ def main():
                                             page, src_file, url, text, chunks = source
                                             with st.expander(f"🔗 {text}"):
                                                 st.markdown(f"[PDFを開く]({url})")
+                                                st.markdown(f"[🖼️ ページ画像を表示]({page_image_url(src_file, page)})")
                                                 st.caption("**参照チャンク:**")
                                                 for idx, chunk in enumerate(chunks, 1):
                                                     st.caption(f"{idx}. {chunk}")
@@ -340,25 +532,27 @@ def main():
                                         st.caption(str(source))
 
                         # メッセージ履歴に追加（セッションと永続化）
-                        st.session_state.messages.append({
-                            'role': 'assistant',
-                            'content': response['answer'],
-                            'sources': response['sources']
-                        })
-                        st.session_state.chat_manager.add_message(
+                        message_id = st.session_state.chat_manager.add_message(
                             'assistant',
                             response['answer'],
                             response['sources']
                         )
+                        append_session_message({
+                            'id': message_id,
+                            'role': 'assistant',
+                            'content': response['answer'],
+                            'sources': response['sources']
+                        })
                     else:
                         error_msg = response['error']
                         st.markdown(error_msg)
-                        st.session_state.messages.append({
+                        message_id = st.session_state.chat_manager.add_message('assistant', error_msg)
+                        append_session_message({
+                            'id': message_id,
                             'role': 'assistant',
                             'content': error_msg,
                             'sources': []
                         })
-                        st.session_state.chat_manager.add_message('assistant', error_msg)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""
+PDFテキスト抽出の並列化ベンチマーク（pages/s とプロセス数）
+
+ページ範囲を複数プロセスに分割するレイアウト解析（extract_text_from_pdf の workers）について、
+プロセス数ごとの処理速度と1プロセスに対する高速化率を測定します（解析結果のキャッシュは使いません）。
+
+使い方:
+    python benchmarks/bench_extract.py                         # 合成PDF（2,000ページ）
+    python benchmarks/bench_extract.py --pages 500 --runs 5
+    python benchmarks/bench_extract.py --pdf data/raw/manual.pdf --workers 1 2 4 8
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.ingestion.extract import analyze_layout, resolve_extract_workers
+
+
+def synthetic_pdf(path: str, pages: int, lines_per_page: int = 40):
+    """本文の詰まったページを持つ合成PDFを作成"""
+    import fitz
+
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        text = "\n".join(
+            f"Section {page_num + 1}.{line + 1}: The quick brown fox jumps over the lazy dog."
+            for line in range(lines_per_page)
+        )
+        page.insert_textbox(fitz.Rect(50, 50, 560, 800), text, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def default_worker_counts() -> list:
+    """1, 2, 4, ... 利用可能なCPU数まで"""
+    cores = resolve_extract_workers(0)
+    counts = [1]
+    while counts[-1] * 2 < cores:
+        counts.append(counts[-1] * 2)
+    if cores > 1:
+        counts.append(cores)
+    return counts
+
+
+def measure(pdf_path: str, workers: int, runs: int) -> float:
+    """抽出の所要時間の中央値（秒）"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        analyze_layout(pdf_path, workers=workers, min_pages_per_worker=1, use_cache=False)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDFテキスト抽出の並列化ベンチマーク")
+    parser.add_argument("--pdf", default=None, help="計測するPDF（省略時は合成PDF）")
+    parser.add_argument("--pages", type=int, default=2000, help="合成PDFのページ数")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="計測するプロセス数（デフォルトは1からCPU数まで倍々）")
+    parser.add_argument("--runs", type=int, default=3, help="プロセス数ごとの試行回数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = args.pdf
+        if pdf_path is None:
+            pdf_path = os.path.join(temp_dir, "synthetic.pdf")
+            print(f"合成PDFを作成中（{args.pages}ページ）...")
+            synthetic_pdf(pdf_path, args.pages)
+
+        import fitz
+        with fitz.open(pdf_path) as doc:
+            pages = len(doc)
+        print(f"PDF: {pdf_path}（{pages}ページ, CPU {resolve_extract_workers(0)}）\n")
+
+        print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+        print("-" * 38)
+        baseline = None
+        for workers in args.workers or default_worker_counts():
+            seconds = measure(pdf_path, workers, args.runs)
+            baseline = baseline or seconds
+            print(f"{workers:>8} {seconds:>9.2f} {pages / seconds:>9.0f} {baseline / seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
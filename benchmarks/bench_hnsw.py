@@ -0,0 +1,113 @@
+"""
+HNSW search_ef の recall / レイテンシ ベンチマーク
+
+保存済みコレクションの埋め込み（または合成データ）を一時コレクションへコピーし、
+search_ef を変えながら numpy の厳密検索に対する recall@k と検索レイテンシを測定します。
+本番のコレクションは変更しません。埋め込みAPIも呼び出しません。
+
+使い方:
+    python benchmarks/bench_hnsw.py                          # storage/chroma のコレクション
+    python benchmarks/bench_hnsw.py --synthetic --n 20000    # 合成データ
+    python benchmarks/bench_hnsw.py --search-ef 10 50 100 200
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import chromadb
+
+from src.config import settings
+from benchmarks.bench_quantization import synthetic_embeddings, chroma_embeddings
+
+
+def build_collection(client, vectors: np.ndarray, batch_size: int = 5000):
+    """設定のHNSWパラメータで一時コレクションを作成してベクトルを登録"""
+    collection = client.create_collection(
+        name="hnsw_benchmark",
+        metadata=settings.storage.hnsw_metadata(),
+        embedding_function=None
+    )
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        collection.add(
+            ids=[str(i) for i in range(start, start + len(batch))],
+            embeddings=batch.tolist()
+        )
+    return collection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HNSW search_ef の recall / レイテンシ ベンチマーク")
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 20, 50, 100, 200, 400])
+    parser.add_argument("--k", type=int, default=100, help="recall@k の k（initial_k 相当）")
+    parser.add_argument("--queries", type=int, default=100, help="クエリ数")
+    parser.add_argument("--synthetic", action="store_true", help="合成データを使用")
+    parser.add_argument("--n", type=int, default=20000, help="合成データの件数")
+    parser.add_argument("--dim", type=int, default=768, help="合成データの次元数")
+    parser.add_argument("--storage-path", default=settings.storage.chroma_path)
+    parser.add_argument("--collection", default=settings.storage.collection_name)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_embeddings(args.n, args.dim)
+    else:
+        vectors = chroma_embeddings(args.storage_path, args.collection)
+    n, dim = vectors.shape
+    k = min(args.k, n)
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(n, min(args.queries, n), replace=False)
+    queries = vectors[picks] + rng.normal(scale=0.05 * np.abs(vectors).mean(),
+                                          size=(len(picks), dim)).astype(np.float32)
+
+    # 厳密検索（コサイン）の正解
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    truth = []
+    for query in queries:
+        scores = normalized @ (query / np.linalg.norm(query))
+        truth.append({str(i) for i in np.argsort(-scores)[:k]})
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        start = time.perf_counter()
+        collection = build_collection(client, vectors)
+        build_s = time.perf_counter() - start
+
+        print(f"データ: {n}件 x {dim}次元, クエリ: {len(queries)}件, recall@{k}")
+        print(f"construction_ef={settings.storage.hnsw_construction_ef}, "
+              f"M={settings.storage.hnsw_m}, 構築: {build_s:.1f}s")
+        print(f"{'search_ef':>10}{'recall':>9}{'p50(ms)':>10}{'p95(ms)':>10}")
+        print("-" * 39)
+
+        for search_ef in args.search_ef:
+            collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+            collection = client.get_collection("hnsw_benchmark")
+            # 1回目はインデックスのロードを含むため除外
+            collection.query(query_embeddings=[queries[0].tolist()], n_results=k)
+
+            hits = 0
+            latencies = []
+            for query, expected in zip(queries, truth):
+                t0 = time.perf_counter()
+                result = collection.query(query_embeddings=[query.tolist()], n_results=k,
+                                          include=[])
+                latencies.append((time.perf_counter() - t0) * 1000)
+                hits += len(set(result["ids"][0]) & expected)
+
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(f"{search_ef:>10}{hits / (k * len(queries)):>9.3f}"
+                  f"{statistics.median(latencies):>10.2f}{p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+インポート時間（コールドスタート）ベンチマーク
+
+`python -X importtime` でモジュールを新しいプロセスにインポートし、累積インポート時間と
+重い依存ライブラリ（chromadb / PyMuPDF / langchain / google.generativeai）が読み込まれたかを測定します。
+Streamlitの再実行やcronから呼ばれるCLIの起動時間の確認に使います。
+
+使い方:
+    python benchmarks/bench_importtime.py
+    python benchmarks/bench_importtime.py --modules src.ui.streamlit_helpers build_db --runs 10
+    python benchmarks/bench_importtime.py --top 15     # 最も遅いインポートを表示
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# プロジェクトルート
+project_root = Path(__file__).parent.parent
+
+DEFAULT_TARGETS = [
+    "src.config",
+    "src.ui.streamlit_helpers",
+    "src.retrieval.search",
+    "src.embedding.store",
+    "build_db",
+    "serve_pdfs",
+]
+# 起動時に読み込まれるべきでない重い依存ライブラリ
+HEAVY_MODULES = ["chromadb", "fitz", "langchain_text_splitters", "google.generativeai", "numpy"]
+
+_LINE_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """-X importtime の出力を (モジュール名, 自身のμs, 累積μs) のリストに変換"""
+    entries = []
+    for line in stderr.splitlines():
+        match = _LINE_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure(module: str) -> Tuple[float, Dict[str, int], List[Tuple[str, int, int]]]:
+    """
+    新しいプロセスでモジュールをインポートして計測
+
+    Returns:
+        (プロセス全体の累積ミリ秒, 重いモジュールの累積μs, 全エントリ)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=project_root, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{module} のインポートに失敗しました:\n{result.stderr[-2000:]}")
+
+    entries = parse_importtime(result.stderr)
+    top_level = [cumulative for name, _, cumulative in entries
+                 if name == module or name == module.split(".")[0]]
+    total_ms = (max(top_level) if top_level else 0) / 1000
+    heavy = {}
+    for name, _, cumulative in entries:
+        if name in HEAVY_MODULES:
+            heavy[name] = max(heavy.get(name, 0), cumulative)
+    return total_ms, heavy, entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="インポート時間（コールドスタート）ベンチマーク")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_TARGETS, help="計測するモジュール")
+    parser.add_argument("--runs", type=int, default=5, help="モジュールごとの試行回数")
+    parser.add_argument("--top", type=int, default=0, help="最も遅いインポートを表示する件数")
+    args = parser.parse_args()
+
+    print(f"{'module':<28} {'median ms':>10} {'min ms':>8}  heavy dependencies loaded")
+    print("-" * 80)
+    for module in args.modules:
+        timings = []
+        heavy = {}
+        entries = []
+        for _ in range(args.runs):
+            total_ms, heavy, entries = measure(module)
+            timings.append(total_ms)
+        loaded = ", ".join(f"{name} ({us / 1000:.0f}ms)" for name, us in heavy.items()) or "-"
+        print(f"{module:<28} {statistics.median(timings):>10.1f} {min(timings):>8.1f}  {loaded}")
+
+        if args.top:
+            for name, self_us, cumulative_us in sorted(entries, key=lambda e: -e[1])[:args.top]:
+                print(f"    {name:<50} self {self_us / 1000:>7.1f}ms  cumulative {cumulative_us / 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+埋め込み量子化の recall / メモリ ベンチマーク
+
+float32の厳密検索を正解として、int8・PQ（再スコアリングあり/なし）の recall@k、
+1ベクトルあたりの常駐バイト数、検索レイテンシを比較します。
+
+使い方:
+    python benchmarks/bench_quantization.py                  # 合成データ（768次元）
+    python benchmarks/bench_quantization.py --from-chroma    # 保存済みコレクションの埋め込み
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.embedding.quantization import QuantizedIndex, _normalize
+
+
+def synthetic_embeddings(n: int, dim: int, n_clusters: int = 50, seed: int = 0) -> np.ndarray:
+    """クラスタ構造を持つ合成埋め込みを生成（実際の文書埋め込みに近い分布）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    assign = rng.integers(0, n_clusters, size=n)
+    return (centers[assign] + rng.normal(scale=0.6, size=(n, dim))).astype(np.float32)
+
+
+def chroma_embeddings(storage_path: str, collection_name: str) -> np.ndarray:
+    """保存済みコレクションから埋め込みを取得（API呼び出しなし）"""
+    import chromadb
+
+    client = chromadb.PersistentClient(path=storage_path)
+    collection = client.get_collection(name=collection_name)
+    data = collection.get(include=["embeddings"])
+    return np.asarray(data["embeddings"], dtype=np.float32)
+
+
+def recall_at_k(index: QuantizedIndex, queries: np.ndarray, truth: list,
+                k: int, rescore_k: int) -> tuple:
+    """recall@k と1クエリあたりの平均レイテンシ（ミリ秒）を計算"""
+    hits = 0
+    start = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        found = {int(i) for i, _ in index.search(query, top_k=k, rescore_k=rescore_k)}
+        hits += len(found & expected)
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return hits / (k * len(queries)), elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込み量子化の recall / メモリ ベンチマーク")
+    parser.add_argument("--n", type=int, default=20000, help="合成データの件数")
+    parser.add_argument("--dim", type=int, default=768, help="合成データの次元数")
+    parser.add_argument("--queries", type=int, default=100, help="クエリ数")
+    parser.add_argument("--k", type=int, default=20, help="recall@k の k")
+    parser.add_argument("--pq-subvectors", type=int, nargs="+", default=[48, 96, 192],
+                        help="PQの部分空間数（複数指定可）")
+    parser.add_argument("--from-chroma", action="store_true",
+                        help="保存済みコレクションの埋め込みを使用")
+    parser.add_argument("--storage-path", default="storage/chroma")
+    parser.add_argument("--collection", default="notebook_rag_collection")
+    args = parser.parse_args()
+
+    if args.from_chroma:
+        vectors = chroma_embeddings(args.storage_path, args.collection)
+    else:
+        vectors = synthetic_embeddings(args.n, args.dim)
+    n, dim = vectors.shape
+
+    # クエリはデータ点に摂動を加えたもの
+    rng = np.random.default_rng(1)
+    picks = rng.choice(n, min(args.queries, n), replace=False)
+    queries = vectors[picks] + rng.normal(scale=0.05 * np.abs(vectors).mean(),
+                                          size=(len(picks), dim)).astype(np.float32)
+
+    normalized = _normalize(vectors)
+    truth = []
+    for query in _normalize(queries):
+        truth.append(set(np.argsort(-(normalized @ query))[:args.k].tolist()))
+
+    ids = [str(i) for i in range(n)]
+    float_bytes = dim * 4
+    print(f"データ: {n}件 x {dim}次元, クエリ: {len(queries)}件, recall@{args.k}")
+    print(f"{'方式':<14}{'bytes/vec':>10}{'圧縮率':>8}{'構築(s)':>9}"
+          f"{'rescore':>9}{'recall':>8}{'ms/query':>10}")
+    print("-" * 68)
+    print(f"{'float32':<14}{float_bytes:>10}{1:>7}x{'-':>9}{'-':>9}{1.0:>8.3f}{'-':>10}")
+
+    configs = [("int8", None)] + [("pq", m) for m in args.pq_subvectors if dim % m == 0]
+    for method, m in configs:
+        start = time.perf_counter()
+        index = QuantizedIndex.build(ids, vectors, method=method, pq_subvectors=m or 96)
+        build_s = time.perf_counter() - start
+        label = method if m is None else f"pq(m={m})"
+        per_vector = index.code_bytes / n
+
+        for rescore_k in (0, args.k * 4):
+            recall, latency = recall_at_k(index, queries, truth, args.k, rescore_k)
+            print(f"{label:<14}{per_vector:>10.0f}{float_bytes / per_vector:>7.0f}x"
+                  f"{build_s:>9.2f}{rescore_k:>9}{recall:>8.3f}{latency:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
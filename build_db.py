@@ -1,112 +1,115 @@
 """
-data/raw にある PDF を直接読み込んでベクトルDB を構築
+data/raw にある PDF からベクトルDB を構築
+
+新規・変更されたPDFだけを取り込みジョブとして登録し、ワーカープロセスで並列に処理します
+（内容が変わっていないPDFは再処理せず、削除されたPDFのチャンクは削除します）。
+
+使い方:
+    python build_db.py                  # 現在のPDFを取り込んで終了
+    python build_db.py --workers 8      # ワーカー数を指定
+    python build_db.py --watch          # data/raw を監視し、追加・変更・削除を自動で反映し続ける
 """
-import os
+import argparse
 import sys
+import threading
+import time
 from pathlib import Path
-from dotenv import load_dotenv
 
 # プロジェクトルートをパスに追加
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
-from src.ingestion.extract import extract_text_from_pdf
-from src.ingestion.chunking import chunk_text
-from src.embedding.store import store_embeddings
-
-load_dotenv()
-
-def build_vector_db():
-    """data/raw の PDF からベクトルDB を構築"""
-    
-    raw_dir = "data/raw"
-    storage_path = "storage/chroma"
-    
-    # data/raw 内の PDF ファイルを検索
-    pdf_files = list(Path(raw_dir).glob("*.pdf"))
-    
-    if not pdf_files:
+from src.config import settings
+
+
+def _create_watcher():
+    from src.ingestion.watcher import FolderWatcher
+    from src.ingestion.worker import get_job_queue
+
+    storage = settings.storage
+    return FolderWatcher(
+        get_job_queue(), raw_dir=storage.data_raw_dir, processed_dir=storage.data_processed_dir,
+        storage_path=storage.chroma_path, debounce_seconds=settings.ingestion.watch_debounce_seconds,
+        retry_failed_seconds=settings.ingestion.watch_retry_failed_seconds
+    )
+
+
+def build_vector_db(workers: int = None) -> bool:
+    """data/raw の PDF からベクトルDB を構築（差分のみ）"""
+    from src.ingestion.watcher import WATCHER_OWNER
+    from src.ingestion.worker import start_workers
+
+    settings.ensure_directories()
+    raw_dir = settings.storage.data_raw_dir
+    if not list(Path(raw_dir).glob("*.pdf")):
         print(f"❌ {raw_dir} に PDF ファイルが見つかりません")
         return False
-    
-    pdf_path = pdf_files[0]
-    print(f"📄 PDF を処理中: {pdf_path}")
-    
-    # 1. PDF からテキスト抽出
-    print("\n1. テキスト抽出中...")
-    pages = extract_text_from_pdf(str(pdf_path))
-    print(f"   ✓ {len(pages)} ページを抽出")
-    
-    # 2. チャンク分割
-    print("\n2. チャンク分割中...")
-    chunks = chunk_text(pages, chunk_size=500)
-    print(f"   ✓ {len(chunks)} チャンクを生成")
-    
-    # 3. ベクトルDB に保存
-    print("\n3. ベクトルDB に保存中...")
-    print("   （この処理には時間がかかります...）")
-    
-    # ChromaDB に直接保存
-    import chromadb
-    from chromadb.utils import embedding_functions
-    import google.generativeai as genai
-    
-    # ChromaDB クライアント作成
-    client = chromadb.PersistentClient(path=storage_path)
-    
-    # コレクション作成または取得
+
+    watcher = _create_watcher()
+    # 一括取り込みでは書き込み完了を待たず、前回失敗したPDFもすぐに再登録
+    watcher.debounce_seconds = 0
+    watcher.retry_failed_seconds = 0
+    events = watcher.scan()
+    for event, path in events:
+        print(f"   {event:<8} {Path(path).name}")
+
+    queue = watcher.queue
+    if queue.pending_count() == 0:
+        print("✅ 変更されたPDFはありません")
+        return True
+
+    print(f"\n📄 {queue.pending_count()} 件のジョブを処理中...")
+    start = time.perf_counter()
+    for process in start_workers(workers, exit_when_idle=True):
+        process.join()
+
+    failed = [job for job in queue.list_jobs(WATCHER_OWNER, limit=len(events) or 1)
+              if job['status'] == 'failed']
+    print(f"\n✅ ベクトルDB の構築が完了しました（{time.perf_counter() - start:.1f}秒）")
+    print(f"   - 保存先: {settings.storage.chroma_path}")
+    print(f"   - 埋め込みモデル: {settings.embedding.model}（既存のコレクションは記録されたモデルで登録）")
+    for job in failed:
+        print(f"   ❌ {job['filename']}: {job['error']}")
+    return not failed
+
+
+def watch(workers: int = None):
+    """data/raw を監視し、ワーカープロセスで取り込み続ける（Ctrl+Cで終了）"""
+    from src.ingestion.worker import start_workers
+
+    settings.ensure_directories()
+    processes = start_workers(workers)
+    stop_event = threading.Event()
     try:
-        collection = client.get_collection(name="pdf_documents")
-        print("   既存のコレクションを使用")
-    except:
-        # Gemini 埋め込み関数
-        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-        
-        class GoogleGenerativeAiEmbeddingFunction(embedding_functions.EmbeddingFunction):
-            def __call__(self, input: list[str]) -> list[list[float]]:
-                embeddings = []
-                for text in input:
-                    result = genai.embed_content(
-                        model="models/text-embedding-004",
-                        content=text,
-                        task_type="RETRIEVAL_DOCUMENT"
-                    )
-                    embeddings.append(result['embedding'])
-                return embeddings
-        
-        gemini_ef = GoogleGenerativeAiEmbeddingFunction()
-        collection = client.create_collection(
-            name="pdf_documents",
-            embedding_function=gemini_ef,
-            metadata={"hnsw:space": "cosine"}
-        )
-        print("   新しいコレクションを作成")
-    
-    # チャンクを追加
-    documents = [chunk["content"] for chunk in chunks]
-    metadatas = [chunk["metadata"] for chunk in chunks]
-    ids = [f"chunk_{i}" for i in range(len(chunks))]
-    
-    collection.add(
-        documents=documents,
-        metadatas=metadatas,
-        ids=ids
-    )
-    
-    print(f"\n✅ ベクトルDB の構築が完了しました")
-    print(f"   - チャンク数: {len(chunks)}")
-    print(f"   - 保存先: {storage_path}")
-    return True
+        _create_watcher().run(stop_event, poll_interval=settings.ingestion.watch_poll_seconds,
+                              use_inotify=settings.ingestion.watch_use_inotify)
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="data/raw の PDF からベクトルDB を構築")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="ワーカープロセス数（デフォルトは INGEST_WORKERS）")
+    parser.add_argument("--watch", action="store_true", help="フォルダを監視し続ける")
+    args = parser.parse_args()
+
     print("=" * 80)
     print("ベクトルDB 構築スクリプト")
     print("=" * 80)
-    
-    success = build_vector_db()
-    
+
+    if args.watch:
+        watch(args.workers)
+        sys.exit(0)
+
+    success = build_vector_db(args.workers)
+
     if success:
         print("\n次のステップ:")
         print("  python debug_search.py  # 検索品質を確認")
-    
+
     sys.exit(0 if success else 1)
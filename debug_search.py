@@ -2,15 +2,23 @@
 ベクトルDB の検索結果をデバッグするスクリプト
 API リクエストを最小限に抑えながら、検索品質を確認
 """
-import chromadb
-import os
+import sys
+from pathlib import Path
+
 from dotenv import load_dotenv
 
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent))
+
+from src.config import settings
+from src.pipeline.aliases import resolve_collection
+from src.pipeline.engine import build_pipeline
+from src.pipeline.resources import get_pipeline_resources
+
 load_dotenv()
 
-# ChromaDB に接続
-client = chromadb.PersistentClient(path="storage/chroma")
-collection = client.get_collection(name="pdf_documents")
+# 取り込み（build_db.py / UI）と同じ保存先・コレクションを検索
+storage_path = settings.storage.chroma_path
 
 # クエリ: 「イエスは心に響く教え方ができました。どうしてですか」
 query = "イエスは心に響く教え方ができました。どうしてですか"
@@ -18,33 +26,21 @@ query = "イエスは心に響く教え方ができました。どうしてで
 print(f"クエリ: {query}\n")
 print("=" * 80)
 
-# Gemini の埋め込みを使用して検索（API リクエスト 1回のみ）
-import google.generativeai as genai
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+# 回答生成と同じエンジンでベクトル検索のみ実行（API リクエスト 1回: クエリの埋め込み）
+pipeline = build_pipeline(n_results=20, initial_k=20, rerank=False, mmr_lambda=1.0, parent_mode="none",
+                          rewrite=False, generate=False)
+context = pipeline.run(query, storage_path)
+results = context.results
 
-# クエリの埋め込みを生成
-result = genai.embed_content(
-    model="models/text-embedding-004",
-    content=query,
-    task_type="RETRIEVAL_QUERY"
-)
-query_embedding = result['embedding']
-
-# ChromaDB で検索（API リクエストなし、ローカル検索のみ）
-results = collection.query(
-    query_embeddings=[query_embedding],
-    n_results=20
-)
-
-print(f"\n検索結果: {len(results['documents'][0])} 件\n")
+print(f"\n検索結果: {len(results)} 件（{context.trace()['search_ms']}ms）\n")
 
 # 上位10件の結果を表示
-for i in range(min(10, len(results['documents'][0]))):
-    distance = results['distances'][0][i]
-    page = results['metadatas'][0][i].get('page', '不明')
-    source = results['metadatas'][0][i].get('source', '不明')
-    chunk = results['documents'][0][i][:200]  # 最初の200文字
-    
+for i, result in enumerate(results[:10]):
+    distance = result['distance']
+    page = result['metadata'].get('page', '不明')
+    source = result['metadata'].get('source', '不明')
+    chunk = result['content'][:200]  # 最初の200文字
+
     print(f"\n【結果 {i+1}】")
     print(f"  距離: {distance:.6f}")
     print(f"  ページ: {page}")
@@ -56,8 +52,11 @@ for i in range(min(10, len(results['documents'][0]))):
 print("\n\n【PDF 3ページ目の検索】")
 print("=" * 80)
 
-# ページ3のチャンクを直接検索
-all_data = collection.get()
+# ページ3のチャンクを直接検索（API リクエストなし）
+collection = get_pipeline_resources().client(storage_path).get_collection(
+    name=resolve_collection(storage_path, settings.storage.collection_name)
+)
+all_data = collection.get(where={"page": 3})
 page_3_chunks = []
 for i, metadata in enumerate(all_data['metadatas']):
     if metadata.get('page') == 3:
@@ -0,0 +1,11 @@
+"""
+PDF取り込みジョブのワーカーを起動
+
+使い方:
+    python ingest_worker.py
+    python ingest_worker.py --workers 4
+"""
+from src.ingestion.worker import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""
+埋め込みモデルの移行（旧版で検索を続けながら新しいモデルの版を作り、完了したら切り替え）
+
+使い方:
+    python migrate_embeddings.py --model models/text-embedding-005
+    python migrate_embeddings.py --model models/text-embedding-005 --batch-size 20 --pause 2
+"""
+from src.pipeline.migration import main
+
+if __name__ == "__main__":
+    main()
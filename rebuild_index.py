@@ -0,0 +1,12 @@
+"""
+data/processed からコレクションを無停止で再構築（新しい版を作り、検証後に切り替え）
+
+使い方:
+    python rebuild_index.py
+    python rebuild_index.py --tenant team-a --query "ナアマンについて"
+    python rebuild_index.py --gc
+"""
+from src.pipeline.rebuild import main
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,35 @@
 """
-PDF配信用の簡易HTTPサーバー
-ポート8502でdata/rawディレクトリ内のPDFを配信します
+PDF配信用のHTTPサーバー
+ポート8503でdata/rawディレクトリ内のPDFを配信します（Range・キャッシュ対応、マルチスレッド）
 """
-import http.server
-import socketserver
 import os
+import sys
 from pathlib import Path
 
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.serving.pdf_server import create_server
+from src.config import settings
+
 PORT = 8503
 DIRECTORY = "data/raw"
 
-class PDFHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=DIRECTORY, **kwargs)
-    
-    def end_headers(self):
-        # CORSヘッダーを追加
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET')
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
-        super().end_headers()
-
 if __name__ == "__main__":
     # ディレクトリが存在することを確認
     os.makedirs(DIRECTORY, exist_ok=True)
-    
-    with socketserver.TCPServer(("", PORT), PDFHandler) as httpd:
+
+    with create_server(
+        DIRECTORY, PORT,
+        page_cache_dir=settings.storage.page_cache_dir,
+        page_cache_max_bytes=settings.storage.page_cache_max_mb * 1024 * 1024,
+        default_dpi=settings.app.page_render_dpi,
+        default_format=settings.app.page_render_format
+    ) as httpd:
         print(f"📄 PDF配信サーバーを起動しました: http://localhost:{PORT}")
         print(f"📁 配信ディレクトリ: {os.path.abspath(DIRECTORY)}")
+        print(f"🖼️ ページ画像: http://localhost:{PORT}/render/<PDF名>?page=N")
         print("Ctrl+C で停止します")
         try:
             httpd.serve_forever()
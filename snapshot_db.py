@@ -0,0 +1,12 @@
+"""
+ベクトルストアのスナップショットを書き出す・復元する（復元時は埋め込みAPIを呼ばない）
+
+使い方:
+    python snapshot_db.py export snapshots/2024-06-01
+    python snapshot_db.py import snapshots/2024-06-01
+    python snapshot_db.py import snapshots/2024-06-01 --tenant team-a --force
+"""
+from src.pipeline.snapshot import main
+
+if __name__ == "__main__":
+    main()
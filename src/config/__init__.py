@@ -1,13 +1,26 @@
 """
 設定管理モジュール
 """
-from .settings import settings, AppSettings, EmbeddingSettings, GenerationSettings, RetrievalSettings, StorageSettings
+from .settings import (
+    settings,
+    Settings,
+    AppSettings,
+    EmbeddingSettings,
+    GenerationSettings,
+    RetrievalSettings,
+    IngestionSettings,
+    ResilienceSettings,
+    StorageSettings,
+)
 
 __all__ = [
     'settings',
+    'Settings',
     'AppSettings',
     'EmbeddingSettings',
     'GenerationSettings',
     'RetrievalSettings',
+    'IngestionSettings',
+    'ResilienceSettings',
     'StorageSettings',
 ]
@@ -2,31 +2,45 @@
 アプリケーション設定の一元管理
 
 環境変数から設定を読み込み、アプリケーション全体で使用する設定値を管理します。
+インポート時には何も読み込まず、最初に設定値へアクセスした時点で.envを読み込んで構築します。
 """
 import os
+import threading
 from pathlib import Path
-from typing import Optional
-from dotenv import load_dotenv
-
-# .envファイルを読み込み
-load_dotenv()
+from typing import Optional, Dict, Any
 
 
 class AppSettings:
     """アプリケーション基本設定"""
-    name: str = "Mini-Notebook RAG"
-    version: str = "1.0.0"
-    max_file_size_mb: int = int(os.getenv("MAX_FILE_SIZE_MB", "10"))
-    max_chat_history: int = int(os.getenv("MAX_CHAT_HISTORY", "50"))
-    log_level: str = os.getenv("LOG_LEVEL", "INFO")
+    def __init__(self):
+        self.name: str = "Mini-Notebook RAG"
+        self.version: str = "1.0.0"
+        self.max_file_size_mb: int = int(os.getenv("MAX_FILE_SIZE_MB", "10"))
+        self.max_chat_history: int = int(os.getenv("MAX_CHAT_HISTORY", "50"))
+        # 起動時・追加読み込み時に1回で読み込むチャット履歴の件数
+        self.chat_page_size: int = int(os.getenv("CHAT_PAGE_SIZE", "10"))
+        # PDF配信サーバー（serve_pdfs.py）とページ画像のレンダリング設定
+        self.pdf_server_url: str = os.getenv("PDF_SERVER_URL", "http://localhost:8503")
+        self.page_render_dpi: int = int(os.getenv("PAGE_RENDER_DPI", "110"))
+        self.page_render_format: str = os.getenv("PAGE_RENDER_FORMAT", "webp")
+        self.log_level: str = os.getenv("LOG_LEVEL", "INFO")
+        # 匿名のチャット履歴のトークン（?session=）の署名鍵（空の場合は保存先に生成した鍵を使用）
+        self.session_secret: str = os.getenv("SESSION_SECRET", "")
 
 
 class EmbeddingSettings:
     """埋め込み設定"""
-    model: str = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
-    api_key: str = os.getenv("GOOGLE_API_KEY", "")
-    task_type_document: str = "RETRIEVAL_DOCUMENT"
-    task_type_query: str = "RETRIEVAL_QUERY"
+    def __init__(self):
+        self.model: str = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+        self.api_key: str = os.getenv("GOOGLE_API_KEY", "")
+        self.task_type_document: str = "RETRIEVAL_DOCUMENT"
+        self.task_type_query: str = "RETRIEVAL_QUERY"
+        # コレクションに記録されたモデルと設定のモデルが異なる場合:
+        # "route"（記録されたモデルで検索・取り込み）/ "refuse"（拒否）
+        self.model_mismatch: str = os.getenv("EMBEDDING_MODEL_MISMATCH", "route").lower()
+        # 埋め込みモデルの移行（migrate_embeddings.py）: 1回に埋め込むチャンク数と、バッチ間の待ち時間（秒）
+        self.migration_batch_size: int = int(os.getenv("MIGRATION_BATCH_SIZE", "50"))
+        self.migration_pause_seconds: float = float(os.getenv("MIGRATION_PAUSE_SECONDS", "1.0"))
     
     def __post_init__(self):
         """APIキーの検証"""
@@ -36,17 +50,121 @@ class EmbeddingSettings:
 
 class GenerationSettings:
     """生成モデル設定"""
-    model: str = os.getenv("GENERATION_MODEL", "models/gemini-flash-latest")
-    temperature: float = float(os.getenv("GENERATION_TEMPERATURE", "0.7"))
-    max_tokens: int = int(os.getenv("GENERATION_MAX_TOKENS", "2048"))
+    def __init__(self):
+        self.model: str = os.getenv("GENERATION_MODEL", "models/gemini-flash-latest")
+        self.temperature: float = float(os.getenv("GENERATION_TEMPERATURE", "0.7"))
+        self.max_tokens: int = int(os.getenv("GENERATION_MAX_TOKENS", "2048"))
+        # プロンプトに入れる資料の入力トークン予算（概算、0で無制限）
+        self.context_token_budget: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
 
 
 class RetrievalSettings:
     """検索設定"""
-    default_top_k: int = int(os.getenv("DEFAULT_TOP_K", "3"))
-    default_initial_k: int = int(os.getenv("DEFAULT_INITIAL_K", "100"))
-    default_final_k: int = int(os.getenv("DEFAULT_FINAL_K", "20"))
-    reranking_enabled: bool = os.getenv("RERANKING_ENABLED", "true").lower() == "true"
+    def __init__(self):
+        self.default_top_k: int = int(os.getenv("DEFAULT_TOP_K", "3"))
+        self.default_initial_k: int = int(os.getenv("DEFAULT_INITIAL_K", "100"))
+        self.default_final_k: int = int(os.getenv("DEFAULT_FINAL_K", "20"))
+        self.reranking_enabled: bool = os.getenv("RERANKING_ENABLED", "true").lower() == "true"
+        # 量子化検索時に float32 で再スコアリングする候補数（top_k の倍率）
+        self.quantization_rescore_factor: int = int(os.getenv("QUANTIZATION_RESCORE_FACTOR", "4"))
+        # MMRで回答生成に使うチャンクを選ぶときの関連度の重み（1.0で関連度順のまま、小さいほど多様性を重視）
+        self.mmr_lambda: float = float(os.getenv("MMR_LAMBDA", "0.7"))
+        # ヒットしたチャンクを広げる親の範囲（none / window / page）と、window の場合の前後のチャンク数
+        self.parent_mode: str = os.getenv("PARENT_EXPANSION", "window").lower()
+        self.parent_window: int = int(os.getenv("PARENT_WINDOW_CHUNKS", "1"))
+        # 追加質問を直近の会話から単独の質問に書き換えて検索（参照する往復数・上限秒数・キャッシュ件数）
+        self.query_rewrite_enabled: bool = os.getenv("QUERY_REWRITE_ENABLED", "true").lower() == "true"
+        self.query_rewrite_turns: int = int(os.getenv("QUERY_REWRITE_TURNS", "3"))
+        self.query_rewrite_timeout_seconds: float = float(os.getenv("QUERY_REWRITE_TIMEOUT_SECONDS", "5"))
+        self.query_rewrite_cache_size: int = int(os.getenv("QUERY_REWRITE_CACHE_SIZE", "256"))
+
+
+class IngestionSettings:
+    """取り込みジョブキューとワーカーの設定"""
+    def __init__(self):
+        self.job_queue_path: str = os.getenv("JOB_QUEUE_PATH", "storage/jobs.db")
+        # ワーカープロセス数（同時に処理できる取り込みジョブ数）
+        self.workers: int = int(os.getenv("INGEST_WORKERS", "2"))
+        self.poll_interval_seconds: float = float(os.getenv("INGEST_POLL_SECONDS", "1.0"))
+        # この秒数ハートビートがないジョブは、ワーカーが停止したものとみなして再実行
+        self.lease_seconds: float = float(os.getenv("INGEST_LEASE_SECONDS", "120"))
+        self.max_attempts: int = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+        # Streamlit起動時にワーカーが動いていなければ自動で起動する
+        self.autostart_workers: bool = os.getenv("INGEST_AUTOSTART_WORKERS", "true").lower() == "true"
+        # 処理中のジョブがある間、UIが進捗を更新する間隔（秒）
+        self.ui_poll_seconds: float = float(os.getenv("INGEST_UI_POLL_SECONDS", "2.0"))
+        # PDFのテキスト抽出に使うプロセス数（0は利用可能なCPU数）と、1プロセスあたりの最小ページ数
+        self.extract_workers: int = int(os.getenv("EXTRACT_WORKERS", "0"))
+        self.extract_min_pages_per_worker: int = int(os.getenv("EXTRACT_MIN_PAGES_PER_WORKER", "50"))
+        # レイアウト解析: 表の抽出、繰り返し現れるヘッダー・フッターの除去、解析結果のキャッシュ先
+        self.layout_detect_tables: bool = os.getenv("LAYOUT_DETECT_TABLES", "true").lower() == "true"
+        self.layout_strip_margins: bool = os.getenv("LAYOUT_STRIP_MARGINS", "true").lower() == "true"
+        self.layout_cache_dir: str = os.getenv("LAYOUT_CACHE_DIR", "storage/layout_cache")
+        # テキストのないページ（スキャン画像）のOCR（Tesseractが必要）
+        self.ocr_enabled: bool = os.getenv("OCR_ENABLED", "true").lower() == "true"
+        self.ocr_language: str = os.getenv("OCR_LANGUAGE", "jpn+eng")
+        self.ocr_dpi: int = int(os.getenv("OCR_DPI", "300"))
+        self.ocr_workers: int = int(os.getenv("OCR_WORKERS", "2"))
+        self.ocr_min_chars: int = int(os.getenv("OCR_MIN_CHARS", "10"))
+        self.ocr_cache_dir: str = os.getenv("OCR_CACHE_DIR", "storage/ocr_cache")
+        # 1回のupsertで埋め込みを登録するチャンク数
+        self.embed_batch_size: int = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+        # ほぼ重複したチャンクの除去（MinHash）: 推定Jaccard類似度の閾値、署名の長さ、LSHのバンド数、文字n-gramの長さ
+        self.dedup_enabled: bool = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+        self.dedup_threshold: float = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+        self.dedup_num_perm: int = int(os.getenv("DEDUP_NUM_PERM", "64"))
+        self.dedup_bands: int = int(os.getenv("DEDUP_BANDS", "16"))
+        self.dedup_shingle_size: int = int(os.getenv("DEDUP_SHINGLE_SIZE", "5"))
+        # 監視フォルダ（build_db.py --watch）: 書き込み完了とみなすまでの秒数と、変更通知がない場合の走査間隔
+        self.watch_debounce_seconds: float = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2.0"))
+        self.watch_poll_seconds: float = float(os.getenv("WATCH_POLL_SECONDS", "5.0"))
+        self.watch_use_inotify: bool = os.getenv("WATCH_USE_INOTIFY", "true").lower() == "true"
+        # 取り込みに失敗したファイルを監視中に再登録するまでの秒数（build_db.py の一括取り込みではすぐに再登録）
+        self.watch_retry_failed_seconds: float = float(os.getenv("WATCH_RETRY_FAILED_SECONDS", "300"))
+        # 再構築（rebuild_index.py）: 切り替え前の検証（自己検索のサンプル数と再現率の下限、
+        # 検証用クエリの上位結果の旧版との重なりの下限）と、切り替え後に旧版を削除するまでの猶予（秒）
+        self.rebuild_sample_size: int = int(os.getenv("REBUILD_SAMPLE_SIZE", "50"))
+        self.rebuild_min_recall: float = float(os.getenv("REBUILD_MIN_RECALL", "0.9"))
+        self.rebuild_min_query_overlap: float = float(os.getenv("REBUILD_MIN_QUERY_OVERLAP", "0.5"))
+        self.rebuild_gc_grace_seconds: float = float(os.getenv("REBUILD_GC_GRACE_SECONDS", "600"))
+
+
+class ResilienceSettings:
+    """API呼び出しのレート制限・リトライ・サーキットブレーカー設定（プロバイダー/モデルごとに共有）"""
+    def __init__(self):
+        self.requests_per_minute: float = float(os.getenv("API_REQUESTS_PER_MINUTE", "60"))
+        # 埋め込みAPIの1分あたりのリクエスト数（1リクエストで最大100テキストをまとめて埋め込む）。
+        # 取り込みワーカーはこの値をワーカー数で分け合う
+        self.embedding_requests_per_minute: float = float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "100"))
+        self.burst: int = int(os.getenv("API_BURST", "5"))
+        self.max_retries: int = int(os.getenv("API_MAX_RETRIES", "3"))
+        self.backoff_max_seconds: float = float(os.getenv("API_BACKOFF_MAX_SECONDS", "30"))
+        self.failure_threshold: int = int(os.getenv("API_FAILURE_THRESHOLD", "5"))
+        self.reset_timeout_seconds: float = float(os.getenv("API_RESET_TIMEOUT_SECONDS", "30"))
+        # 1回の回答生成に使えるレイテンシ予算（検索・リランキング・生成で共有）
+        self.answer_budget_seconds: float = float(os.getenv("ANSWER_LATENCY_BUDGET_SECONDS", "30"))
+        # 予算のうちリランキングに使える割合（使い切ったらベクトル検索の順序を使用）
+        self.rerank_budget_fraction: float = float(os.getenv("RERANK_BUDGET_FRACTION", "0.3"))
+        # リランキングを試みる最小の残り時間（秒）
+        self.rerank_min_seconds: float = float(os.getenv("RERANK_MIN_SECONDS", "1.0"))
+        # 生成の応答がこのパーセンタイルの所要時間を超えたら同じリクエストをもう1つ発行（空の場合は無効）
+        self.hedge_percentile: Optional[float] = (float(os.getenv("HEDGE_PERCENTILE"))
+                                                  if os.getenv("HEDGE_PERCENTILE") else None)
+
+
+class TenantSettings:
+    """テナント（チーム）ごとの分離と上限の設定（0は無制限）"""
+    def __init__(self):
+        # テナントを指定しない場合のテナント（このテナントは CHROMA_COLLECTION_NAME をそのまま使う）
+        self.default_tenant: str = os.getenv("DEFAULT_TENANT", "default")
+        # ログインユーザーのテナントの割り当て（"alice@example.com=team-a,@example.org=team-b"、
+        # @ドメイン はそのドメインの全ユーザー。割り当てのないユーザー・未ログインは既定のテナント）
+        self.assignments: str = os.getenv("TENANT_ASSIGNMENTS", "")
+        self.max_documents: int = int(os.getenv("TENANT_MAX_DOCUMENTS", "0"))
+        self.max_chunks: int = int(os.getenv("TENANT_MAX_CHUNKS", "0"))
+        # 1テナントが同時に使える取り込みワーカー数（大きなアップロードが他のテナントを待たせないように。
+        # 既定のテナントの一括取り込み・監視フォルダのジョブは対象外）
+        self.max_concurrent_jobs: int = int(os.getenv("TENANT_MAX_CONCURRENT_JOBS", "0"))
 
 
 class StorageSettings:
@@ -58,13 +176,43 @@ class StorageSettings:
         self.data_raw_dir: str = os.getenv("DATA_RAW_DIR", "data/raw")
         self.data_processed_dir: str = os.getenv("DATA_PROCESSED_DIR", "data/processed")
         self.static_dir: str = os.getenv("STATIC_DIR", "static")
-        
-        # ディレクトリの作成
-        Path(self.chroma_path).mkdir(parents=True, exist_ok=True)
-        Path(self.chat_history_path).parent.mkdir(parents=True, exist_ok=True)
-        Path(self.data_raw_dir).mkdir(parents=True, exist_ok=True)
-        Path(self.data_processed_dir).mkdir(parents=True, exist_ok=True)
-        Path(self.static_dir).mkdir(parents=True, exist_ok=True)
+        # 埋め込みの量子化モード（none / int8 / pq）
+        self.vector_quantization: str = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+        self.pq_subvectors: int = int(os.getenv("PQ_SUBVECTORS", "96"))
+        # 量子化器を学習する最小件数と、学習し直す件数の増加率（学習時の何倍か）
+        self.quantization_min_train: int = int(os.getenv("QUANTIZATION_MIN_TRAIN", "1000"))
+        self.quantization_retrain_factor: float = float(os.getenv("QUANTIZATION_RETRAIN_FACTOR", "2.0"))
+        # レンダリング済みページ画像のキャッシュ
+        self.page_cache_dir: str = os.getenv("PAGE_CACHE_DIR", "storage/page_cache")
+        self.page_cache_max_mb: int = int(os.getenv("PAGE_CACHE_MAX_MB", "256"))
+        # HNSWインデックスのパラメータ（コレクション作成時に適用）
+        self.hnsw_space: str = os.getenv("HNSW_SPACE", "cosine")
+        self.hnsw_construction_ef: int = int(os.getenv("HNSW_CONSTRUCTION_EF", "100"))
+        self.hnsw_search_ef: int = int(os.getenv("HNSW_SEARCH_EF", "100"))
+        self.hnsw_m: int = int(os.getenv("HNSW_M", "16"))
+        self.hnsw_batch_size: int = int(os.getenv("HNSW_BATCH_SIZE", "100"))
+        self.hnsw_sync_threshold: int = int(os.getenv("HNSW_SYNC_THRESHOLD", "1000"))
+        # スナップショットの復元で1回に登録する件数（ChromaDBの上限を超える場合は上限に合わせる）
+        self.snapshot_batch_size: int = int(os.getenv("SNAPSHOT_BATCH_SIZE", "5000"))
+
+    def hnsw_metadata(self) -> Dict[str, Any]:
+        """コレクション作成時に渡すHNSWメタデータ"""
+        return {
+            "hnsw:space": self.hnsw_space,
+            "hnsw:construction_ef": self.hnsw_construction_ef,
+            "hnsw:search_ef": self.hnsw_search_ef,
+            "hnsw:M": self.hnsw_m,
+            "hnsw:batch_size": self.hnsw_batch_size,
+            "hnsw:sync_threshold": self.hnsw_sync_threshold,
+        }
+
+    def quantization_options(self) -> Dict[str, Any]:
+        """update_quantized_index() に渡す量子化インデックスの設定"""
+        return {
+            "pq_subvectors": self.pq_subvectors,
+            "min_train": self.quantization_min_train,
+            "retrain_factor": self.quantization_retrain_factor,
+        }
 
 
 class Settings:
@@ -74,13 +222,13 @@ class Settings:
         self.embedding = EmbeddingSettings()
         self.generation = GenerationSettings()
         self.retrieval = RetrievalSettings()
+        self.resilience = ResilienceSettings()
+        self.ingestion = IngestionSettings()
+        self.tenants = TenantSettings()
         self.storage = StorageSettings()
-        
-        # ディレクトリの初期化
-        self._ensure_directories()
-    
-    def _ensure_directories(self):
-        """必要なディレクトリを作成"""
+
+    def ensure_directories(self):
+        """必要なディレクトリを作成（書き込みを行うエントリポイントの起動時に呼び出す）"""
         Path(self.storage.chroma_path).mkdir(parents=True, exist_ok=True)
         Path(self.storage.chat_history_path).parent.mkdir(parents=True, exist_ok=True)
         Path(self.storage.data_raw_dir).mkdir(parents=True, exist_ok=True)
@@ -88,5 +236,36 @@ class Settings:
         Path(self.storage.static_dir).mkdir(parents=True, exist_ok=True)
 
 
-# グローバル設定インスタンス
-settings = Settings()
+class LazySettings:
+    """
+    最初の属性アクセスで.envを読み込み、Settingsを構築するプロキシ
+
+    `from src.config import settings` はインポートのみで、ファイルI/Oは発生しません。
+    """
+    def __init__(self):
+        self._settings: Optional[Settings] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Settings:
+        if self._settings is None:
+            with self._lock:
+                if self._settings is None:
+                    from dotenv import load_dotenv
+
+                    # .envファイルを読み込み
+                    load_dotenv()
+                    self._settings = Settings()
+        return self._settings
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+    def reload(self) -> Settings:
+        """環境変数を読み直して設定を再構築"""
+        with self._lock:
+            self._settings = None
+        return self._load()
+
+
+# グローバル設定インスタンス（初回アクセス時に構築）
+settings = LazySettings()
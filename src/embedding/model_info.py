@@ -0,0 +1,86 @@
+"""
+コレクションに保存した埋め込みのモデルと次元数の記録
+
+コレクションの作成時に埋め込みモデルを、最初の登録時に次元数をコレクションのメタデータに記録します。
+EMBEDDING_MODEL を変更しても、保存済みのベクトルと異なるモデルでクエリを埋め込むことはありません:
+EMBEDDING_MODEL_MISMATCH が "route"（デフォルト）の場合は記録されたモデルで検索・取り込みし、
+"refuse" の場合は EmbeddingModelMismatch で拒否します。
+新しいモデルへの移行は src/pipeline/migration.py（migrate_embeddings.py）で行います。
+
+モデルの記録がないコレクション（記録を始める前に作成したもの）は現在の設定のモデルで作成されたものとみなします。
+"""
+from typing import Any, Dict, Optional
+
+from src.config import settings
+from src.utils.error_handler import EmbeddingModelMismatch
+from src.utils.logger import setup_logger
+
+logger = setup_logger("embedding_model")
+
+EMBEDDING_MODEL_KEY = "embedding_model"
+EMBEDDING_DIMENSIONS_KEY = "embedding_dimensions"
+
+MODEL_MISMATCH_POLICIES = ("route", "refuse")
+
+
+def collection_metadata(model_name: str = None) -> Dict[str, Any]:
+    """コレクション作成時に渡すメタデータ（HNSWの設定と埋め込みモデル）"""
+    return dict(settings.storage.hnsw_metadata(), **{EMBEDDING_MODEL_KEY: model_name or settings.embedding.model})
+
+
+def recorded_model(collection) -> Optional[str]:
+    """コレクションに記録された埋め込みモデル（記録がなければNone）"""
+    return (collection.metadata or {}).get(EMBEDDING_MODEL_KEY)
+
+
+def recorded_dimensions(collection) -> Optional[int]:
+    """コレクションに記録された埋め込みの次元数（記録がなければNone）"""
+    return (collection.metadata or {}).get(EMBEDDING_DIMENSIONS_KEY)
+
+
+def embedding_model_for(collection) -> str:
+    """コレクションの検索・登録に使う埋め込みモデル（記録がなければ現在の設定）"""
+    return recorded_model(collection) or settings.embedding.model
+
+
+def record_embedding_model(collection, model_name: str, dimensions: int) -> bool:
+    """
+    コレクションのメタデータに埋め込みモデルと次元数を記録
+
+    Returns:
+        記録を更新したか（既に同じ内容が記録されていればFalse）
+    """
+    metadata = dict(collection.metadata or {})
+    if metadata.get(EMBEDDING_MODEL_KEY) == model_name and metadata.get(EMBEDDING_DIMENSIONS_KEY) == dimensions:
+        return False
+    # HNSWの設定は作成後に変更できないため、それ以外の項目だけを書き換える
+    metadata = {key: value for key, value in metadata.items() if not key.startswith("hnsw:")}
+    metadata.update({EMBEDDING_MODEL_KEY: model_name, EMBEDDING_DIMENSIONS_KEY: int(dimensions)})
+    collection.modify(metadata=metadata)
+    return True
+
+
+def resolve_embedding_model(collection_name: str, recorded: Optional[str], requested: str,
+                            policy: str = None) -> str:
+    """
+    コレクションの検索・登録に使う埋め込みモデルを決める
+
+    Args:
+        collection_name: コレクション名（エラーメッセージ用）
+        recorded: コレクションに記録された埋め込みモデル（記録がなければNone）
+        requested: 使おうとしている埋め込みモデル
+        policy: "route"（記録されたモデルを使う）/ "refuse"（拒否）。Noneの場合は設定から取得
+
+    Raises:
+        EmbeddingModelMismatch: モデルが異なり、policy が "refuse" の場合
+    """
+    if recorded is None or recorded == requested:
+        return requested
+    policy = policy or settings.embedding.model_mismatch
+    if policy == "refuse":
+        raise EmbeddingModelMismatch(
+            f"コレクション {collection_name} の埋め込みは {recorded} で作成されています"
+            f"（現在の設定: {requested}）。python migrate_embeddings.py で移行してください"
+        )
+    logger.debug(f"コレクション {collection_name} は記録されたモデル {recorded} で検索します（設定: {requested}）")
+    return recorded
@@ -0,0 +1,681 @@
+"""
+埋め込みベクトルの量子化インデックス
+
+float32の埋め込みをint8スカラー量子化または直積量子化（PQ）で圧縮して保持し、
+近似スコアで候補を絞り込んだ後、ディスク上のfloat32ベクトルで上位候補のみ再スコアリングします。
+float32ベクトルはメモリマップで開くため、常駐メモリは量子化コードのみになります。
+
+量子化器は学習データが min_train 件に達するまで学習しません（未学習の間、検索はChromaの通常の検索）。
+学習後も件数が学習時の retrain_factor 倍に増えるたびに、保存済みの全ベクトルで学習し直します。
+
+保存した基本部分・差分のファイルは書き換えず、取り込みのたびに追加した分だけを差分ファイルに書き、
+読み込むファイルの一覧（manifest.json）を1回の置き換えで切り替えます。
+変更はプロセス間の排他ロックの中で行うため、複数のワーカーが同時に取り込んでもベクトルを失いません。
+"""
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+QUANTIZATION_METHODS = ("none", "int8", "pq")
+
+# PQのコードブック（1バイト = 256セントロイド）を縮めずに学習するための最小件数
+_PQ_CENTROIDS = 256
+
+# 近似スコア計算時に一度に展開する行数（一時配列のメモリを抑える）
+_SCORE_BLOCK_ROWS = 65536
+
+# 差分ファイルがこの数に達したら全体を書き直す（読み込み時に適用する差分を増やしすぎない）
+MAX_DELTAS = 16
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """コサイン類似度を内積で計算できるようにL2正規化する"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class ScalarQuantizer:
+    """
+    次元ごとのmin/maxで8bitに量子化するスカラー量子化器（float32比で1/4）
+    """
+    def __init__(self, lower: Optional[np.ndarray] = None, scale: Optional[np.ndarray] = None):
+        self.lower = lower
+        self.scale = scale
+
+    def fit(self, vectors: np.ndarray) -> "ScalarQuantizer":
+        """学習データから次元ごとの値域を求める"""
+        self.lower = vectors.min(axis=0).astype(np.float32)
+        upper = vectors.max(axis=0).astype(np.float32)
+        scale = (upper - self.lower) / 255.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """ベクトルを8bitコードに変換（値域外は切り詰め）"""
+        codes = np.rint((vectors - self.lower) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """8bitコードから近似ベクトルを復元"""
+        return codes.astype(np.float32) * self.scale + self.lower
+
+    def score(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        クエリと各コードの近似内積を計算
+
+        dot(q, lower + c * scale) = dot(q, lower) + c @ (q * scale) を利用し、
+        復元ベクトルを丸ごと作らずに計算します。
+        """
+        offset = float(np.dot(query, self.lower))
+        weights = query * self.scale
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _SCORE_BLOCK_ROWS):
+            block = codes[start:start + _SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weights + offset
+        return scores
+
+    def state(self) -> dict:
+        return {"sq_lower": self.lower, "sq_scale": self.scale}
+
+    @classmethod
+    def from_state(cls, state) -> "ScalarQuantizer":
+        return cls(lower=state["sq_lower"], scale=state["sq_scale"])
+
+
+class ProductQuantizer:
+    """
+    ベクトルをn_subvectors個の部分空間に分割し、各部分空間をk-meansのコードブックで
+    1バイトに符号化する直積量子化器（768次元・96分割でfloat32比1/32）
+    """
+    def __init__(self, n_subvectors: int = 96, n_centroids: int = 256,
+                 n_iter: int = 20, max_train: int = 20000, seed: int = 0):
+        self.n_subvectors = n_subvectors
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.max_train = max_train
+        self.seed = seed
+        self.codebooks: Optional[np.ndarray] = None  # (n_subvectors, n_centroids, sub_dim)
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dim = vectors.shape
+        return vectors.reshape(n, self.n_subvectors, dim // self.n_subvectors)
+
+    def fit(self, vectors: np.ndarray) -> "ProductQuantizer":
+        """部分空間ごとにk-meansでコードブックを学習する"""
+        n, dim = vectors.shape
+        if dim % self.n_subvectors != 0:
+            raise ValueError(
+                f"次元数 {dim} は分割数 {self.n_subvectors} で割り切れる必要があります"
+            )
+        rng = np.random.default_rng(self.seed)
+        if n > self.max_train:
+            vectors = vectors[rng.choice(n, self.max_train, replace=False)]
+            n = self.max_train
+
+        # 学習データが少ない場合はセントロイド数を減らす
+        k = min(self.n_centroids, n)
+        sub = self._split(vectors)
+        codebooks = np.empty((self.n_subvectors, k, dim // self.n_subvectors), dtype=np.float32)
+
+        for j in range(self.n_subvectors):
+            data = sub[:, j, :]
+            centroids = data[rng.choice(n, k, replace=False)].copy()
+            for _ in range(self.n_iter):
+                assign = self._nearest(data, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, data)
+                counts = np.bincount(assign, minlength=k)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+            codebooks[j] = centroids
+
+        self.n_centroids = k
+        self.codebooks = codebooks
+        return self
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # ||x - c||^2 = ||x||^2 - 2 x·c + ||c||^2（||x||^2は順位に影響しない）
+        dists = -2.0 * data @ centroids.T + (centroids ** 2).sum(axis=1)
+        return dists.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """ベクトルをPQコード（n, n_subvectors）に変換"""
+        sub = self._split(vectors)
+        codes = np.empty((len(vectors), self.n_subvectors), dtype=np.uint8)
+        for j in range(self.n_subvectors):
+            codes[:, j] = self._nearest(sub[:, j, :], self.codebooks[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """PQコードから近似ベクトルを復元"""
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.n_subvectors)]
+        return np.concatenate(parts, axis=1)
+
+    def score(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        非対称距離計算（ADC）で近似内積を計算
+
+        部分空間ごとにクエリとセントロイドの内積表を作り、コードで引いて合計します。
+        """
+        sub_query = query.reshape(self.n_subvectors, -1)
+        table = np.einsum("jd,jkd->jk", sub_query, self.codebooks).astype(np.float32)
+        rows = np.arange(self.n_subvectors)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _SCORE_BLOCK_ROWS):
+            block = codes[start:start + _SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = table[rows, block].sum(axis=1)
+        return scores
+
+    def state(self) -> dict:
+        return {"pq_codebooks": self.codebooks}
+
+    @classmethod
+    def from_state(cls, state) -> "ProductQuantizer":
+        codebooks = state["pq_codebooks"]
+        quantizer = cls(n_subvectors=codebooks.shape[0], n_centroids=codebooks.shape[1])
+        quantizer.codebooks = codebooks
+        return quantizer
+
+
+class _StackedVectors:
+    """
+    複数のfloat32行列（保存済みの基本部分はメモリマップ、差分はメモリ上）を1つの行列として参照
+
+    行の削除・上書きは各行列の残す行番号で表すため、メモリマップの内容を読み込まずに扱えます。
+    """
+    def __init__(self, parts: List[Tuple[np.ndarray, np.ndarray]], dim: int):
+        self.parts = parts  # (行列, 残す行番号) のリスト
+        self.dim = dim
+        self._offsets = np.cumsum([0] + [len(rows) for _, rows in parts])
+
+    @classmethod
+    def of(cls, matrix: np.ndarray) -> "_StackedVectors":
+        return cls([(matrix, np.arange(len(matrix)))] if len(matrix) else [], matrix.shape[1])
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    def select(self, keep: np.ndarray) -> "_StackedVectors":
+        """keep（真偽値の配列）が真の行だけを残す"""
+        parts = []
+        for (matrix, rows), start, end in zip(self.parts, self._offsets[:-1], self._offsets[1:]):
+            selected = rows[keep[start:end]]
+            if len(selected):
+                parts.append((matrix, selected))
+        return _StackedVectors(parts, self.dim)
+
+    def append(self, matrix: np.ndarray) -> "_StackedVectors":
+        if not len(matrix):
+            return self
+        return _StackedVectors(self.parts + [(matrix, np.arange(len(matrix)))], self.dim)
+
+    def __getitem__(self, positions) -> np.ndarray:
+        """指定した行を読み込む（メモリマップからは該当行のみ）"""
+        positions = np.asarray(positions, dtype=np.int64)
+        result = np.empty((len(positions), self.dim), dtype=np.float32)
+        part_of = np.searchsorted(self._offsets, positions, side="right") - 1
+        for part in np.unique(part_of):
+            mask = part_of == part
+            matrix, rows = self.parts[part]
+            result[mask] = matrix[rows[positions[mask] - self._offsets[part]]]
+        return result
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        if not self.parts:
+            return np.empty((0, self.dim), dtype=dtype or np.float32)
+        matrix = np.concatenate([np.asarray(matrix[rows]) for matrix, rows in self.parts])
+        return matrix if dtype is None else matrix.astype(dtype)
+
+
+class _IndexLock:
+    """
+    量子化インデックスの読み込み・変更・保存をプロセス間で1つに制限する排他ロック
+
+    検索（読み込みのみ）はロックを取りません（manifest.json の置き換えで一貫した版を読む）。
+    """
+    def __init__(self, directory: str):
+        self.path = Path(directory) / QuantizedIndex.LOCK_FILE
+        self._file = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a+b")
+        if sys.platform == "win32":
+            import msvcrt
+
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK は約10秒で諦めるため、取れるまで待ち続ける
+                    continue
+        else:
+            import fcntl
+
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class QuantizedIndex:
+    """
+    量子化コードによる全件近似スコアリング + float32再スコアリングの検索インデックス
+
+    ディレクトリ構成:
+        manifest.json         : 読み込むファイルの一覧（世代番号・基本部分・差分）
+        base-<世代>.npz       : ID・量子化コード・量子化器のパラメータ・学習時の件数
+        base-<世代>.npy       : 正規化済みfloat32ベクトル（再スコアリング・再学習用、メモリマップで参照）
+        delta-<世代>-<番号>.npz: 追加・上書きしたベクトル（ID・コード・float32）と削除したID
+        lock                  : 変更時の排他ロック
+
+    ファイルは一度書いたら変更せず、manifest.json の置き換えで新しい版に切り替えるため、
+    読み込み中に別のプロセスが保存しても、IDとコード・ベクトルの行がずれることはありません。
+    量子化器が未学習（quantizer が None）の間はfloat32ベクトルだけを保持します。
+    """
+    MANIFEST_FILE = "manifest.json"
+    LOCK_FILE = "lock"
+    # 世代ごとのファイルを使う前の形式（読み込みのみ対応し、次の保存で置き換える）
+    INDEX_FILE = "index.npz"
+    VECTORS_FILE = "vectors.npy"
+
+    def __init__(self, method: str, quantizer, ids: np.ndarray, codes: np.ndarray,
+                 vectors=None, trained_size: int = 0):
+        if method not in ("int8", "pq"):
+            raise ValueError(f"未対応の量子化方式です: {method}")
+        self.method = method
+        self.quantizer = quantizer
+        self.ids = ids
+        self.codes = codes
+        if vectors is not None and not isinstance(vectors, _StackedVectors):
+            # メモリマップはそのまま参照する（float32のためコピーしない）
+            vectors = _StackedVectors.of(np.asarray(vectors, dtype=np.float32))
+        self.vectors: Optional[_StackedVectors] = vectors
+        self.trained_size = trained_size
+
+    @classmethod
+    def build(cls, ids: Sequence[str], embeddings, method: str = "int8",
+              pq_subvectors: int = 96, min_train: int = 0) -> "QuantizedIndex":
+        """
+        埋め込みから量子化器を学習してインデックスを構築
+
+        Args:
+            ids: ベクトルID
+            embeddings: 埋め込み（n, dim）
+            method: 'int8' または 'pq'
+            pq_subvectors: PQの部分空間数
+            min_train: 量子化器を学習する最小件数（満たない場合は未学習のインデックス）
+        """
+        vectors = _normalize(embeddings)
+        index = cls(method, None, np.asarray(ids, dtype=str),
+                    np.empty((len(vectors), 0), dtype=np.uint8), vectors)
+        if len(vectors) >= min_train_size(method, min_train):
+            index.train(pq_subvectors)
+        return index
+
+    @property
+    def is_trained(self) -> bool:
+        return self.quantizer is not None
+
+    def train(self, pq_subvectors: int = 96):
+        """保持している全ベクトルで量子化器を学習し、全件を符号化し直す"""
+        vectors = np.asarray(self.vectors)
+        if self.method == "int8":
+            quantizer = ScalarQuantizer().fit(vectors)
+        else:
+            quantizer = ProductQuantizer(n_subvectors=pq_subvectors).fit(vectors)
+        self.quantizer = quantizer
+        self.codes = quantizer.encode(vectors)
+        self.trained_size = len(vectors)
+
+    def needs_training(self, min_train: int = 0, retrain_factor: float = 0) -> bool:
+        """
+        量子化器を（再）学習すべきか
+
+        Args:
+            min_train: 学習する最小件数
+            retrain_factor: 学習時の件数の何倍に増えたら学習し直すか（0以下なら学習し直さない）
+        """
+        if len(self) < min_train_size(self.method, min_train):
+            return False
+        if not self.is_trained:
+            return True
+        return retrain_factor > 0 and len(self) >= self.trained_size * retrain_factor
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """正規化済みベクトルを量子化コードに変換（未学習の場合は0バイトのコード）"""
+        if self.is_trained:
+            return self.quantizer.encode(vectors)
+        return np.empty((len(vectors), 0), dtype=np.uint8)
+
+    def add(self, ids: Sequence[str], embeddings):
+        """
+        ベクトルを追加（既存IDは上書き）。量子化器は学習し直さず既存のものを使います
+        （学習し直すかどうかは needs_training() で判断します）。
+        """
+        vectors = _normalize(embeddings)
+        self._upsert(np.asarray(ids, dtype=str), self.encode(vectors), vectors)
+
+    def _upsert(self, ids: np.ndarray, codes: np.ndarray, vectors: np.ndarray):
+        keep = ~np.isin(self.ids, ids)
+        self.ids = np.concatenate([self.ids[keep], ids])
+        self.codes = np.concatenate([self.codes[keep], codes])
+        if self.vectors is not None:
+            self.vectors = self.vectors.select(keep).append(vectors)
+        else:
+            self.vectors = _StackedVectors.of(vectors)
+
+    def remove(self, ids: Sequence[str]) -> int:
+        """
+        ベクトルを削除
+
+        Returns:
+            削除した件数
+        """
+        keep = ~np.isin(self.ids, np.asarray(list(ids), dtype=str))
+        removed = int((~keep).sum())
+        if removed:
+            self.ids = self.ids[keep]
+            self.codes = self.codes[keep]
+            if self.vectors is not None:
+                self.vectors = self.vectors.select(keep)
+        return removed
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def code_bytes(self) -> int:
+        """常駐する量子化コードのバイト数"""
+        return int(self.codes.nbytes)
+
+    def search(self, query_embedding, top_k: int, rescore_k: Optional[int] = None,
+               allowed_ids: Optional[Sequence[str]] = None) -> List[Tuple[str, float]]:
+        """
+        近似スコアで候補を絞り込み、float32ベクトルで再スコアリングする
+
+        Args:
+            query_embedding: クエリの埋め込み
+            top_k: 返す件数
+            rescore_k: 再スコアリングする候補数（Noneの場合はtop_kの4倍）
+            allowed_ids: 検索対象のID（メタデータの絞り込み結果。Noneの場合は全件）
+
+        Returns:
+            (ID, コサイン距離) のリスト（距離の昇順）
+        """
+        # 絞り込みはスコア計算の前に行う（上位候補を絞り込んだ後に除くと件数が足りなくなる）
+        rows = None
+        if allowed_ids is not None:
+            rows = np.flatnonzero(np.isin(self.ids, np.asarray(list(allowed_ids), dtype=str)))
+        if len(self.ids) == 0 or (rows is not None and len(rows) == 0):
+            return []
+        query = _normalize(query_embedding)[0]
+        if self.is_trained:
+            approx = self.quantizer.score(query, self.codes if rows is None else self.codes[rows])
+        else:
+            # 未学習の間はfloat32ベクトルで正確にスコアリング
+            approx = np.asarray(self.vectors if rows is None else self.vectors[rows]) @ query
+
+        if rescore_k is None:
+            rescore_k = top_k * 4
+        n_candidates = min(max(rescore_k, top_k), len(approx))
+        candidates = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+        scores = approx[candidates]
+        if rows is not None:
+            candidates = rows[candidates]
+
+        if self.vectors is not None and rescore_k > 0 and self.is_trained:
+            # メモリマップから候補行のみ読み込んで正確なスコアを計算
+            candidates.sort()
+            scores = np.asarray(self.vectors[candidates]) @ query
+
+        order = np.argsort(-scores)[:top_k]
+        return [(str(self.ids[candidates[i]]), float(1.0 - scores[i])) for i in order]
+
+    @staticmethod
+    def _read_manifest(directory: str) -> Optional[Dict]:
+        try:
+            with open(Path(directory) / QuantizedIndex.MANIFEST_FILE, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write_manifest(directory: str, manifest: Dict):
+        path = Path(directory)
+        tmp_path = path / (QuantizedIndex.MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path / QuantizedIndex.MANIFEST_FILE)
+
+    def save(self, directory: str):
+        """
+        インデックス全体を新しい世代として保存
+
+        新しい世代のファイルを書き終えてから manifest.json を置き換えるため、
+        読み込み中のプロセスは古い世代か新しい世代のどちらかを一貫して読みます。
+        """
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        previous = self._read_manifest(directory)
+        generation = (previous["generation"] + 1) if previous else 1
+
+        base = f"base-{generation:06d}"
+        np.savez(path / f"{base}.npz", method=np.array(self.method), ids=self.ids, codes=self.codes,
+                 trained_size=np.array(self.trained_size),
+                 **(self.quantizer.state() if self.is_trained else {}))
+        manifest = {"generation": generation, "base": f"{base}.npz", "vectors": None, "deltas": []}
+        if self.vectors is not None:
+            np.save(path / f"{base}.npy", np.asarray(self.vectors, dtype=np.float32))
+            manifest["vectors"] = f"{base}.npy"
+        self._write_manifest(directory, manifest)
+        self._remove_old_generations(path, generation)
+
+    def save_delta(self, directory: str, ids: Sequence[str] = (), codes: np.ndarray = None,
+                   vectors: np.ndarray = None, removed: Sequence[str] = ()):
+        """
+        保存済みのインデックスに差分（追加・上書きしたベクトルと削除したID）だけを追記
+
+        既存のファイルは書き換えず、差分ファイルを書いてから manifest.json に加えます。
+        差分が MAX_DELTAS 個に達した場合は、このインデックス（差分を適用済み）全体を保存し直します。
+        """
+        manifest = self._read_manifest(directory)
+        if manifest is None or len(manifest["deltas"]) >= MAX_DELTAS:
+            self.save(directory)
+            return
+        ids = np.asarray(list(ids), dtype=str)
+        dim = self.vectors.dim if self.vectors is not None else 0
+        name = f"delta-{manifest['generation']:06d}-{len(manifest['deltas']) + 1:04d}.npz"
+        np.savez(Path(directory) / name, ids=ids,
+                 codes=codes if codes is not None else np.empty((0, self.codes.shape[1]), dtype=np.uint8),
+                 vectors=vectors if vectors is not None else np.empty((0, dim), dtype=np.float32),
+                 removed=np.asarray(list(removed), dtype=str))
+        manifest["deltas"].append(name)
+        self._write_manifest(directory, manifest)
+
+    def _remove_old_generations(self, path: Path, generation: int):
+        """
+        2世代前までのファイルを削除
+
+        直前の世代は、manifest.json を置き換える前に読み始めたプロセスのために残します。
+        """
+        stale = [path / self.INDEX_FILE, path / self.VECTORS_FILE]
+        for file in path.iterdir():
+            parts = file.name.split(".")[0].split("-")
+            if parts[0] in ("base", "delta") and len(parts) > 1 and parts[1].isdigit():
+                if int(parts[1]) < generation - 1:
+                    stale.append(file)
+        for file in stale:
+            try:
+                file.unlink()
+            except OSError:
+                # 存在しない・他のプロセスがメモリマップで開いている（Windows）場合は次の保存で削除
+                pass
+
+    @classmethod
+    def load(cls, directory: str, mmap_vectors: bool = True) -> "QuantizedIndex":
+        """保存済みインデックスを読み込む（基本部分のfloat32ベクトルはメモリマップ）"""
+        path = Path(directory)
+        manifest = cls._read_manifest(directory)
+        if manifest is None:
+            manifest = {"base": cls.INDEX_FILE, "deltas": [],
+                        "vectors": cls.VECTORS_FILE if (path / cls.VECTORS_FILE).exists() else None}
+
+        with np.load(path / manifest["base"]) as data:
+            method = str(data["method"])
+            state = {key: data[key] for key in data.files}
+        quantizer = None
+        if method == "int8" and "sq_lower" in state:
+            quantizer = ScalarQuantizer.from_state(state)
+        elif method == "pq" and "pq_codebooks" in state:
+            quantizer = ProductQuantizer.from_state(state)
+        # 学習時の件数を記録する前のインデックスは保存時の件数で学習したものとみなす
+        trained_size = int(state["trained_size"]) if "trained_size" in state else len(state["ids"])
+
+        vectors = None
+        if manifest["vectors"]:
+            vectors = np.load(path / manifest["vectors"], mmap_mode="r" if mmap_vectors else None)
+        index = cls(method, quantizer, state["ids"], state["codes"], vectors,
+                    trained_size=trained_size if quantizer is not None else 0)
+
+        for name in manifest["deltas"]:
+            with np.load(path / name) as delta:
+                index.remove(delta["removed"])
+                if len(delta["ids"]):
+                    index._upsert(delta["ids"], delta["codes"], delta["vectors"])
+        return index
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        path = Path(directory)
+        return (path / QuantizedIndex.MANIFEST_FILE).exists() or (path / QuantizedIndex.INDEX_FILE).exists()
+
+
+def quantized_index_dir(storage_path: str, collection_name: str) -> str:
+    """コレクションに対応する量子化インデックスの保存先"""
+    return os.path.join(storage_path, "quantized", collection_name)
+
+
+_index_cache = {}
+
+
+def _index_stamp(directory: str) -> Tuple[int, int]:
+    """保存した版の識別（manifest.json は置き換えで更新されるため、inodeと更新時刻で判定）"""
+    path = Path(directory) / QuantizedIndex.MANIFEST_FILE
+    if not path.exists():
+        path = Path(directory) / QuantizedIndex.INDEX_FILE
+    stat_result = path.stat()
+    return stat_result.st_ino, stat_result.st_mtime_ns
+
+
+def load_quantized_index(directory: str) -> QuantizedIndex:
+    """
+    量子化インデックスを読み込む（ファイルが更新されていなければプロセス内のキャッシュを返す）
+    """
+    stamp = _index_stamp(directory)
+    cached = _index_cache.get(directory)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    index = QuantizedIndex.load(directory)
+    _index_cache[directory] = (stamp, index)
+    return index
+
+
+def min_train_size(method: str, min_train: int = 0) -> int:
+    """
+    量子化器を学習する最小件数
+
+    PQは1バイトのコードに対応する256個のセントロイドを学習できる件数を下限にします
+    （少ない件数で学習するとコードブックが小さいまま固定されるため）。
+    """
+    if method == "pq":
+        return max(min_train, _PQ_CENTROIDS)
+    return min_train
+
+
+def update_quantized_index(storage_path: str, collection_name: str, ids: Sequence[str],
+                           embeddings, method: str, pq_subvectors: int = 96,
+                           min_train: int = 0, retrain_factor: float = 0) -> QuantizedIndex:
+    """
+    量子化インデックスにベクトルを追加する（存在しない場合は新規構築）
+
+    量子化器は最初のバッチだけでなく、保存済みの全ベクトルで学習します:
+    件数が min_train に達した時点で初めて学習し、その後は学習時の件数の retrain_factor 倍に
+    増えるたびに学習し直します。量子化方式が変わった場合も全ベクトルで学習し直します。
+    学習し直さない場合は追加分だけを差分ファイルに書きます。
+
+    Args:
+        min_train: 量子化器を学習する最小件数（満たない間は未学習で、検索はChromaの通常の検索）
+        retrain_factor: 学習時の件数の何倍に増えたら学習し直すか（0以下なら学習し直さない）
+    """
+    directory = quantized_index_dir(storage_path, collection_name)
+    with _IndexLock(directory):
+        if not QuantizedIndex.exists(directory):
+            index = QuantizedIndex.build(ids, embeddings, method=method, pq_subvectors=pq_subvectors,
+                                         min_train=min_train)
+            index.save(directory)
+            return index
+
+        index = QuantizedIndex.load(directory)
+        retrain = index.method != method
+        if retrain:
+            index = QuantizedIndex(method, None, index.ids, np.empty((len(index), 0), dtype=np.uint8),
+                                   index.vectors)
+        ids = np.asarray(ids, dtype=str)
+        vectors = codes = None
+        if len(ids):
+            vectors = _normalize(embeddings)
+            codes = index.encode(vectors)
+            index._upsert(ids, codes, vectors)
+
+        if retrain or index.needs_training(min_train, retrain_factor):
+            index.train(pq_subvectors)
+            index.save(directory)
+        elif len(ids):
+            index.save_delta(directory, ids, codes, vectors)
+    return index
+
+
+def remove_from_quantized_index(storage_path: str, collection_name: str, ids: Sequence[str]) -> int:
+    """
+    量子化インデックスからベクトルを削除する（インデックスがない場合は何もしない）
+
+    Returns:
+        削除した件数
+    """
+    directory = quantized_index_dir(storage_path, collection_name)
+    if not QuantizedIndex.exists(directory):
+        return 0
+    with _IndexLock(directory):
+        index = QuantizedIndex.load(directory)
+        stored = set(index.ids.tolist())
+        present = [i for i in ids if i in stored]
+        removed = index.remove(present)
+        if removed:
+            index.save_delta(directory, removed=present)
+    return removed
@@ -0,0 +1,45 @@
+"""
+レート制限付きのGemini埋め込み関数
+
+chromadb の GoogleGenerativeAiEmbeddingFunction はテキストごとに embed_content を呼ぶため、
+1,000チャンクの文書で1,000回のリクエストになります。ここでは最大100テキストを1回の
+embed_content（batchEmbedContents）にまとめ、そのバッチ1回の呼び出しごとに、モデル単位で共有する
+トークンバケット・リトライ・サーキットブレーカーを通します（EMBEDDING_REQUESTS_PER_MINUTE）。
+
+埋め込み関数の名前と設定は元の関数と同じため、既存のコレクションもそのまま開けます。
+chromadb の読み込みを遅らせるため、このモジュールは src/pipeline/resources.py から必要になった時点で読み込みます。
+"""
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+from chromadb.api.types import Documents, Embeddings
+from chromadb.utils.embedding_functions import GoogleGenerativeAiEmbeddingFunction
+
+# batchEmbedContents の1リクエストで埋め込めるテキスト数の上限
+EMBED_REQUEST_BATCH_SIZE = 100
+
+
+class RateLimitedGeminiEmbeddingFunction(GoogleGenerativeAiEmbeddingFunction):
+    """バッチ1回のAPI呼び出しごとにトークンを1つ消費するGemini埋め込み関数"""
+
+    def __call__(self, input: Documents) -> Embeddings:
+        from src.pipeline.resources import get_embedding_handler
+
+        if not all(isinstance(item, str) for item in input):
+            raise ValueError("Google Generative AI only supports text documents, not images")
+
+        handler = get_embedding_handler(self.model_name)
+        embeddings: List = []
+        for start in range(0, len(input), EMBED_REQUEST_BATCH_SIZE):
+            # 失敗したバッチだけを再試行し、埋め込み済みのバッチはAPIを呼び直さない
+            batch = list(input[start:start + EMBED_REQUEST_BATCH_SIZE])
+            embeddings.extend(handler.execute(self._embed_batch, batch))
+        return embeddings
+
+    def _embed_batch(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """テキストのリストを1回のAPI呼び出しで埋め込む"""
+        kwargs: Dict[str, Any] = {"model": self.model_name, "content": list(texts), "task_type": self.task_type}
+        if self.dimension is not None:
+            kwargs["output_dimensionality"] = self.dimension
+        result = self._genai.embed_content(**kwargs)
+        return [np.array(embedding, dtype=np.float32) for embedding in result["embedding"]]
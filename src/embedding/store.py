@@ -1,28 +1,48 @@
 import os
 import sys
 import json
-import chromadb
-from chromadb.utils import embedding_functions
-import google.generativeai as genai
-from dotenv import load_dotenv
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 
 # Windows環境でのエンコーディングエラー対策
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding='utf-8')
 
-load_dotenv()
-
 # 設定のインポート
 from src.config import settings
+from src.pipeline.aliases import resolve_collection
+from src.pipeline.resources import get_pipeline_resources
+
+def _ids_for_sources(collection, sources) -> List[str]:
+    """指定した元ファイル（metadataのsource）に属するチャンクのID"""
+    ids = []
+    for source in sources:
+        ids.extend(collection.get(where={"source": source}, include=[])["ids"])
+    return ids
+
 
-def store_embeddings(processed_file: str, storage_path: str = None):
+def store_embeddings(processed_file: str, storage_path: str = None,
+                     progress_callback: Optional[Callable[[int, int], None]] = None,
+                     start_index: int = 0, batch_size: int = None, collection_name: str = None,
+                     max_chunks: int = None, embedding_model: str = None) -> int:
     """
     JSONデータからテキストを読み込み、Google Geminiでベクトル化してChromaDBに保存します。
     
     Args:
         processed_file: 処理済みJSONファイルのパス
         storage_path: ChromaDBの保存パス（Noneの場合は設定から取得）
+        progress_callback: バッチごとに (登録済み件数, 全件数) を受け取る関数
+        start_index: この位置のチャンクから登録を再開（中断したジョブの再開用）
+        batch_size: 1回のupsertで登録するチャンク数（Noneの場合は設定から取得）
+        collection_name: 登録先のコレクション（Noneの場合は設定から取得。テナントごとのコレクション用）
+        max_chunks: コレクションのチャンク数の上限（Noneの場合は設定から取得、0は無制限）
+        embedding_model: 埋め込みモデル（Noneの場合は設定から取得。埋め込みモデルの移行用）
+
+    Returns:
+        登録したチャンク数（重複除去が有効な場合は代表チャンクの数）
+
+    Raises:
+        TenantLimitExceeded: 登録するとチャンク数の上限を超える場合（何も登録しない）
+        EmbeddingModelMismatch: コレクションが別のモデルで作成され、EMBEDDING_MODEL_MISMATCH が "refuse" の場合
     """
     if storage_path is None:
         storage_path = settings.storage.chroma_path
@@ -37,37 +57,198 @@ def store_embeddings(processed_file: str, storage_path: str = None):
 
     print(f"Loaded {len(chunks)} chunks from {processed_file}")
 
-    # 2. ChromaDBの初期化
-    client = chromadb.PersistentClient(path=storage_path)
-    
-    # Google Gemini Embedding関数
-    gemini_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
-        api_key=api_key,
-        model_name=settings.embedding.model,
-        task_type=settings.embedding.task_type_document
-    )
-
-    # コレクション（テーブルのようなもの）の作成または取得
-    collection_name = settings.storage.collection_name
-    collection = client.get_or_create_collection(
-        name=collection_name,
-        embedding_function=gemini_ef,
-        metadata={"hnsw:space": "cosine"}
+    # 2. コレクション（テーブルのようなもの）の作成または取得
+    # クライアントと埋め込み関数はプロセス内で共有（chromadb はこの時点で読み込み）
+    resources = get_pipeline_resources()
+    collection_name = resolve_collection(storage_path, collection_name or settings.storage.collection_name)
+    # 既存のコレクションは保存済みのベクトルと同じモデルで埋め込む
+    collection = resources.collection(
+        storage_path, collection_name,
+        task_type=settings.embedding.task_type_document, create=True, model_name=embedding_model
     )
 
     # 3. データの登録
-    ids = [f"{os.path.basename(processed_file)}_{i}" for i in range(len(chunks))]
-    documents = [c["content"] for c in chunks]
-    metadatas = [c["metadata"] for c in chunks]
+    all_ids = [f"{os.path.basename(processed_file)}_{i}" for i in range(len(chunks))]
+    sources = {c["metadata"].get("source") for c in chunks if c["metadata"].get("source")}
+
+    # ほぼ重複したチャンクは代表だけを埋め込む
+    # （計画は共有の重複インデックスに依存し、中断から再開までに他の文書の取り込みで変わりうるため、
+    #  処理済みJSONの隣に保存して再開時は同じ計画を使う。計画がなければ最初から登録し直す）
+    dedup_index, plan, plan_path = None, None, None
+    if settings.ingestion.dedup_enabled and len(sources) == 1:
+        from src.ingestion.dedup import (
+            DedupIndex, MinHasher, dedup_index_path, dedup_plan_path, load_dedup_plan, plan_dedup, save_dedup_plan
+        )
+
+        ingestion = settings.ingestion
+        dedup_index = DedupIndex(dedup_index_path(storage_path, collection_name), bands=ingestion.dedup_bands)
+        hasher = MinHasher(ingestion.dedup_num_perm, ingestion.dedup_shingle_size)
+        plan_path = dedup_plan_path(processed_file)
+        if start_index > 0:
+            plan = load_dedup_plan(plan_path, chunks, hasher)
+            if plan is None:
+                print("Dedup plan of the interrupted run not found; restarting from the first chunk.")
+                start_index = 0
+        if plan is None:
+            plan = plan_dedup(
+                all_ids, chunks, dedup_index, source=next(iter(sources)), hasher=hasher,
+                threshold=ingestion.dedup_threshold, bands=ingestion.dedup_bands
+            )
+            save_dedup_plan(plan_path, plan)
+        selected = plan.representatives
+        print(f"Deduplicated {len(chunks)} chunks into {len(selected)} representatives.")
+    else:
+        selected = range(len(chunks))
+
+    ids = [all_ids[i] for i in selected]
+    documents = [chunks[i]["content"] for i in selected]
+    metadatas = [chunks[i]["metadata"] for i in selected]
+    if plan is not None:
+        metadatas = [dict(m, dup_group=chunk_id) for m, chunk_id in zip(metadatas, ids)]
+
+    # チャンク数の上限（同じ文書の再取り込みは以前のチャンクと置き換わる分を差し引く）
+    if start_index == 0:
+        from src.pipeline.tenants import check_chunk_quota
 
+        check_chunk_quota(collection.count(), len(_ids_for_sources(collection, sources)), len(ids),
+                          max_chunks=max_chunks, collection_name=collection_name)
+
+    # バッチごとに登録し、進捗を通知（IDは決定的なため、途中から再開しても重複しない）
+    batch_size = batch_size or settings.ingestion.embed_batch_size
     print(f"Upserting to collection '{collection_name}'...")
-    collection.upsert(
-        ids=ids,
-        documents=documents,
-        metadatas=metadatas
-    )
+    for start in range(start_index, len(ids), batch_size):
+        end = min(start + batch_size, len(ids))
+        collection.upsert(
+            ids=ids[start:end],
+            documents=documents[start:end],
+            metadatas=metadatas[start:end]
+        )
+        if progress_callback is not None:
+            progress_callback(end, len(ids))
     
-    print(f"Successfully stored {len(chunks)} vectors.")
+    print(f"Successfully stored {len(ids)} vectors.")
+    stored_count = len(ids)
+
+    # 最初の登録で埋め込みの次元数をモデルと合わせて記録
+    from src.embedding.model_info import embedding_model_for, record_embedding_model, recorded_dimensions
+
+    if ids and recorded_dimensions(collection) is None:
+        sample = collection.get(ids=ids[:1], include=["embeddings"])
+        if len(sample["embeddings"]):
+            record_embedding_model(collection, embedding_model_for(collection), len(sample["embeddings"][0]))
+
+    # 親の範囲（前後のチャンク・ページ全体）に広げる検索用に、すべてのチャンクをページストアに保存
+    from src.retrieval.page_store import PageStore, page_store_path
+
+    page_store = PageStore(page_store_path(storage_path, collection_name))
+    for source in sources:
+        page_store.replace_source(source, [c for c in chunks if c["metadata"].get("source") == source])
+
+    # すべてのコピーの出典を記録し、この文書の代表を失ったグループは他の文書のコピーを代表に昇格
+    if dedup_index is not None:
+        promoted = dedup_index.replace_source(next(iter(sources)), all_ids, chunks, plan)
+        _upsert_promoted(collection, promoted)
+        ids.extend(p["id"] for p in promoted)
+        os.remove(plan_path)
+
+    # 前回の取り込みより短くなった文書の古いチャンク・重複になったチャンクを削除
+    # （登録後に削除するため検索から消える時間がない）
+    new_ids = set(ids)
+    stale_ids = [i for i in _ids_for_sources(collection, sources) if i not in new_ids]
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+        print(f"Removed {len(stale_ids)} stale chunks.")
+
+    # 4. 量子化インデックスの更新（Chromaが計算した埋め込みを再利用し、追加のAPI呼び出しはしない）
+    method = settings.storage.vector_quantization
+    if method != "none":
+        from src.embedding.quantization import (
+            QuantizedIndex, quantized_index_dir, remove_from_quantized_index, update_quantized_index
+        )
+
+        # インデックスがまだなければ、この文書だけでなくコレクションの全ベクトルから作る
+        if QuantizedIndex.exists(quantized_index_dir(storage_path, collection_name)):
+            stored = collection.get(ids=ids, include=["embeddings"])
+        else:
+            stored = collection.get(include=["embeddings"])
+        if stale_ids:
+            remove_from_quantized_index(storage_path, collection_name, stale_ids)
+        index = update_quantized_index(
+            storage_path, collection_name, stored["ids"], stored["embeddings"],
+            method=method, **settings.storage.quantization_options()
+        )
+        if index.is_trained:
+            print(f"Updated {method} quantized index ({len(index)} vectors, {index.code_bytes} bytes).")
+        else:
+            print(f"Quantized index pending training ({len(index)} vectors).")
+
+    # 5. コレクションのバージョンを進める（キャッシュ済みのドキュメント数・ハンドルを無効化）
+    resources.notify_ingested(storage_path, collection_name)
+    return stored_count
+
+
+def _upsert_promoted(collection, promoted: List[Dict]):
+    """重複グループの代表に昇格したチャンクを登録"""
+    if promoted:
+        collection.upsert(
+            ids=[p["id"] for p in promoted],
+            documents=[p["content"] for p in promoted],
+            metadatas=[p["metadata"] for p in promoted]
+        )
+        print(f"Promoted {len(promoted)} duplicate chunks to representatives.")
+
+def delete_document(source: str, storage_path: str = None, collection_name: str = None) -> int:
+    """
+    元ファイル（metadataのsource）に属するチャンクをベクトルDBから削除
+
+    Args:
+        source: PDFのファイル名
+        storage_path: ChromaDBの保存パス（Noneの場合は設定から取得）
+        collection_name: コレクション（Noneの場合は設定から取得）
+
+    Returns:
+        削除したチャンク数
+    """
+    if storage_path is None:
+        storage_path = settings.storage.chroma_path
+
+    resources = get_pipeline_resources()
+    collection_name = resolve_collection(storage_path, collection_name or settings.storage.collection_name)
+    try:
+        collection = resources.collection(storage_path, collection_name)
+    except Exception:
+        # コレクションがまだない
+        return 0
+
+    ids = _ids_for_sources(collection, [source])
+    from src.retrieval.page_store import PageStore, page_store_path
+
+    pages_path = page_store_path(storage_path, collection_name)
+    if os.path.exists(pages_path):
+        PageStore(pages_path).replace_source(source, [])
+    promoted = []
+    if settings.ingestion.dedup_enabled:
+        from src.ingestion.dedup import DedupIndex, dedup_index_path
+
+        index_path = dedup_index_path(storage_path, collection_name)
+        if os.path.exists(index_path):
+            # この文書にしかない代表を失うグループは、他の文書のコピーを代表に昇格
+            promoted = DedupIndex(index_path, bands=settings.ingestion.dedup_bands).replace_source(source, [], [])
+    if not ids:
+        return 0
+    collection.delete(ids=ids)
+    _upsert_promoted(collection, promoted)
+    method = settings.storage.vector_quantization
+    if method != "none":
+        from src.embedding.quantization import remove_from_quantized_index, update_quantized_index
+
+        remove_from_quantized_index(storage_path, collection_name, ids)
+        if promoted:
+            stored = collection.get(ids=[p["id"] for p in promoted], include=["embeddings"])
+            update_quantized_index(storage_path, collection_name, stored["ids"], stored["embeddings"],
+                                   method=method, **settings.storage.quantization_options())
+    resources.notify_ingested(storage_path, collection_name)
+    return len(ids)
 
 if __name__ == "__main__":
     processed_dir = "data/processed"
@@ -0,0 +1,116 @@
+"""
+入力トークン予算に収まるようにプロンプトの資料（コンテキスト）を詰める
+
+検索結果を関連度の高い順に、概算のトークン数が予算に収まる限り追加します。
+同じページの隣り合うチャンク（chunk_id が連続）は1つの資料にまとめ、チャンク化で重ねた部分
+（chunk_overlap）を取り除くため、同じ文章を2回送りません。
+
+トークン数はAPIを呼ばずに概算します（日本語の文字は1文字≒1トークン、それ以外は4文字≒1トークン）。
+"""
+import math
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+# 日本語（ひらがな・カタカナ・漢字・全角記号）の文字
+_CJK_PATTERN = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+# 資料の見出し（--- 資料 N ---）と区切りの改行の分
+BLOCK_OVERHEAD_TOKENS = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    others = len("".join(text.split())) - cjk
+    return cjk + math.ceil(others / 4)
+
+
+def merge_overlapping(first: str, second: str, max_overlap: int = 200) -> str:
+    """first の末尾と second の先頭の重なり（最長一致）を除いて連結"""
+    limit = min(len(first), len(second), max_overlap)
+    for size in range(limit, 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+class ContextBlock(NamedTuple):
+    """プロンプトに入れる1つの資料（同じページの連続したチャンクをまとめたもの）"""
+    content: str
+    source: str
+    page: object
+    results: List[Dict]  # まとめた検索結果（関連度の高い順）
+    tokens: int
+
+
+class PackedContext(NamedTuple):
+    """詰めた結果"""
+    blocks: List[ContextBlock]  # 最も関連度の高いチャンクを含む資料から順
+    tokens: int  # 資料全体の概算トークン数
+    dropped: int  # 予算に収まらず除いた検索結果の数
+
+
+def _chunk_index(result: Dict) -> Optional[int]:
+    value = result["metadata"].get("chunk_id")
+    return value if isinstance(value, int) else None
+
+
+def _block(results: List[Dict]) -> ContextBlock:
+    """同じページの連続したチャンクを chunk_id 順に重なりを除いて連結"""
+    ordered = sorted(results, key=_chunk_index)
+    content = ordered[0]["content"]
+    for result in ordered[1:]:
+        content = merge_overlapping(content, result["content"])
+    metadata = results[0]["metadata"]
+    return ContextBlock(content, metadata.get("source", "不明"), metadata.get("page", "不明"), results,
+                        estimate_tokens(content) + BLOCK_OVERHEAD_TOKENS)
+
+
+def pack_context(results: List[Dict], budget_tokens: int) -> PackedContext:
+    """
+    検索結果を関連度の高い順に、概算トークン数が予算に収まる限り資料に詰める
+
+    Args:
+        results: 関連度の高い順の検索結果（content, metadata）
+        budget_tokens: 資料全体の入力トークン予算（0以下の場合は無制限。先頭の結果は超えても入れる）
+
+    Returns:
+        PackedContext（資料は最初に追加した検索結果の順）
+    """
+    groups: List[List[Dict]] = []
+    total = 0
+    dropped = 0
+
+    for result in results:
+        metadata = result["metadata"]
+        index = _chunk_index(result)
+        # 同じページで chunk_id が隣り合う資料（間を埋める場合は両側）とまとめる
+        adjacent = [
+            i for i, group in enumerate(groups)
+            if index is not None
+            and group[0]["metadata"].get("source") == metadata.get("source")
+            and group[0]["metadata"].get("page") == metadata.get("page")
+            and any(_chunk_index(r) is not None and abs(_chunk_index(r) - index) <= 1 for r in group)
+        ]
+        merged = [r for i in adjacent for r in groups[i]] + [result]
+        before = sum(_block(groups[i]).tokens for i in adjacent)
+        cost = _block(merged).tokens - before
+
+        # 最も関連度の高い結果は予算を超えても入れる（資料が空のプロンプトにしない）
+        if budget_tokens > 0 and total + cost > budget_tokens and groups:
+            dropped += 1
+            continue
+        total += cost
+        if adjacent:
+            groups[adjacent[0]] = merged
+            for i in reversed(adjacent[1:]):
+                del groups[i]
+        else:
+            groups.append([result])
+
+    return PackedContext([_block(group) for group in groups], total, dropped)
+
+
+def format_context(packed: PackedContext) -> str:
+    """プロンプト用の「--- 資料 N ---」形式のテキスト"""
+    return "".join(f"\n--- 資料 {i} ---\n{block.content}\n" for i, block in enumerate(packed.blocks, 1))
@@ -2,7 +2,6 @@ import json
 import os
 import sys
 from typing import List, Dict
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # Windows環境でのエンコーディングエラー対策
 if sys.platform == "win32":
@@ -12,6 +11,9 @@ def chunk_text(extracted_data: List[Dict], chunk_size: int = 500, chunk_overlap:
     """
     抽出されたテキストをチャンク（断片）に分割します。
     """
+    # langchain はインポートが重いため初回呼び出し時に読み込み
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
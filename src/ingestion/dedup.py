@@ -0,0 +1,395 @@
+"""
+ほぼ重複したチャンクの検出（MinHash + LSH）
+
+マニュアルの版違いやページごとに繰り返される定型文は、内容がほぼ同じチャンクとして何度も埋め込まれ、
+検索候補（initial_k）を埋めてしまいます。取り込み時にチャンクをMinHashで指紋化し、
+Jaccard類似度が閾値以上のチャンクをグループにまとめて、代表の1チャンクだけを埋め込みます。
+
+- 文字 n-gram（日本語は単語区切りがないため文字単位）の集合でMinHash署名を計算（NumPyでベクトル化）
+- 署名をバンドに分けたLSHで候補を絞り、推定Jaccard類似度で確認
+- すべてのコピーの出典（ファイル・ページ）と本文はSQLiteの重複インデックスに保持し、
+  検索結果にはグループ内の他の出典を付けて返します
+- 代表チャンクの文書が削除・変更された場合は、他の文書に残るコピーを代表に昇格させます
+  （取り込み直した文書に同じ内容のチャンクがあれば、そのチャンクがグループの代表を引き継ぎます）
+"""
+import json
+import os
+import sqlite3
+import zlib
+from contextlib import closing
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+# MinHashの法（メルセンヌ素数 2^31 - 1。a*x + b が uint64 に収まる）
+_MERSENNE_PRIME = (1 << 31) - 1
+
+# SQLiteのIN句に一度に渡す値の数
+_SQL_BATCH = 500
+
+
+class MinHasher:
+    """文字 n-gram の集合からMinHash署名を計算"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """空白を詰めた文字 n-gram のハッシュ値"""
+        text = "".join(text.split())
+        n = self.shingle_size
+        grams = {text[i:i + n] for i in range(max(len(text) - n + 1, 1))}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) % _MERSENNE_PRIME for g in grams),
+                           dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        x = self.shingles(text)
+        hashed = (self._a[:, None] * x[None, :] + self._b[:, None]) % _MERSENNE_PRIME
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        """(len(texts), num_perm) の署名行列"""
+        if not texts:
+            return np.zeros((0, self.num_perm), dtype=np.uint32)
+        return np.stack([self.signature(text) for text in texts])
+
+
+def estimate_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """2つの署名から推定したJaccard類似度"""
+    return float(np.mean(a == b))
+
+
+def band_keys(signature: np.ndarray, bands: int) -> List[str]:
+    """LSHのバンドごとのキー（同じキーを持つ署名が候補になる）"""
+    rows = len(signature) // bands
+    return [signature[i * rows:(i + 1) * rows].tobytes().hex() for i in range(bands)]
+
+
+class DedupPlan(NamedTuple):
+    """重複除去の結果"""
+    representatives: List[int]  # 埋め込むチャンクの位置
+    groups: List[str]  # チャンクごとの代表チャンクのID
+    signatures: np.ndarray
+    adopted: Dict[str, str] = {}  # 代表のID -> 引き継ぐグループ（取り込み直しで代表を失うグループ）
+
+
+def dedup_index_path(storage_path: str, collection_name: str) -> str:
+    """コレクションに対応する重複インデックスの保存先"""
+    return os.path.join(storage_path, "dedup", f"{collection_name}.db")
+
+
+def dedup_plan_path(processed_file: str) -> str:
+    """処理済みJSONに対応する重複除去の計画の保存先（処理済みJSONの一覧に含まれないよう拡張子を変える）"""
+    return processed_file + ".dedup"
+
+
+def save_dedup_plan(path: str, plan: DedupPlan):
+    """途中から再開したときに同じ代表を登録するため、計画（署名以外）を保存"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"representatives": list(plan.representatives), "groups": list(plan.groups),
+                   "adopted": dict(plan.adopted)}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_dedup_plan(path: str, chunks: Sequence[Dict], hasher: MinHasher) -> Optional[DedupPlan]:
+    """保存した計画を読み込む（ないか、チャンク数が合わない場合はNone。署名は本文から計算し直す）"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if len(data.get("groups", [])) != len(chunks):
+        return None
+    signatures = hasher.signatures([chunk["content"] for chunk in chunks])
+    return DedupPlan(data["representatives"], data["groups"], signatures, data.get("adopted", {}))
+
+
+class DedupIndex:
+    """
+    取り込み済みチャンクの署名と出典を保持するSQLiteインデックス
+
+    chunks: すべてのコピー（代表かどうか、所属グループ、出典、本文・メタデータ）
+    bands:  代表チャンクのLSHバンドキー
+    """
+
+    def __init__(self, db_path: str, bands: int = 16):
+        self.db_path = db_path
+        self.bands = bands
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                group_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                page INTEGER,
+                is_representative INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                signature BLOB NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_group ON chunks (group_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                band_key TEXT NOT NULL,
+                chunk_id TEXT NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands (band, band_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS bands_chunk ON bands (chunk_id)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def find_representatives(self, signature: np.ndarray, exclude_source: str = None) -> Dict[str, np.ndarray]:
+        """
+        LSHバンドが一致する代表チャンク（候補）の署名
+
+        Args:
+            exclude_source: この出典の代表は除く（取り込み直し中の文書自身と比較しないため）
+        """
+        return self.find_candidates(signature[np.newaxis, :], exclude_source)[0][0]
+
+    def find_candidates(self, signatures: np.ndarray, source: str = None
+                        ) -> List[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]]:
+        """
+        文書のすべてのチャンクについて、LSHバンドが一致する候補を1つの接続でまとめて検索
+
+        Args:
+            signatures: チャンクの署名（n, num_perm）
+            source: 取り込み直す文書の出典（この出典の代表は候補に含めない）
+
+        Returns:
+            チャンクごとの (他の文書の代表の署名, 代表を失うグループの署名) 。
+            代表を失うグループは source の古い代表のグループのうち他の文書にコピーが残るもので、
+            署名は昇格するはずのコピーのものです
+        """
+        keys = [band_keys(signature, self.bands) for signature in signatures]
+        unique_keys = sorted({key for chunk_keys in keys for key in chunk_keys})
+        matches: Dict[Tuple[int, str], List[str]] = {}
+        representatives: Dict[str, Tuple[str, np.ndarray]] = {}
+        with closing(self._connect()) as conn:
+            for start in range(0, len(unique_keys), _SQL_BATCH):
+                batch = unique_keys[start:start + _SQL_BATCH]
+                rows = conn.execute(
+                    "SELECT b.band, b.band_key, c.chunk_id, c.source, c.signature "
+                    "FROM bands b JOIN chunks c ON c.chunk_id = b.chunk_id "
+                    f"WHERE b.band_key IN ({','.join('?' * len(batch))}) AND c.is_representative = 1", batch
+                ).fetchall()
+                for row in rows:
+                    matches.setdefault((row['band'], row['band_key']), []).append(row['chunk_id'])
+                    representatives[row['chunk_id']] = (
+                        row['source'], np.frombuffer(row['signature'], dtype=np.uint32))
+
+            # 取り込み直す文書の古い代表のグループで、他の文書に残るコピー（昇格する順に最初のもの）
+            orphan_copies: Dict[str, np.ndarray] = {}
+            own = sorted(chunk_id for chunk_id, (rep_source, _) in representatives.items()
+                         if source is not None and rep_source == source)
+            for start in range(0, len(own), _SQL_BATCH):
+                batch = own[start:start + _SQL_BATCH]
+                rows = conn.execute(
+                    f"SELECT group_id, signature FROM chunks WHERE group_id IN ({','.join('?' * len(batch))}) "
+                    "AND source != ? ORDER BY chunk_id", batch + [source]
+                ).fetchall()
+                for row in rows:
+                    orphan_copies.setdefault(row['group_id'], np.frombuffer(row['signature'], dtype=np.uint32))
+
+        candidates = []
+        for chunk_keys in keys:
+            others: Dict[str, np.ndarray] = {}
+            orphans: Dict[str, np.ndarray] = {}
+            for band, key in enumerate(chunk_keys):
+                for chunk_id in matches.get((band, key), []):
+                    rep_source, signature = representatives[chunk_id]
+                    if source is None or rep_source != source:
+                        others[chunk_id] = signature
+                    elif chunk_id in orphan_copies:
+                        orphans[chunk_id] = orphan_copies[chunk_id]
+            candidates.append((others, orphans))
+        return candidates
+
+    def replace_source(self, source: str, ids: Sequence[str], chunks: Sequence[Dict],
+                       plan: Optional[DedupPlan] = None) -> List[Dict]:
+        """
+        文書のチャンクの記録を置き換える（plan=None・chunks空の場合は削除）
+
+        この文書の代表を失ったグループでは、他の文書に残るコピーを代表に昇格させます。
+
+        Returns:
+            昇格したチャンク（{"id", "content", "metadata"}）。呼び出し側でベクトルDBに登録する
+        """
+        promoted = []
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                old_ids = [row['chunk_id'] for row in conn.execute(
+                    "SELECT chunk_id FROM chunks WHERE source = ?", (source,))]
+                self._delete(conn, old_ids)
+
+                # 古い代表のグループを同じ内容の新しい代表に付け替える（他の文書のコピーを昇格させない）
+                adopted = plan.adopted if plan is not None else {}
+                for new_id, group_id in adopted.items():
+                    conn.execute("UPDATE chunks SET group_id = ? WHERE group_id = ?", (new_id, group_id))
+
+                # 代表を失ったグループのコピーを昇格（新しいチャンクを登録する前に判定するため、
+                # 古い代表と同じIDの別の内容のチャンクがグループの代表とみなされることはない）
+                orphaned = conn.execute(
+                    "SELECT DISTINCT c.group_id FROM chunks c WHERE NOT EXISTS ("
+                    "SELECT 1 FROM chunks r WHERE r.chunk_id = c.group_id AND r.is_representative = 1)"
+                ).fetchall()
+                for (group_id,) in orphaned:
+                    if group_id in adopted:
+                        continue
+                    row = conn.execute("SELECT * FROM chunks WHERE group_id = ? ORDER BY chunk_id LIMIT 1",
+                                       (group_id,)).fetchone()
+                    new_id = row['chunk_id']
+                    conn.execute("UPDATE chunks SET group_id = ? WHERE group_id = ?", (new_id, group_id))
+                    conn.execute("UPDATE chunks SET is_representative = 1 WHERE chunk_id = ?", (new_id,))
+                    self._insert_bands(conn, new_id, np.frombuffer(row['signature'], dtype=np.uint32))
+                    promoted.append({"id": new_id, "content": row['content'],
+                                     "metadata": dict(json.loads(row['metadata']), dup_group=new_id)})
+
+                if plan is not None:
+                    representatives = set(plan.representatives)
+                    for i, (chunk_id, chunk) in enumerate(zip(ids, chunks)):
+                        is_rep = i in representatives
+                        conn.execute(
+                            "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (chunk_id, plan.groups[i], source, chunk["metadata"].get("page"), int(is_rep),
+                             chunk["content"], json.dumps(chunk["metadata"], ensure_ascii=False),
+                             plan.signatures[i].tobytes())
+                        )
+                        if is_rep:
+                            self._insert_bands(conn, chunk_id, plan.signatures[i])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return promoted
+
+    def _insert_bands(self, conn: sqlite3.Connection, chunk_id: str, signature: np.ndarray):
+        conn.executemany("INSERT INTO bands (band, band_key, chunk_id) VALUES (?, ?, ?)",
+                         [(band, key, chunk_id) for band, key in enumerate(band_keys(signature, self.bands))])
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, chunk_ids: Sequence[str]):
+        for start in range(0, len(chunk_ids), 500):
+            batch = list(chunk_ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM bands WHERE chunk_id IN ({placeholders})", batch)
+            conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+
+    def copies(self, group_ids: Sequence[str]) -> Dict[str, List[Dict]]:
+        """グループごとのすべてのコピーの出典（{"source", "page"}、代表を含む）"""
+        group_ids = list(group_ids)
+        if not group_ids:
+            return {}
+        placeholders = ",".join("?" * len(group_ids))
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT group_id, source, page FROM chunks WHERE group_id IN ({placeholders}) "
+                "ORDER BY source, page, chunk_id", group_ids
+            ).fetchall()
+        result: Dict[str, List[Dict]] = {}
+        for row in rows:
+            result.setdefault(row['group_id'], []).append({"source": row['source'], "page": row['page']})
+        return result
+
+
+def plan_dedup(ids: Sequence[str], chunks: Sequence[Dict], index: Optional[DedupIndex],
+               source: Optional[str], hasher: MinHasher, threshold: float = 0.9,
+               bands: int = 16) -> DedupPlan:
+    """
+    チャンクを重複グループにまとめ、埋め込む代表を決める
+
+    同じ文書内のチャンク同士と、重複インデックスにある他の文書の代表チャンクを比較します。
+    他の文書の代表と重複するチャンクは埋め込まず、そのグループに加えます。
+    取り込み直しで代表を失うグループ（この文書の古い代表と他の文書のコピー）と重複するチャンクは
+    代表になり、そのグループを引き継ぎます（他の文書のコピーが昇格して代表が2つになるのを防ぐ）。
+
+    Args:
+        ids: チャンクID
+        chunks: チャンク（content, metadata）
+        index: 重複インデックス（Noneの場合は文書内のみ）
+        source: この文書の出典（取り込み直しのとき自身の古い記録と比較しないため）
+        hasher: MinHasher
+        threshold: この推定Jaccard類似度以上を重複とみなす
+        bands: LSHのバンド数
+    """
+    signatures = hasher.signatures([chunk["content"] for chunk in chunks])
+    groups: List[str] = []
+    representatives: List[int] = []
+    adopted: Dict[str, str] = {}
+    local_buckets: Dict[tuple, List[int]] = {}
+    # 重複インデックスの候補は全チャンク分をまとめて検索（チャンクごとに問い合わせない）
+    candidates_by_chunk = index.find_candidates(signatures, source) if index is not None else None
+
+    for i, signature in enumerate(signatures):
+        keys = band_keys(signature, bands)
+        group = None
+
+        # 文書内の代表と比較
+        candidates = {j for band, key in enumerate(keys) for j in local_buckets.get((band, key), [])}
+        for j in sorted(candidates):
+            if estimate_similarity(signature, signatures[j]) >= threshold:
+                group = ids[j]
+                break
+
+        # 他の文書の代表と比較
+        if group is None and candidates_by_chunk is not None:
+            others, orphans = candidates_by_chunk[i]
+            for chunk_id, other in sorted(others.items()):
+                if estimate_similarity(signature, other) >= threshold:
+                    group = chunk_id
+                    break
+
+            # 代表を失うグループのコピーと比較（一致すれば代表としてグループを引き継ぐ）
+            if group is None:
+                for group_id, copy in sorted(orphans.items()):
+                    if group_id not in adopted.values() and estimate_similarity(signature, copy) >= threshold:
+                        adopted[ids[i]] = group_id
+                        break
+
+        if group is None:
+            group = ids[i]
+            representatives.append(i)
+            for band, key in enumerate(keys):
+                local_buckets.setdefault((band, key), []).append(i)
+        groups.append(group)
+
+    return DedupPlan(representatives, groups, signatures, adopted)
+
+
+def collapse_duplicates(results: List[Dict], index: Optional[DedupIndex] = None) -> List[Dict]:
+    """
+    検索結果を重複グループごとにまとめる（各グループの最上位のみ残す）
+
+    index を指定した場合、グループ内の他の出典を "duplicates" として付けます。
+    """
+    collapsed = []
+    seen = set()
+    for result in results:
+        group = result["metadata"].get("dup_group")
+        if group is not None:
+            if group in seen:
+                continue
+            seen.add(group)
+        collapsed.append(result)
+
+    if index is not None:
+        groups = [r["metadata"]["dup_group"] for r in collapsed if r["metadata"].get("dup_group")]
+        copies = index.copies(groups)
+        for result in collapsed:
+            group = result["metadata"].get("dup_group")
+            if group in copies:
+                own = (result["metadata"].get("source"), result["metadata"].get("page"))
+                result["duplicates"] = [c for c in copies[group] if (c["source"], c["page"]) != own]
+    return collapsed
@@ -1,7 +1,6 @@
-import fitz  # PyMuPDF
 import os
 import sys
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 # Windows環境でのエンコーディングエラー対策
 if sys.platform == "win32":
@@ -41,42 +40,150 @@ def clean_text(text: str) -> str:
             
     return "\n".join(cleaned_lines)
 
-def extract_text_from_pdf(pdf_path: str) -> List[Dict]:
+def _page_data(layout: Dict, source: str, total_pages: int) -> Dict:
+    """レイアウト解析結果からページデータを作成（表はセル区切りのまま、本文は改行を整理）"""
+    page_content = []
+    for block in layout["blocks"]:
+        if block["type"] == "table":
+            page_content.append(block["text"])
+        else:
+            page_content.append(clean_text(block["text"]))
+
+    full_text = "\n\n".join(page_content)
+
+    return {
+        "page": layout["page"],
+        "content": full_text.strip(),
+        "metadata": {
+            "source": source,
+            "total_pages": total_pages
+        }
+    }
+
+
+def _analyze_page_range(pdf_path: str, start: int, end: int, detect_tables: bool) -> List[Dict]:
+    """
+    ページ範囲 [start, end) のレイアウトを解析（ワーカープロセスで実行）
+
+    ドキュメントはプロセスごとに開きます（PyMuPDFのDocumentはプロセス間で共有できないため）。
+    """
+    import fitz
+
+    from src.ingestion.layout import analyze_page
+
+    with fitz.open(pdf_path) as doc:
+        return [analyze_page(doc[page_num], detect_tables) for page_num in range(start, end)]
+
+
+def resolve_extract_workers(workers: Optional[int] = None) -> int:
+    """抽出に使うプロセス数（0以下は利用可能なCPU数）"""
+    if workers is None:
+        from src.config import settings
+        workers = settings.ingestion.extract_workers
+    if workers <= 0:
+        workers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    return max(workers, 1)
+
+
+def analyze_layout(pdf_path: str, workers: Optional[int] = None,
+                   min_pages_per_worker: Optional[int] = None,
+                   metrics: Optional[Dict] = None, use_cache: bool = True) -> List[Dict]:
+    """
+    PDF全ページのレイアウトを解析（src/ingestion/layout.py の analyze_page の結果をページ順に返す）
+
+    結果はPDFの内容のハッシュをキーにキャッシュされ、同じPDFは解析し直しません。
+    ページ数が多い場合はページ範囲を複数のプロセスに分割して並列に解析します。
+
+    Args:
+        use_cache: Falseの場合はキャッシュを使わずに解析する（ベンチマーク用）
+    """
+    import fitz  # PyMuPDF（インポートが重いため初回呼び出し時に読み込み）
+    from src.config import settings
+    from src.ingestion.layout import LayoutCache
+
+    ingestion = settings.ingestion
+    detect_tables = ingestion.layout_detect_tables
+    cache = LayoutCache(ingestion.layout_cache_dir)
+    key = cache.key_for(pdf_path, detect_tables) if use_cache else None
+    layouts = cache.get(key) if use_cache else None
+    if metrics is not None:
+        metrics["layout_cached"] = layouts is not None
+    if layouts is not None:
+        return layouts
+
+    with fitz.open(pdf_path) as doc:
+        total_pages = len(doc)
+    workers = resolve_extract_workers(workers)
+    if min_pages_per_worker is None:
+        min_pages_per_worker = ingestion.extract_min_pages_per_worker
+    workers = min(workers, total_pages // max(min_pages_per_worker, 1))
+
+    if workers <= 1:
+        layouts = _analyze_page_range(pdf_path, 0, total_pages, detect_tables)
+    else:
+        layouts = _analyze_parallel(pdf_path, total_pages, workers, detect_tables)
+    if use_cache:
+        cache.put(key, layouts)
+    return layouts
+
+
+def extract_text_from_pdf(pdf_path: str, workers: Optional[int] = None,
+                          min_pages_per_worker: Optional[int] = None,
+                          ocr: Optional[bool] = None, metrics: Optional[Dict] = None) -> List[Dict]:
     """
     PDFからテキストを抽出し、ページごとの構造化データとして返します。
+
+    ブロックは段組みを考慮した読み順に並べ、表は「| セル | セル |」形式の行として抽出し、
+    複数ページで繰り返されるヘッダー・フッターは除去します（レイアウト解析はキャッシュされます）。
+
+    Args:
+        pdf_path: PDFファイルのパス
+        workers: 解析に使うプロセス数（Noneの場合は設定 EXTRACT_WORKERS、0は利用可能なCPU数）
+        min_pages_per_worker: 1プロセスあたりの最小ページ数。これに満たない場合は分割しない
+            （プロセス起動のコストの方が大きいため。Noneの場合は設定 EXTRACT_MIN_PAGES_PER_WORKER）
+        ocr: テキストのないページをOCRするか（Noneの場合は設定 OCR_ENABLED）
+        metrics: 指定した場合、レイアウトキャッシュのヒット（layout_cached）とOCRの計測値を書き込む
+            （OCRの計測値は src/ingestion/ocr.py の apply_ocr を参照）
     """
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"File not found: {pdf_path}")
 
-    doc = fitz.open(pdf_path)
-    extracted_data = []
+    from src.config import settings
+    from src.ingestion.layout import remove_repeated_margins
 
-    for page_num, page in enumerate(doc):
-        # ブロック単位でテキストを取得（レイアウト保持のため）
-        blocks = page.get_text("blocks")
-        # 読み順（上から下、左から右）にある程度ソートされている
-        
-        page_content = []
-        for b in blocks:
-            block_text = b[4] # 5番目の要素がテキスト
-            if block_text.strip():
-                cleaned_block = clean_text(block_text)
-                page_content.append(cleaned_block)
-        
-        full_text = "\n\n".join(page_content)
-        
-        extracted_data.append({
-            "page": page_num + 1,
-            "content": full_text.strip(),
-            "metadata": {
-                "source": os.path.basename(pdf_path),
-                "total_pages": len(doc)
-            }
-        })
-    
-    doc.close()
+    ingestion = settings.ingestion
+    layouts = analyze_layout(pdf_path, workers, min_pages_per_worker, metrics)
+    if ingestion.layout_strip_margins:
+        layouts = remove_repeated_margins(layouts)
+
+    source = os.path.basename(pdf_path)
+    extracted_data = [_page_data(layout, source, len(layouts)) for layout in layouts]
+
+    # スキャン画像のみのページはOCRで補う
+    if ingestion.ocr_enabled if ocr is None else ocr:
+        from src.ingestion.ocr import apply_ocr
+
+        apply_ocr(pdf_path, extracted_data, metrics=metrics, workers=ingestion.ocr_workers,
+                  dpi=ingestion.ocr_dpi, language=ingestion.ocr_language,
+                  cache_dir=ingestion.ocr_cache_dir, min_chars=ingestion.ocr_min_chars)
     return extracted_data
 
+
+def _analyze_parallel(pdf_path: str, total_pages: int, workers: int, detect_tables: bool) -> List[Dict]:
+    """ページ範囲をプロセスプールで並列に解析し、ページ順に結合"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    # ページごとの重さの偏り（図版の多い章など）を均すため、ワーカー数より細かく分割する
+    n_ranges = min(total_pages, workers * 4)
+    bounds = [total_pages * i // n_ranges for i in range(n_ranges + 1)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_analyze_page_range, pdf_path, start, end, detect_tables)
+                   for start, end in zip(bounds, bounds[1:])]
+        layouts = []
+        for future in futures:
+            layouts.extend(future.result())
+    return layouts
+
 if __name__ == "__main__":
     # テスト実行用のロジック
     input_dir = "data/raw"
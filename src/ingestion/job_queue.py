@@ -0,0 +1,359 @@
+"""
+PDF取り込みジョブの永続キュー（SQLite）
+
+Streamlitのスクリプトスレッドから取り込み処理を切り離すため、アップロード時にはジョブを登録するだけにし、
+別プロセスのワーカー（src/ingestion/worker.py）が順に処理します。
+
+- ジョブの状態と段階ごとの進捗（抽出 → チャンク化 → 埋め込み）をDBに記録し、UIはこれをポーリングします
+- 途中の成果物（処理済みJSON、登録済みチャンク数）を記録するため、ワーカーが停止しても続きから再開できます
+- 実行中のジョブはワーカーがハートビートを更新し、一定時間途絶えたジョブは別のワーカーが引き継ぎます
+- ジョブはテナントごとに同時実行数を制限し、1つのテナントの大量のアップロードが他のテナントを待たせないようにします
+"""
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# 処理段階（この順に進む）
+STAGES = ("extract", "chunk", "embed")
+STAGE_LABELS = {
+    "queued": "待機中",
+    "extract": "テキスト抽出",
+    "chunk": "チャンク化",
+    "embed": "埋め込み生成",
+    "done": "完了",
+}
+
+
+class JobQueue:
+    """
+    SQLiteに保存する取り込みジョブのキュー
+
+    操作ごとに接続を開くため、複数のプロセス・スレッドから同時に使用できます。
+    ジョブの取得（claim）は BEGIN IMMEDIATE で排他し、同じジョブを2つのワーカーが処理しないようにします。
+    """
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_path: str = "storage/jobs.db", lease_seconds: float = 120.0,
+                 max_attempts: int = 3, max_jobs_per_tenant: int = 0):
+        """
+        Args:
+            db_path: キューのDBファイルのパス
+            lease_seconds: この秒数ハートビートのない実行中ジョブは停止したとみなす
+            max_attempts: ジョブを試行する最大回数
+            max_jobs_per_tenant: 1テナントが同時に実行できるジョブ数（0は無制限。
+                既定のテナント（tenant が None）のジョブは一括取り込み・監視フォルダ用のため制限しない）
+        """
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_jobs_per_tenant = max_jobs_per_tenant
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                self._migrate(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in (
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL,
+                    pdf_path TEXT NOT NULL,
+                    processed_dir TEXT NOT NULL,
+                    storage_path TEXT NOT NULL,
+                    owner TEXT,
+                    tenant TEXT,
+                    status TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT NOT NULL DEFAULT '',
+                    error TEXT,
+                    processed_path TEXT,
+                    chunks_count INTEGER NOT NULL DEFAULT 0,
+                    embedded_count INTEGER NOT NULL DEFAULT 0,
+                    stage_timings TEXT NOT NULL DEFAULT '{}',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    heartbeat_at REAL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )""",
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)",
+                "CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, id)",
+                """CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    pid INTEGER,
+                    heartbeat_at REAL NOT NULL
+                )""",
+                # 監視フォルダから取り込んだファイル（内容のハッシュで変更を検出）
+                """CREATE TABLE IF NOT EXISTS source_files (
+                    path TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    job_id INTEGER,
+                    updated_at TEXT NOT NULL
+                )""",
+            ):
+                conn.execute(statement)
+            # バージョン2までのDBにはテナントの列がない（既存のジョブは既定のテナント）
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "tenant" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN tenant TEXT")
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job['stage_timings'] = json.loads(job['stage_timings'] or '{}')
+        return job
+
+    def enqueue(self, pdf_path: str, filename: str = None, owner: str = None,
+                processed_dir: str = "data/processed", storage_path: str = "storage/chroma",
+                tenant: str = None) -> int:
+        """
+        取り込みジョブを登録
+
+        Args:
+            pdf_path: 保存済みPDFのパス
+            filename: 表示用のファイル名（Noneの場合はpdf_pathから取得）
+            owner: ジョブの所有者（ブラウザセッションまたはユーザーID）
+            processed_dir: 処理済みJSONの保存先
+            storage_path: ChromaDBの保存パス
+            tenant: ジョブのテナント（Noneの場合は既定のテナント）
+
+        Returns:
+            ジョブID
+        """
+        now = datetime.now().isoformat()
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "INSERT INTO jobs (filename, pdf_path, processed_dir, storage_path, owner, tenant, status, "
+                "stage, message, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (filename or os.path.basename(pdf_path), pdf_path, processed_dir, storage_path, owner,
+                 tenant, QUEUED, STAGE_LABELS["queued"], now, now)
+            ).lastrowid
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """
+        次に処理するジョブを取得して実行中にする
+
+        待機中のジョブのほか、ハートビートが途絶えた実行中のジョブ（停止したワーカーのもの）も引き継ぎます。
+        試行回数が上限に達したジョブは失敗として扱います。
+        同時実行数の上限に達したテナントのジョブは飛ばし、他のテナントのジョブを先に処理します
+        （既定のテナントのジョブは上限の対象外で、複数のワーカーで並列に処理します）。
+
+        Returns:
+            ジョブ（なければNone）
+        """
+        now = time.time()
+        stale = now - self.lease_seconds
+        busy_filter = ""
+        params = [QUEUED, RUNNING, stale]
+        if self.max_jobs_per_tenant > 0:
+            busy_filter = (
+                " AND (tenant IS NULL OR tenant NOT IN (SELECT tenant FROM jobs "
+                "WHERE tenant IS NOT NULL AND status = ? AND heartbeat_at >= ? "
+                "GROUP BY tenant HAVING COUNT(*) >= ?))"
+            )
+            params += [RUNNING, stale, self.max_jobs_per_tenant]
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = conn.execute(
+                        "SELECT * FROM jobs WHERE (status = ? OR (status = ? AND heartbeat_at < ?))"
+                        f"{busy_filter} ORDER BY id LIMIT 1",
+                        params
+                    ).fetchone()
+                    if row is None:
+                        conn.execute("COMMIT")
+                        return None
+
+                    if row['attempts'] >= self.max_attempts:
+                        conn.execute(
+                            "UPDATE jobs SET status = ?, error = ?, message = ?, updated_at = ? WHERE id = ?",
+                            (FAILED, row['error'] or "ワーカーが応答しなくなりました",
+                             f"{row['attempts']}回試行しましたが完了しませんでした",
+                             datetime.now().isoformat(), row['id'])
+                        )
+                        continue
+
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker_id = ?, heartbeat_at = ?, "
+                        "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (RUNNING, worker_id, now, datetime.now().isoformat(), row['id'])
+                    )
+                    job = self._row_to_job(conn.execute(
+                        "SELECT * FROM jobs WHERE id = ?", (row['id'],)
+                    ).fetchone())
+                    conn.execute("COMMIT")
+                    return job
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def update(self, job_id: int, **fields):
+        """
+        ジョブの進捗を更新（ハートビートも更新）
+
+        Args:
+            job_id: ジョブID
+            **fields: stage, progress, message, processed_path, chunks_count, embedded_count, stage_timings
+        """
+        allowed = {"stage", "progress", "message", "processed_path", "chunks_count",
+                   "embedded_count", "stage_timings"}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"更新できない項目です: {unknown}")
+        if "stage_timings" in fields:
+            fields["stage_timings"] = json.dumps(fields["stage_timings"])
+
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        values = list(fields.values())
+        with closing(self._connect()) as conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments}{', ' if assignments else ''}"
+                "heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                values + [time.time(), datetime.now().isoformat(), job_id]
+            )
+
+    def complete(self, job_id: int, message: str = ""):
+        """ジョブを完了にする"""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, stage = 'done', progress = 1, message = ?, error = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (DONE, message or STAGE_LABELS["done"], datetime.now().isoformat(), job_id)
+            )
+
+    def fail(self, job_id: int, error: str, retry: bool = False):
+        """
+        ジョブの失敗を記録
+
+        Args:
+            job_id: ジョブID
+            error: エラー内容
+            retry: Trueの場合、試行回数が上限に達していなければ待機中に戻す
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            can_retry = retry and row is not None and row['attempts'] < self.max_attempts
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, message = ?, worker_id = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (QUEUED if can_retry else FAILED, error,
+                 "再試行待ち" if can_retry else f"エラー: {error}",
+                 datetime.now().isoformat(), job_id)
+            )
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        """ジョブを取得"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, owner: str = None, limit: int = 20) -> List[Dict]:
+        """
+        最近のジョブを取得（新しい順）
+
+        Args:
+            owner: 指定した場合はその所有者のジョブのみ
+            limit: 取得する件数
+        """
+        with closing(self._connect()) as conn:
+            if owner is None:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM jobs WHERE owner = ? ORDER BY id DESC LIMIT ?",
+                                    (owner, limit)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def pending_count(self, tenant: str = None) -> int:
+        """待機中・実行中のジョブ数（tenant を指定した場合はそのテナントのみ）"""
+        with closing(self._connect()) as conn:
+            if tenant is None:
+                return conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)",
+                                    (QUEUED, RUNNING)).fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?) AND tenant IS ?",
+                                (QUEUED, RUNNING, tenant)).fetchone()[0]
+
+    def worker_heartbeat(self, worker_id: str):
+        """ワーカーの生存を記録"""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO workers (worker_id, pid, heartbeat_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET pid = excluded.pid, heartbeat_at = excluded.heartbeat_at",
+                (worker_id, os.getpid(), time.time())
+            )
+
+    def remove_worker(self, worker_id: str):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def live_worker_count(self, timeout: float = 30.0) -> int:
+        """直近timeout秒以内にハートビートのあったワーカー数"""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?",
+                                (time.time() - timeout,)).fetchone()[0]
+
+    def get_source_files(self) -> Dict[str, Dict]:
+        """取り込み済みファイルの一覧（パス → size, mtime_ns, content_hash, job_id, job_status, processed_path）"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT source_files.*, jobs.status AS job_status, jobs.processed_path FROM source_files "
+                "LEFT JOIN jobs ON jobs.id = source_files.job_id"
+            ).fetchall()
+        return {row['path']: dict(row) for row in rows}
+
+    def queued_job_for(self, pdf_path: str) -> Optional[int]:
+        """そのPDFのまだ開始していないジョブID（なければNone。開始したジョブは古い内容を読んでいる可能性がある）"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT id FROM jobs WHERE pdf_path = ? AND status = ? ORDER BY id DESC LIMIT 1",
+                               (pdf_path, QUEUED)).fetchone()
+        return row['id'] if row else None
+
+    def record_source_file(self, path: str, content_hash: str, size: int, mtime_ns: int,
+                           job_id: int = None):
+        """取り込んだファイルの内容ハッシュとサイズ・更新時刻を記録"""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO source_files (path, content_hash, size, mtime_ns, job_id, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET "
+                "content_hash = excluded.content_hash, size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                "job_id = COALESCE(excluded.job_id, job_id), updated_at = excluded.updated_at",
+                (path, content_hash, size, mtime_ns, job_id, datetime.now().isoformat())
+            )
+
+    def remove_source_file(self, path: str):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM source_files WHERE path = ?", (path,))
+
+
+def make_worker_id(index: int = 0) -> str:
+    """ホスト名・プロセスID・番号からワーカーIDを生成"""
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
@@ -0,0 +1,224 @@
+"""
+ページのレイアウト解析（読み順の並べ替え・表の抽出・ヘッダー/フッターの除去）
+
+PyMuPDFの get_text("blocks") はおおよそ描画順のため、段組みのページでは左右の段の文章が交互に並びます。
+ここではブロックの位置から段を検出して読み順に並べ替え、表は行ごとの区切り文字付きテキストとして抽出し、
+複数ページで繰り返されるヘッダー・フッター（書名・ページ番号など）を除去します。
+
+解析結果（ページごとのブロック）はPDFの内容のハッシュをキーにディスクへキャッシュするため、
+チャンク化のパラメータを変えて取り込み直してもPDFを解析し直しません。
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 解析結果の形式を変えたら上げる（古いキャッシュを無効化）
+LAYOUT_VERSION = 1
+
+# ページ幅に対してこの割合より広いブロックは段をまたぐ（見出し・図表のキャプションなど）
+SPANNING_WIDTH_RATIO = 0.6
+# ページ上端・下端からこの割合の範囲をヘッダー・フッターの候補とする
+MARGIN_RATIO = 0.08
+
+
+def _block(bbox, text: str, kind: str = "text") -> Dict:
+    return {"bbox": [round(v, 2) for v in bbox], "text": text, "type": kind}
+
+
+def _overlap_ratio(inner, outer) -> float:
+    """inner の面積のうち outer と重なる割合"""
+    x0, y0 = max(inner[0], outer[0]), max(inner[1], outer[1])
+    x1, y1 = min(inner[2], outer[2]), min(inner[3], outer[3])
+    if x1 <= x0 or y1 <= y0:
+        return 0.0
+    area = (inner[2] - inner[0]) * (inner[3] - inner[1])
+    return (x1 - x0) * (y1 - y0) / area if area > 0 else 0.0
+
+
+def table_to_text(rows: List[List[Optional[str]]]) -> str:
+    """表を行ごとに「| セル | セル |」形式のテキストに変換（セル内の改行は空白に）"""
+    lines = []
+    for row in rows:
+        cells = [" ".join((cell or "").split()) for cell in row]
+        if any(cells):
+            lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def analyze_page(page, detect_tables: bool = True) -> Dict:
+    """
+    1ページのレイアウトを解析
+
+    Returns:
+        {"page", "width", "height", "blocks": [{"bbox", "text", "type"}]}
+        blocks は読み順に並べ替え済み（type は "text" または "table"）
+    """
+    tables = []
+    if detect_tables:
+        try:
+            for table in page.find_tables().tables:
+                text = table_to_text(table.extract())
+                if text:
+                    tables.append(_block(table.bbox, text, "table"))
+        except Exception:
+            # 表の検出に失敗したページは通常のテキストとして扱う
+            tables = []
+
+    blocks = []
+    for b in page.get_text("dict")["blocks"]:
+        # 画像ブロックは対象外
+        if b.get("type", 0) != 0:
+            continue
+        for block in _split_block_by_columns(b["lines"]):
+            if not block["text"].strip():
+                continue
+            # 表の中のテキストは表として抽出済み
+            if any(_overlap_ratio(block["bbox"], table["bbox"]) > 0.5 for table in tables):
+                continue
+            blocks.append(block)
+
+    rect = page.rect
+    return {
+        "page": page.number + 1,
+        "width": round(rect.width, 2),
+        "height": round(rect.height, 2),
+        "blocks": order_blocks(blocks + tables, rect.width),
+    }
+
+
+def _split_block_by_columns(lines: List[Dict]) -> List[Dict]:
+    """
+    ブロック内の行を横方向の位置で分ける
+
+    MuPDFは同じ高さに並んだ左右の段の行を1つのブロックにまとめることがあるため、
+    x範囲が重ならない行のグループを別々のブロックにします。
+    """
+    groups = []
+    for line in sorted(lines, key=lambda l: l["bbox"][0]):
+        x0, x1 = line["bbox"][0], line["bbox"][2]
+        if groups and x0 <= groups[-1]["x1"]:
+            groups[-1]["x1"] = max(groups[-1]["x1"], x1)
+            groups[-1]["lines"].append(line)
+        else:
+            groups.append({"x1": x1, "lines": [line]})
+
+    blocks = []
+    for group in groups:
+        group_lines = sorted(group["lines"], key=lambda l: (l["bbox"][1], l["bbox"][0]))
+        bbox = [min(l["bbox"][0] for l in group_lines), min(l["bbox"][1] for l in group_lines),
+                max(l["bbox"][2] for l in group_lines), max(l["bbox"][3] for l in group_lines)]
+        text = "\n".join("".join(span["text"] for span in l["spans"]) for l in group_lines)
+        blocks.append(_block(bbox, text))
+    return blocks
+
+
+def _columns(blocks: List[Dict]) -> List[List[float]]:
+    """ブロックのx範囲を重なりで結合し、段（左から順のx範囲）を求める"""
+    columns: List[List[float]] = []
+    for block in sorted(blocks, key=lambda b: b["bbox"][0]):
+        x0, x1 = block["bbox"][0], block["bbox"][2]
+        if columns and x0 <= columns[-1][1]:
+            columns[-1][1] = max(columns[-1][1], x1)
+        else:
+            columns.append([x0, x1])
+    return columns
+
+
+def order_blocks(blocks: List[Dict], page_width: float) -> List[Dict]:
+    """
+    ブロックを読み順に並べ替え
+
+    ページ幅の大部分を占めるブロック（見出しなど）でページを上下の帯に分け、
+    帯ごとに段を検出して「段の左から順 → 段の中は上から順」に並べます。
+    """
+    spanning = sorted((b for b in blocks if b["bbox"][2] - b["bbox"][0] > page_width * SPANNING_WIDTH_RATIO),
+                      key=lambda b: b["bbox"][1])
+    spanning_ids = {id(b) for b in spanning}
+
+    bands: Dict[int, List[Dict]] = {}
+    for block in blocks:
+        if id(block) in spanning_ids:
+            continue
+        band = sum(1 for s in spanning if s["bbox"][1] < block["bbox"][1])
+        bands.setdefault(band, []).append(block)
+
+    keyed = []
+    for band, band_blocks in bands.items():
+        columns = _columns(band_blocks)
+        for block in band_blocks:
+            column = next(i for i, (x0, x1) in enumerate(columns) if x0 <= block["bbox"][0] <= x1)
+            keyed.append(((band, 0, column, block["bbox"][1], block["bbox"][0]), block))
+    for index, block in enumerate(spanning):
+        keyed.append(((index, 1, 0, block["bbox"][1], block["bbox"][0]), block))
+    return [block for _, block in sorted(keyed, key=lambda item: item[0])]
+
+
+def _margin_key(text: str) -> str:
+    """ヘッダー・フッター比較用の正規化（数字はページ番号として同一視）"""
+    return re.sub(r"\d+", "#", " ".join(text.split()))
+
+
+def remove_repeated_margins(layouts: List[Dict], min_pages: int = 3,
+                            min_ratio: float = 0.5) -> List[Dict]:
+    """
+    複数ページの上端・下端に繰り返し現れるブロック（ヘッダー・フッター・ページ番号）を除去
+
+    Args:
+        layouts: analyze_page の結果（ページ順）
+        min_pages: この数以上のページに現れたものを除去
+        min_ratio: かつ全ページのこの割合以上に現れたもの
+
+    Returns:
+        ブロックを除去した新しいレイアウトのリスト
+    """
+    def in_margin(block, layout):
+        y0, y1 = block["bbox"][1], block["bbox"][3]
+        return y1 <= layout["height"] * MARGIN_RATIO or y0 >= layout["height"] * (1 - MARGIN_RATIO)
+
+    counts = Counter()
+    for layout in layouts:
+        counts.update({_margin_key(b["text"]) for b in layout["blocks"] if in_margin(b, layout)})
+    threshold = max(min_pages, len(layouts) * min_ratio)
+    repeated = {key for key, count in counts.items() if count >= threshold}
+    if not repeated:
+        return layouts
+
+    return [
+        dict(layout, blocks=[b for b in layout["blocks"]
+                             if not (in_margin(b, layout) and _margin_key(b["text"]) in repeated)])
+        for layout in layouts
+    ]
+
+
+class LayoutCache:
+    """PDFの内容のハッシュをキーにしたレイアウト解析結果のディスクキャッシュ"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def key_for(pdf_path: str, detect_tables: bool) -> str:
+        digest = hashlib.sha256(f"layout-v{LAYOUT_VERSION}:tables={detect_tables}:".encode())
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        try:
+            with open(self.cache_dir / f"{key}.json", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, key: str, layouts: List[Dict]):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(layouts, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_dir / f"{key}.json")
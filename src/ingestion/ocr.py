@@ -0,0 +1,186 @@
+"""
+テキストのないページ（スキャン画像のみのページ）のOCR
+
+抽出したテキストが OCR_MIN_CHARS 文字未満のページを画像にレンダリングし、Tesseract（PyMuPDFのOCR機能経由、CPUのみ）で
+文字認識します。
+
+- OCRはCPU負荷が高いため、プロセス数に上限のあるプロセスプールで並列に実行します
+- 結果はページ画像（レンダリング結果の画素列）のハッシュをキーにディスクへキャッシュし、
+  同じPDFを再取り込みしてもOCRをやり直しません（ファイル名が変わっても内容が同じならヒット）
+"""
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger("ocr")
+
+
+class OCRResult(NamedTuple):
+    """1ページ分のOCR結果"""
+    page: int  # 1始まりのページ番号
+    text: str
+    elapsed_ms: float  # レンダリング・ハッシュ計算・OCRにかかった時間
+    cached: bool
+
+
+def is_textless(content: str, min_chars: int = 10) -> bool:
+    """空白を除いた文字数が min_chars 未満ならテキストのないページとみなす"""
+    return len("".join(content.split())) < min_chars
+
+
+def tesseract_available() -> bool:
+    """TesseractのOCRデータが見つかるか"""
+    try:
+        import fitz
+
+        return bool(fitz.get_tessdata())
+    except Exception:
+        return False
+
+
+def tesseract_ocr(pixmap, language: str) -> str:
+    """PyMuPDF経由でTesseractを実行してページ画像のテキストを取得"""
+    import fitz
+
+    pdf_bytes = pixmap.pdfocr_tobytes(language=language)
+    with fitz.open("pdf", pdf_bytes) as ocr_doc:
+        return ocr_doc[0].get_text()
+
+
+class OCRCache:
+    """
+    ページ画像のハッシュをキーにしたOCR結果のディスクキャッシュ
+
+    別プロセス（取り込みワーカー・OCRプール）から同時に読み書きできるよう、一時ファイル経由で保存します。
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.txt"
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return self._path(key).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, text: str):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+def page_image_key(pixmap, language: str) -> str:
+    """ページ画像（画素列・サイズ）とOCR言語からキャッシュキーを作成"""
+    digest = hashlib.sha256()
+    digest.update(f"{pixmap.width}x{pixmap.height}x{pixmap.n}:{language}:".encode())
+    digest.update(pixmap.samples)
+    return digest.hexdigest()
+
+
+def _ocr_page(pdf_path: str, page_num: int, dpi: int, language: str, cache_dir: str,
+              engine: Callable) -> OCRResult:
+    """1ページをレンダリングしてOCR（プロセスプールで実行）"""
+    import fitz
+
+    start = time.perf_counter()
+    with fitz.open(pdf_path) as doc:
+        pixmap = doc[page_num - 1].get_pixmap(dpi=dpi)
+    key = page_image_key(pixmap, language)
+
+    cache = OCRCache(cache_dir)
+    text = cache.get(key)
+    cached = text is not None
+    if not cached:
+        text = engine(pixmap, language).strip()
+        cache.put(key, text)
+    return OCRResult(page_num, text, (time.perf_counter() - start) * 1000, cached)
+
+
+def ocr_pages(pdf_path: str, pages: Iterable[int], workers: int = 2, dpi: int = 300,
+              language: str = "jpn+eng", cache_dir: str = "storage/ocr_cache",
+              engine: Callable = tesseract_ocr) -> List[OCRResult]:
+    """
+    指定したページをOCR
+
+    Args:
+        pdf_path: PDFファイルのパス
+        pages: 1始まりのページ番号
+        workers: OCRに使うプロセス数の上限
+        dpi: OCR用にレンダリングする解像度
+        language: Tesseractの言語（例: 'jpn+eng'）
+        cache_dir: OCR結果のキャッシュディレクトリ
+        engine: (Pixmap, 言語) を受け取りテキストを返す関数（プロセス間で受け渡せるモジュールレベルの関数）
+
+    Returns:
+        ページ順のOCR結果
+    """
+    pages = sorted(set(pages))
+    if not pages:
+        return []
+
+    args = (dpi, language, cache_dir, engine)
+    if workers <= 1 or len(pages) == 1:
+        return [_ocr_page(pdf_path, page, *args) for page in pages]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(pages))) as executor:
+        futures = [executor.submit(_ocr_page, pdf_path, page, *args) for page in pages]
+        return [future.result() for future in futures]
+
+
+def apply_ocr(pdf_path: str, extracted_data: List[Dict], metrics: Optional[Dict] = None,
+              engine: Callable = None, **options) -> List[Dict]:
+    """
+    抽出結果のうちテキストのないページをOCRして content を置き換える
+
+    Args:
+        pdf_path: PDFファイルのパス
+        extracted_data: extract_text_from_pdf の抽出結果（その場で更新）
+        metrics: 指定した場合、OCRの計測値（ocr_pages, ocr_cached, ocr_ms, ocr_page_ms）を書き込む
+        engine: OCRエンジン（Noneの場合はTesseract。利用できなければOCRせずに返す）
+        **options: ocr_pages に渡す workers / dpi / language / cache_dir / min_chars
+
+    Returns:
+        extracted_data
+    """
+    min_chars = options.pop("min_chars", 10)
+    targets = [page_data["page"] for page_data in extracted_data
+               if is_textless(page_data["content"], min_chars)]
+    if not targets:
+        return extracted_data
+
+    if engine is None:
+        if not tesseract_available():
+            logger.warning(f"{os.path.basename(pdf_path)}: テキストのないページが{len(targets)}ページありますが、"
+                           "Tesseractが見つからないためOCRを省略します")
+            return extracted_data
+        engine = tesseract_ocr
+
+    start = time.perf_counter()
+    results = ocr_pages(pdf_path, targets, engine=engine, **options)
+    by_page = {page_data["page"]: page_data for page_data in extracted_data}
+    for result in results:
+        page_data = by_page[result.page]
+        if result.text:
+            page_data["content"] = result.text
+        page_data["metadata"] = dict(page_data["metadata"], ocr=True)
+
+    cached = sum(result.cached for result in results)
+    logger.info(f"{os.path.basename(pdf_path)}: {len(results)}ページをOCR（キャッシュ {cached}件, "
+                f"{(time.perf_counter() - start) * 1000:.0f}ms）")
+    if metrics is not None:
+        metrics["ocr_pages"] = len(results)
+        metrics["ocr_cached"] = cached
+        metrics["ocr_ms"] = (time.perf_counter() - start) * 1000
+        metrics["ocr_page_ms"] = {str(result.page): round(result.elapsed_ms, 1) for result in results}
+    return extracted_data
@@ -0,0 +1,280 @@
+"""
+監視フォルダ（data/raw）からの自動取り込み
+
+フォルダ内のPDFを定期的に走査し、新規・変更・削除を検出して取り込みジョブキューに登録します。
+処理そのものは取り込みワーカー（src/ingestion/worker.py）が並列に行います。
+
+- 変更の通知にはLinuxではinotifyを使い、使えない環境ではポーリングで走査します
+- 書き込み中のファイルを取り込まないよう、サイズと更新時刻が debounce 秒変化しなくなってから処理します
+- サイズ・更新時刻が記録と同じファイルはハッシュを計算せずに省略し、変わった場合も内容のハッシュが
+  同じなら再取り込みしません（コピーし直し・touch など）
+- 削除されたPDFのチャンクはベクトルDBから削除します
+- 取り込みに失敗したファイルは retry_failed_seconds 後に再登録します（ファイルが変わらなくても再試行）
+- UIからアップロードされたファイルはUIが同じ記録に登録するため、二重に取り込みません
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.ingestion.job_queue import FAILED, JobQueue
+from src.utils.logger import setup_logger
+
+logger = setup_logger("folder_watcher")
+
+# 監視フォルダから登録したジョブの所有者
+WATCHER_OWNER = "watcher"
+
+# inotifyのイベント（作成・書き込み完了・移動・削除）
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PollingNotifier:
+    """変更通知なし（wait() は指定時間待つだけ）"""
+    name = "polling"
+
+    def wait(self, timeout: float) -> bool:
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+class InotifyNotifier:
+    """
+    inotifyでフォルダの変更を待つ（Linuxのみ）
+
+    イベントの内容は解釈せず、変更があったことだけを通知します（走査は FolderWatcher が行う）。
+    """
+    name = "inotify"
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 に失敗しました")
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch に失敗しました: {directory}")
+
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+        # 溜まっているイベントを読み捨てる
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self._fd)
+
+
+def create_notifier(directory: str, use_inotify: bool = True):
+    """inotifyが使えればInotifyNotifier、使えなければPollingNotifier"""
+    if use_inotify and sys.platform.startswith("linux"):
+        try:
+            return InotifyNotifier(directory)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotifyを使用できないためポーリングで監視します: {e}")
+    return PollingNotifier()
+
+
+def _default_delete(source: str, storage_path: str) -> int:
+    from src.embedding.store import delete_document
+    return delete_document(source, storage_path)
+
+
+class FolderWatcher:
+    """
+    監視フォルダのPDFとジョブキューの取り込み記録を突き合わせ、差分をジョブとして登録する
+    """
+
+    def __init__(self, queue: JobQueue, raw_dir: str = "data/raw",
+                 processed_dir: str = "data/processed", storage_path: str = "storage/chroma",
+                 debounce_seconds: float = 2.0, retry_failed_seconds: float = 300.0,
+                 delete_document: Callable[[str, str], int] = _default_delete,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            queue: 取り込みジョブキュー（取り込み済みファイルの記録も保持）
+            raw_dir: 監視するフォルダ
+            processed_dir: 処理済みJSONの保存先
+            storage_path: ChromaDBの保存パス
+            debounce_seconds: サイズ・更新時刻がこの秒数変化しなければ書き込み完了とみなす
+            retry_failed_seconds: 取り込みに失敗したファイルを失敗の検出からこの秒数後に再登録（0は検出した走査で再登録）
+            delete_document: 削除されたPDFのチャンクを削除する関数（テスト用に差し替え可能）
+            clock: 時刻関数（テスト用）
+        """
+        self.queue = queue
+        self.raw_dir = raw_dir
+        self.processed_dir = processed_dir
+        self.storage_path = storage_path
+        self.debounce_seconds = debounce_seconds
+        self.retry_failed_seconds = retry_failed_seconds
+        self.delete_document = delete_document
+        self.clock = clock
+        # 書き込み中の可能性があるファイル: パス → ((size, mtime_ns), 最後に変化を検出した時刻)
+        self._unsettled: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        # 失敗したジョブ: ジョブID → 失敗を最初に検出した時刻
+        self._failed_seen: Dict[int, float] = {}
+
+    @property
+    def has_unsettled(self) -> bool:
+        """書き込み完了待ちのファイルがあるか"""
+        return bool(self._unsettled)
+
+    def _list_pdfs(self) -> Dict[str, os.stat_result]:
+        files = {}
+        if not os.path.isdir(self.raw_dir):
+            return files
+        with os.scandir(self.raw_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(".pdf"):
+                    try:
+                        files[os.path.abspath(entry.path)] = entry.stat()
+                    except FileNotFoundError:
+                        pass
+        return files
+
+    def _retry_due(self, record: Dict, now: float) -> bool:
+        """記録したジョブが失敗していて、再登録までの待ち時間を過ぎたか"""
+        job_id = record.get('job_id')
+        if record.get('job_status') != FAILED:
+            self._failed_seen.pop(job_id, None)
+            return False
+        first_seen = self._failed_seen.setdefault(job_id, now)
+        if now - first_seen < self.retry_failed_seconds:
+            return False
+        del self._failed_seen[job_id]
+        return True
+
+    def scan(self) -> List[Tuple[str, str]]:
+        """
+        フォルダを1回走査して差分を処理
+
+        Returns:
+            (イベント種別, パス) のリスト。種別は 'new' / 'changed' / 'retry' / 'deleted'
+        """
+        now = self.clock()
+        # 他のフォルダ（テナントのディレクトリなど）の記録は削除の判定に含めない
+        raw_dir = os.path.abspath(self.raw_dir)
+        known = {path: record for path, record in self.queue.get_source_files().items()
+                 if os.path.dirname(path) == raw_dir}
+        current = self._list_pdfs()
+        events = []
+
+        for path, stat_result in sorted(current.items()):
+            signature = (stat_result.st_size, stat_result.st_mtime_ns)
+            record = known.get(path)
+            if record is not None and (record['size'], record['mtime_ns']) == signature:
+                self._unsettled.pop(path, None)
+                if not self._retry_due(record, now):
+                    continue
+                content_hash, event = record['content_hash'], "retry"
+            else:
+                # サイズ・更新時刻が debounce 秒変化しなくなるまで待つ
+                previous = self._unsettled.get(path)
+                if previous is None or previous[0] != signature:
+                    self._unsettled[path] = (signature, now)
+                    if self.debounce_seconds > 0:
+                        continue
+                elif now - previous[1] < self.debounce_seconds:
+                    continue
+                self._unsettled.pop(path, None)
+
+                try:
+                    content_hash = file_sha256(path)
+                except FileNotFoundError:
+                    continue
+                if record is not None and record['content_hash'] == content_hash:
+                    # 内容は同じ（更新時刻のみ変化）
+                    self.queue.record_source_file(path, content_hash, *signature)
+                    if not self._retry_due(record, now):
+                        continue
+                    event = "retry"
+                else:
+                    event = "changed" if record is not None else "new"
+
+            # UIからのアップロードなど、まだ開始していないジョブがあるファイルは登録しない
+            job_id = self.queue.queued_job_for(path)
+            if job_id is None:
+                job_id = self.queue.enqueue(path, owner=WATCHER_OWNER, processed_dir=self.processed_dir,
+                                            storage_path=self.storage_path)
+                events.append((event, path))
+                logger.info(f"取り込みジョブを登録 ({event}): {os.path.basename(path)} (job {job_id})")
+            self.queue.record_source_file(path, content_hash, *signature, job_id=job_id)
+
+        for path in sorted(set(known) - set(current)):
+            self._unsettled.pop(path, None)
+            removed = self.delete_document(os.path.basename(path), self.storage_path)
+            # 処理済みJSONも削除する（残すと再構築で削除した文書が戻ってくる）
+            processed_path = known[path].get('processed_path')
+            if processed_path:
+                try:
+                    os.remove(processed_path)
+                except FileNotFoundError:
+                    pass
+            self.queue.remove_source_file(path)
+            events.append(("deleted", path))
+            logger.info(f"削除されたPDFのチャンクを削除: {os.path.basename(path)} ({removed}件)")
+
+        # 走査中に消えたファイルの待機状態を破棄
+        for path in [path for path in self._unsettled if path not in current]:
+            del self._unsettled[path]
+        return events
+
+    def run(self, stop_event: threading.Event = None, poll_interval: float = 5.0,
+            use_inotify: bool = True):
+        """
+        フォルダを監視し続ける
+
+        Args:
+            stop_event: セットされたら終了
+            poll_interval: 変更通知がない場合の走査間隔（秒）
+            use_inotify: inotifyが使える環境ではそれで変更を待つ
+        """
+        stop_event = stop_event or threading.Event()
+        Path(self.raw_dir).mkdir(parents=True, exist_ok=True)
+        notifier = create_notifier(self.raw_dir, use_inotify)
+        logger.info(f"フォルダ監視を開始: {self.raw_dir}（{notifier.name}）")
+        try:
+            while not stop_event.is_set():
+                try:
+                    self.scan()
+                except Exception as e:
+                    logger.error(f"フォルダの走査に失敗: {e}")
+                # 書き込み完了待ちのファイルがあれば debounce 後に再走査
+                timeout = poll_interval
+                if self.has_unsettled:
+                    timeout = min(timeout, max(self.debounce_seconds, 0.1))
+                notifier.wait(timeout)
+        finally:
+            notifier.close()
+            logger.info("フォルダ監視を終了")
@@ -0,0 +1,269 @@
+"""
+取り込みジョブのワーカー
+
+JobQueue からジョブを取得し、抽出 → チャンク化 → 埋め込み の各段階を実行して進捗を記録します。
+中断したジョブ（ワーカーの停止・再試行）は記録済みの成果物から再開します。
+
+- 処理済みJSONが保存済みなら抽出・チャンク化を省略
+- 埋め込みは登録済みのチャンク数から再開（IDが決定的なため重複しない）
+
+登録が終わるとコレクションのバージョンが進み、起動中のアプリはChromaDBクライアントを開き直して
+（src/pipeline/resources.py）再起動せずに新しいチャンクを検索できます。
+
+使い方:
+    python ingest_worker.py                # 設定のワーカー数で起動
+    python ingest_worker.py --workers 4
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Process
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from src.config import settings
+from src.ingestion.chunking import save_processed_data
+from src.ingestion.job_queue import STAGE_LABELS, JobQueue, make_worker_id
+from src.pipeline.tenants import collection_name_for
+from src.utils.error_handler import is_retryable_error
+from src.utils.logger import setup_logger
+
+logger = setup_logger("ingest_worker")
+
+# ワーカーの生存確認に使うハートビートの間隔（秒）
+WORKER_HEARTBEAT_SECONDS = 5.0
+
+
+def get_job_queue() -> JobQueue:
+    """設定に従ってジョブキューを開く"""
+    ingestion = settings.ingestion
+    return JobQueue(ingestion.job_queue_path, lease_seconds=ingestion.lease_seconds,
+                    max_attempts=ingestion.max_attempts,
+                    max_jobs_per_tenant=settings.tenants.max_concurrent_jobs)
+
+
+class _Heartbeat:
+    """処理中のジョブとワーカーのハートビートを一定間隔で更新するスレッド"""
+
+    def __init__(self, queue: JobQueue, worker_id: str, interval: float):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.interval = interval
+        self.job_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.interval)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.queue.worker_heartbeat(self.worker_id)
+                if self.job_id is not None:
+                    self.queue.update(self.job_id)
+            except Exception as e:
+                logger.debug(f"ハートビートの更新に失敗: {e}")
+
+
+def _default_extract(pdf_path: str, metrics: Dict) -> List[Dict]:
+    from src.ingestion.extract import extract_text_from_pdf
+    return extract_text_from_pdf(pdf_path, metrics=metrics)
+
+
+def _default_chunk(extracted_data: List[Dict]) -> List[Dict]:
+    from src.ingestion.chunking import chunk_text
+    return chunk_text(extracted_data)
+
+
+def _default_store(processed_path: str, storage_path: str,
+                   progress_callback: Callable[[int, int], None], start_index: int,
+                   collection_name: str = None) -> int:
+    from src.embedding.store import store_embeddings
+
+    # 埋め込み関数がAPIの呼び出しごとにレート制限・リトライする（ここでファイル全体を再試行すると
+    # 登録済みのバッチも最初の start_index から埋め込み直すため、失敗時はジョブの再試行で記録済みの位置から再開）
+    return store_embeddings(processed_path, storage_path, progress_callback=progress_callback,
+                            start_index=start_index, collection_name=collection_name)
+
+
+def process_job(queue: JobQueue, job: Dict,
+                extract: Callable[[str, Dict], List[Dict]] = _default_extract,
+                chunk: Callable[[List[Dict]], List[Dict]] = _default_chunk,
+                store: Callable[..., int] = _default_store) -> int:
+    """
+    ジョブを実行して段階ごとの進捗を記録
+
+    Args:
+        queue: ジョブキュー
+        job: claim() で取得したジョブ
+        extract, chunk, store: 各段階の処理（テスト用に差し替え可能）
+
+    Returns:
+        登録したチャンク数
+    """
+    job_id = job['id']
+    timings = dict(job.get('stage_timings') or {})
+    processed_path = job.get('processed_path')
+
+    embedded_count = 0
+    if processed_path and os.path.exists(processed_path):
+        # 前回の試行でチャンク化まで完了している（埋め込みは登録済みの位置から再開）
+        embedded_count = job.get('embedded_count') or 0
+        logger.info(f"ジョブ{job_id}: 処理済みデータから再開 ({processed_path})")
+    else:
+        queue.update(job_id, stage="extract", progress=0.0, message=STAGE_LABELS["extract"])
+        start = time.perf_counter()
+        # OCRを行った場合は extract_metrics に ocr_pages / ocr_cached / ocr_ms / ocr_page_ms が入る
+        extract_metrics: Dict = {}
+        extracted_data = extract(job['pdf_path'], extract_metrics)
+        timings['extract_ms'] = (time.perf_counter() - start) * 1000
+        timings.update(extract_metrics)
+
+        queue.update(job_id, stage="chunk", progress=0.0,
+                     message=f"{STAGE_LABELS['chunk']}（{len(extracted_data)}ページ）",
+                     stage_timings=timings)
+        start = time.perf_counter()
+        chunks = chunk(extracted_data)
+        os.makedirs(job['processed_dir'], exist_ok=True)
+        processed_path = os.path.join(job['processed_dir'], Path(job['filename']).stem + ".json")
+        save_processed_data(chunks, processed_path)
+        timings['chunk_ms'] = (time.perf_counter() - start) * 1000
+
+        # 成果物のパスを記録してから次の段階へ（以降の再試行はここから再開）
+        queue.update(job_id, processed_path=processed_path, chunks_count=len(chunks),
+                     embedded_count=0, stage_timings=timings)
+
+    def on_progress(done: int, total: int):
+        queue.update(job_id, stage="embed", progress=done / total if total else 1.0,
+                     embedded_count=done, chunks_count=total,
+                     message=f"{STAGE_LABELS['embed']}（{done}/{total}）")
+
+    queue.update(job_id, stage="embed", message=STAGE_LABELS["embed"])
+    start = time.perf_counter()
+    # テナントのジョブはテナントのコレクションに登録
+    chunks_count = store(processed_path, job['storage_path'], on_progress, embedded_count,
+                         collection_name=collection_name_for(job.get('tenant')))
+    timings['embed_ms'] = timings.get('embed_ms', 0.0) + (time.perf_counter() - start) * 1000
+
+    queue.update(job_id, embedded_count=chunks_count, chunks_count=chunks_count, stage_timings=timings)
+    queue.complete(job_id, f"完了: {chunks_count}チャンクを登録しました")
+    return chunks_count
+
+
+def run_worker(queue: JobQueue = None, worker_id: str = None, poll_interval: float = None,
+               stop_event: threading.Event = None, max_jobs: int = None,
+               exit_when_idle: bool = False, **stage_functions) -> int:
+    """
+    ジョブを取得して処理するループ
+
+    Args:
+        queue: ジョブキュー（Noneの場合は設定から作成）
+        worker_id: ワーカーID
+        poll_interval: ジョブがないときの待機秒数
+        stop_event: セットされたらループを終了
+        max_jobs: 処理するジョブ数の上限（テスト用）
+        exit_when_idle: 待機中のジョブがなくなったら終了（一括取り込み用）
+        **stage_functions: process_job に渡す各段階の処理
+
+    Returns:
+        処理したジョブ数
+    """
+    queue = queue or get_job_queue()
+    worker_id = worker_id or make_worker_id()
+    poll_interval = settings.ingestion.poll_interval_seconds if poll_interval is None else poll_interval
+    stop_event = stop_event or threading.Event()
+
+    queue.worker_heartbeat(worker_id)
+    heartbeat = _Heartbeat(queue, worker_id, min(WORKER_HEARTBEAT_SECONDS, queue.lease_seconds / 4)).start()
+    processed = 0
+    logger.info(f"ワーカー起動: {worker_id}")
+    try:
+        while not stop_event.is_set() and (max_jobs is None or processed < max_jobs):
+            job = queue.claim(worker_id)
+            if job is None:
+                if exit_when_idle:
+                    break
+                queue.worker_heartbeat(worker_id)
+                stop_event.wait(poll_interval)
+                continue
+
+            logger.info(f"ジョブ{job['id']}を開始: {job['filename']}（{job['attempts']}回目）")
+            heartbeat.job_id = job['id']
+            try:
+                process_job(queue, job, **stage_functions)
+                logger.info(f"ジョブ{job['id']}が完了しました")
+            except Exception as e:
+                logger.error(f"ジョブ{job['id']}が失敗しました: {e}")
+                queue.fail(job['id'], str(e), retry=is_retryable_error(e))
+            finally:
+                heartbeat.job_id = None
+                processed += 1
+    finally:
+        heartbeat.stop()
+        queue.remove_worker(worker_id)
+        logger.info(f"ワーカー終了: {worker_id}")
+    return processed
+
+
+def worker_main(index: int = 0, exit_when_idle: bool = False, workers: int = 1):
+    """ワーカープロセスのエントリポイント（埋め込みAPIのレート制限は workers 個のワーカーで分け合う）"""
+    from src.pipeline.resources import set_embedding_rate_share
+
+    set_embedding_rate_share(workers)
+    try:
+        run_worker(worker_id=make_worker_id(index), exit_when_idle=exit_when_idle)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(count: int = None, exit_when_idle: bool = False) -> List[Process]:
+    """ワーカープロセスを起動"""
+    count = count or settings.ingestion.workers
+    processes = []
+    for index in range(count):
+        process = Process(target=worker_main, args=(index, exit_when_idle, count), name=f"ingest-worker-{index}")
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def spawn_worker_daemon(count: int = None) -> subprocess.Popen:
+    """
+    ワーカーを独立したプロセスとして起動（Streamlitの再実行・終了の影響を受けない）
+    """
+    project_root = Path(__file__).resolve().parents[2]
+    command = [sys.executable, str(project_root / "ingest_worker.py")]
+    if count:
+        command += ["--workers", str(count)]
+    logger.info(f"取り込みワーカーを起動: {' '.join(command)}")
+    return subprocess.Popen(command, cwd=os.getcwd(), stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=(sys.platform != "win32"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF取り込みジョブのワーカー")
+    parser.add_argument("--workers", type=int, default=None, help="起動するワーカープロセス数")
+    args = parser.parse_args()
+
+    settings.ensure_directories()
+    processes = start_workers(args.workers)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+from .resources import PipelineResources, get_pipeline_resources
+
+__all__ = ["PipelineResources", "get_pipeline_resources"]
@@ -0,0 +1,194 @@
+"""
+コレクションのエイリアス（論理名 → 実際のコレクション）
+
+再構築（src/pipeline/rebuild.py）は新しい版のコレクション（{論理名}.v{番号}）を別に作り、
+検証が済んだらエイリアスを書き換えて検索・取り込みの対象を切り替えます（ブルー/グリーン方式）。
+エイリアスは保存先のファイルに記録し、一時ファイルからの置き換えで1回の操作で切り替えるため、
+検索中のプロセスは切り替えの前後どちらかの版を必ず読みます。
+
+エイリアスのない論理名は、そのままの名前のコレクションを指します（再構築前のデータ）。
+切り替えで使われなくなった版は退役させ、猶予時間（実行中の検索が終わるまで）を過ぎてから削除します。
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger("collection_aliases")
+
+ALIAS_DIR_NAME = "collection_aliases"
+
+# 版の区切り（テナント名・コレクション名に使わない "." を使う）
+VERSION_SEPARATOR = ".v"
+
+
+def _alias_file(storage_path: str, logical_name: str) -> Path:
+    return Path(storage_path) / ALIAS_DIR_NAME / f"{logical_name}.json"
+
+
+def read_alias(storage_path: str, logical_name: str) -> Dict:
+    """
+    エイリアスの記録
+
+    Returns:
+        {"active": 使用中のコレクション, "retired": [{"name", "retired_at"}]}（記録がなければ active は論理名）
+    """
+    try:
+        data = json.loads(_alias_file(storage_path, logical_name).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        data = {}
+    return {"active": data.get("active") or logical_name, "retired": list(data.get("retired", []))}
+
+
+def _write_alias(storage_path: str, logical_name: str, data: Dict):
+    path = _alias_file(storage_path, logical_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class SwapInProgress(RuntimeError):
+    """同じ論理名で新しい版の作成（再構築・スナップショットの復元）が既に実行中"""
+
+
+class SwapLock:
+    """同じ論理名の新しい版の作成を同時に1つに制限するロックファイル"""
+
+    def __init__(self, storage_path: str, logical_name: str):
+        self.path = Path(storage_path) / ALIAS_DIR_NAME / f"{logical_name}.lock"
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise SwapInProgress(f"新しい版の作成が既に実行中です（中断した場合は {self.path} を削除してください）")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "started_at": time.time()}, f)
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def resolve_collection(storage_path: str, logical_name: str) -> str:
+    """論理名が現在指しているコレクション名"""
+    return read_alias(storage_path, logical_name)["active"]
+
+
+def next_version_name(storage_path: str, logical_name: str, existing: List[str] = ()) -> str:
+    """新しい版のコレクション名（{論理名}.v{番号}、使用中・退役済み・既存のどれとも重ならない番号）"""
+    alias = read_alias(storage_path, logical_name)
+    names = [alias["active"]] + [r["name"] for r in alias["retired"]] + list(existing)
+    pattern = re.compile(re.escape(logical_name + VERSION_SEPARATOR) + r"(\d+)$")
+    numbers = [int(m.group(1)) for m in (pattern.match(name) for name in names) if m]
+    return f"{logical_name}{VERSION_SEPARATOR}{max(numbers, default=0) + 1}"
+
+
+def switch_alias(storage_path: str, logical_name: str, target: str) -> str:
+    """
+    エイリアスを target に切り替え、それまで使っていた版を退役させる
+
+    Returns:
+        退役させたコレクション名
+    """
+    alias = read_alias(storage_path, logical_name)
+    previous = alias["active"]
+    retired = [r for r in alias["retired"] if r["name"] != target]
+    if previous != target:
+        retired.append({"name": previous, "retired_at": time.time()})
+    _write_alias(storage_path, logical_name, {"active": target, "retired": retired})
+    logger.info(f"コレクション「{logical_name}」を {previous} から {target} に切り替えました")
+    return previous
+
+
+def drop_collection_data(storage_path: str, collection_name: str) -> bool:
+    """
+    コレクションと、その重複除去・ページストア・量子化インデックス・バージョンを削除
+
+    Returns:
+        削除するコレクションがあったか
+    """
+    from src.embedding.quantization import quantized_index_dir
+    from src.ingestion.dedup import dedup_index_path
+    from src.pipeline.resources import bump_collection_version, get_pipeline_resources
+    from src.retrieval.page_store import page_store_path
+
+    resources = get_pipeline_resources()
+    resources.invalidate(storage_path, collection_name)
+
+    existed = False
+    if os.path.exists(storage_path):
+        try:
+            resources.client(storage_path).delete_collection(name=collection_name)
+            existed = True
+        except Exception:
+            # コレクションがない
+            pass
+
+    for path in (dedup_index_path(storage_path, collection_name),
+                 page_store_path(storage_path, collection_name)):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    shutil.rmtree(quantized_index_dir(storage_path, collection_name), ignore_errors=True)
+
+    # 他のプロセスのキャッシュ済みドキュメント数も無効化
+    bump_collection_version(storage_path, collection_name)
+    resources.invalidate(storage_path, collection_name)
+    return existed
+
+
+def collect_retired(storage_path: str, logical_name: str, grace_seconds: float = 0.0,
+                    now: float = None) -> List[str]:
+    """
+    退役してから grace_seconds 秒以上経った版を削除
+
+    Returns:
+        削除したコレクション名
+    """
+    now = time.time() if now is None else now
+    alias = read_alias(storage_path, logical_name)
+    expired = [r for r in alias["retired"] if now - r["retired_at"] >= grace_seconds]
+    if not expired:
+        return []
+    for retired in expired:
+        drop_collection_data(storage_path, retired["name"])
+        logger.info(f"退役したコレクション {retired['name']} を削除しました")
+
+    # 削除中に切り替えがあっても失わないよう、最新の記録から削除した版だけを除く
+    dropped = {r["name"] for r in expired}
+    alias = read_alias(storage_path, logical_name)
+    _write_alias(storage_path, logical_name, {
+        "active": alias["active"], "retired": [r for r in alias["retired"] if r["name"] not in dropped]
+    })
+    return sorted(dropped)
+
+
+def drop_all_versions(storage_path: str, logical_name: str) -> bool:
+    """
+    論理名のすべての版（使用中・退役済み・再構築前）とエイリアスを削除
+
+    Returns:
+        削除するコレクションがあったか
+    """
+    alias = read_alias(storage_path, logical_name)
+    names = {logical_name, alias["active"]} | {r["name"] for r in alias["retired"]}
+    existed = False
+    for name in sorted(names):
+        existed = drop_collection_data(storage_path, name) or existed
+    path = _alias_file(storage_path, logical_name)
+    if path.exists():
+        path.unlink()
+    return existed
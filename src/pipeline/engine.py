@@ -0,0 +1,314 @@
+"""
+RAGパイプラインのエンジン（段階の組み合わせ・共有リソース・段階ごとの計測）
+
+質問の書き換え → ベクトル検索 → LLMリランキング → 選択（MMR） → 親の範囲への拡張 → コンテキストの詰め込み → 生成
+の各段階を Stage として組み合わせ、Streamlit UI（generate_answer_ui）・CLI（rag.py / search.py）・
+デバッグ用スクリプト（debug_search.py）のすべてが同じ RAGPipeline を通ります。
+件数などの既定値は設定（RetrievalSettings / GenerationSettings）から取得するため、
+入口によって検索件数や使うコレクションが変わることはありません。
+
+クライアント・埋め込み関数・生成モデルは src/pipeline/resources.py の共有キャッシュを使い、
+各段階の所要時間はリクエストのトレース（Deadline）とプロセス全体の LatencyTracker（"stage:<段階名>"）に記録します。
+
+使い方:
+    context = build_pipeline().run("ナアマンから何を学べますか？", "storage/chroma")
+    print(context.answer, context.trace())
+"""
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from src.config import settings
+from src.pipeline.tenants import collection_name_for
+from src.utils.deadline import Deadline, get_latency_tracker
+from src.utils.logger import setup_logger
+
+logger = setup_logger("pipeline_engine")
+
+ANSWER_PROMPT = """
+あなたは提供された資料に基づいて質問に答える、誠実で役立つアシスタントです。
+
+【重要な指示】
+1. 以下の資料を**すべて注意深く読み**、質問に関連する情報を探してください
+2. 質問に直接答えている箇所だけでなく、**関連する文脈や背景情報**も含めて回答してください
+3. 複数の資料に関連情報がある場合は、それらを**統合して包括的な回答**を作成してください
+4. 回答の根拠となる資料番号を明記してください（例: [資料 1, 3]）
+5. 資料に情報が含まれている場合は、必ず具体的に答えてください
+6. 本当に情報が見つからない場合のみ「提供された資料にはその情報が含まれていません」と答えてください
+
+【資料】
+{context}
+
+【ユーザーの質問】
+{query}
+
+【回答】
+上記の資料に基づいて、質問に対する詳しい回答を日本語で記述してください。
+"""
+
+
+class PipelineContext:
+    """1回のリクエストで段階の間を受け渡す状態"""
+
+    def __init__(self, query: str, storage_path: str, collection_name: str, deadline: Deadline,
+                 history: Optional[List[Dict]] = None):
+        self.query = query  # ユーザーの質問
+        self.search_query = query  # 検索・生成に使う質問（書き換え後）
+        self.rewritten_query: Optional[str] = None
+        self.storage_path = storage_path
+        self.collection_name = collection_name  # 論理名（検索時に使用中の版に解決）
+        self.deadline = deadline
+        self.history = history or []
+        self.results: List[Dict] = []  # 関連度の高い順の検索結果
+        self.packed = None  # PackedContext
+        self.prompt = ""
+        self.answer = ""
+        self.result_counts: Dict[str, int] = {}  # 段階ごとの処理後の件数
+
+    def trace(self) -> Dict[str, Any]:
+        """各段階の所要時間（ミリ秒）・件数・コンテキストの大きさ"""
+        trace: Dict[str, Any] = {**self.deadline.timings, 'total_ms': round(self.deadline.elapsed() * 1000, 1),
+                                 'result_counts': dict(self.result_counts),
+                                 'rewritten_query': self.rewritten_query}
+        if self.packed is not None:
+            trace.update({'context_tokens': self.packed.tokens, 'context_blocks': len(self.packed.blocks),
+                          'context_dropped': self.packed.dropped})
+        return trace
+
+
+class Stage:
+    """パイプラインの段階（name の所要時間を "<name>_ms" として記録）"""
+    name = "stage"
+
+    def run(self, context: PipelineContext):
+        raise NotImplementedError
+
+
+class RewriteStage(Stage):
+    """追加質問を直近の会話から単独の質問に書き換え（単独で意味が通る質問・キャッシュ済みはLLMを呼ばない）"""
+    name = "rewrite"
+
+    def __init__(self, turns: int = None, timeout_seconds: float = None):
+        retrieval = settings.retrieval
+        self.turns = retrieval.query_rewrite_turns if turns is None else turns
+        self.timeout_seconds = retrieval.query_rewrite_timeout_seconds if timeout_seconds is None else timeout_seconds
+
+    def run(self, context: PipelineContext):
+        if not context.history:
+            return
+        from src.retrieval.query_rewrite import rewrite_query
+
+        rewrite = rewrite_query(context.query, context.history, turns=self.turns,
+                                timeout=min(self.timeout_seconds, context.deadline.remaining()))
+        if rewrite.rewritten:
+            context.rewritten_query = rewrite.query
+            context.search_query = rewrite.query
+            logger.info(f"質問を書き換え{'（キャッシュ）' if rewrite.cached else ''}: {rewrite.query[:50]}")
+
+
+class RetrieveStage(Stage):
+    """ベクトル検索（広めに取得）"""
+    name = "search"
+
+    def __init__(self, top_k: int, include_embeddings: bool = False,
+                 search: Callable[..., List[Dict]] = None):
+        self.top_k = top_k
+        self.include_embeddings = include_embeddings
+        self.search = search
+
+    def run(self, context: PipelineContext):
+        if self.search is None:
+            from src.retrieval.search import semantic_search
+
+            self.search = semantic_search
+        context.results = self.search(context.search_query, context.storage_path, top_k=self.top_k,
+                                      deadline=context.deadline, include_embeddings=self.include_embeddings,
+                                      collection_name=context.collection_name)
+
+
+class RerankStage(Stage):
+    """LLMリランキング（予算の配分を使い切ったらベクトル検索の順序にフォールバック）"""
+    name = "rerank"
+
+    def __init__(self, top_k: int, budget_fraction: float = None, min_seconds: float = None,
+                 rerank: Callable[..., List[Dict]] = None):
+        resilience = settings.resilience
+        self.top_k = top_k
+        self.budget_fraction = resilience.rerank_budget_fraction if budget_fraction is None else budget_fraction
+        self.min_seconds = resilience.rerank_min_seconds if min_seconds is None else min_seconds
+        self.rerank = rerank
+
+    def run(self, context: PipelineContext):
+        if self.rerank is None:
+            from src.retrieval.reranker import rerank_with_llm
+
+            self.rerank = rerank_with_llm
+        timeout = context.deadline.share(self.budget_fraction)
+        if timeout < self.min_seconds:
+            logger.warning(f"残り時間が少ないためリランキングをスキップ（残り{context.deadline.remaining():.1f}秒）")
+            timeout = 0
+        context.results = self.rerank(context.search_query, context.results, top_k=self.top_k, timeout=timeout)
+
+
+class SelectStage(Stage):
+    """最終的に使う件数を選ぶ（mmr_lambda が1未満ならMMRで同じ内容の重複を避ける）"""
+    name = "select"
+
+    def __init__(self, n_results: int, mmr_lambda: float = 1.0):
+        self.n_results = n_results
+        self.mmr_lambda = mmr_lambda
+
+    def run(self, context: PipelineContext):
+        if self.mmr_lambda < 1:
+            from src.retrieval.mmr import mmr_rerank
+
+            context.results = mmr_rerank(context.results, self.n_results, self.mmr_lambda)
+        else:
+            context.results = context.results[:self.n_results]
+
+
+class ExpandStage(Stage):
+    """ヒットしたチャンクを親の範囲（前後のチャンク・ページ全体）に広げる（ローカルのページストアから取得）"""
+    name = "expand"
+
+    def __init__(self, mode: str, radius: int = None):
+        self.mode = mode
+        self.radius = settings.retrieval.parent_window if radius is None else radius
+
+    def run(self, context: PipelineContext):
+        from src.pipeline.aliases import resolve_collection
+        from src.retrieval.page_store import PageStore, expand_results, page_store_path
+
+        pages_path = page_store_path(context.storage_path,
+                                     resolve_collection(context.storage_path, context.collection_name))
+        if os.path.exists(pages_path):
+            context.results = expand_results(context.results, PageStore(pages_path), self.mode, radius=self.radius)
+
+
+class PackStage(Stage):
+    """入力トークン予算に収まる分だけ関連度順に詰める（同じページの連続したチャンクは重なりを除いて1つに）"""
+    name = "pack"
+
+    def __init__(self, token_budget: int = None):
+        self.token_budget = settings.generation.context_token_budget if token_budget is None else token_budget
+
+    def run(self, context: PipelineContext):
+        from src.generation.context import format_context, pack_context
+
+        context.packed = pack_context(context.results, self.token_budget)
+        context.prompt = ANSWER_PROMPT.format(context=format_context(context.packed), query=context.search_query)
+        logger.info(f"コンテキスト: {len(context.packed.blocks)}資料, 約{context.packed.tokens}トークン"
+                    f"（予算超過で除外 {context.packed.dropped}件）")
+
+
+class GenerateStage(Stage):
+    """回答の生成（リトライ・ヘッジ付き、生成モデルはプロセス内で共有）"""
+    name = "generation"
+
+    def __init__(self, model_name: str = None, hedge_percentile: float = None,
+                 generate: Callable[[str], str] = None):
+        self.model_name = model_name or settings.generation.model
+        self.hedge_percentile = settings.resilience.hedge_percentile if hedge_percentile is None else hedge_percentile
+        self.generate = generate
+
+    def run(self, context: PipelineContext):
+        if self.generate is not None:
+            context.answer = self.generate(context.prompt)
+            return
+        from src.pipeline.resources import get_api_handler, get_pipeline_resources
+
+        def generate_with_retry():
+            return get_pipeline_resources().generation_model(self.model_name).generate_content(context.prompt)
+
+        handler = get_api_handler(self.model_name, deadline=context.deadline, hedge_percentile=self.hedge_percentile)
+        context.answer = handler.execute(generate_with_retry).text
+
+
+class RAGPipeline:
+    """段階を順に実行するパイプライン"""
+
+    def __init__(self, stages: Sequence[Stage], budget_seconds: float = None):
+        self.stages = list(stages)
+        self.budget_seconds = settings.resilience.answer_budget_seconds if budget_seconds is None else budget_seconds
+
+    @property
+    def stage_names(self) -> List[str]:
+        return [stage.name for stage in self.stages]
+
+    def run(self, query: str, storage_path: str = None, tenant: str = None, history: Optional[List[Dict]] = None,
+            deadline: Deadline = None) -> PipelineContext:
+        """
+        質問に対してすべての段階を実行
+
+        Args:
+            query: ユーザーの質問
+            storage_path: ChromaDBの保存パス（Noneの場合は設定から取得）
+            tenant: 検索するテナント（Noneの場合は既定のテナント）
+            history: この質問より前の会話（古い順）
+            deadline: レイテンシ予算（Noneの場合は budget_seconds で作成）
+
+        Returns:
+            PipelineContext（results / packed / answer と trace()）
+        """
+        context = PipelineContext(query, storage_path or settings.storage.chroma_path, collection_name_for(tenant),
+                                  deadline or Deadline(self.budget_seconds), history)
+        for stage in self.stages:
+            started_at = time.monotonic()
+            stage.run(context)
+            context.deadline.mark(f"{stage.name}_ms")
+            context.result_counts[stage.name] = len(context.results)
+            get_latency_tracker(f"stage:{stage.name}").record(time.monotonic() - started_at)
+        logger.info(f"パイプライン完了: {context.trace()}")
+        return context
+
+
+def build_pipeline(n_results: int = None, initial_k: int = None, final_k: int = None, rerank: bool = None,
+                   mmr_lambda: float = None, parent_mode: str = None, rewrite: bool = None,
+                   generate: bool = True, budget_seconds: float = None) -> RAGPipeline:
+    """
+    設定を既定値とするパイプラインを組み立てる
+
+    Args:
+        n_results: 最終的に使用するチャンク数（Noneの場合は DEFAULT_TOP_K）
+        initial_k: 初期取得件数（Noneの場合は DEFAULT_INITIAL_K）
+        final_k: リランキング後に残す件数（Noneの場合は DEFAULT_FINAL_K）
+        rerank: LLMリランキングを使うか（Noneの場合は RERANKING_ENABLED）
+        mmr_lambda: MMRの関連度の重み（Noneの場合は MMR_LAMBDA、1.0で先頭から選ぶ）
+        parent_mode: 親の範囲（"none" / "window" / "page"、Noneの場合は PARENT_EXPANSION）
+        rewrite: 追加質問を書き換えるか（Noneの場合は QUERY_REWRITE_ENABLED）
+        generate: コンテキストの詰め込みと回答の生成まで行うか（Falseの場合は検索結果まで）
+        budget_seconds: レイテンシ予算（Noneの場合は ANSWER_LATENCY_BUDGET_SECONDS）
+    """
+    retrieval = settings.retrieval
+    n_results = retrieval.default_top_k if n_results is None else n_results
+    initial_k = retrieval.default_initial_k if initial_k is None else initial_k
+    final_k = retrieval.default_final_k if final_k is None else final_k
+    rerank = retrieval.reranking_enabled if rerank is None else rerank
+    mmr_lambda = retrieval.mmr_lambda if mmr_lambda is None else mmr_lambda
+    parent_mode = retrieval.parent_mode if parent_mode is None else parent_mode
+    rewrite = retrieval.query_rewrite_enabled if rewrite is None else rewrite
+
+    stages: List[Stage] = []
+    if rewrite:
+        stages.append(RewriteStage())
+    stages.append(RetrieveStage(initial_k, include_embeddings=mmr_lambda < 1))
+    if rerank:
+        stages.append(RerankStage(final_k))
+    stages.append(SelectStage(n_results, mmr_lambda))
+    if parent_mode != "none":
+        stages.append(ExpandStage(parent_mode))
+    if generate:
+        stages += [PackStage(), GenerateStage()]
+    return RAGPipeline(stages, budget_seconds)
+
+
+def stage_latency_percentiles(q: float = 95, stage_names: Sequence[str] = None) -> Dict[str, Optional[float]]:
+    """
+    プロセス内で記録した段階ごとの所要時間のパーセンタイル（ミリ秒、サンプルが少ない段階はNone）
+    """
+    names = stage_names or ("rewrite", "search", "rerank", "select", "expand", "pack", "generation")
+    percentiles = {}
+    for name in names:
+        seconds = get_latency_tracker(f"stage:{name}").percentile(q)
+        percentiles[name] = None if seconds is None else round(seconds * 1000, 1)
+    return percentiles
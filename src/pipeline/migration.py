@@ -0,0 +1,129 @@
+"""
+埋め込みモデルの移行
+
+使用中のコレクションはそのまま検索に使い続け、data/processed のチャンクを新しいモデルで
+並行する新しい版のコレクションに埋め込み直します。埋め込みは小さなバッチごとに間隔を空けて行い
+（MIGRATION_BATCH_SIZE / MIGRATION_PAUSE_SECONDS）、検索・取り込みのAPI枠を使い切りません。
+登録・検証・切り替え・旧版の削除は再構築（src/pipeline/rebuild.py）と同じです。
+
+移行中（切り替え前）の検索と取り込みは、旧版に記録されたモデルで行われます（src/embedding/model_info.py）。
+そのため EMBEDDING_MODEL を先に新しいモデルに変えても、旧版を新しいモデルのクエリで検索することはありません。
+
+使い方:
+    python migrate_embeddings.py --model models/text-embedding-005
+    python migrate_embeddings.py --model models/text-embedding-005 --tenant team-a --query "ナアマンについて"
+"""
+import argparse
+import sys
+import time
+from typing import Callable, Optional, Sequence
+
+from src.config import settings
+from src.pipeline.aliases import resolve_collection
+from src.pipeline.rebuild import RebuildResult, rebuild_collection
+from src.pipeline.tenants import collection_name_for
+from src.utils.logger import setup_logger
+
+logger = setup_logger("migration")
+
+
+def active_embedding_model(storage_path: str = None, tenant: str = None) -> Optional[str]:
+    """使用中のコレクションに記録された埋め込みモデル（コレクション・記録がなければNone）"""
+    from src.embedding.model_info import recorded_model
+    from src.pipeline.resources import get_pipeline_resources
+
+    storage_path = storage_path or settings.storage.chroma_path
+    collection_name = resolve_collection(storage_path, collection_name_for(tenant))
+    try:
+        collection = get_pipeline_resources().client(storage_path).get_collection(name=collection_name)
+    except Exception:
+        return None
+    return recorded_model(collection)
+
+
+def throttled_store(model_name: str, batch_size: int = None, pause_seconds: float = None,
+                    sleep: Callable[[float], None] = time.sleep) -> Callable[[str, str, str], int]:
+    """
+    処理済みJSONを model_name で小さなバッチごとに間隔を空けて登録する関数（rebuild_collection の store）
+    """
+    from src.embedding.store import store_embeddings
+
+    batch_size = batch_size or settings.embedding.migration_batch_size
+    pause_seconds = settings.embedding.migration_pause_seconds if pause_seconds is None else pause_seconds
+
+    def pause(done: int, total: int):
+        if done < total and pause_seconds > 0:
+            sleep(pause_seconds)
+
+    def store(processed_path: str, storage_path: str, collection_name: str) -> int:
+        # 新しいモデルのレート制限・サーキットブレーカーはAPIの呼び出しごとに同じモデルを使う検索・取り込みと共有
+        return store_embeddings(processed_path, storage_path, progress_callback=pause, batch_size=batch_size,
+                                collection_name=collection_name, embedding_model=model_name)
+    return store
+
+
+def migrate_embedding_model(model_name: str = None, storage_path: str = None, tenant: str = None,
+                            queries: Sequence[str] = (), batch_size: int = None, pause_seconds: float = None,
+                            store: Callable[[str, str, str], int] = None,
+                            **rebuild_options) -> Optional[RebuildResult]:
+    """
+    使用中のコレクションを新しい埋め込みモデルの版に移行する
+
+    Args:
+        model_name: 移行先の埋め込みモデル（Noneの場合は設定から取得）
+        storage_path: ChromaDBの保存パス（Noneの場合は設定から取得）
+        tenant: 移行するテナント（Noneの場合は既定のテナント）
+        queries: 検証用クエリ（旧版・新しい版をそれぞれのモデルで検索し、上位結果の重なりを確認）
+        batch_size, pause_seconds: 1回に埋め込むチャンク数とバッチ間の待ち時間（Noneの場合は設定から取得）
+        store: (処理済みJSON, 保存パス, コレクション名) を登録する関数（テスト用に差し替え可能）
+        rebuild_options: rebuild_collection() に渡すその他の引数
+
+    Returns:
+        RebuildResult（使用中のコレクションが既に model_name の場合はNone）
+
+    Raises:
+        SwapInProgress: 同じコレクションの再構築・復元・移行が実行中の場合
+    """
+    model_name = model_name or settings.embedding.model
+    storage_path = storage_path or settings.storage.chroma_path
+    current = active_embedding_model(storage_path, tenant)
+    if current == model_name:
+        logger.info(f"{collection_name_for(tenant)} は既に {model_name} で埋め込まれています")
+        return None
+
+    logger.info(f"埋め込みモデルの移行開始: {collection_name_for(tenant)}（{current or '記録なし'} → {model_name}）")
+    store = store or throttled_store(model_name, batch_size, pause_seconds)
+    return rebuild_collection(storage_path, tenant=tenant, queries=queries, store=store, **rebuild_options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込みモデルの移行")
+    parser.add_argument("--model", default=None, help="移行先の埋め込みモデル（省略時は EMBEDDING_MODEL）")
+    parser.add_argument("--tenant", default=None, help="移行するテナント（省略時は既定のテナント）")
+    parser.add_argument("--query", action="append", default=[], help="検証用クエリ（複数指定可）")
+    parser.add_argument("--batch-size", type=int, default=None, help="1回に埋め込むチャンク数")
+    parser.add_argument("--pause", type=float, default=None, help="バッチ間の待ち時間（秒）")
+    args = parser.parse_args()
+
+    settings.ensure_directories()
+    model_name = args.model or settings.embedding.model
+    result = migrate_embedding_model(model_name, tenant=args.tenant, queries=args.query,
+                                     batch_size=args.batch_size, pause_seconds=args.pause)
+    if result is None:
+        print(f"✅ 既に {model_name} で埋め込まれています")
+    elif result.switched:
+        print(f"✅ {result.collection} を {model_name} の版 {result.target} に切り替えました"
+              f"（{result.files}ファイル, {result.chunks}チャンク, 自己検索の再現率 {result.recall}）")
+        print(f"旧版 {result.previous} は猶予時間の経過後に削除されます（python rebuild_index.py --gc）")
+        if model_name != settings.embedding.model:
+            print(f"EMBEDDING_MODEL も {model_name} に変更してください"
+                  f"（変更するまでは記録されたモデルに振り分けて検索・取り込みします）")
+    else:
+        print(f"❌ 移行を中止しました（{result.previous} を使い続けます）")
+        for problem in result.problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
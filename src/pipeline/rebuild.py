@@ -0,0 +1,288 @@
+"""
+コレクションの無停止再構築（ブルー/グリーン方式）
+
+埋め込みモデルやチャンク設定を変えたときに、データベースをクリアせずに data/processed から
+新しい版のコレクションを作り直します。再構築中も検索は使用中の版で続けられます。
+
+1. 新しい版（{論理名}.v{番号}）に処理済みJSONをすべて登録（再構築中に追加・更新された分も追いかけて登録）
+2. 検証: チャンク数、旧版の文書がすべてあるか、保存済みの埋め込みによる自己検索の再現率、
+   検証用クエリの上位結果の旧版との重なり
+3. 検証に通ったらエイリアスを切り替え（検索は次のリクエストから新しい版を読む）
+4. 旧版は退役させ、猶予時間を過ぎてから削除（実行中の検索が読み終わるのを待つ）
+
+検証に失敗した場合は切り替えず、作りかけの版を削除します。
+
+使い方:
+    python rebuild_index.py                       # 既定のテナントを再構築
+    python rebuild_index.py --tenant team-a --query "ナアマンについて"
+    python rebuild_index.py --gc                  # 猶予時間を過ぎた旧版だけを削除
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from src.config import settings
+from src.pipeline.aliases import (
+    SwapLock,
+    collect_retired,
+    drop_collection_data,
+    next_version_name,
+    resolve_collection,
+    switch_alias,
+)
+from src.pipeline.tenants import collection_name_for, tenant_dirs
+from src.utils.logger import setup_logger
+
+logger = setup_logger("rebuild")
+
+# 再構築中に追加・更新された処理済みJSONを追いかけて登録する最大回数
+MAX_CATCH_UP_ROUNDS = 5
+
+
+class RebuildResult(NamedTuple):
+    """再構築の結果"""
+    collection: str  # 論理名
+    previous: str  # 再構築前に使用していたコレクション
+    target: str  # 新しい版
+    switched: bool  # 切り替えたか
+    files: int  # 登録した処理済みJSONの数
+    chunks: int  # 新しい版のチャンク数
+    recall: Optional[float]  # 自己検索の再現率
+    query_overlap: Optional[float]  # 検証用クエリの上位結果の旧版との重なり（平均）
+    problems: List[str]  # 検証で見つかった問題（空なら合格）
+    dropped: List[str]  # 削除した退役済みの版
+
+
+def list_processed_files(processed_dir: str) -> Dict[str, int]:
+    """処理済みJSONのパス → 更新時刻ns"""
+    if not os.path.isdir(processed_dir):
+        return {}
+    return {os.path.join(processed_dir, name): os.stat(os.path.join(processed_dir, name)).st_mtime_ns
+            for name in sorted(os.listdir(processed_dir)) if name.endswith(".json")}
+
+
+def self_recall(collection, sample_size: int, k: int = 5) -> Optional[float]:
+    """
+    保存済みの埋め込みで自分自身を検索し、上位 k 件に入る割合（埋め込みAPIは呼ばない）
+
+    Returns:
+        再現率（コレクションが空の場合はNone）
+    """
+    ids = collection.get(include=[])["ids"]
+    if not ids:
+        return None
+    step = max(1, len(ids) // max(1, sample_size))
+    sample_ids = sorted(ids)[::step][:sample_size]
+    sample = collection.get(ids=sample_ids, include=["embeddings"])
+    results = collection.query(query_embeddings=list(sample["embeddings"]),
+                               n_results=min(k, len(ids)), include=[])
+    hits = sum(1 for chunk_id, found in zip(sample["ids"], results["ids"]) if chunk_id in found)
+    return hits / len(sample["ids"])
+
+
+def _page_keys(results: List[Dict]) -> set:
+    return {(r["metadata"].get("source"), r["metadata"].get("page")) for r in results}
+
+
+def query_overlap(search: Callable[[str, str, int], List[Dict]], previous: str, target: str,
+                  queries: Sequence[str], k: int = 5) -> Optional[float]:
+    """
+    検証用クエリの上位 k 件の（ファイル, ページ）のうち、新しい版でも上位に入った割合の平均
+
+    Args:
+        search: (コレクション名, クエリ, 件数) を受け取り検索結果を返す関数
+    """
+    overlaps = []
+    for query in queries:
+        before = _page_keys(search(previous, query, k))
+        if not before:
+            continue
+        after = _page_keys(search(target, query, k))
+        overlaps.append(len(before & after) / len(before))
+    return sum(overlaps) / len(overlaps) if overlaps else None
+
+
+def _sources(storage_path: str, collection_name: str) -> Optional[set]:
+    """ページストアに記録された文書（ページストアがなければNone）"""
+    from src.retrieval.page_store import PageStore, page_store_path
+
+    path = page_store_path(storage_path, collection_name)
+    return PageStore(path).sources() if os.path.exists(path) else None
+
+
+def _default_store(processed_path: str, storage_path: str, collection_name: str) -> int:
+    from src.embedding.store import store_embeddings
+
+    # 埋め込みAPIのレート制限はAPIの呼び出しごとに取り込みワーカー・検索と共有（再構築が検索の枠を使い切らない）
+    return store_embeddings(processed_path, storage_path, collection_name=collection_name)
+
+
+def _default_search(storage_path: str) -> Callable[[str, str, int], List[Dict]]:
+    from src.retrieval.search import semantic_search
+
+    def search(collection_name: str, query: str, k: int) -> List[Dict]:
+        return semantic_search(query, storage_path, top_k=k, collection_name=collection_name)
+    return search
+
+
+def rebuild_collection(storage_path: str = None, processed_dir: str = None, tenant: str = None,
+                       queries: Sequence[str] = (), store: Callable[[str, str, str], int] = None,
+                       search: Callable[[str, str, int], List[Dict]] = None,
+                       sample_size: int = None, min_recall: float = None, min_query_overlap: float = None,
+                       gc_grace_seconds: float = None) -> RebuildResult:
+    """
+    処理済みJSONから新しい版のコレクションを作り、検証に通ったら切り替える
+
+    Args:
+        storage_path: ChromaDBの保存パス（Noneの場合は設定から取得）
+        processed_dir: 処理済みJSONのディレクトリ（Noneの場合はテナントのディレクトリ）
+        tenant: 再構築するテナント（Noneの場合は既定のテナント）
+        queries: 検証用クエリ（旧版と新しい版の上位結果の重なりを確認。埋め込みAPIを呼ぶ）
+        store: (処理済みJSON, 保存パス, コレクション名) を登録する関数（テスト用に差し替え可能）
+        search: (コレクション名, クエリ, 件数) で検索する関数（テスト用に差し替え可能）
+        sample_size, min_recall, min_query_overlap, gc_grace_seconds: Noneの場合は設定から取得
+
+    Returns:
+        RebuildResult
+
+    Raises:
+        SwapInProgress: 同じコレクションの再構築・復元が実行中の場合
+    """
+    ingestion = settings.ingestion
+    storage_path = storage_path or settings.storage.chroma_path
+    processed_dir = processed_dir or tenant_dirs(tenant)[1]
+    store = store or _default_store
+    sample_size = ingestion.rebuild_sample_size if sample_size is None else sample_size
+    min_recall = ingestion.rebuild_min_recall if min_recall is None else min_recall
+    min_query_overlap = ingestion.rebuild_min_query_overlap if min_query_overlap is None else min_query_overlap
+    gc_grace_seconds = ingestion.rebuild_gc_grace_seconds if gc_grace_seconds is None else gc_grace_seconds
+
+    from src.pipeline.resources import get_pipeline_resources
+
+    logical_name = collection_name_for(tenant)
+    resources = get_pipeline_resources()
+    with SwapLock(storage_path, logical_name):
+        previous = resolve_collection(storage_path, logical_name)
+        client = resources.client(storage_path)
+        existing = [c if isinstance(c, str) else c.name for c in client.list_collections()]
+        target = next_version_name(storage_path, logical_name, existing)
+        logger.info(f"再構築開始: {logical_name}（{previous} → {target}）")
+
+        # 1. 新しい版に登録（再構築中に追加・更新された処理済みJSONも追いかける）
+        registered: Dict[str, int] = {}
+        problems: List[str] = []
+        for _ in range(MAX_CATCH_UP_ROUNDS):
+            pending = {path: mtime for path, mtime in list_processed_files(processed_dir).items()
+                       if registered.get(path) != mtime}
+            if not pending:
+                break
+            for path, mtime in pending.items():
+                try:
+                    store(path, storage_path, target)
+                    registered[path] = mtime
+                except Exception as e:
+                    problems.append(f"{os.path.basename(path)} の登録に失敗: {e}")
+                    logger.error(problems[-1])
+            if problems:
+                break
+
+        # 2. 検証
+        chunks, recall, overlap = 0, None, None
+        if not problems:
+            try:
+                collection = client.get_collection(name=target)
+            except Exception:
+                collection = None
+            chunks = collection.count() if collection is not None else 0
+            if chunks == 0:
+                problems.append("新しい版にチャンクが登録されていません")
+            else:
+                previous_sources = _sources(storage_path, previous)
+                target_sources = _sources(storage_path, target) or set()
+                missing = sorted((previous_sources or set()) - target_sources)
+                if missing:
+                    problems.append(f"旧版の文書が新しい版にありません: {', '.join(missing[:5])}"
+                                    f"{' ほか' if len(missing) > 5 else ''}（{len(missing)}件）")
+                # 削除した文書の処理済みJSONが残っていると、再構築で文書が戻ってしまう
+                extra = sorted(target_sources - previous_sources) if previous_sources is not None else []
+                if extra:
+                    problems.append(f"旧版にない文書が新しい版にあります: {', '.join(extra[:5])}"
+                                    f"{' ほか' if len(extra) > 5 else ''}（{len(extra)}件）")
+                recall = self_recall(collection, sample_size)
+                if recall is not None and recall < min_recall:
+                    problems.append(f"自己検索の再現率が下限を下回りました（{recall:.2f} < {min_recall:.2f}）")
+                if queries and previous != target:
+                    overlap = query_overlap(search or _default_search(storage_path), previous, target, queries)
+                    if overlap is not None and overlap < min_query_overlap:
+                        problems.append(f"検証用クエリの上位結果の重なりが下限を下回りました"
+                                        f"（{overlap:.2f} < {min_query_overlap:.2f}）")
+
+        if problems:
+            drop_collection_data(storage_path, target)
+            logger.error(f"再構築を中止しました（{previous} を使い続けます）: {problems}")
+            return RebuildResult(logical_name, previous, target, False, len(registered), chunks,
+                                 recall, overlap, problems, [])
+
+        # 3. 切り替え（次の検索から新しい版を読む）
+        switch_alias(storage_path, logical_name, target)
+        resources.notify_ingested(storage_path, target)
+
+        # 切り替えの直前に旧版へ取り込まれた分を新しい版にも登録
+        for path, mtime in list_processed_files(processed_dir).items():
+            if registered.get(path) != mtime:
+                store(path, storage_path, target)
+                registered[path] = mtime
+
+        # 4. 猶予時間を過ぎた退役済みの版を削除（今回退役させた版は次回以降）
+        dropped = collect_retired(storage_path, logical_name, gc_grace_seconds)
+        logger.info(f"再構築完了: {target}（{chunks}チャンク, 再現率 {recall}, 重なり {overlap}）")
+        return RebuildResult(logical_name, previous, target, True, len(registered), chunks,
+                             recall, overlap, [], dropped)
+
+
+def spawn_rebuild_daemon(tenant: str = None) -> subprocess.Popen:
+    """再構築を独立したプロセスとして起動（Streamlitの再実行・終了の影響を受けない）"""
+    project_root = Path(__file__).resolve().parents[2]
+    command = [sys.executable, str(project_root / "rebuild_index.py")]
+    if tenant:
+        command += ["--tenant", tenant]
+    logger.info(f"再構築を起動: {' '.join(command)}")
+    return subprocess.Popen(command, cwd=os.getcwd(), stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=(sys.platform != "win32"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コレクションの無停止再構築")
+    parser.add_argument("--tenant", default=None, help="再構築するテナント（省略時は既定のテナント）")
+    parser.add_argument("--query", action="append", default=[], help="検証用クエリ（複数指定可）")
+    parser.add_argument("--gc", action="store_true", help="猶予時間を過ぎた旧版の削除だけを行う")
+    parser.add_argument("--grace", type=float, default=None, help="旧版を削除するまでの猶予（秒）")
+    args = parser.parse_args()
+
+    settings.ensure_directories()
+    storage_path = settings.storage.chroma_path
+    if args.gc:
+        grace = settings.ingestion.rebuild_gc_grace_seconds if args.grace is None else args.grace
+        dropped = collect_retired(storage_path, collection_name_for(args.tenant), grace)
+        print(f"削除した旧版: {', '.join(dropped) or 'なし'}")
+        return
+
+    result = rebuild_collection(storage_path, tenant=args.tenant, queries=args.query,
+                                gc_grace_seconds=args.grace)
+    if result.switched:
+        print(f"✅ {result.collection} を {result.target} に切り替えました"
+              f"（{result.files}ファイル, {result.chunks}チャンク, 自己検索の再現率 {result.recall}）")
+        print(f"旧版 {result.previous} は猶予時間の経過後に削除されます（python rebuild_index.py --gc）")
+    else:
+        print(f"❌ 再構築を中止しました（{result.previous} を使い続けます）")
+        for problem in result.problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
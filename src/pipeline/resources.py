@@ -0,0 +1,342 @@
+"""
+RAGパイプラインの長寿命オブジェクト（ベクトルストア・埋め込み関数・生成モデル）の共有キャッシュ
+
+Streamlitはユーザー操作のたびにスクリプト全体を再実行しますが、インポート済みのモジュールは
+再実行をまたいで保持されるため、ここに置いたオブジェクトは全セッションで共有されます。
+取り込み・クリア時には invalidate() で明示的に無効化します。
+
+ドキュメント数はコレクションのバージョン番号（取り込みのたびに増加）をキーにキャッシュし、
+バージョンが変わらない限りDBを開かずに返します。バージョンは保存先のファイルに記録するため、
+別プロセス（CLIからの取り込みやジョブキューのワーカー）での更新も検出できます。
+
+ChromaDBのクライアントは読み込んだHNSWインデックスをメモリに保持し、別プロセスが追加したベクトルは
+同じクライアントから検索できません。そのため、別プロセスでバージョンが進んだことを検出したら
+コレクションのハンドルだけでなくクライアントも開き直します。
+"""
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from src.config import settings
+from src.utils.deadline import Deadline
+from src.utils.error_handler import APIRetryHandler
+from src.utils.logger import setup_logger
+
+logger = setup_logger("pipeline_resources")
+
+VERSION_DIR_NAME = "collection_versions"
+
+
+def _version_file(storage_path: str, collection_name: str) -> Path:
+    return Path(storage_path) / VERSION_DIR_NAME / collection_name
+
+
+def read_collection_version(storage_path: str, collection_name: str) -> Tuple[int, int]:
+    """
+    コレクションのバージョンを取得
+
+    Returns:
+        (バージョン番号, ファイルの更新時刻ns)。ファイルがない場合は (0, 0)
+    """
+    path = _version_file(storage_path, collection_name)
+    try:
+        stat_result = path.stat()
+        return int(path.read_text(encoding="utf-8").strip() or 0), stat_result.st_mtime_ns
+    except (FileNotFoundError, ValueError):
+        return 0, 0
+
+
+def bump_collection_version(storage_path: str, collection_name: str) -> int:
+    """コレクションのバージョンを1つ進める（一時ファイル経由で置き換え）"""
+    path = _version_file(storage_path, collection_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    version = read_collection_version(storage_path, collection_name)[0] + 1
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(str(version))
+    os.replace(tmp_path, path)
+    return version
+
+
+class PipelineResources:
+    """
+    パイプラインで共有するオブジェクトのキャッシュ
+
+    いずれのオブジェクトも初回アクセス時に作成されます（chromadb などの重いインポートもその時点）。
+    """
+    def __init__(self):
+        self._clients: Dict[str, Any] = {}
+        self._embedding_functions: Dict[Tuple[str, str], Any] = {}
+        self._collections: Dict[Tuple[str, str, str, str], Tuple[Tuple[int, int], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._counts: Dict[Tuple[str, str], Tuple[Tuple[int, int], Tuple[int, Dict[str, Any]]]] = {}
+        # 現在のクライアントで読んだコレクションのバージョン（別プロセスでの更新の検出用）
+        self._client_versions: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._lock = threading.RLock()
+
+    def client(self, storage_path: str):
+        """ChromaDBクライアント（保存先ごとに1つ）"""
+        key = os.path.abspath(storage_path)
+        with self._lock:
+            if key not in self._clients:
+                import chromadb
+
+                self._clients[key] = chromadb.PersistentClient(path=storage_path)
+            return self._clients[key]
+
+    def _fresh_client(self, storage_path: str, collection_name: str, version: Tuple[int, int]):
+        """
+        コレクションを読むためのクライアント
+
+        このクライアントで前回読んだ後に別プロセスでバージョンが進んでいれば、クライアントを開き直します
+        （古いクライアントはメモリ上のHNSWインデックスを使い続け、追加されたベクトルを検索できないため）。
+        """
+        path_key = os.path.abspath(storage_path)
+        with self._lock:
+            seen = self._client_versions.get((path_key, collection_name))
+            if seen is not None and seen != version and path_key in self._clients:
+                logger.info(f"{collection_name} が別プロセスで更新されたため、ChromaDBクライアントを開き直します")
+                self.invalidate(storage_path, collection_name, close_client=True)
+            self._client_versions[(path_key, collection_name)] = version
+            return self.client(storage_path)
+
+    def embedding_function(self, task_type: str, model_name: str = None):
+        """Gemini埋め込み関数（モデル・タスク種別ごとに1つ）"""
+        model_name = model_name or settings.embedding.model
+        key = (model_name, task_type)
+        with self._lock:
+            if key not in self._embedding_functions:
+                from src.embedding.rate_limited import RateLimitedGeminiEmbeddingFunction
+
+                # APIの呼び出しごとにモデルのレート制限・リトライ・サーキットブレーカーを通す
+                self._embedding_functions[key] = RateLimitedGeminiEmbeddingFunction(
+                    api_key=settings.embedding.api_key,
+                    model_name=model_name,
+                    task_type=task_type
+                )
+            return self._embedding_functions[key]
+
+    def collection(self, storage_path: str, collection_name: str = None,
+                   task_type: str = None, create: bool = False, model_name: str = None):
+        """
+        コレクションのハンドル
+
+        保存済みの埋め込みと異なるモデルを指定した場合は、コレクションに記録されたモデルで開きます
+        （EMBEDDING_MODEL_MISMATCH が "refuse" の場合は EmbeddingModelMismatch）。
+
+        Args:
+            storage_path: ChromaDBの保存パス
+            collection_name: コレクション名（Noneの場合は設定から取得）
+            task_type: 埋め込みのタスク種別（Noneの場合は検索用）
+            create: 存在しない場合に作成するか（取り込み用、作成時は model_name を記録）
+            model_name: 埋め込みモデル（Noneの場合は設定から取得）
+        """
+        from src.embedding.model_info import collection_metadata, recorded_model, resolve_embedding_model
+
+        collection_name = collection_name or settings.storage.collection_name
+        task_type = task_type or settings.embedding.task_type_query
+        model_name = model_name or settings.embedding.model
+        key = (os.path.abspath(storage_path), collection_name, task_type, model_name)
+        # 別プロセスでコレクションが作り直された場合に備え、バージョンが変わったら取得し直す
+        version = read_collection_version(storage_path, collection_name)
+        with self._lock:
+            cached = self._collections.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+            client = self._fresh_client(storage_path, collection_name, version)
+            embedding_function = self.embedding_function(task_type, model_name)
+            if create:
+                collection = client.get_or_create_collection(
+                    name=collection_name,
+                    embedding_function=embedding_function,
+                    metadata=collection_metadata(model_name)
+                )
+            else:
+                collection = client.get_collection(
+                    name=collection_name,
+                    embedding_function=embedding_function
+                )
+
+            # 保存済みのベクトルと同じモデルでクエリ・文書を埋め込む
+            routed = resolve_embedding_model(collection_name, recorded_model(collection), model_name)
+            if routed != model_name:
+                collection = client.get_collection(
+                    name=collection_name,
+                    embedding_function=self.embedding_function(task_type, routed)
+                )
+            self._collections[key] = (version, collection)
+            return collection
+
+    def generation_model(self, model_name: str = None):
+        """Gemini生成モデル（モデルごとに1つ）"""
+        model_name = model_name or settings.generation.model
+        with self._lock:
+            if model_name not in self._models:
+                import google.generativeai as genai
+
+                genai.configure(api_key=settings.embedding.api_key)
+                self._models[model_name] = genai.GenerativeModel(model_name)
+            return self._models[model_name]
+
+    def document_count(self, storage_path: str, collection_name: str = None) -> int:
+        """
+        コレクションのドキュメント数（バージョンが変わらない限りキャッシュを返す）
+
+        Raises:
+            コレクションが存在しない場合はchromadbの例外
+        """
+        return self._collection_stats(storage_path, collection_name)[0]
+
+    def collection_metadata(self, storage_path: str, collection_name: str = None) -> Dict[str, Any]:
+        """
+        コレクションのメタデータ（埋め込みモデル・次元数など。ドキュメント数と一緒にキャッシュ）
+
+        Raises:
+            コレクションが存在しない場合はchromadbの例外
+        """
+        return self._collection_stats(storage_path, collection_name)[1]
+
+    def _collection_stats(self, storage_path: str, collection_name: str = None) -> Tuple[int, Dict[str, Any]]:
+        collection_name = collection_name or settings.storage.collection_name
+        key = (os.path.abspath(storage_path), collection_name)
+        version = read_collection_version(storage_path, collection_name)
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        collection = self._fresh_client(storage_path, collection_name, version).get_collection(name=collection_name)
+        stats = (collection.count(), dict(collection.metadata or {}))
+        with self._lock:
+            self._counts[key] = (version, stats)
+        return stats
+
+    def invalidate(self, storage_path: str, collection_name: str = None, close_client: bool = False):
+        """
+        取り込み・クリア後にキャッシュを無効化
+
+        Args:
+            storage_path: ChromaDBの保存パス
+            collection_name: コレクション名（Noneの場合は設定から取得）
+            close_client: クライアントも閉じる（保存先ディレクトリを削除する場合）
+        """
+        collection_name = collection_name or settings.storage.collection_name
+        path_key = os.path.abspath(storage_path)
+        with self._lock:
+            self._counts.pop((path_key, collection_name), None)
+            for key in [key for key in self._collections if key[:2] == (path_key, collection_name)]:
+                del self._collections[key]
+
+            if close_client:
+                for key in [key for key in self._collections if key[0] == path_key]:
+                    del self._collections[key]
+                for key in [key for key in self._counts if key[0] == path_key]:
+                    del self._counts[key]
+                for key in [key for key in self._client_versions if key[0] == path_key]:
+                    del self._client_versions[key]
+                client = self._clients.pop(path_key, None)
+                if client is not None:
+                    try:
+                        client.close()
+                    except Exception as e:
+                        logger.debug(f"ChromaDBクライアントのクローズに失敗: {e}")
+                    # 同じパスで新しいクライアントを作れるよう、chromadbの共有キャッシュも破棄
+                    client.clear_system_cache()
+
+    def notify_ingested(self, storage_path: str, collection_name: str = None) -> int:
+        """
+        取り込み完了を記録（バージョンを進めてキャッシュを無効化）
+
+        このプロセスで登録したベクトルは同じクライアントから検索できるため、クライアントは開き直しません。
+        """
+        collection_name = collection_name or settings.storage.collection_name
+        version = bump_collection_version(storage_path, collection_name)
+        self.invalidate(storage_path, collection_name)
+        path_key = os.path.abspath(storage_path)
+        with self._lock:
+            if (path_key, collection_name) in self._client_versions:
+                self._client_versions[(path_key, collection_name)] = read_collection_version(
+                    storage_path, collection_name)
+        return version
+
+
+_resources: Optional[PipelineResources] = None
+_resources_lock = threading.Lock()
+
+# 埋め込みAPIのレート制限を分け合うプロセス数（取り込みワーカーが起動時に設定）
+_embedding_rate_share = 1
+
+
+def get_pipeline_resources() -> PipelineResources:
+    """プロセス全体で共有するPipelineResourcesを取得"""
+    global _resources
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                _resources = PipelineResources()
+    return _resources
+
+
+def get_api_handler(model_name: str, deadline: Deadline = None, hedge_percentile: float = None,
+                    max_retries: int = None, max_queue_wait: float = None) -> APIRetryHandler:
+    """
+    モデルごとのAPIリトライハンドラーを取得
+
+    レート制限とサーキットブレーカーの状態はモデル単位で全セッションに共有されます。
+    共有状態は最初に作ったハンドラーの設定で作成されるため、同じモデルを呼ぶハンドラーは
+    すべてここで設定（RESILIENCE の各値）から作成します。
+
+    Args:
+        model_name: モデル名（共有状態のキー）
+        deadline: リクエストのレイテンシ予算
+        hedge_percentile: ヘッジを発行するパーセンタイル
+        max_retries: 最大試行回数（Noneの場合は設定から取得。任意の処理は1回だけ試行）
+        max_queue_wait: レート制限で待機する上限秒数（Noneの場合は APIRetryHandler の既定値）
+    """
+    resilience = settings.resilience
+    options = {} if max_queue_wait is None else {'max_queue_wait': max_queue_wait}
+    return APIRetryHandler(
+        max_retries=resilience.max_retries if max_retries is None else max_retries,
+        provider=f"gemini:{model_name}",
+        requests_per_minute=resilience.requests_per_minute,
+        burst=resilience.burst,
+        max_wait=resilience.backoff_max_seconds,
+        failure_threshold=resilience.failure_threshold,
+        reset_timeout=resilience.reset_timeout_seconds,
+        deadline=deadline,
+        hedge_percentile=hedge_percentile,
+        **options
+    )
+
+
+def set_embedding_rate_share(processes: int):
+    """
+    埋め込みAPIのレート制限を分け合うプロセス数を設定
+
+    レート制限はプロセスごとのため、N個のワーカーがそれぞれ EMBEDDING_REQUESTS_PER_MINUTE で
+    呼び出すと合計でN倍になります。ワーカーは起動時に自分を含むワーカー数を設定し、1/Nの枠で埋め込みます。
+    埋め込みのハンドラーを作る前に呼び出してください。
+    """
+    global _embedding_rate_share
+    _embedding_rate_share = max(1, int(processes))
+
+
+def get_embedding_handler(model_name: str) -> APIRetryHandler:
+    """
+    埋め込みモデルのAPIリトライハンドラーを取得
+
+    生成モデルとは別の EMBEDDING_REQUESTS_PER_MINUTE でレート制限します（1トークン = バッチ1回の呼び出し）。
+    """
+    resilience = settings.resilience
+    return APIRetryHandler(
+        max_retries=resilience.max_retries,
+        provider=f"gemini:{model_name}",
+        requests_per_minute=resilience.embedding_requests_per_minute / _embedding_rate_share,
+        burst=resilience.burst,
+        max_wait=resilience.backoff_max_seconds,
+        failure_threshold=resilience.failure_threshold,
+        reset_timeout=resilience.reset_timeout_seconds,
+    )
@@ -0,0 +1,363 @@
+"""
+ベクトルストアのスナップショット（書き出しと高速な復元）
+
+新しいノードで storage/chroma を作り直すために全PDFをGeminiで埋め込み直す代わりに、
+保存済みの埋め込みをそのまま書き出し、復元時は埋め込み済みのベクトルを大きなバッチで登録します
+（埋め込みAPIは呼びません）。
+
+スナップショットはディレクトリで、列ごとのファイルに分けて保存します:
+
+- manifest.json      件数・次元数・設定のフィンガープリント・各ファイルのSHA-256
+- embeddings.npy     埋め込み（float32 の N×次元 行列、復元時はメモリマップで読み込み）
+- ids.json.gz / documents.json.gz / metadatas.json.gz   ID・本文・メタデータの列
+- pages.db / dedup.db   ページストアと重複除去のインデックス（ある場合）
+
+復元は新しい版のコレクション（src/pipeline/aliases.py）に登録してから切り替えるため、
+復元中も使用中の版で検索を続けられます。
+
+使い方:
+    python snapshot_db.py export snapshots/2024-06-01
+    python snapshot_db.py import snapshots/2024-06-01
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple
+
+from src.config import settings
+from src.pipeline.aliases import (
+    SwapLock,
+    collect_retired,
+    drop_collection_data,
+    next_version_name,
+    resolve_collection,
+    switch_alias,
+)
+from src.pipeline.tenants import collection_name_for
+from src.utils.logger import setup_logger
+
+logger = setup_logger("snapshot")
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+COLUMN_FILES = {"ids": "ids.json.gz", "documents": "documents.json.gz", "metadatas": "metadatas.json.gz"}
+PAGES_FILE = "pages.db"
+DEDUP_FILE = "dedup.db"
+
+# 一致しないと復元後の検索・取り込みが正しく動かない設定
+CRITICAL_FINGERPRINT_KEYS = ("embedding_model", "dedup_num_perm", "dedup_shingle_size")
+
+
+class SnapshotInfo(NamedTuple):
+    """書き出したスナップショット"""
+    path: str
+    collection: str  # 書き出したコレクション
+    count: int
+    dimensions: int
+    seconds: float
+
+
+class RestoreResult(NamedTuple):
+    """復元の結果"""
+    collection: str  # 論理名
+    previous: str  # 復元前に使用していたコレクション
+    target: str  # 復元した版
+    count: int
+    seconds: float
+
+
+def settings_fingerprint() -> Dict:
+    """スナップショットの互換性を判定する設定"""
+    ingestion = settings.ingestion
+    return {
+        "embedding_model": settings.embedding.model,
+        "embedding_task_type": settings.embedding.task_type_document,
+        "hnsw_space": settings.storage.hnsw_space,
+        "dedup_enabled": ingestion.dedup_enabled,
+        "dedup_num_perm": ingestion.dedup_num_perm,
+        "dedup_shingle_size": ingestion.dedup_shingle_size,
+        "dedup_bands": ingestion.dedup_bands,
+    }
+
+
+def fingerprint_mismatches(snapshot: Dict, current: Dict) -> List[str]:
+    """互換性のない設定の差分（"項目: スナップショットの値 → 現在の値"）"""
+    return [f"{key}: {snapshot.get(key)} → {current.get(key)}"
+            for key in CRITICAL_FINGERPRINT_KEYS if snapshot.get(key) != current.get(key)]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_column(path: str, values: List):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(values, f, ensure_ascii=False)
+
+
+def _read_column(path: str) -> List:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _backup_sqlite(source: str, destination: str):
+    """SQLiteを書き込み中でも一貫した状態でコピー"""
+    with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(destination)) as dst:
+        src.backup(dst)
+
+
+def export_snapshot(output_dir: str, storage_path: str = None, tenant: str = None,
+                    page_size: int = 1000) -> SnapshotInfo:
+    """
+    使用中のコレクションをスナップショットとして書き出す
+
+    Args:
+        output_dir: 書き出し先のディレクトリ（既にある場合は置き換え）
+        storage_path: ChromaDBの保存パス（Noneの場合は設定から取得）
+        tenant: 書き出すテナント（Noneの場合は既定のテナント）
+        page_size: 1回に読み出す件数
+
+    Returns:
+        SnapshotInfo
+    """
+    import numpy as np
+    from numpy.lib.format import open_memmap
+
+    from src.embedding.model_info import embedding_model_for
+    from src.ingestion.dedup import dedup_index_path
+    from src.pipeline.resources import get_pipeline_resources
+    from src.retrieval.page_store import page_store_path
+
+    start = time.perf_counter()
+    storage_path = storage_path or settings.storage.chroma_path
+    logical_name = collection_name_for(tenant)
+    collection_name = resolve_collection(storage_path, logical_name)
+    collection = get_pipeline_resources().client(storage_path).get_collection(name=collection_name)
+    count = collection.count()
+
+    # 一時ディレクトリに書いてから置き換える（途中で失敗しても壊れたスナップショットを残さない）
+    tmp_dir = output_dir.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[Dict] = []
+    embeddings = None
+    dimensions = 0
+    while len(ids) < count:
+        batch = collection.get(limit=min(page_size, count - len(ids)), offset=len(ids),
+                               include=["embeddings", "documents", "metadatas"])
+        if not batch["ids"]:
+            break
+        vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+        if embeddings is None:
+            dimensions = vectors.shape[1]
+            embeddings = open_memmap(os.path.join(tmp_dir, EMBEDDINGS_FILE), mode="w+",
+                                     dtype=np.float32, shape=(count, dimensions))
+        embeddings[len(ids):len(ids) + len(vectors)] = vectors
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        metadatas.extend(batch["metadatas"])
+
+    if embeddings is None:
+        np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), np.zeros((0, 0), dtype=np.float32))
+    else:
+        embeddings.flush()
+        del embeddings
+        if len(ids) < count:
+            # 書き出し中に削除されたチャンクの分を詰める
+            vectors = np.load(os.path.join(tmp_dir, EMBEDDINGS_FILE))[:len(ids)]
+            np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), vectors)
+
+    for key, values in (("ids", ids), ("documents", documents), ("metadatas", metadatas)):
+        _write_column(os.path.join(tmp_dir, COLUMN_FILES[key]), values)
+    for source, name in ((page_store_path(storage_path, collection_name), PAGES_FILE),
+                         (dedup_index_path(storage_path, collection_name), DEDUP_FILE)):
+        if os.path.exists(source):
+            _backup_sqlite(source, os.path.join(tmp_dir, name))
+
+    files = {name: _sha256(os.path.join(tmp_dir, name)) for name in sorted(os.listdir(tmp_dir))}
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "collection": logical_name,
+        "source_collection": collection_name,
+        "count": len(ids),
+        "dimensions": dimensions,
+        "dtype": "float32",
+        "created_at": datetime.now().isoformat(),
+        # 埋め込みモデルは設定ではなく、書き出したベクトルを作ったモデル（コレクションの記録）
+        "fingerprint": dict(settings_fingerprint(), embedding_model=embedding_model_for(collection)),
+        "files": files,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+    seconds = time.perf_counter() - start
+    logger.info(f"スナップショットを書き出しました: {output_dir}（{len(ids)}件, {dimensions}次元, {seconds:.1f}秒）")
+    return SnapshotInfo(output_dir, collection_name, len(ids), dimensions, seconds)
+
+
+def read_manifest(snapshot_dir: str) -> Dict:
+    """スナップショットのマニフェスト"""
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"対応していないスナップショットの形式です: {manifest.get('format')}")
+    return manifest
+
+
+def _default_open_collection(storage_path: str, model_name: str) -> Callable[[str], object]:
+    from src.pipeline.resources import get_pipeline_resources
+
+    def open_collection(name: str):
+        # 復元する版にはベクトルを作ったモデルを記録（--force で設定と異なるモデルを復元した場合も）
+        return get_pipeline_resources().collection(
+            storage_path, name, task_type=settings.embedding.task_type_document, create=True,
+            model_name=model_name
+        )
+    return open_collection
+
+
+def import_snapshot(snapshot_dir: str, storage_path: str = None, tenant: str = None, force: bool = False,
+                    batch_size: int = None, open_collection: Callable[[str], object] = None) -> RestoreResult:
+    """
+    スナップショットを新しい版のコレクションに登録し、使用中のコレクションを切り替える
+
+    Args:
+        snapshot_dir: export_snapshot() で書き出したディレクトリ
+        storage_path: ChromaDBの保存パス（Noneの場合は設定から取得）
+        tenant: 復元先のテナント（Noneの場合は既定のテナント）
+        force: 埋め込みモデルなどの設定が一致しなくても復元する
+        batch_size: 1回に登録する件数（Noneの場合は設定から取得）
+        open_collection: コレクション名から登録先のコレクションを作成・取得する関数（テスト用に差し替え可能）
+
+    Returns:
+        RestoreResult
+
+    Raises:
+        ValueError: 設定が一致しない・ファイルが壊れている場合
+        SwapInProgress: 同じコレクションの再構築・復元が実行中の場合
+    """
+    import numpy as np
+
+    from src.embedding.model_info import record_embedding_model
+    from src.embedding.quantization import update_quantized_index
+    from src.ingestion.dedup import dedup_index_path
+    from src.pipeline.resources import get_pipeline_resources
+    from src.retrieval.page_store import page_store_path
+
+    start = time.perf_counter()
+    storage_path = storage_path or settings.storage.chroma_path
+    manifest = read_manifest(snapshot_dir)
+    mismatches = fingerprint_mismatches(manifest["fingerprint"], settings_fingerprint())
+    if mismatches and not force:
+        raise ValueError("スナップショットと現在の設定が一致しません: " + "; ".join(mismatches))
+    for name, digest in manifest["files"].items():
+        if _sha256(os.path.join(snapshot_dir, name)) != digest:
+            raise ValueError(f"スナップショットのファイルが壊れています: {name}")
+
+    embeddings = np.load(os.path.join(snapshot_dir, EMBEDDINGS_FILE), mmap_mode="r")
+    columns = {key: _read_column(os.path.join(snapshot_dir, name)) for key, name in COLUMN_FILES.items()}
+    count = manifest["count"]
+    if len(embeddings) != count or any(len(values) != count for values in columns.values()):
+        raise ValueError("スナップショットの件数が一致しません")
+
+    resources = get_pipeline_resources()
+    client = resources.client(storage_path)
+    batch_size = min(batch_size or settings.storage.snapshot_batch_size, client.get_max_batch_size())
+    logical_name = collection_name_for(tenant)
+    with SwapLock(storage_path, logical_name):
+        previous = resolve_collection(storage_path, logical_name)
+        existing = [c if isinstance(c, str) else c.name for c in client.list_collections()]
+        target = next_version_name(storage_path, logical_name, existing)
+        logger.info(f"スナップショットを復元: {snapshot_dir} → {target}（{count}件, バッチ {batch_size}件）")
+
+        try:
+            model_name = manifest["fingerprint"]["embedding_model"]
+            collection = (open_collection or _default_open_collection(storage_path, model_name))(target)
+            # 埋め込み済みのベクトルを渡すため、埋め込み関数（API）は呼ばれない
+            for begin in range(0, count, batch_size):
+                end = min(begin + batch_size, count)
+                collection.add(
+                    ids=columns["ids"][begin:end],
+                    embeddings=np.asarray(embeddings[begin:end]),
+                    documents=columns["documents"][begin:end],
+                    metadatas=columns["metadatas"][begin:end]
+                )
+
+            for name, destination in ((PAGES_FILE, page_store_path(storage_path, target)),
+                                      (DEDUP_FILE, dedup_index_path(storage_path, target))):
+                if os.path.exists(os.path.join(snapshot_dir, name)):
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    shutil.copyfile(os.path.join(snapshot_dir, name), destination)
+
+            method = settings.storage.vector_quantization
+            if method != "none" and count:
+                update_quantized_index(storage_path, target, columns["ids"], np.asarray(embeddings),
+                                       method=method, **settings.storage.quantization_options())
+
+            if count:
+                record_embedding_model(collection, model_name, manifest["dimensions"])
+
+            if collection.count() != count:
+                raise RuntimeError(f"復元した件数が一致しません（{collection.count()} / {count}）")
+        except Exception:
+            drop_collection_data(storage_path, target)
+            raise
+
+        switch_alias(storage_path, logical_name, target)
+        resources.notify_ingested(storage_path, target)
+        # 以前の切り替えで退役し、猶予時間を過ぎた版を削除（今回退役した版は猶予時間まで残す）
+        collect_retired(storage_path, logical_name, settings.ingestion.rebuild_gc_grace_seconds)
+
+    seconds = time.perf_counter() - start
+    logger.info(f"スナップショットを復元しました: {target}（{count}件, {seconds:.1f}秒）")
+    return RestoreResult(logical_name, previous, target, count, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベクトルストアのスナップショット")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="使用中のコレクションを書き出す")
+    export_parser.add_argument("path", help="書き出し先のディレクトリ")
+    export_parser.add_argument("--tenant", default=None, help="テナント（省略時は既定のテナント）")
+    import_parser = subparsers.add_parser("import", help="スナップショットから復元して切り替える")
+    import_parser.add_argument("path", help="スナップショットのディレクトリ")
+    import_parser.add_argument("--tenant", default=None, help="テナント（省略時は既定のテナント）")
+    import_parser.add_argument("--force", action="store_true", help="埋め込みモデルなどの設定が一致しなくても復元する")
+    args = parser.parse_args()
+
+    settings.ensure_directories()
+    try:
+        if args.command == "export":
+            info = export_snapshot(args.path, tenant=args.tenant)
+            print(f"✅ {info.collection} を {info.path} に書き出しました（{info.count}件, {info.dimensions}次元, "
+                  f"{info.seconds:.1f}秒）")
+        else:
+            result = import_snapshot(args.path, tenant=args.tenant, force=args.force)
+            print(f"✅ {result.collection} を {result.target} に復元して切り替えました（{result.count}件, "
+                  f"{result.seconds:.1f}秒）")
+            print(f"旧版 {result.previous} は猶予時間の経過後に削除されます（python rebuild_index.py --gc）")
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+テナント（チーム）ごとのコレクションと上限
+
+1つのインストールを複数のチームで共有するため、テナントごとに別のChromaコレクション
+（とその重複除去・ページストア・量子化インデックス）と、PDF・処理済みJSONの保存先を分けます。
+
+- 既定のテナントは従来のコレクション名・ディレクトリをそのまま使います（既存のデータはそのまま既定のテナント）
+- UIのテナントはログインユーザーとサーバー側の割り当て（TENANT_ASSIGNMENTS）で決め、URLでは切り替えられません
+- 文書数・チャンク数の上限を超える取り込みは TenantLimitExceeded で拒否します（再試行しない）
+- クリアはそのテナントのコレクションとファイルだけを削除し、保存先全体を消したりクライアントを閉じたりしません
+
+ここで返すコレクション名は論理名です。再構築後の実際のコレクションは src/pipeline/aliases.py で解決します。
+"""
+import os
+import re
+import shutil
+from typing import Dict, Optional, Tuple
+
+from src.config import settings
+from src.utils.error_handler import TenantLimitExceeded
+from src.utils.logger import setup_logger
+
+logger = setup_logger("tenants")
+
+# テナント名（コレクション名・ディレクトリ名に使うため英数字と _ - のみ）
+_TENANT_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,62}$")
+
+# 既定以外のテナントのコレクション名の区切り（{既定のコレクション名}__{テナント}）
+COLLECTION_SEPARATOR = "__"
+TENANT_DIR_NAME = "tenants"
+
+
+def resolve_tenant(tenant: Optional[str] = None) -> str:
+    """テナント名を検証して返す（Noneの場合は既定のテナント）"""
+    tenant = tenant or settings.tenants.default_tenant
+    if not _TENANT_PATTERN.match(tenant):
+        raise ValueError(f"テナント名に使えない文字が含まれています: {tenant!r}")
+    return tenant
+
+
+def parse_tenant_assignments(value: str = None) -> Dict[str, str]:
+    """
+    テナントの割り当てを解析（"alice@example.com=team-a,@example.org=team-b" → {メールアドレス/@ドメイン: テナント}）
+
+    Raises:
+        ValueError: 書式・テナント名が正しくない場合
+    """
+    value = settings.tenants.assignments if value is None else value
+    assignments = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        identity, separator, tenant = entry.partition("=")
+        if not separator or not identity.strip():
+            raise ValueError(f"テナントの割り当ての書式が正しくありません: {entry.strip()!r}")
+        assignments[identity.strip().lower()] = resolve_tenant(tenant.strip())
+    return assignments
+
+
+def tenant_for_user(email: Optional[str], assignments: Dict[str, str] = None) -> str:
+    """
+    ログインユーザーのテナント（メールアドレス、次にドメインの割り当て。なければ既定のテナント）
+
+    未ログイン（email が None）の場合は常に既定のテナントです。
+    """
+    assignments = parse_tenant_assignments() if assignments is None else assignments
+    if not email:
+        return settings.tenants.default_tenant
+    email = email.strip().lower()
+    domain = "@" + email.rpartition("@")[2]
+    return assignments.get(email) or assignments.get(domain) or settings.tenants.default_tenant
+
+
+def is_default_tenant(tenant: Optional[str] = None) -> bool:
+    return resolve_tenant(tenant) == settings.tenants.default_tenant
+
+
+def job_tenant(tenant: Optional[str] = None) -> Optional[str]:
+    """ジョブキューに記録するテナント（既定のテナントは以前のジョブと同じくNone）"""
+    return None if is_default_tenant(tenant) else resolve_tenant(tenant)
+
+
+def collection_name_for(tenant: Optional[str] = None) -> str:
+    """テナントのコレクション名"""
+    base = settings.storage.collection_name
+    if is_default_tenant(tenant):
+        return base
+    return f"{base}{COLLECTION_SEPARATOR}{resolve_tenant(tenant)}"
+
+
+def tenant_dirs(tenant: Optional[str] = None, raw_dir: str = None,
+                processed_dir: str = None) -> Tuple[str, str]:
+    """テナントのPDF・処理済みJSONの保存先 (raw_dir, processed_dir)"""
+    raw_dir = raw_dir or settings.storage.data_raw_dir
+    processed_dir = processed_dir or settings.storage.data_processed_dir
+    if is_default_tenant(tenant):
+        return raw_dir, processed_dir
+    tenant = resolve_tenant(tenant)
+    return (os.path.join(raw_dir, TENANT_DIR_NAME, tenant),
+            os.path.join(processed_dir, TENANT_DIR_NAME, tenant))
+
+
+def source_path_for(source: str, tenant: Optional[str] = None) -> str:
+    """PDF配信サーバー（data/raw を公開）でのPDFの相対パス"""
+    if is_default_tenant(tenant):
+        return source
+    return f"{TENANT_DIR_NAME}/{resolve_tenant(tenant)}/{source}"
+
+
+def tenant_usage(storage_path: str, tenant: Optional[str] = None) -> Dict[str, int]:
+    """
+    テナントの使用量
+
+    Returns:
+        {"documents": 取り込み済みの文書数, "chunks": コレクションのチャンク数}
+    """
+    from src.pipeline.aliases import resolve_collection
+    from src.pipeline.resources import get_pipeline_resources
+    from src.retrieval.page_store import PageStore, page_store_path
+
+    collection_name = resolve_collection(storage_path, collection_name_for(tenant))
+    pages_path = page_store_path(storage_path, collection_name)
+    documents = PageStore(pages_path).source_count() if os.path.exists(pages_path) else 0
+    try:
+        chunks = get_pipeline_resources().document_count(storage_path, collection_name)
+    except Exception:
+        # コレクションがまだない
+        chunks = 0
+    return {"documents": documents, "chunks": chunks}
+
+
+def check_document_quota(storage_path: str, tenant: Optional[str] = None, pending: int = 0,
+                         max_documents: int = None):
+    """
+    文書を1つ追加するとテナントの文書数の上限を超える場合に TenantLimitExceeded
+
+    Args:
+        pending: 取り込み待ち・取り込み中の文書数（まだ数に入っていない分）
+        max_documents: 上限（Noneの場合は設定から取得、0は無制限）
+    """
+    if max_documents is None:
+        max_documents = settings.tenants.max_documents
+    if max_documents <= 0:
+        return
+    documents = tenant_usage(storage_path, tenant)["documents"] + pending
+    if documents + 1 > max_documents:
+        raise TenantLimitExceeded(
+            f"テナント「{resolve_tenant(tenant)}」の文書数が上限（{max_documents}件）に達しています"
+            f"（取り込み済み・処理中 {documents}件）"
+        )
+
+
+def check_chunk_quota(current: int, replaced: int, added: int, max_chunks: int = None,
+                      collection_name: str = ""):
+    """
+    チャンクを登録するとテナントのチャンク数の上限を超える場合に TenantLimitExceeded
+
+    Args:
+        current: コレクションの現在のチャンク数
+        replaced: 登録で置き換わる（同じ文書の以前の）チャンク数
+        added: 登録するチャンク数
+        max_chunks: 上限（Noneの場合は設定から取得、0は無制限）
+        collection_name: メッセージに含めるコレクション名
+    """
+    if max_chunks is None:
+        max_chunks = settings.tenants.max_chunks
+    if max_chunks <= 0:
+        return
+    total = current - replaced + added
+    if total > max_chunks:
+        raise TenantLimitExceeded(
+            f"チャンク数が上限（{max_chunks}件）を超えます（{collection_name} 登録後 {total}件）"
+        )
+
+
+def clear_tenant(storage_path: str, tenant: Optional[str] = None) -> bool:
+    """
+    テナントのデータだけを削除（他のテナントの検索・取り込みは止めない）
+
+    コレクション（再構築で作った版を含む）と、その重複除去・ページストア・量子化インデックス・バージョンを削除します。
+    既定以外のテナントはアップロードしたPDF・処理済みJSONも削除します。
+
+    Returns:
+        削除するコレクションがあったか
+    """
+    from src.pipeline.aliases import drop_all_versions
+
+    collection_name = collection_name_for(tenant)
+    existed = drop_all_versions(storage_path, collection_name)
+
+    if not is_default_tenant(tenant):
+        for directory in tenant_dirs(tenant):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    logger.info(f"テナント「{resolve_tenant(tenant)}」のデータを削除しました（{collection_name}）")
+    return existed
@@ -0,0 +1,79 @@
+"""
+MMR（Maximal Marginal Relevance）による多様性を考慮した候補選択
+
+隣り合うチャンクは50文字重なっているため、関連度順に上位を取ると同じページのほぼ同じ内容で
+すべての枠が埋まりがちです。MMRは「クエリへの関連度」と「選択済みチャンクとの類似度」の差で
+1件ずつ選ぶことで、少ないチャンク（＝少ない入力トークン）でより多くの情報を渡します。
+
+    score(d) = λ * relevance(d) - (1 - λ) * max_{s ∈ 選択済み} cos(d, s)
+
+候補の埋め込み行列からコサイン類似度行列を1回の行列積で求め、選択済みとの最大類似度は
+選ぶたびにベクトル演算で更新します（候補数 n に対して O(n^2) の計算を NumPy で実行）。
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def mmr_select(embeddings, relevance: Sequence[float], k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    MMRで k 件の候補を選ぶ
+
+    Args:
+        embeddings: 候補の埋め込み（n × 次元）
+        relevance: 候補ごとのクエリへの関連度（コサイン類似度と同じ 0〜1 程度の尺度、大きいほど関連が高い）
+        k: 選ぶ件数
+        lambda_mult: 1.0 で関連度のみ、0.0 で多様性のみ
+
+    Returns:
+        選んだ候補の位置（選んだ順）
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    n = len(vectors)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1.0)
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(k - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+def _relevance(results: List[Dict]) -> List[float]:
+    """
+    リランクスコアがあれば最大値で割った値を、なければ 1 - コサイン距離を関連度とする
+    """
+    if all(r.get('rerank_score') is not None for r in results):
+        scores = [float(r['rerank_score']) for r in results]
+        top = max(scores)
+        return [score / top if top > 0 else 1.0 for score in scores]
+    return [1.0 - float(r.get('distance', 0)) for r in results]
+
+
+def mmr_rerank(results: List[Dict], k: int, lambda_mult: Optional[float]) -> List[Dict]:
+    """
+    検索結果（"embedding" を含む）からMMRで k 件を選ぶ
+
+    lambda_mult が None または 1 以上の場合、埋め込みがない結果が含まれる場合は先頭 k 件を返します。
+    """
+    if lambda_mult is None or lambda_mult >= 1 or len(results) <= k:
+        return results[:k]
+    if any(r.get('embedding') is None for r in results):
+        return results[:k]
+
+    selected = mmr_select([r['embedding'] for r in results], _relevance(results), k, lambda_mult)
+    return [results[i] for i in selected]
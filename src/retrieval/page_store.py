@@ -0,0 +1,156 @@
+"""
+小さいチャンクで検索し、親の範囲（前後のチャンク・ページ全体）に広げて回答生成に渡す（small-to-big）
+
+500文字のチャンクは埋め込みが的確な一方、回答に必要な前後の文脈が切れがちです。
+取り込み時にすべてのチャンクを (source, page, chunk_id) をキーにローカルのSQLiteに保存しておき、
+検索でヒットしたチャンクを親の範囲の本文に置き換えます（ベクトル検索やAPI呼び出しを追加しません）。
+"""
+import os
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.generation.context import merge_overlapping
+
+# 親の範囲の種類
+PARENT_NONE = "none"
+PARENT_WINDOW = "window"  # ヒットしたチャンクの前後 radius 個
+PARENT_PAGE = "page"  # ページ全体
+PARENT_MODES = (PARENT_NONE, PARENT_WINDOW, PARENT_PAGE)
+
+
+def page_store_path(storage_path: str, collection_name: str) -> str:
+    """コレクションに対応するページストアの保存先"""
+    return os.path.join(storage_path, "pages", f"{collection_name}.db")
+
+
+class PageStore:
+    """(source, page) ごとのチャンク本文を chunk_id 順に保持するSQLiteストア"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS chunks (
+                source TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (source, page, chunk_id)
+            )""")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def replace_source(self, source: str, chunks: Sequence[Dict]):
+        """文書のチャンクを置き換える（chunks が空の場合は削除）"""
+        rows = [(source, c["metadata"]["page"], c["metadata"]["chunk_id"], c["content"]) for c in chunks
+                if c["metadata"].get("page") is not None and c["metadata"].get("chunk_id") is not None]
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def source_count(self) -> int:
+        """保存している文書（source）の数"""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(DISTINCT source) FROM chunks").fetchone()[0]
+
+    def sources(self) -> set:
+        """保存している文書（source）"""
+        with closing(self._connect()) as conn:
+            return {row[0] for row in conn.execute("SELECT DISTINCT source FROM chunks")}
+
+    def page_chunks(self, source: str, page: int) -> List[Tuple[int, str]]:
+        """ページの (chunk_id, 本文) を chunk_id 順に"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT chunk_id, content FROM chunks WHERE source = ? AND page = ? ORDER BY chunk_id",
+                (source, page)
+            ).fetchall()
+
+
+def _join(contents: Sequence[str]) -> str:
+    text = contents[0]
+    for content in contents[1:]:
+        text = merge_overlapping(text, content)
+    return text
+
+
+def expand_results(results: List[Dict], store: PageStore, mode: str = PARENT_WINDOW,
+                   radius: int = 1) -> List[Dict]:
+    """
+    検索結果を親の範囲の本文に広げる
+
+    同じページで範囲が重なる・隣り合う結果は、先に現れた（関連度の高い）結果に1つにまとめます。
+    ページストアに記録がない結果（ページストア導入前に取り込んだ文書など）はそのまま返します。
+
+    Args:
+        results: 関連度の高い順の検索結果（metadata に source, page, chunk_id）
+        store: ページストア
+        mode: "window"（前後 radius 個のチャンク）または "page"（ページ全体）
+        radius: "window" の場合の前後のチャンク数
+
+    Returns:
+        本文を親の範囲に置き換えた結果（元のチャンクは "chunk_content"、範囲は metadata の "parent_range"）
+    """
+    if mode == PARENT_NONE:
+        return results
+
+    page_cache: Dict[Tuple[str, int], List[Tuple[int, str]]] = {}
+    expanded: List[Dict] = []
+    ranges: List[Optional[Tuple[str, int, int, int]]] = []  # expanded と同じ順の (source, page, 開始, 終了)
+
+    for result in results:
+        metadata = result["metadata"]
+        source, page, chunk_id = metadata.get("source"), metadata.get("page"), metadata.get("chunk_id")
+        if source is None or page is None or chunk_id is None:
+            expanded.append(result)
+            ranges.append(None)
+            continue
+
+        key = (source, page)
+        if key not in page_cache:
+            page_cache[key] = store.page_chunks(source, page)
+        chunks = page_cache[key]
+        if not chunks:
+            expanded.append(result)
+            ranges.append(None)
+            continue
+
+        if mode == PARENT_PAGE:
+            start, end = chunks[0][0], chunks[-1][0]
+        else:
+            start, end = chunk_id - radius, chunk_id + radius
+
+        # 同じページで重なる・隣り合う範囲があればまとめる
+        merged = False
+        for i, existing in enumerate(ranges):
+            if existing and existing[:2] == key and start <= existing[3] + 1 and end >= existing[2] - 1:
+                ranges[i] = (source, page, min(start, existing[2]), max(end, existing[3]))
+                expanded[i]["merged_hits"] = expanded[i].get("merged_hits", 1) + 1
+                merged = True
+                break
+        if merged:
+            continue
+        expanded.append(dict(result, chunk_content=result["content"]))
+        ranges.append((source, page, start, end))
+
+    for result, parent in zip(expanded, ranges):
+        if parent is None:
+            continue
+        source, page, start, end = parent
+        window = [(chunk_id, content) for chunk_id, content in page_cache[(source, page)]
+                  if start <= chunk_id <= end]
+        if window:
+            result["content"] = _join([content for _, content in window])
+            result["metadata"] = dict(result["metadata"], parent_range=f"{window[0][0]}-{window[-1][0]}")
+    return expanded
@@ -0,0 +1,187 @@
+"""
+会話履歴を使った質問の書き換え（追加質問を単独で意味の通る検索クエリにする）
+
+「それについてもっと詳しく」のような追加質問は、そのままベクトル検索すると無関係なチャンクが返ります。
+直近 N 往復の会話から、指示語を具体的な語に置き換えた単独の質問をLLMで生成して検索に使います。
+
+- 指示語・省略のない質問は書き換えずにそのまま使います（LLMを呼ばない簡易判定）
+- 結果は（会話履歴のダイジェスト, 質問）をキーにプロセス内でキャッシュします
+- 失敗・タイムアウトした場合は元の質問で検索します
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger("query_rewrite")
+
+# 前の会話を指す語（これらを含む質問は単独では意味が通らない可能性がある）
+_REFERENCE_PATTERN = re.compile(
+    r"(それ|その|そこ|そう|これ|この|ここ|こう|あれ|あの|あそこ|彼|彼女|同じ|他に|ほかに|もっと|詳しく|"
+    r"続き|さっき|先ほど|前の|上記|今の|具体的に|例えば)"
+    r"|\b(it|its|this|that|these|those|they|them|he|she|more)\b",
+    re.IGNORECASE
+)
+
+# この文字数（空白を除く）未満の質問は省略が多いとみなす
+SHORT_QUERY_CHARS = 8
+
+# 書き換えプロンプトに含めるアシスタントの回答の最大文字数
+_ANSWER_PREVIEW_CHARS = 300
+
+
+class RewriteResult(NamedTuple):
+    """書き換えの結果"""
+    query: str  # 検索に使う質問
+    rewritten: bool  # 書き換えたか
+    cached: bool  # キャッシュから返したか
+
+
+def recent_turns(history: List[Dict], turns: int) -> List[Dict]:
+    """直近 turns 往復（user / assistant のメッセージ）"""
+    messages = [m for m in history if m.get('role') in ('user', 'assistant') and m.get('content')]
+    return messages[-turns * 2:] if turns > 0 else []
+
+
+def needs_rewrite(query: str, history: List[Dict]) -> bool:
+    """会話履歴があり、質問が指示語を含むか短い場合に書き換える"""
+    if not history:
+        return False
+    if len("".join(query.split())) < SHORT_QUERY_CHARS:
+        return True
+    return bool(_REFERENCE_PATTERN.search(query))
+
+
+def history_digest(history: List[Dict]) -> str:
+    """会話履歴のダイジェスト（キャッシュキー用）"""
+    digest = hashlib.sha256()
+    for message in history:
+        digest.update(f"{message['role']}\x00{message['content']}\x01".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RewriteCache:
+    """（履歴のダイジェスト, 質問）をキーにした書き換え結果のLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: tuple, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_default_cache: Optional[RewriteCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_rewrite_cache() -> RewriteCache:
+    """プロセス内で共有する書き換えキャッシュ"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            from src.config import settings
+
+            _default_cache = RewriteCache(settings.retrieval.query_rewrite_cache_size)
+        return _default_cache
+
+
+def build_rewrite_prompt(query: str, history: List[Dict]) -> str:
+    """書き換え用のプロンプト"""
+    lines = []
+    for message in history:
+        content = " ".join(message['content'].split())
+        if message['role'] == 'assistant':
+            content = content[:_ANSWER_PREVIEW_CHARS]
+            lines.append(f"アシスタント: {content}")
+        else:
+            lines.append(f"ユーザー: {content}")
+    conversation = "\n".join(lines)
+    return f"""以下の会話の続きとして、ユーザーが最後の質問をしました。
+会話を読まなくても意味が通じるよう、指示語や省略を具体的な語に置き換えた単独の質問に書き換えてください。
+既に単独で意味が通じる場合はそのまま返してください。書き換えた質問だけを1行で出力してください。
+
+【会話】
+{conversation}
+
+【最後の質問】
+{query}
+
+【書き換えた質問】"""
+
+
+def _clean(text: str) -> str:
+    """LLMの出力から質問の1行を取り出す"""
+    for line in text.strip().splitlines():
+        line = line.strip().strip('「」"\'').strip()
+        if line:
+            return line
+    return ""
+
+
+def _default_generate(prompt: str, timeout: Optional[float]) -> str:
+    """生成モデルで書き換え（任意の処理のため再試行しない）"""
+    from src.config import settings
+    from src.pipeline.resources import get_api_handler, get_pipeline_resources
+    from src.utils.deadline import Deadline
+
+    model_name = settings.generation.model
+    model = get_pipeline_resources().generation_model(model_name)
+    handler = get_api_handler(model_name, deadline=Deadline(timeout) if timeout is not None else None,
+                              max_retries=1, max_queue_wait=2.0)
+    return handler.execute(model.generate_content, prompt).text
+
+
+def rewrite_query(query: str, history: List[Dict], turns: int = 3, timeout: Optional[float] = None,
+                  generate: Callable[[str, Optional[float]], str] = None,
+                  cache: Optional[RewriteCache] = None) -> RewriteResult:
+    """
+    追加質問を直近の会話から単独の質問に書き換える
+
+    Args:
+        query: ユーザーの最新の質問
+        history: それ以前の会話（古い順、各要素は role, content）
+        turns: 参照する直近の往復数
+        timeout: 書き換えに使える秒数
+        generate: (プロンプト, タイムアウト) を受け取り生成テキストを返す関数（Noneの場合は生成モデル）
+        cache: 書き換えキャッシュ（Noneの場合はプロセス内で共有するキャッシュ）
+
+    Returns:
+        RewriteResult（書き換えない・失敗した場合は元の質問）
+    """
+    history = recent_turns(history, turns)
+    if not needs_rewrite(query, history):
+        return RewriteResult(query, False, False)
+    if timeout is not None and timeout <= 0:
+        return RewriteResult(query, False, False)
+
+    cache = cache if cache is not None else get_rewrite_cache()
+    key = (history_digest(history), query)
+    cached = cache.get(key)
+    if cached is not None:
+        return RewriteResult(cached, cached != query, True)
+
+    try:
+        rewritten = _clean((generate or _default_generate)(build_rewrite_prompt(query, history), timeout))
+    except Exception as e:
+        logger.warning(f"質問の書き換えに失敗したため元の質問で検索します: {e}")
+        return RewriteResult(query, False, False)
+
+    rewritten = rewritten or query
+    cache.put(key, rewritten)
+    return RewriteResult(rewritten, rewritten != query, False)
@@ -5,21 +5,23 @@ LLMを使用した検索結果のリランキング機能
 最も関連性の高いものを上位に選出します。
 """
 
-import os
-from typing import List, Dict, Tuple
-import google.generativeai as genai
-from dotenv import load_dotenv
+from typing import List, Dict, Optional, Tuple
 
-# 環境変数の読み込み
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+from src.pipeline.resources import get_api_handler, get_pipeline_resources
+from src.utils.deadline import Deadline
+
+
+def _generative_model(model_name: str):
+    """プロセス内で共有する生成モデルを返す（google.generativeai は初回呼び出し時に読み込み）"""
+    return get_pipeline_resources().generation_model(model_name)
 
 
 def rerank_with_llm(
     query: str,
     search_results: List[Dict],
     top_k: int = 20,
-    model_name: str = "gemini-2.0-flash-exp"
+    model_name: str = "gemini-2.0-flash-exp",
+    timeout: Optional[float] = None
 ) -> List[Dict]:
     """
     LLMを使用して検索結果をリランキングする
@@ -29,6 +31,7 @@ def rerank_with_llm(
         search_results: ベクトル検索の結果リスト
         top_k: 返す上位件数（デフォルト: 20）
         model_name: 使用するモデル名
+        timeout: リランキングに使える秒数（超過した場合はベクトル検索の順序を返す）
 
     Returns:
         リランキングされた検索結果のリスト（上位top_k件）
@@ -39,8 +42,11 @@ def rerank_with_llm(
     if len(search_results) <= top_k:
         return search_results
 
+    if timeout is not None and timeout <= 0:
+        return search_results[:top_k]
+
     # LLMに渡すプロンプトを構築
-    model = genai.GenerativeModel(model_name)
+    model = _generative_model(model_name)
 
     # 各結果に番号を付けて提示
     candidates_text = "\n\n".join([
@@ -61,8 +67,11 @@ def rerank_with_llm(
 回答:"""
 
     try:
-        # LLMに評価させる
-        response = model.generate_content(prompt)
+        # LLMに評価させる（リランキングは任意の処理のため再試行せず、
+        # レート制限中・APIが一時停止中の場合はすぐにベクトル検索の順序へフォールバック）
+        handler = get_api_handler(model_name, deadline=Deadline(timeout) if timeout is not None else None,
+                                  max_retries=1, max_queue_wait=5.0)
+        response = handler.execute(model.generate_content, prompt)
         ranking_text = response.text.strip()
 
         # 番号を抽出（カンマ区切り、改行区切りなどに対応）
@@ -113,7 +122,7 @@ def evaluate_relevance_batch(
     if not search_results:
         return []
 
-    model = genai.GenerativeModel(model_name)
+    model = _generative_model(model_name)
 
     # 各結果に番号を付けて提示
     candidates_text = "\n\n".join([
@@ -1,20 +1,21 @@
 import os
 import sys
-from typing import List, Dict
-import chromadb
-from chromadb.utils import embedding_functions
-from dotenv import load_dotenv
+from typing import List, Dict, Optional
 
 # Windows環境でのエンコーディングエラー対策
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding='utf-8')
 
-load_dotenv()
-
 # 設定のインポート
 from src.config import settings
-
-def semantic_search(query: str, storage_path: str = None, top_k: int = None) -> List[Dict]:
+from src.embedding.model_info import embedding_model_for
+from src.pipeline.aliases import resolve_collection
+from src.pipeline.resources import get_pipeline_resources
+from src.utils.deadline import Deadline, call_with_deadline
+
+def semantic_search(query: str, storage_path: str = None, top_k: int = None,
+                    deadline: Optional[Deadline] = None, include_embeddings: bool = False,
+                    collection_name: str = None, where: Optional[Dict] = None) -> List[Dict]:
     """
     ベクトル検索を実行し、結果を辞書のリストとして返す
 
@@ -22,6 +23,10 @@ def semantic_search(query: str, storage_path: str = None, top_k: int = None) ->
         query: 検索クエリ
         storage_path: ChromaDBの保存パス（Noneの場合は設定から取得）
         top_k: 取得する結果の件数（Noneの場合は設定から取得）
+        deadline: リクエストのレイテンシ予算（超過した場合はDeadlineExceeded）
+        include_embeddings: 各結果にチャンクの埋め込み（"embedding"）を含める（MMRによる選択用）
+        collection_name: 検索するコレクション（Noneの場合は設定から取得。テナントごとのコレクション用）
+        where: メタデータによる絞り込み（Chromaのwhere条件。量子化インデックスの検索にも適用）
 
     Returns:
         検索結果のリスト（各要素は content, metadata, distance を含む辞書）
@@ -35,27 +40,48 @@ def semantic_search(query: str, storage_path: str = None, top_k: int = None) ->
     if not api_key:
         raise ValueError("GOOGLE_API_KEY not found in .env file.")
 
-    # ChromaDBの初期化
-    client = chromadb.PersistentClient(path=storage_path)
-
-    # Google Gemini Embedding関数
-    gemini_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
-        api_key=api_key,
-        model_name=settings.embedding.model,
-        task_type=settings.embedding.task_type_query
-    )
-
-    collection_name = settings.storage.collection_name
-    collection = client.get_collection(
-        name=collection_name,
-        embedding_function=gemini_ef
-    )
-
-    # 検索実行
-    results = collection.query(
-        query_texts=[query],
-        n_results=top_k
-    )
+    # クライアント・埋め込み関数・コレクションはプロセス内で共有（リクエストごとに作り直さない）
+    resources = get_pipeline_resources()
+    # 再構築で切り替わる論理名は、この時点で使用中の版に解決（1回の検索の中では同じ版を読む）
+    collection_name = resolve_collection(storage_path, collection_name or settings.storage.collection_name)
+    collection = resources.collection(storage_path, collection_name,
+                                      task_type=settings.embedding.task_type_query)
+    # クエリは保存済みのベクトルと同じモデルで埋め込む（埋め込みモデルの移行中は旧版のモデル）
+    gemini_ef = resources.embedding_function(settings.embedding.task_type_query, embedding_model_for(collection))
+
+    # 学習済みの量子化インデックスがあればそちらで検索（学習に必要な件数に達するまではChromaで検索）
+    if settings.storage.vector_quantization != "none":
+        from src.embedding.quantization import QuantizedIndex, load_quantized_index, quantized_index_dir
+
+        index_dir = quantized_index_dir(storage_path, collection_name)
+        if QuantizedIndex.exists(index_dir) and load_quantized_index(index_dir).is_trained:
+            if deadline is not None:
+                search_results = call_with_deadline(
+                    lambda: _quantized_search(query, collection, gemini_ef, index_dir, top_k,
+                                              include_embeddings, where),
+                    timeout=deadline.remaining()
+                )
+            else:
+                search_results = _quantized_search(query, collection, gemini_ef, index_dir, top_k,
+                                                   include_embeddings, where)
+            return _collapse_duplicates(search_results, storage_path, collection_name)
+
+    # 検索実行（クエリの埋め込みにAPI呼び出しを含むため、予算があれば打ち切れるようにする）
+    def run_query():
+        include = ["documents", "metadatas", "distances"]
+        if include_embeddings:
+            include.append("embeddings")
+        return collection.query(
+            query_texts=[query],
+            n_results=top_k,
+            where=where,
+            include=include
+        )
+
+    if deadline is not None:
+        results = call_with_deadline(run_query, timeout=deadline.remaining())
+    else:
+        results = run_query()
 
     # 結果を整形
     search_results = []
@@ -65,14 +91,89 @@ def semantic_search(query: str, storage_path: str = None, top_k: int = None) ->
             "metadata": results["metadatas"][0][i],
             "distance": results["distances"][0][i]
         })
+        if include_embeddings:
+            search_results[-1]["embedding"] = results["embeddings"][0][i]
+
+    return _collapse_duplicates(search_results, storage_path, collection_name)
+
+
+def _collapse_duplicates(search_results: List[Dict], storage_path: str,
+                         collection_name: str) -> List[Dict]:
+    """
+    ほぼ重複したチャンクのグループごとに検索結果をまとめ、他の出典を "duplicates" に付ける
+    """
+    if not settings.ingestion.dedup_enabled:
+        return search_results
+
+    from src.ingestion.dedup import DedupIndex, collapse_duplicates, dedup_index_path
+
+    index_path = dedup_index_path(storage_path, collection_name)
+    index = DedupIndex(index_path) if os.path.exists(index_path) else None
+    return collapse_duplicates(search_results, index)
+
+
+def _quantized_search(query: str, collection, embedding_function, index_dir: str,
+                      top_k: int, include_embeddings: bool = False,
+                      where: Optional[Dict] = None) -> List[Dict]:
+    """
+    量子化インデックスで近傍IDを求め、本文とメタデータをChromaから取得する
 
+    where を指定した場合は、条件に合うIDだけをスコアリングの対象にします。
+    """
+    from src.embedding.quantization import load_quantized_index
+
+    allowed_ids = None
+    if where:
+        allowed_ids = collection.get(where=where, include=[])["ids"]
+        if not allowed_ids:
+            return []
+    query_embedding = embedding_function([query])[0]
+    index = load_quantized_index(index_dir)
+    hits = index.search(
+        query_embedding, top_k,
+        rescore_k=top_k * settings.retrieval.quantization_rescore_factor,
+        allowed_ids=allowed_ids
+    )
+    if not hits:
+        return []
+
+    include = ["documents", "metadatas"]
+    if include_embeddings:
+        include.append("embeddings")
+    fetched = collection.get(ids=[hit_id for hit_id, _ in hits], include=include)
+    records = {
+        fetched["ids"][i]: (fetched["documents"][i], fetched["metadatas"][i],
+                            fetched["embeddings"][i] if include_embeddings else None)
+        for i in range(len(fetched["ids"]))
+    }
+
+    search_results = []
+    for hit_id, distance in hits:
+        if hit_id not in records:
+            continue
+        document, metadata, embedding = records[hit_id]
+        search_results.append({
+            "content": document,
+            "metadata": metadata,
+            "distance": distance
+        })
+        if include_embeddings:
+            search_results[-1]["embedding"] = embedding
     return search_results
 
 
+def _print_duplicates(result: Dict):
+    """同じ内容の他の出典を表示"""
+    duplicates = result.get("duplicates")
+    if duplicates:
+        others = ", ".join(f"{d['source']} (Page {d['page']})" for d in duplicates)
+        print(f"Also in: {others}")
+
+
 def search_db(query: str, storage_path: str, n_results: int = 3, use_reranking: bool = False,
               initial_k: int = 100, final_k: int = 20):
     """
-    クエリに対して類似度の高いチャンクをベクトルDBから検索します。
+    クエリに対して類似度の高いチャンクをベクトルDBから検索します（回答生成と同じエンジンの検索段階まで）。
 
     Args:
         query: 検索クエリ
@@ -82,48 +183,34 @@ def search_db(query: str, storage_path: str, n_results: int = 3, use_reranking:
         initial_k: リランキング使用時の初期取得件数
         final_k: リランキング後に残す件数
     """
-    if use_reranking:
-        # リランキングを使用する場合
-        from reranker import rerank_with_llm
-
-        # まず広めに取得
-        initial_results = semantic_search(query, storage_path, top_k=initial_k)
+    from src.pipeline.engine import build_pipeline
 
-        # LLMでリランキング
-        reranked_results = rerank_with_llm(query, initial_results, top_k=final_k)
+    # リランキングしない場合は表示する件数だけを取得（ヒットしたチャンクをそのまま表示）
+    pipeline = build_pipeline(n_results=n_results, initial_k=initial_k if use_reranking else n_results,
+                              final_k=final_k, rerank=use_reranking, mmr_lambda=1.0, parent_mode="none",
+                              rewrite=False, generate=False)
+    context = pipeline.run(query, storage_path)
+    counts = context.result_counts
 
-        results_to_show = reranked_results[:n_results]
-
-        print(f"\n🔍 Query: {query}")
-        print(f"📊 初期取得: {len(initial_results)}件 → リランキング後: {len(reranked_results)}件 → 表示: {len(results_to_show)}件")
-        print("-" * 50)
-
-        for i, result in enumerate(results_to_show, 1):
-            doc = result["content"]
-            meta = result["metadata"]
-            dist = result.get("distance", 0)
-            rerank_score = result.get("rerank_score", "N/A")
-
-            print(f"Result {i} (Distance: {dist:.4f}, Rerank Score: {rerank_score})")
-            print(f"Source: {meta['source']} (Page {meta['page']})")
-            print(f"Content: {doc[:300]}...")
-            print("-" * 50)
-    else:
-        # 通常のベクトル検索のみ
-        results = semantic_search(query, storage_path, top_k=n_results)
-
-        print(f"\n🔍 Query: {query}")
-        print("-" * 50)
+    print(f"\n🔍 Query: {query}")
+    if use_reranking:
+        print(f"📊 初期取得: {counts['search']}件 → リランキング後: {counts['rerank']}件 → 表示: {counts['select']}件")
+    print("-" * 50)
 
-        for i, result in enumerate(results, 1):
-            doc = result["content"]
-            meta = result["metadata"]
-            dist = result["distance"]
+    for i, result in enumerate(context.results, 1):
+        doc = result["content"]
+        meta = result["metadata"]
+        dist = result.get("distance", 0)
 
+        if use_reranking:
+            print(f"Result {i} (Distance: {dist:.4f}, Rerank Score: {result.get('rerank_score', 'N/A')})")
+        else:
             print(f"Result {i} (Distance: {dist:.4f})")
-            print(f"Source: {meta['source']} (Page {meta['page']})")
-            print(f"Content: {doc[:300]}...")
-            print("-" * 50)
+        print(f"Source: {meta['source']} (Page {meta['page']})")
+        _print_duplicates(result)
+        print(f"Content: {doc[:300]}...")
+        print("-" * 50)
+    return context.results
 
 if __name__ == "__main__":
     storage_dir = "storage/chroma"
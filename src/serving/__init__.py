@@ -0,0 +1,9 @@
+__all__ = ["create_server"]
+
+
+def __getattr__(name):
+    # http.server の読み込みを避けるため、page_render だけを使う場合はサーバーをインポートしない
+    if name == "create_server":
+        from .pdf_server import create_server
+        return create_server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,195 @@
+"""
+PDFの1ページを画像にレンダリングし、ディスク上のLRUキャッシュに保存する機能
+
+PDF配信サーバーの /render/ エンドポイントと、回答生成後の引用ページの事前レンダリングで
+同じキャッシュディレクトリを共有します（別プロセスからでも再利用可能）。
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from src.utils.logger import setup_logger
+
+logger = setup_logger("page_render")
+
+# 対応フォーマットとContent-Type
+IMAGE_FORMATS = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+MIN_DPI = 36
+MAX_DPI = 300
+
+
+class PageRenderCache:
+    """
+    レンダリング済みページのディスクキャッシュ（合計サイズ上限付きLRU）
+
+    ヒット時にファイルの更新時刻を更新し、上限を超えたら更新時刻の古いものから削除します。
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str, fmt: str) -> Path:
+        return self.cache_dir / f"{key}.{fmt}"
+
+    def get(self, key: str, fmt: str) -> Optional[Path]:
+        """キャッシュを参照（ヒットしたら最終利用時刻を更新）"""
+        path = self.path_for(key, fmt)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, fmt: str, data: bytes) -> Path:
+        """キャッシュに保存（一時ファイル経由で置き換え、上限を超えたら古いものを削除）"""
+        path = self.path_for(key, fmt)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """合計サイズが上限以下になるまで最終利用時刻の古いものから削除"""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                stat_result = entry.stat()
+                entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+                total += stat_result.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+    def total_bytes(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+
+
+def render_page(pdf_path: str, page: int, dpi: int = 110, fmt: str = "webp") -> bytes:
+    """
+    PDFの1ページを画像にレンダリング
+
+    Args:
+        pdf_path: PDFファイルのパス
+        page: ページ番号（1始まり）
+        dpi: 解像度
+        fmt: 'png' / 'webp' / 'jpeg'
+
+    Returns:
+        画像のバイト列
+    """
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as doc:
+        if not 1 <= page <= len(doc):
+            raise ValueError(f"ページ番号が範囲外です: {page} (全{len(doc)}ページ)")
+        pixmap = doc[page - 1].get_pixmap(dpi=dpi)
+        if fmt == "png":
+            return pixmap.tobytes("png")
+        # WebP / JPEG は Pillow 経由で変換
+        return pixmap.pil_tobytes(format="WEBP" if fmt == "webp" else "JPEG", quality=80)
+
+
+class PageRenderer:
+    """
+    キャッシュ付きのページレンダラー
+
+    同じページへの同時リクエストは1回だけレンダリングします。
+    """
+    def __init__(self, pdf_dir: str, cache: PageRenderCache):
+        self.pdf_dir = os.path.abspath(pdf_dir)
+        self.cache = cache
+        self._key_locks = {}
+        self._locks_guard = threading.Lock()
+
+    def resolve_pdf(self, source: str) -> Optional[str]:
+        """ソース名を配信ディレクトリ内のPDFパスに変換（ディレクトリ外・存在しない場合はNone）"""
+        path = os.path.abspath(os.path.join(self.pdf_dir, source))
+        if not path.startswith(self.pdf_dir + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    @staticmethod
+    def cache_key(pdf_path: str, page: int, dpi: int, fmt: str) -> str:
+        """PDFの内容が変われば（サイズ・更新時刻）キーも変わる"""
+        stat_result = os.stat(pdf_path)
+        raw = f"{os.path.basename(pdf_path)}|{stat_result.st_size}|{stat_result.st_mtime_ns}|{page}|{dpi}|{fmt}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_or_render(self, source: str, page: int, dpi: int = 110,
+                      fmt: str = "webp") -> Tuple[Path, str]:
+        """
+        レンダリング済みページのパスを返す（キャッシュになければレンダリング）
+
+        Returns:
+            (画像ファイルのパス, キャッシュキー)
+
+        Raises:
+            FileNotFoundError: PDFが存在しない場合
+            ValueError: ページ番号・フォーマットが不正な場合
+        """
+        if fmt not in IMAGE_FORMATS:
+            raise ValueError(f"未対応のフォーマットです: {fmt}")
+        dpi = min(max(int(dpi), MIN_DPI), MAX_DPI)
+        pdf_path = self.resolve_pdf(source)
+        if pdf_path is None:
+            raise FileNotFoundError(f"PDFが見つかりません: {source}")
+
+        key = self.cache_key(pdf_path, page, dpi, fmt)
+        cached = self.cache.get(key, fmt)
+        if cached is not None:
+            return cached, key
+
+        with self._locks_guard:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            cached = self.cache.get(key, fmt)
+            if cached is None:
+                cached = self.cache.put(key, fmt, render_page(pdf_path, page, dpi, fmt))
+        with self._locks_guard:
+            self._key_locks.pop(key, None)
+        return cached, key
+
+
+# 事前レンダリング用のワーカー（回答生成の応答時間に影響しないようバックグラウンドで実行）
+_prerender_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prerender")
+
+
+def prerender_pages(renderer: PageRenderer, pages: Iterable[Tuple[str, int]],
+                    dpi: int = 110, fmt: str = "webp"):
+    """
+    引用されたページをバックグラウンドでレンダリングしてキャッシュに載せる
+
+    Args:
+        renderer: ページレンダラー
+        pages: (ソース名, ページ番号) のリスト
+    """
+    def _render(source: str, page: int):
+        try:
+            renderer.get_or_render(source, page, dpi, fmt)
+        except Exception as e:
+            logger.debug(f"事前レンダリングをスキップ: {source} p.{page}: {e}")
+
+    for source, page in dict.fromkeys(pages):
+        _prerender_executor.submit(_render, source, int(page))
@@ -0,0 +1,264 @@
+"""
+PDF配信用HTTPサーバー
+
+- スレッド化（ThreadingHTTPServer）: 遅いクライアントが他のリクエストをブロックしない
+- HTTP Range対応: ブラウザのPDFビューアが必要な範囲だけを取得できる（#page=N の高速表示）
+- ETag / Last-Modified による条件付きリクエスト（304）とキャッシュ可能なCache-Control
+- socket.sendfile によるゼロコピー転送（未対応のOSでは通常の送信にフォールバック）
+- /render/<PDF名>?page=N&dpi=110&format=webp : 1ページだけを画像で返す（キャッシュ付き）
+"""
+import email.utils
+import mimetypes
+import os
+import posixpath
+import re
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from src.serving.page_render import IMAGE_FORMATS, PageRenderCache, PageRenderer
+
+DEFAULT_PORT = 8503
+DEFAULT_DIRECTORY = "data/raw"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600, must-revalidate"
+RENDER_PREFIX = "/render/"
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """ファイルサイズと更新時刻からETagを生成"""
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Rangeヘッダを解析して (開始, 終了) を返す（終了は含む）
+
+    単一範囲のみ対応します。複数範囲や解釈できない指定はNone（全体を返す）、
+    満たせない範囲はValueErrorを送出します。
+    """
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    start_text, end_text = match.groups()
+    if not start_text and not end_text:
+        return None
+
+    if not start_text:
+        # bytes=-N : 末尾Nバイト
+        length = int(end_text)
+        if length == 0:
+            raise ValueError("unsatisfiable range")
+        return max(size - length, 0), size - 1
+
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or end < start:
+        raise ValueError("unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+class PDFRequestHandler(BaseHTTPRequestHandler):
+    """data/raw 以下のファイルを Range / 条件付きリクエスト対応で配信するハンドラ"""
+
+    server_version = "MiniNotebookPDF/1.0"
+    protocol_version = "HTTP/1.1"
+    directory = DEFAULT_DIRECTORY
+    cache_control = DEFAULT_CACHE_CONTROL
+    renderer: Optional[PageRenderer] = None
+    default_dpi = 110
+    default_format = "webp"
+
+    def do_GET(self):
+        self._dispatch(send_body=True)
+
+    def do_HEAD(self):
+        self._dispatch(send_body=False)
+
+    def _dispatch(self, send_body: bool):
+        if urlsplit(self.path).path.startswith(RENDER_PREFIX):
+            self._serve_rendered_page(send_body)
+        else:
+            path = self.translate_path(self.path)
+            if path is None or not os.path.isfile(path):
+                self._send_error(HTTPStatus.NOT_FOUND)
+                return
+            self._send_file(path, send_body)
+
+    def do_OPTIONS(self):
+        """CORSプリフライト"""
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def end_headers(self):
+        # CORSヘッダーを追加（Rangeリクエストを別オリジンのビューアから使えるように）
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Range, If-None-Match, If-Modified-Since")
+        self.send_header("Access-Control-Expose-Headers",
+                         "Accept-Ranges, Content-Length, Content-Range, ETag")
+        super().end_headers()
+
+    def translate_path(self, path: str) -> Optional[str]:
+        """URLパスを配信ディレクトリ内のファイルパスに変換（ディレクトリ外はNone）"""
+        path = unquote(urlsplit(path).path)
+        path = posixpath.normpath(path).lstrip("/")
+        root = os.path.abspath(self.directory)
+        full_path = os.path.abspath(os.path.join(root, *path.split("/")))
+        if full_path != root and not full_path.startswith(root + os.sep):
+            return None
+        return full_path
+
+    def _send_error(self, status: HTTPStatus, extra_headers: dict = None):
+        body = f"{status.value} {status.phrase}".encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        """If-None-Match / If-Modified-Since を評価"""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def _serve_rendered_page(self, send_body: bool):
+        """1ページをレンダリングした画像を返す"""
+        if self.renderer is None:
+            self._send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        url = urlsplit(self.path)
+        source = unquote(url.path[len(RENDER_PREFIX):])
+        query = parse_qs(url.query)
+        try:
+            page = int(query.get("page", ["1"])[0])
+            dpi = int(query.get("dpi", [str(self.default_dpi)])[0])
+        except ValueError:
+            self._send_error(HTTPStatus.BAD_REQUEST)
+            return
+        fmt = query.get("format", [self.default_format])[0].lower()
+
+        try:
+            path, key = self.renderer.get_or_render(source, page, dpi, fmt)
+        except FileNotFoundError:
+            self._send_error(HTTPStatus.NOT_FOUND)
+            return
+        except ValueError:
+            self._send_error(HTTPStatus.BAD_REQUEST)
+            return
+        # キャッシュファイルの更新時刻はLRUのために変わるため、ETagにはキャッシュキーを使う
+        self._send_file(str(path), send_body, content_type=IMAGE_FORMATS[fmt], etag=f'"{key}"')
+
+    def _send_file(self, path: str, send_body: bool, content_type: str = None,
+                   etag: str = None):
+        with open(path, "rb") as f:
+            stat_result = os.fstat(f.fileno())
+            size = stat_result.st_size
+            etag = etag or make_etag(stat_result)
+            last_modified = email.utils.formatdate(stat_result.st_mtime, usegmt=True)
+            validators = {"ETag": etag, "Last-Modified": last_modified,
+                          "Cache-Control": self.cache_control}
+
+            if self._not_modified(etag, stat_result.st_mtime):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                for name, value in validators.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+
+            # If-Range が一致しない場合はRangeを無視して全体を返す
+            byte_range = None
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    self._send_error(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+                                     {"Content-Range": f"bytes */{size}"})
+                    return
+
+            if byte_range is None:
+                start, end = 0, size - 1
+                self.send_response(HTTPStatus.OK)
+            else:
+                start, end = byte_range
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+
+            length = max(end - start + 1, 0)
+            content_type = (content_type or mimetypes.guess_type(path)[0]
+                            or "application/octet-stream")
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            for name, value in validators.items():
+                self.send_header(name, value)
+            self.end_headers()
+
+            if send_body and length > 0:
+                try:
+                    # ゼロコピー転送（os.sendfile が使えない環境では内部で通常送信にフォールバック）
+                    self.connection.sendfile(f, offset=start, count=length)
+                except (BrokenPipeError, ConnectionResetError):
+                    # ビューアが途中で接続を切るのは通常の動作
+                    self.close_connection = True
+
+    def log_message(self, format, *args):
+        # Range リクエストが大量に発生するため、標準エラー出力へのアクセスログは出さない
+        pass
+
+
+def create_server(directory: str = DEFAULT_DIRECTORY, port: int = DEFAULT_PORT,
+                  host: str = "", cache_control: str = DEFAULT_CACHE_CONTROL,
+                  page_cache_dir: Optional[str] = None,
+                  page_cache_max_bytes: int = 256 * 1024 * 1024,
+                  default_dpi: int = 110, default_format: str = "webp") -> ThreadingHTTPServer:
+    """
+    PDF配信サーバーを作成
+
+    Args:
+        directory: 配信するディレクトリ
+        port: 待ち受けポート（0の場合は空きポート）
+        host: 待ち受けアドレス
+        cache_control: Cache-Control ヘッダの値
+        page_cache_dir: ページ画像キャッシュのディレクトリ（Noneの場合は /render/ を無効化）
+        page_cache_max_bytes: ページ画像キャッシュの上限サイズ
+        default_dpi: /render/ の既定解像度
+        default_format: /render/ の既定フォーマット
+
+    Returns:
+        serve_forever() で起動できるサーバー
+    """
+    renderer = None
+    if page_cache_dir is not None:
+        renderer = PageRenderer(directory, PageRenderCache(page_cache_dir, page_cache_max_bytes))
+
+    handler = type("ConfiguredPDFRequestHandler", (PDFRequestHandler,), {
+        "directory": directory,
+        "cache_control": cache_control,
+        "renderer": renderer,
+        "default_dpi": default_dpi,
+        "default_format": default_format,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -25,6 +25,7 @@ class SearchResult(TypedDict):
     metadata: Dict[str, Any]
     distance: float
     rerank_score: Optional[float]
+    duplicates: List[Dict[str, Any]]  # 同じ内容の他の出典（source, page）
 
 
 class ProcessResult(TypedDict):
@@ -35,7 +36,12 @@ class ProcessResult(TypedDict):
     chunks_count: int
 
 
-class GenerateAnswerResult(TypedDict):
+class _GenerateAnswerTrace(TypedDict, total=False):
+    """回答生成結果のうち、成功時のみ含まれる項目"""
+    trace: Dict[str, Any]  # 各段階の所要時間（ミリ秒）など
+
+
+class GenerateAnswerResult(_GenerateAnswerTrace):
     """回答生成結果の型"""
     success: bool
     answer: str
@@ -48,6 +54,9 @@ class DBStatus(TypedDict):
     exists: bool
     document_count: int
     collections: List[str]
+    embedding_model: Optional[str]  # コレクションに記録された埋め込みモデル
+    embedding_dimensions: Optional[int]
+    model_mismatch: bool  # 記録されたモデルが現在の設定と異なる（移行が必要）
     error: Optional[str]
 
 
@@ -71,3 +80,34 @@ class ClearDatabaseResult(TypedDict):
     """データベースクリア結果の型"""
     success: bool
     message: str
+
+
+class WarmUpResult(TypedDict):
+    """ベクトルストアのウォームアップ結果の型"""
+    success: bool
+    elapsed_ms: float
+    document_count: int
+    error: str
+
+
+class IngestJob(TypedDict):
+    """取り込みジョブの型（JobQueueの1行）"""
+    id: int
+    filename: str
+    status: str  # 'queued' | 'running' | 'done' | 'failed'
+    stage: str  # 'queued' | 'extract' | 'chunk' | 'embed' | 'done'
+    progress: float  # 現在の段階の進捗（0〜1）
+    message: str
+    error: Optional[str]
+    chunks_count: int
+    embedded_count: int
+    stage_timings: Dict[str, Any]  # 段階ごとの所要時間（ミリ秒）とOCRの計測値
+    attempts: int
+
+
+class SubmitJobResult(TypedDict):
+    """取り込みジョブ登録結果の型"""
+    success: bool
+    message: str
+    filename: str
+    job_id: Optional[int]
@@ -1,31 +1,79 @@
 import os
 import sys
-import chromadb
-from chromadb.utils import embedding_functions
-import google.generativeai as genai
-from dotenv import load_dotenv
-from typing import Dict, List
+from typing import Dict, List, Optional
 import shutil
+from urllib.parse import quote
 
 # Add src to path for imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 from src.ingestion.extract import extract_text_from_pdf
 from src.ingestion.chunking import chunk_text, save_processed_data
+from src.ingestion.worker import get_job_queue, spawn_worker_daemon
 from src.embedding.store import store_embeddings
-from src.retrieval.search import semantic_search
-from src.retrieval.reranker import rerank_with_llm
+from src.embedding.model_info import EMBEDDING_DIMENSIONS_KEY, EMBEDDING_MODEL_KEY
 from src.utils.logger import setup_logger
-from src.utils.error_handler import handle_errors, APIRetryHandler, get_user_friendly_error_message
-from src.types import ProcessResult, GenerateAnswerResult, DBStatus, MultiplePDFProcessResult, ClearDatabaseResult
-
-load_dotenv()
+from src.utils.error_handler import handle_errors, get_user_friendly_error_message, TenantLimitExceeded
+from src.utils.deadline import Deadline
+from src.types import (ProcessResult, GenerateAnswerResult, DBStatus, MultiplePDFProcessResult,
+                       ClearDatabaseResult, WarmUpResult, IngestJob, SubmitJobResult)
+from src.config import settings
+from src.serving.page_render import PageRenderCache, PageRenderer, prerender_pages
+from src.pipeline.aliases import resolve_collection
+from src.pipeline.engine import build_pipeline
+from src.pipeline.resources import get_pipeline_resources
+from src.pipeline.tenants import (check_document_quota, clear_tenant, collection_name_for, is_default_tenant,
+                                  job_tenant, resolve_tenant, source_path_for, tenant_dirs)
+
+# chromadb / google.generativeai はインポートが重いため、各関数の初回呼び出し時に読み込みます
 
 # ロガーのセットアップ
 logger = setup_logger("streamlit_helpers")
 
-# APIリトライハンドラー
-retry_handler = APIRetryHandler(max_retries=3, backoff_factor=2.0)
+
+# 引用ページの事前レンダリング用（PDF配信サーバーとキャッシュディレクトリを共有）
+_page_renderer = None
+
+
+def get_page_renderer(raw_dir: str = "data/raw") -> PageRenderer:
+    """ページレンダラーを取得（初回のみ作成）"""
+    global _page_renderer
+    if _page_renderer is None:
+        cache = PageRenderCache(settings.storage.page_cache_dir,
+                                settings.storage.page_cache_max_mb * 1024 * 1024)
+        _page_renderer = PageRenderer(raw_dir, cache)
+    return _page_renderer
+
+
+def page_image_url(source: str, page: int) -> str:
+    """PDF配信サーバーでレンダリングされた1ページ画像のURL"""
+    return f"{settings.app.pdf_server_url}/render/{quote(source)}?page={page}"
+
+
+def _check_upload_size(uploaded_file) -> str:
+    """ファイルサイズをチェック（10MB制限）し、超えていればエラーメッセージを返す"""
+    file_size_mb = uploaded_file.size / (1024 * 1024)
+    if file_size_mb > 10:
+        logger.warning(f"ファイルサイズが大きすぎます: {file_size_mb:.2f}MB")
+        return f'ファイルサイズが大きすぎます（{file_size_mb:.2f}MB）。10MB以下のファイルをアップロードしてください。'
+    return ""
+
+
+def _save_uploaded_pdf(uploaded_file, raw_dir: str, static_dir: str = "static") -> str:
+    """アップロードされたPDFを raw_dir と static_dir（ブラウザ閲覧用）に保存してパスを返す"""
+    os.makedirs(raw_dir, exist_ok=True)
+    os.makedirs(static_dir, exist_ok=True)
+    pdf_path = os.path.join(raw_dir, uploaded_file.name)
+    static_pdf_path = os.path.join(static_dir, uploaded_file.name)
+
+    logger.debug(f"PDFを保存: {pdf_path}")
+    with open(pdf_path, "wb") as f:
+        f.write(uploaded_file.getbuffer())
+
+    # staticフォルダにも保存（ブラウザ閲覧用）
+    with open(static_pdf_path, "wb") as f:
+        f.write(uploaded_file.getbuffer())
+    return pdf_path
 
 
 @handle_errors(logger)
@@ -35,36 +83,25 @@ def process_uploaded_pdf(uploaded_file, raw_dir: str = "data/raw",
     """
     アップロードされたPDFを処理: 保存 -> 抽出 -> チャンク化 -> 埋め込み
 
+    処理が終わるまで戻りません。UIからは submit_ingest_job() でワーカーに任せます。
+
     Returns:
         Dict with keys: 'success' (bool), 'message' (str), 'filename' (str), 'chunks_count' (int)
     """
     logger.info(f"PDFファイル処理開始: {uploaded_file.name}")
 
     try:
-        # ファイルサイズチェック（10MB制限）
-        file_size_mb = uploaded_file.size / (1024 * 1024)
-        if file_size_mb > 10:
-            logger.warning(f"ファイルサイズが大きすぎます: {file_size_mb:.2f}MB")
+        size_error = _check_upload_size(uploaded_file)
+        if size_error:
             return {
                 'success': False,
-                'message': f'ファイルサイズが大きすぎます（{file_size_mb:.2f}MB）。10MB以下のファイルをアップロードしてください。',
+                'message': size_error,
                 'filename': uploaded_file.name,
                 'chunks_count': 0
             }
 
         # 1. PDFを保存
-        os.makedirs(raw_dir, exist_ok=True)
-        os.makedirs("static", exist_ok=True)
-        pdf_path = os.path.join(raw_dir, uploaded_file.name)
-        static_pdf_path = os.path.join("static", uploaded_file.name)
-        
-        logger.debug(f"PDFを保存: {pdf_path}")
-        with open(pdf_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
-        # staticフォルダにも保存（ブラウザ閲覧用）
-        with open(static_pdf_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+        pdf_path = _save_uploaded_pdf(uploaded_file, raw_dir)
 
         # 2. テキスト抽出
         logger.info("テキスト抽出を開始")
@@ -84,12 +121,9 @@ def process_uploaded_pdf(uploaded_file, raw_dir: str = "data/raw",
         save_processed_data(chunks, processed_path)
         logger.debug(f"処理済みデータを保存: {processed_path}")
 
-        # 5. 埋め込みを保存（リトライ付き）
+        # 5. 埋め込みを保存（埋め込み関数がAPIの呼び出しごとにレート制限・リトライ）
         logger.info("埋め込み生成を開始")
-        def embed_with_retry():
-            return store_embeddings(processed_path, storage_path)
-
-        retry_handler.execute(embed_with_retry)
+        store_embeddings(processed_path, storage_path)
         logger.info("埋め込み生成完了")
 
         return {
@@ -112,7 +146,11 @@ def process_uploaded_pdf(uploaded_file, raw_dir: str = "data/raw",
 
 @handle_errors(logger)
 def generate_answer_ui(query: str, storage_path: str = "storage/chroma",
-                      n_results: int = 3, initial_k: int = 100, final_k: int = 20) -> GenerateAnswerResult:
+                      n_results: int = 3, initial_k: int = 100, final_k: int = 20,
+                      mmr_lambda: Optional[float] = None,
+                      parent_mode: Optional[str] = None,
+                      history: Optional[List[Dict]] = None,
+                      tenant: Optional[str] = None) -> GenerateAnswerResult:
     """
     RAGパイプラインでクエリに対する回答を生成（UI用）
 
@@ -122,14 +160,21 @@ def generate_answer_ui(query: str, storage_path: str = "storage/chroma",
         n_results: 最終的に使用するチャンク数
         initial_k: 初期取得件数
         final_k: リランキング後に残す件数
+        mmr_lambda: MMRの関連度の重み（Noneの場合は設定から取得、1.0でリランキング順の先頭を使用）
+        parent_mode: ヒットしたチャンクを広げる範囲（"none" / "window" / "page"、Noneの場合は設定から取得）
+        history: この質問より前の会話（古い順）。追加質問を単独の質問に書き換えて検索する
+        tenant: 検索するテナント（Noneの場合は既定のテナント）
 
     Returns:
-        Dict with keys: 'success' (bool), 'answer' (str), 'sources' (List[str]), 'error' (str)
+        Dict with keys: 'success' (bool), 'answer' (str), 'sources' (List[str]), 'error' (str),
+        'trace' (Dict: 各段階の所要時間など)
     """
     logger.info(f"クエリ処理開始: {query[:50]}...")
+    # 検索・リランキング・生成で共有するレイテンシ予算
+    deadline = Deadline(settings.resilience.answer_budget_seconds)
 
     try:
-        api_key = os.getenv("GOOGLE_API_KEY")
+        api_key = settings.embedding.api_key
         if not api_key:
             logger.error("API keyが設定されていません")
             return {
@@ -139,28 +184,21 @@ def generate_answer_ui(query: str, storage_path: str = "storage/chroma",
                 'error': 'GOOGLE_API_KEYが.envファイルに設定されていません。'
             }
 
-        # 1. ベクトル検索 (Retrieval) - 広めに取得
-        logger.info(f"ベクトル検索開始: 初期取得{initial_k}件")
-        initial_results = semantic_search(query, storage_path, top_k=initial_k)
-        logger.info(f"ベクトル検索完了: {len(initial_results)}件のチャンクを取得")
-
-        # 2. LLMリランキング
-        logger.info(f"LLMリランキング開始: 上位{final_k}件に絞り込み")
-        reranked_results = rerank_with_llm(query, initial_results, top_k=final_k)
-        logger.info(f"リランキング完了: {len(reranked_results)}件")
+        # 書き換え → 検索 → リランキング → MMR → 親の範囲への拡張 → 詰め込み → 生成（CLIと同じエンジン）
+        pipeline = build_pipeline(n_results=n_results, initial_k=initial_k, final_k=final_k,
+                                  mmr_lambda=mmr_lambda, parent_mode=parent_mode)
+        context = pipeline.run(query, storage_path, tenant=tenant, history=history, deadline=deadline)
+        packed = context.packed
 
-        # 3. プロンプト構築とソース情報の整理
-        context = ""
+        # ソース情報の整理
         page_sources = {}  # ページごとにチャンクをグループ化
 
-        # 最終的にn_results件のみ使用
-        for i, result in enumerate(reranked_results[:n_results]):
-            chunk_text = result['content']
+        for result in (r for block in packed.blocks for r in block.results):
+            # プレビューは親の範囲ではなくヒットしたチャンク
+            chunk_text = result.get('chunk_content', result['content'])
             distance = result.get('distance', 0)
             rerank_score = result.get('rerank_score', 0)
 
-            context += f"\n--- 資料 {i+1} ---\n{chunk_text}\n"
-
             page = result['metadata'].get('page', '不明')
             source = result['metadata'].get('source', '不明')
 
@@ -197,49 +235,27 @@ def generate_answer_ui(query: str, storage_path: str = "storage/chroma",
             page = info['page']
             source = info['source']
             chunk_count = len(info['chunks'])
-            url = f"http://localhost:8503/{source}#page={page}"
+            # PDF配信サーバーでのパス（テナントのPDFは data/raw/tenants/<テナント>/ の下）
+            source_path = source_path_for(source, tenant)
+            url = f"{settings.app.pdf_server_url}/{quote(source_path)}#page={page}"
             text = f"📄 ページ {page} ({source}) - {chunk_count}件"
-            # タプル: (page, source, url, text, chunks_preview)
+            # タプル: (page, source_path, url, text, chunks_preview)
             # chunksもタプルに変換（Streamlitのセッション状態に対応）
-            sources.append((page, source, url, text, tuple(info['chunks'])))
-
-        prompt = f"""
-あなたは提供された資料に基づいて質問に答える、誠実で役立つアシスタントです。
-
-【重要な指示】
-1. 以下の資料を**すべて注意深く読み**、質問に関連する情報を探してください
-2. 質問に直接答えている箇所だけでなく、**関連する文脈や背景情報**も含めて回答してください
-3. 複数の資料に関連情報がある場合は、それらを**統合して包括的な回答**を作成してください
-4. 回答の根拠となる資料番号を明記してください（例: [資料 1, 3]）
-5. 資料に情報が含まれている場合は、必ず具体的に答えてください
-6. 本当に情報が見つからない場合のみ「提供された資料にはその情報が含まれていません」と答えてください
-
-【資料】
-{context}
-
-【ユーザーの質問】
-{query}
+            sources.append((page, source_path, url, text, tuple(info['chunks'])))
 
-【回答】
-上記の資料に基づいて、質問に対する詳しい回答を日本語で記述してください。
-"""
+        # 引用ページをバックグラウンドで事前レンダリング（ページ画像リンクを即座に表示するため）
+        prerender_pages(get_page_renderer(),
+                        [(source_path_for(info['source'], tenant), info['page']) for _, info in sorted_pages],
+                        dpi=settings.app.page_render_dpi, fmt=settings.app.page_render_format)
 
-        # 3. 生成 (Generation) - リトライ付き
-        logger.info("回答生成開始")
-
-        def generate_with_retry():
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('models/gemini-flash-latest')
-            return model.generate_content(prompt)
-
-        response = retry_handler.execute(generate_with_retry)
-        logger.info(f"回答生成完了: {len(response.text)}文字")
+        logger.info(f"回答生成完了: {len(context.answer)}文字 ({deadline.timings})")
 
         return {
             'success': True,
-            'answer': response.text,
+            'answer': context.answer,
             'sources': list(dict.fromkeys(sources)),  # 順序を維持して重複除去
-            'error': ''
+            'error': '',
+            'trace': context.trace()
         }
 
     except Exception as e:
@@ -271,12 +287,13 @@ def clear_chat_history(session_state) -> None:
         session_state.messages = []
 
 
-def check_db_status(storage_path: str = "storage/chroma") -> DBStatus:
+def check_db_status(storage_path: str = "storage/chroma", tenant: Optional[str] = None) -> DBStatus:
     """
-    ChromaDBのステータスを確認
+    ChromaDBのステータスを確認（tenant を指定した場合はそのテナントのコレクション）
 
     Returns:
-        Dict with keys: 'exists' (bool), 'document_count' (int), 'collections' (List[str])
+        Dict with keys: 'exists' (bool), 'document_count' (int), 'collections' (List[str]),
+        'embedding_model' (str), 'embedding_dimensions' (int), 'model_mismatch' (bool)
     """
     try:
         if not os.path.exists(storage_path):
@@ -286,7 +303,7 @@ def check_db_status(storage_path: str = "storage/chroma") -> DBStatus:
                 'collections': []
             }
 
-        api_key = os.getenv("GOOGLE_API_KEY")
+        api_key = settings.embedding.api_key
         if not api_key:
             return {
                 'exists': False,
@@ -295,23 +312,20 @@ def check_db_status(storage_path: str = "storage/chroma") -> DBStatus:
                 'error': 'API key not configured'
             }
 
-        client = chromadb.PersistentClient(path=storage_path)
-        gemini_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
-            api_key=api_key,
-            model_name="models/text-embedding-004",
-            task_type="RETRIEVAL_QUERY"
-        )
-
+        # ドキュメント数はコレクションのバージョンが変わらない限りキャッシュから返す（DBを開かない）
+        collection_name = resolve_collection(storage_path, collection_name_for(tenant))
         try:
-            collection = client.get_collection(
-                name="notebook_rag_collection",
-                embedding_function=gemini_ef
-            )
-            count = collection.count()
+            resources = get_pipeline_resources()
+            count = resources.document_count(storage_path, collection_name)
+            metadata = resources.collection_metadata(storage_path, collection_name)
+            model = metadata.get(EMBEDDING_MODEL_KEY)
             return {
                 'exists': True,
                 'document_count': count,
-                'collections': ['notebook_rag_collection']
+                'collections': [collection_name],
+                'embedding_model': model,
+                'embedding_dimensions': metadata.get(EMBEDDING_DIMENSIONS_KEY),
+                'model_mismatch': model is not None and model != settings.embedding.model
             }
         except Exception:
             return {
@@ -329,25 +343,85 @@ def check_db_status(storage_path: str = "storage/chroma") -> DBStatus:
         }
 
 
-def clear_database(storage_path: str = "storage/chroma") -> ClearDatabaseResult:
+def _warm_up_quantized_index(storage_path: str, collection_name: str) -> bool:
     """
-    データベースをクリア
+    検索で使う学習済みの量子化インデックスを読み込み、保持しているベクトルでダミー検索する
+
+    Returns:
+        量子化インデックスを読み込んだか（Falseの場合はHNSWで検索するためHNSWを読み込む）
+    """
+    if settings.storage.vector_quantization == "none":
+        return False
+    from src.embedding.quantization import QuantizedIndex, load_quantized_index, quantized_index_dir
+
+    index_dir = quantized_index_dir(storage_path, collection_name)
+    if not QuantizedIndex.exists(index_dir):
+        return False
+    index = load_quantized_index(index_dir)
+    if not index.is_trained:
+        return False
+    if len(index) > 0:
+        index.search(index.vectors[[0]][0], 1)
+    return True
+
+
+def warm_up_vector_store(storage_path: str = "storage/chroma", tenant: Optional[str] = None) -> WarmUpResult:
+    """
+    ベクトルストアのウォームアップ
+
+    セグメントをロードし、保存済みの埋め込みでダミー検索を実行してHNSWインデックスを
+    メモリに載せます。学習済みの量子化インデックスで検索する場合は、HNSWではなく
+    量子化インデックスを読み込みます。埋め込みAPIは呼び出しません。
+
+    Returns:
+        Dict with keys: 'success' (bool), 'elapsed_ms' (float), 'document_count' (int), 'error' (str)
+    """
+    import time
+
+    start = time.perf_counter()
+    try:
+        if not os.path.exists(storage_path):
+            return {'success': False, 'elapsed_ms': 0.0, 'document_count': 0,
+                    'error': 'storage not found'}
+
+        client = get_pipeline_resources().client(storage_path)
+        collection_name = resolve_collection(storage_path, collection_name_for(tenant))
+        collection = client.get_collection(name=collection_name)
+        count = collection.count()
+        if count > 0 and not _warm_up_quantized_index(storage_path, collection_name):
+            sample = collection.get(limit=1, include=["embeddings"])
+            collection.query(query_embeddings=[sample["embeddings"][0]], n_results=1)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"ベクトルストアのウォームアップ完了: {count}件, {elapsed_ms:.0f}ms")
+        return {'success': True, 'elapsed_ms': elapsed_ms, 'document_count': count, 'error': ''}
+
+    except Exception as e:
+        logger.warning(f"ベクトルストアのウォームアップに失敗: {e}")
+        return {'success': False, 'elapsed_ms': (time.perf_counter() - start) * 1000,
+                'document_count': 0, 'error': str(e)}
+
+
+def clear_database(storage_path: str = "storage/chroma", tenant: Optional[str] = None) -> ClearDatabaseResult:
+    """
+    テナントのデータベースをクリア
+
+    そのテナントのコレクションと付随するファイルだけを削除します。保存先全体の削除やクライアントの
+    クローズはしないため、他のテナントの検索・取り込みは止まりません。
 
     Args:
         storage_path: Chromaデータベースのパス
+        tenant: クリアするテナント（Noneの場合は既定のテナント）
 
     Returns:
         処理結果の辞書
     """
-    import shutil
-
     try:
-        if os.path.exists(storage_path):
-            shutil.rmtree(storage_path)
-            logger.info("データベースをクリアしました")
+        if clear_tenant(storage_path, tenant):
+            logger.info(f"テナント「{resolve_tenant(tenant)}」のデータベースをクリアしました")
             return {
                 'success': True,
-                'message': '✅ データベースをクリアしました。ページをリロード（F5）してから、PDFを再アップロードしてください。'
+                'message': '✅ データベースをクリアしました。PDFを再アップロードしてください。'
             }
         else:
             return {
@@ -423,6 +497,83 @@ def process_multiple_pdfs(uploaded_files: List, raw_dir: str = "data/raw",
     }
 
 
+def submit_ingest_job(uploaded_file, owner: str = None, raw_dir: str = "data/raw",
+                      processed_dir: str = "data/processed",
+                      storage_path: str = "storage/chroma", tenant: Optional[str] = None) -> SubmitJobResult:
+    """
+    アップロードされたPDFを保存し、取り込みジョブとして登録（処理はワーカーが行う）
+
+    Args:
+        uploaded_file: アップロードされたファイル
+        owner: ジョブの所有者（セッションID）。get_ingest_jobs() での絞り込みに使用
+        tenant: 取り込み先のテナント（Noneの場合は既定のテナント）。PDFはテナントのディレクトリに保存
+
+    Returns:
+        Dict with keys: 'success' (bool), 'message' (str), 'filename' (str), 'job_id' (int)
+    """
+    try:
+        size_error = _check_upload_size(uploaded_file)
+        if size_error:
+            return {'success': False, 'message': size_error, 'filename': uploaded_file.name,
+                    'job_id': None}
+
+        raw_dir, processed_dir = tenant_dirs(tenant, raw_dir, processed_dir)
+        queue = get_job_queue()
+        # 同じ名前のPDFの再アップロードは置き換えのため文書数に数えない
+        if not os.path.exists(os.path.join(raw_dir, uploaded_file.name)):
+            check_document_quota(storage_path, tenant, pending=queue.pending_count(job_tenant(tenant)))
+
+        static_dir = "static" if is_default_tenant(tenant) else os.path.join("static", "tenants",
+                                                                              resolve_tenant(tenant))
+        pdf_path = os.path.abspath(_save_uploaded_pdf(uploaded_file, raw_dir, static_dir))
+        job_id = queue.enqueue(pdf_path, filename=uploaded_file.name, owner=owner,
+                               processed_dir=processed_dir, storage_path=storage_path,
+                               tenant=job_tenant(tenant))
+        if is_default_tenant(tenant):
+            # 監視フォルダ（data/raw）に保存したため、監視中のワーカーが同じファイルを再度登録しないよう記録
+            from src.ingestion.watcher import file_sha256
+
+            stat_result = os.stat(pdf_path)
+            queue.record_source_file(pdf_path, file_sha256(pdf_path), stat_result.st_size,
+                                     stat_result.st_mtime_ns, job_id=job_id)
+        logger.info(f"取り込みジョブを登録: {uploaded_file.name} (job {job_id})")
+        return {'success': True, 'message': f'{uploaded_file.name} を取り込みキューに追加しました',
+                'filename': uploaded_file.name, 'job_id': job_id}
+
+    except TenantLimitExceeded as e:
+        logger.warning(f"テナントの上限のため取り込みを拒否: {e}")
+        return {'success': False, 'message': f'📦 {e}', 'filename': uploaded_file.name, 'job_id': None}
+    except Exception as e:
+        logger.error(f"取り込みジョブの登録に失敗: {e}")
+        return {'success': False, 'message': f'エラーが発生しました: {str(e)}',
+                'filename': uploaded_file.name, 'job_id': None}
+
+
+def get_ingest_jobs(owner: str = None, limit: int = 10) -> List[IngestJob]:
+    """
+    最近の取り込みジョブの状態を取得（UIのポーリング用）
+
+    Returns:
+        ジョブのリスト（新しい順）
+    """
+    keys = IngestJob.__annotations__.keys()
+    return [{key: job[key] for key in keys} for job in get_job_queue().list_jobs(owner, limit)]
+
+
+def ensure_ingest_workers() -> int:
+    """
+    取り込みワーカーが動いていなければ起動（設定で自動起動が有効な場合）
+
+    Returns:
+        稼働中のワーカー数（起動した場合は起動した数）
+    """
+    live = get_job_queue().live_worker_count()
+    if live == 0 and settings.ingestion.autostart_workers:
+        spawn_worker_daemon(settings.ingestion.workers)
+        return settings.ingestion.workers
+    return live
+
+
 def get_processed_pdfs(raw_dir: str = "data/raw") -> List[str]:
     """
     処理済みのPDFファイル一覧を取得
@@ -1,79 +1,302 @@
+import hashlib
+import hmac
 import json
 import os
-from typing import List, Dict
+import secrets
+import sqlite3
+import uuid
+from contextlib import closing
+from typing import List, Dict, Optional
 from datetime import datetime
 from pathlib import Path
 
+# セッションIDを指定しない場合（および旧形式の履歴）の保存先
+DEFAULT_SESSION_ID = "default"
+
+# ログインユーザーと匿名のブラウザセッションは別の名前空間に分ける
+# （匿名のトークンからログインユーザーの履歴を指定できないように）
+USER_SESSION_PREFIX = "user:"
+ANONYMOUS_SESSION_PREFIX = "anon:"
+
+
+def user_session_id(email: str) -> str:
+    """ログインユーザーの履歴のセッションID"""
+    return f"{USER_SESSION_PREFIX}{email.strip().lower()}"
+
+
+def _sign(value: str, secret: str) -> str:
+    return hmac.new(secret.encode("utf-8"), value.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def new_anonymous_token(secret: str) -> str:
+    """匿名のブラウザセッションのトークン（"<uuid>.<署名>"、URLの ?session= に保存）"""
+    value = uuid.uuid4().hex
+    return f"{value}.{_sign(value, secret)}"
+
+
+def anonymous_session_id(token: Optional[str], secret: str) -> Optional[str]:
+    """
+    匿名のトークンを検証して履歴のセッションID（"anon:<uuid>"）を返す
+
+    署名が一致しない・形式が違うトークン（"user:..." など）はNone
+    """
+    value, _, signature = (token or "").partition(".")
+    if len(value) != 32 or not all(c in "0123456789abcdef" for c in value):
+        return None
+    if not hmac.compare_digest(signature, _sign(value, secret)):
+        return None
+    return f"{ANONYMOUS_SESSION_PREFIX}{value}"
+
+
+def load_session_secret(path: str, secret: str = None) -> str:
+    """
+    匿名のトークンの署名鍵（secret が空ならファイルから読み込み、なければ作成して保存）
+
+    ファイルに保存するため、再起動後も同じトークンで同じ履歴を表示できます。
+    """
+    if secret:
+        return secret
+    path = Path(path)
+    try:
+        return path.read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    value = secrets.token_hex(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # 別のプロセスが先に作成した
+        return path.read_text(encoding="utf-8").strip()
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(value)
+    return value
+
 
 class ChatHistoryManager:
     """
-    チャット履歴を管理するクラス（上限50メッセージ）
+    チャット履歴を管理するクラス（セッションごとに上限50メッセージ）
+
+    履歴はSQLite（WALモード）に追記専用で保存します。メッセージ追加は1行のINSERTのみで、
+    件数はトリガーで管理するセッションごとのカウンタから取得します。上限を超えた古いメッセージは
+    読み出し時には除外され、一定量たまった時点でまとめて削除（コンパクション）されます。
+    複数のStreamlitセッションから同時に書き込んでも安全です。
+
+    履歴はsession_id（ブラウザセッションまたはユーザーID）ごとに分割され、
+    他のセッションの履歴量が読み込み速度に影響しません。
     """
-    def __init__(self, history_file: str = "storage/chat_history.json", max_messages: int = 50):
+    SCHEMA_VERSION = 2
+
+    def __init__(self, history_file: str = "storage/chat_history.json", max_messages: int = 50,
+                 compaction_slack: int = None, session_id: str = DEFAULT_SESSION_ID):
         """
         Args:
-            history_file: 履歴ファイルのパス
-            max_messages: 保存する最大メッセージ数（デフォルト: 50）
+            history_file: 履歴ファイルのパス（.jsonの場合は同名の.dbに保存し、既存のJSONは初回に取り込み）
+            max_messages: セッションごとに保存する最大メッセージ数（デフォルト: 50）
+            compaction_slack: 上限をこの件数超えたらコンパクションを実行（デフォルト: max_messagesと同数）
+            session_id: 履歴を分割するセッションID（またはユーザーID）
         """
         self.history_file = Path(history_file)
+        self.db_file = (self.history_file.with_suffix(".db")
+                        if self.history_file.suffix == ".json" else self.history_file)
         self.max_messages = max_messages
+        self.compaction_slack = compaction_slack if compaction_slack is not None else max_messages
+        self.session_id = session_id
         self._ensure_file_exists()
 
+    def _connect(self) -> sqlite3.Connection:
+        """操作ごとに接続を開く（Streamlitのスクリプトスレッドをまたいで安全に使うため）"""
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
     def _ensure_file_exists(self):
-        """履歴ファイルのディレクトリとファイルを作成"""
-        self.history_file.parent.mkdir(parents=True, exist_ok=True)
-        if not self.history_file.exists():
-            self._save_history([])
-
-    def _save_history(self, messages: List[Dict]):
-        """履歴をファイルに保存"""
-        with open(self.history_file, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
+        """履歴DBのディレクトリとテーブルを作成"""
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                self._migrate(conn)
+            self._import_legacy_json(conn)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """スキーマを作成（セッション列のない旧スキーマは移行）"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 他のプロセスが先に移行を済ませている場合は何もしない
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= self.SCHEMA_VERSION:
+                conn.execute("COMMIT")
+                return
+
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(messages)")]
+            if columns and "session_id" not in columns:
+                conn.execute(
+                    "ALTER TABLE messages ADD COLUMN session_id TEXT NOT NULL "
+                    f"DEFAULT '{DEFAULT_SESSION_ID}'"
+                )
+            conn.execute("DROP TRIGGER IF EXISTS messages_count_insert")
+            conn.execute("DROP TRIGGER IF EXISTS messages_count_delete")
+            conn.execute("DROP TABLE IF EXISTS message_count")
+
+            for statement in (
+                """CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    sources TEXT,
+                    session_id TEXT NOT NULL DEFAULT 'default'
+                )""",
+                "CREATE INDEX IF NOT EXISTS messages_session_id ON messages (session_id, id)",
+                """CREATE TABLE IF NOT EXISTS session_counts (
+                    session_id TEXT PRIMARY KEY,
+                    total INTEGER NOT NULL
+                )""",
+                """CREATE TRIGGER IF NOT EXISTS messages_count_insert AFTER INSERT ON messages
+                BEGIN
+                    INSERT OR IGNORE INTO session_counts (session_id, total) VALUES (NEW.session_id, 0);
+                    UPDATE session_counts SET total = total + 1 WHERE session_id = NEW.session_id;
+                END""",
+                """CREATE TRIGGER IF NOT EXISTS messages_count_delete AFTER DELETE ON messages
+                BEGIN
+                    UPDATE session_counts SET total = total - 1 WHERE session_id = OLD.session_id;
+                END""",
+                """CREATE TABLE IF NOT EXISTS history_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )""",
+                "DELETE FROM session_counts",
+                """INSERT INTO session_counts (session_id, total)
+                   SELECT session_id, COUNT(*) FROM messages GROUP BY session_id""",
+                f"PRAGMA user_version = {self.SCHEMA_VERSION}",
+            ):
+                conn.execute(statement)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _import_legacy_json(self, conn: sqlite3.Connection):
+        """旧形式（JSON配列）の履歴ファイルがあれば一度だけ既定セッションに取り込む"""
+        if self.db_file == self.history_file or not self.history_file.exists():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute(
+                "SELECT 1 FROM history_meta WHERE key = 'legacy_json_imported'"
+            ).fetchone()
+            if not done:
+                try:
+                    with open(self.history_file, 'r', encoding='utf-8') as f:
+                        legacy = json.load(f)
+                except (json.JSONDecodeError, OSError):
+                    legacy = []
+                for message in legacy[-self.max_messages:] if isinstance(legacy, list) else []:
+                    self._insert(conn, DEFAULT_SESSION_ID, message.get('role', ''),
+                                 message.get('content', ''), message.get('sources'),
+                                 message.get('timestamp'))
+                conn.execute(
+                    "INSERT INTO history_meta (key, value) VALUES ('legacy_json_imported', ?)",
+                    (datetime.now().isoformat(),)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, session_id: str, role: str, content: str, sources,
+                timestamp: str = None) -> int:
+        return conn.execute(
+            "INSERT INTO messages (session_id, role, content, timestamp, sources) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (session_id, role, content, timestamp or datetime.now().isoformat(),
+             json.dumps(sources, ensure_ascii=False) if sources else None)
+        ).lastrowid
+
+    @staticmethod
+    def _row_to_message(row) -> Dict:
+        message_id, role, content, timestamp, sources = row
+        message = {'id': message_id, 'role': role, 'content': content, 'timestamp': timestamp}
+        if sources:
+            message['sources'] = json.loads(sources)
+        return message
+
+    def _total(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute(
+            "SELECT total FROM session_counts WHERE session_id = ?", (self.session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _fetch_latest(self, count: int, before_id: Optional[int] = None) -> List[Dict]:
+        with closing(self._connect()) as conn:
+            # 保持上限より古いメッセージ（未コンパクション分）は返さない
+            oldest = conn.execute(
+                "SELECT id FROM messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT 1 OFFSET ?", (self.session_id, self.max_messages - 1)
+            ).fetchone()
+            rows = conn.execute(
+                "SELECT id, role, content, timestamp, sources FROM messages "
+                "WHERE session_id = ? AND id < ? AND id >= ? ORDER BY id DESC LIMIT ?",
+                (self.session_id,
+                 before_id if before_id is not None else 2 ** 63 - 1,
+                 oldest[0] if oldest else 0,
+                 count)
+            ).fetchall()
+        return [self._row_to_message(row) for row in reversed(rows)]
 
     def load_history(self) -> List[Dict]:
         """
         履歴をロード
 
         Returns:
-            メッセージのリスト
+            メッセージのリスト（最新max_messages件、古い順）
         """
         try:
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
+            return self._fetch_latest(self.max_messages)
+        except sqlite3.DatabaseError:
             return []
 
-    def add_message(self, role: str, content: str, sources: List[str] = None):
+    def add_message(self, role: str, content: str, sources: List[str] = None) -> int:
         """
-        メッセージを追加（上限を超えた場合は古いものを削除）
+        メッセージを追加（上限を超えた分はコンパクション時に削除）
 
         Args:
             role: メッセージの役割 ('user' または 'assistant')
             content: メッセージ内容
             sources: ソース情報（オプション）
-        """
-        messages = self.load_history()
-
-        # 新しいメッセージを追加
-        new_message = {
-            'role': role,
-            'content': content,
-            'timestamp': datetime.now().isoformat()
-        }
-        if sources:
-            new_message['sources'] = sources
-
-        messages.append(new_message)
 
-        # 上限を超えた場合、古いメッセージを削除
-        if len(messages) > self.max_messages:
-            messages = messages[-self.max_messages:]
+        Returns:
+            追加したメッセージのID
+        """
+        with closing(self._connect()) as conn:
+            message_id = self._insert(conn, self.session_id, role, content, sources)
+            if self._total(conn) > self.max_messages + self.compaction_slack:
+                self.compact(conn)
+        return message_id
 
-        self._save_history(messages)
+    def compact(self, conn: sqlite3.Connection = None):
+        """このセッションで上限を超えた古いメッセージを削除"""
+        if conn is None:
+            with closing(self._connect()) as own_conn:
+                return self.compact(own_conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id <= ("
+                "SELECT id FROM messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.session_id, self.session_id, self.max_messages)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
 
     def clear_history(self):
-        """履歴をクリア"""
-        self._save_history([])
+        """このセッションの履歴をクリア"""
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (self.session_id,))
 
     def get_recent_messages(self, count: int = 10) -> List[Dict]:
         """
@@ -85,8 +308,20 @@ class ChatHistoryManager:
         Returns:
             最近のメッセージのリスト
         """
-        messages = self.load_history()
-        return messages[-count:] if messages else []
+        return self._fetch_latest(min(count, self.max_messages))
+
+    def get_messages_before(self, before_id: int, count: int = 10) -> List[Dict]:
+        """
+        指定したメッセージIDより古いメッセージを取得（ページング用）
+
+        Args:
+            before_id: このIDより古いメッセージを取得
+            count: 取得するメッセージ数
+
+        Returns:
+            メッセージのリスト（古い順）
+        """
+        return self._fetch_latest(count, before_id=before_id)
 
     def get_message_count(self) -> int:
         """
@@ -95,7 +330,8 @@ class ChatHistoryManager:
         Returns:
             メッセージ数
         """
-        return len(self.load_history())
+        with closing(self._connect()) as conn:
+            return min(self._total(conn), self.max_messages)
 
     def export_history(self, export_path: str):
         """
@@ -0,0 +1,141 @@
+"""
+リクエスト単位のレイテンシ予算（デッドライン）とヘッジリクエスト
+
+1回の回答生成に使える時間を Deadline として検索・リランキング・生成に引き回し、
+遅いAPI呼び出しが全体の応答時間を決めてしまうことを防ぎます。
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """レイテンシ予算を使い切った"""
+
+
+class Deadline:
+    """
+    リクエストの残り時間を管理するクラス
+
+    段階ごとの所要時間（ミリ秒）を記録し、回答のトレースとして返せるようにします。
+    """
+    def __init__(self, budget_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.budget = budget_seconds
+        self.clock = clock
+        self.started_at = clock()
+        self.expires_at = self.started_at + budget_seconds
+        self.timings: Dict[str, float] = {}
+        self._stage_started_at = self.started_at
+
+    def remaining(self) -> float:
+        """残り秒数（0未満にはならない）"""
+        return max(self.expires_at - self.clock(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def elapsed(self) -> float:
+        return self.clock() - self.started_at
+
+    def share(self, fraction: float) -> float:
+        """全体予算のうちfractionの割合を、残り時間を上限として返す"""
+        return min(self.budget * fraction, self.remaining())
+
+    def check(self, stage: str = ""):
+        """予算を使い切っていればDeadlineExceeded"""
+        if self.expired:
+            raise DeadlineExceeded(f"レイテンシ予算（{self.budget:.1f}秒）を超過しました: {stage}")
+
+    def mark(self, stage: str):
+        """前回のmarkからの所要時間をstageとして記録"""
+        now = self.clock()
+        self.timings[stage] = round((now - self._stage_started_at) * 1000, 1)
+        self._stage_started_at = now
+
+
+class LatencyTracker:
+    """
+    直近の所要時間からパーセンタイルを求める（ヘッジの発火タイミング用）
+
+    サンプルが少ないうちはNoneを返し、ヘッジを行いません。
+    """
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(key: str) -> LatencyTracker:
+    """キー（プロバイダー/モデル）ごとに共有されるLatencyTrackerを取得"""
+    with _trackers_lock:
+        if key not in _trackers:
+            _trackers[key] = LatencyTracker()
+        return _trackers[key]
+
+
+# タイムアウトした呼び出しはスレッド上で完了まで走り続けるため、上限付きのプールで実行
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="deadline")
+
+
+def call_with_deadline(func: Callable[[], Any], timeout: Optional[float],
+                       hedge_after: Optional[float] = None,
+                       tracker: Optional[LatencyTracker] = None,
+                       may_hedge: Optional[Callable[[], bool]] = None) -> Any:
+    """
+    関数をタイムアウト付きで実行（必要ならヘッジリクエストを発行）
+
+    Args:
+        func: 実行する関数（引数なし）
+        timeout: 待機する上限秒数（Noneの場合は無制限）
+        hedge_after: この秒数までに応答がなければ同じ呼び出しをもう1つ発行し、先に返った方を使う
+        tracker: 成功した呼び出しの所要時間を記録するLatencyTracker
+        may_hedge: ヘッジの直前に呼び、Falseならヘッジしない（レート制限のトークン取得など）
+
+    Returns:
+        関数の戻り値
+
+    Raises:
+        DeadlineExceeded: timeout以内に応答がなかった場合
+    """
+    started_at = time.monotonic()
+    if timeout is not None and timeout <= 0:
+        raise DeadlineExceeded("レイテンシ予算が残っていません")
+
+    futures = [_executor.submit(func)]
+    if hedge_after is not None and (timeout is None or hedge_after < timeout):
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done and (may_hedge is None or may_hedge()):
+            futures.append(_executor.submit(func))
+
+    while futures:
+        remaining = None if timeout is None else max(timeout - (time.monotonic() - started_at), 0)
+        done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded(f"{timeout:.1f}秒以内に応答がありませんでした")
+        future = done.pop()
+        futures.remove(future)
+        if future.exception() is None or not futures:
+            # 片方が失敗しても、もう片方の応答を待つ
+            result = future.result()
+            if tracker is not None:
+                tracker.record(time.monotonic() - started_at)
+            return result
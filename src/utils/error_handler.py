@@ -1,7 +1,25 @@
 import functools
+import random
+import re
+import time
 import traceback
-from typing import Callable, Any
+from typing import Callable, Any, Optional
 from .logger import default_logger
+from .deadline import Deadline, DeadlineExceeded, call_with_deadline, get_latency_tracker
+from .rate_limit import (
+    CircuitOpenError,
+    RateLimitTimeout,
+    get_circuit_breaker,
+    get_rate_limiter,
+)
+
+
+class TenantLimitExceeded(Exception):
+    """テナントの文書数・チャンク数の上限を超える（待っても解消しないため再試行しない）"""
+
+
+class EmbeddingModelMismatch(Exception):
+    """保存済みの埋め込みと異なるモデルでの検索・取り込み（移行するまで解消しないため再試行しない）"""
 
 
 def handle_errors(logger=None):
@@ -55,20 +73,152 @@ def safe_execute(func: Callable, default_return: Any = None, logger=None) -> Any
         return default_return
 
 
+def classify_error(error: Exception) -> str:
+    """
+    エラーを種類に分類
+
+    Returns:
+        'unavailable' / 'deadline' / 'quota' / 'limit' / 'model' / 'auth' / 'server' / 'network' / 'pdf' / 'unknown'
+    """
+    if isinstance(error, TenantLimitExceeded):
+        return "limit"
+    if isinstance(error, EmbeddingModelMismatch):
+        return "model"
+    if isinstance(error, CircuitOpenError):
+        return "unavailable"
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    if isinstance(error, RateLimitTimeout):
+        return "quota"
+
+    error_str = str(error)
+    lowered = error_str.lower()
+    if "429" in error_str or "quota" in lowered or "exceeded" in lowered:
+        return "quota"
+    if "401" in error_str or "403" in error_str or "authentication" in lowered or "api key" in lowered:
+        return "auth"
+    if "500" in error_str or "502" in error_str or "503" in error_str:
+        return "server"
+    if isinstance(error, (ConnectionError, TimeoutError)) or "connection" in lowered \
+            or "network" in lowered or "timeout" in lowered:
+        return "network"
+    if "pdf" in lowered or "file not found" in lowered:
+        return "pdf"
+    return "unknown"
+
+
+# 待てば回復する可能性があるエラー
+RETRYABLE_ERROR_TYPES = ("quota", "server", "network")
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """リトライすべきエラーかどうか（認証エラーや入力エラーはリトライしない）"""
+    return classify_error(error) in RETRYABLE_ERROR_TYPES
+
+
+_RETRY_AFTER_PATTERNS = (
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+    re.compile(r"retry-after:?\s*([\d.]+)", re.IGNORECASE),
+)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    エラーに含まれるretry-afterのヒント（秒）を取得
+
+    属性（retry_after）、HTTPレスポンスのRetry-Afterヘッダ、エラーメッセージの順に探します。
+    """
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None and headers.get("Retry-After"):
+        try:
+            return float(headers.get("Retry-After"))
+        except ValueError:
+            pass
+
+    for pattern in _RETRY_AFTER_PATTERNS:
+        match = pattern.search(str(error))
+        if match:
+            return float(match.group(1))
+    return None
+
+
 class APIRetryHandler:
     """
     API呼び出しのリトライ処理を行うクラス
+
+    - プロバイダー/モデルごとに共有するトークンバケットで呼び出し間隔を制御
+    - 再試行可能なエラー（クォータ・サーバー・ネットワーク）のみジッター付き指数バックオフで再試行
+    - retry-afterのヒントがあれば、共有バケットを通じて全呼び出し元をその時刻まで待機
+    - 連続失敗でサーキットブレーカーを開き、回復まで即座に失敗（CircuitOpenError）させる
     """
-    def __init__(self, max_retries: int = 3, backoff_factor: float = 2.0):
+    def __init__(self, max_retries: int = 3, backoff_factor: float = 2.0, provider: str = "default",
+                 requests_per_minute: float = 60.0, burst: int = 5, initial_wait: float = 1.0,
+                 max_wait: float = 30.0, max_queue_wait: float = 60.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 deadline: Optional[Deadline] = None, hedge_percentile: Optional[float] = None,
+                 sleep: Callable[[float], None] = time.sleep):
         """
         Args:
-            max_retries: 最大リトライ回数
+            max_retries: 最大試行回数
             backoff_factor: バックオフ係数（待機時間の倍率）
+            provider: 共有状態のキー（例: 'gemini:models/gemini-flash-latest'）
+            requests_per_minute: 1分あたりの最大リクエスト数
+            burst: 連続して許可するリクエスト数
+            initial_wait: 初回リトライの最大待機秒数
+            max_wait: リトライ待機の上限秒数
+            max_queue_wait: レート制限で待機する上限秒数
+            failure_threshold: サーキットブレーカーを開く連続失敗回数
+            reset_timeout: サーキットブレーカーを開いておく秒数
+            deadline: リクエストのレイテンシ予算（各試行・待機をこの残り時間内に収める）
+            hedge_percentile: 応答がこのパーセンタイルの所要時間を超えたら同じ呼び出しをもう1つ発行
+            sleep: 待機関数（テスト用に差し替え可能）
         """
         self.max_retries = max_retries
         self.backoff_factor = backoff_factor
+        self.provider = provider
+        self.initial_wait = initial_wait
+        self.max_wait = max_wait
+        self.max_queue_wait = max_queue_wait
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.latency_tracker = get_latency_tracker(provider)
+        self.sleep = sleep
+        self.rate_limiter = get_rate_limiter(provider, requests_per_minute, burst)
+        self.circuit_breaker = get_circuit_breaker(provider, failure_threshold, reset_timeout)
         self.logger = default_logger
 
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """フルジッター付き指数バックオフ（retry-afterのヒントがあればそれ以上待つ）"""
+        ceiling = min(self.max_wait, self.initial_wait * (self.backoff_factor ** attempt))
+        wait = random.uniform(0, ceiling)
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            wait = max(wait, min(retry_after, self.max_wait))
+        return wait
+
+    def _call(self, func: Callable, *args, **kwargs) -> Any:
+        """1回分の呼び出し（デッドラインやヘッジが指定されていればスレッド上で実行）"""
+        if self.deadline is None and self.hedge_percentile is None:
+            return func(*args, **kwargs)
+
+        hedge_after = None
+        if self.hedge_percentile is not None:
+            hedge_after = self.latency_tracker.percentile(self.hedge_percentile)
+        return call_with_deadline(
+            lambda: func(*args, **kwargs),
+            timeout=self.deadline.remaining() if self.deadline is not None else None,
+            hedge_after=hedge_after,
+            tracker=self.latency_tracker,
+            # ヘッジも1回の呼び出しとしてトークンを使う（待たずに取れなければヘッジしない）
+            may_hedge=self.rate_limiter.try_acquire,
+        )
+
     def execute(self, func: Callable, *args, **kwargs) -> Any:
         """
         関数をリトライ付きで実行
@@ -82,30 +232,76 @@ class APIRetryHandler:
             関数の戻り値
 
         Raises:
-            最後のエラー（全リトライ失敗時）
+            CircuitOpenError: プロバイダーが一時停止中の場合
+            DeadlineExceeded: レイテンシ予算を使い切った場合
+            最後のエラー（全リトライ失敗時、または再試行不可能なエラー）
         """
-        import time
-
         last_exception = None
-        wait_time = 1.0
 
         for attempt in range(self.max_retries):
+            max_queue_wait = self.max_queue_wait
+            if self.deadline is not None:
+                self.deadline.check(self.provider)
+                max_queue_wait = min(max_queue_wait, self.deadline.remaining())
+            self.circuit_breaker.before_call()
             try:
-                return func(*args, **kwargs)
+                self.rate_limiter.acquire(max_queue_wait, sleep=self.sleep)
+            except Exception as e:
+                # APIを呼んでいないため、half-open の試行枠を返す（返さないと回復を試せなくなる）
+                self.circuit_breaker.release_trial()
+                if isinstance(e, RateLimitTimeout) and self.deadline is not None:
+                    raise DeadlineExceeded(str(e)) from e
+                raise
+            try:
+                result = self._call(func, *args, **kwargs)
             except Exception as e:
                 last_exception = e
+                error_type = classify_error(e)
                 self.logger.warning(
-                    f"API呼び出し失敗 (試行 {attempt + 1}/{self.max_retries}): {e}"
+                    f"API呼び出し失敗 [{self.provider}] (試行 {attempt + 1}/{self.max_retries}, "
+                    f"{error_type}): {e}"
                 )
-
-                if attempt < self.max_retries - 1:
-                    self.logger.info(f"{wait_time}秒待機してリトライします...")
-                    time.sleep(wait_time)
-                    wait_time *= self.backoff_factor
+                if error_type == "deadline":
+                    # 予算内に応答しなかった呼び出しは遅延による失敗としてブレーカーに数える
+                    self.circuit_breaker.on_failure()
+                    raise
+                if error_type not in RETRYABLE_ERROR_TYPES:
+                    # 入力や認証の問題はリトライしても解決せず、回復したことの証拠にもならないため
+                    # ブレーカーの状態は変えない（half-open の試行枠だけ返す）
+                    self.circuit_breaker.release_trial()
+                    raise
+
+                self.circuit_breaker.on_failure()
+                if error_type == "quota":
+                    self.rate_limiter.on_throttle(get_retry_after(e))
+
+                if attempt < self.max_retries - 1 and not self.circuit_breaker.is_open:
+                    wait_time = self._backoff(attempt, e)
+                    if self.deadline is not None and wait_time >= self.deadline.remaining():
+                        # 待機すると予算を超えるため、これ以上リトライしない
+                        break
+                    self.logger.info(f"{wait_time:.1f}秒待機してリトライします...")
+                    self.sleep(wait_time)
+                    continue
+                break
+            else:
+                self.circuit_breaker.on_success()
+                self.rate_limiter.on_success()
+                return result
 
         self.logger.error(f"全てのリトライが失敗しました: {last_exception}")
         raise last_exception
 
+    def execute_with_fallback(self, func: Callable, fallback: Callable, *args, **kwargs) -> Any:
+        """
+        関数を実行し、失敗またはプロバイダー停止中の場合はfallbackの戻り値を返す
+        """
+        try:
+            return self.execute(func, *args, **kwargs)
+        except Exception as e:
+            self.logger.warning(f"フォールバックを使用します [{self.provider}]: {e}")
+            return fallback()
+
 
 def get_user_friendly_error_message(error: Exception) -> str:
     """
@@ -118,9 +314,55 @@ def get_user_friendly_error_message(error: Exception) -> str:
         ユーザー向けのわかりやすいエラーメッセージ
     """
     error_str = str(error)
-    
+    error_type = classify_error(error)
+
+    # サーキットブレーカーによる一時停止
+    if error_type == "unavailable":
+        return f"""
+⏸️ **APIを一時的に停止しています**
+
+Google Gemini APIでエラーが続いたため、負荷を避けるために呼び出しを一時停止しています。
+
+**解決方法:**
+- 約{error.retry_in:.0f}秒後に再度お試しください
+"""
+
+    # レイテンシ予算の超過
+    if error_type == "deadline":
+        return """
+⏱️ **回答の生成が時間内に完了しませんでした**
+
+APIの応答が遅れているため、待ち時間の上限で処理を打ち切りました。
+
+**解決方法:**
+- しばらく待ってから再度お試しください
+- 質問を短くすると応答が速くなる場合があります
+"""
+
+    # テナントの文書数・チャンク数の上限
+    if error_type == "limit":
+        return f"""
+📦 **保存できる上限に達しました**
+
+{error_str}
+
+**解決方法:**
+- 不要な文書を削除するか、データベースをクリアしてから再度お試しください
+"""
+
+    # 保存済みの埋め込みと異なるモデル
+    if error_type == "model":
+        return f"""
+🧭 **埋め込みモデルが一致しません**
+
+{error_str}
+
+**解決方法:**
+- `EMBEDDING_MODEL` を元のモデルに戻すか、`python migrate_embeddings.py` で新しいモデルに移行してください
+"""
+
     # 429 クォータ超過エラー
-    if "429" in error_str or "quota" in error_str.lower() or "exceeded" in error_str.lower():
+    if error_type == "quota":
         return """
 ⚠️ **API利用制限に達しました**
 
@@ -139,7 +381,7 @@ Google Gemini APIの無料枠の制限に達しました。以下のいずれか
 """
     
     # 401/403 認証エラー
-    elif "401" in error_str or "403" in error_str or "authentication" in error_str.lower() or "api key" in error_str.lower():
+    elif error_type == "auth":
         return """
 🔑 **API認証エラー**
 
@@ -154,7 +396,7 @@ Google Gemini APIキーが無効または設定されていません。
 """
     
     # 500番台 サーバーエラー
-    elif "500" in error_str or "502" in error_str or "503" in error_str:
+    elif error_type == "server":
         return """
 🔧 **サーバーエラー**
 
@@ -168,7 +410,7 @@ Google Gemini APIのサーバーで一時的な問題が発生しています。
 """
     
     # ネットワークエラー
-    elif "connection" in error_str.lower() or "network" in error_str.lower() or "timeout" in error_str.lower():
+    elif error_type == "network":
         return """
 🌐 **ネットワーク接続エラー**
 
@@ -181,7 +423,7 @@ Google Gemini APIのサーバーで一時的な問題が発生しています。
 """
     
     # PDFファイルエラー
-    elif "pdf" in error_str.lower() or "file not found" in error_str.lower():
+    elif error_type == "pdf":
         return f"""
 📄 **PDFファイルエラー**
 
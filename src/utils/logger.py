@@ -4,6 +4,16 @@ from datetime import datetime
 from pathlib import Path
 
 
+class LazyFileHandler(logging.FileHandler):
+    """最初のログ出力時にディレクトリとファイルを開くファイルハンドラ（インポート時のI/Oを避ける）"""
+    def __init__(self, filename, encoding: str = 'utf-8'):
+        super().__init__(filename, encoding=encoding, delay=True)
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+
 def setup_logger(name: str = "mini_notebook_rag", log_level: str = "INFO") -> logging.Logger:
     """
     アプリケーション用のロガーをセットアップ
@@ -15,11 +25,8 @@ def setup_logger(name: str = "mini_notebook_rag", log_level: str = "INFO") -> lo
     Returns:
         設定済みのロガーインスタンス
     """
-    # ログディレクトリの作成
+    # ログファイル名（日付付き、ディレクトリは最初の出力時に作成）
     log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-
-    # ログファイル名（日付付き）
     log_file = log_dir / f"app_{datetime.now().strftime('%Y%m%d')}.log"
 
     # ロガーの取得
@@ -36,8 +43,8 @@ def setup_logger(name: str = "mini_notebook_rag", log_level: str = "INFO") -> lo
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-    # ファイルハンドラ（UTF-8エンコーディング）
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    # ファイルハンドラ（UTF-8エンコーディング、最初の出力時に開く）
+    file_handler = LazyFileHandler(log_file, encoding='utf-8')
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
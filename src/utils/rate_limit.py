@@ -0,0 +1,194 @@
+"""
+API呼び出しのレート制限とサーキットブレーカー
+
+プロバイダー/モデルごとの状態をプロセス内で共有し、複数のStreamlitセッションが
+同時にクォータ超過したAPIへ一斉にリトライすることを防ぎます。
+"""
+import threading
+import time
+from typing import Callable, Dict
+
+
+class RateLimitTimeout(Exception):
+    """レート制限の待ち時間が上限を超えた"""
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出しを行わなかった"""
+    def __init__(self, key: str, retry_in: float):
+        super().__init__(f"{key} は一時的に利用停止中です（{retry_in:.0f}秒後に再試行）")
+        self.key = key
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """
+    適応型トークンバケット
+
+    スロットリング（429）を受けるとレートを半減し、成功が続くと徐々に元のレートへ戻します（AIMD）。
+    retry-afterのヒントを受け取った場合は、その時刻まで全呼び出し元を待機させます。
+    """
+    def __init__(self, requests_per_minute: float, capacity: int = 5,
+                 min_requests_per_minute: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.max_rate = requests_per_minute / 60.0
+        self.min_rate = min(min_requests_per_minute / 60.0, self.max_rate)
+        self.rate = self.max_rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.updated_at = clock()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = max(now - self.updated_at, 0.0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """
+        トークンを1つ予約し、呼び出しまでに待つべき秒数を返す
+
+        予約は即座に確定するため、同時に呼び出した複数スレッドは順番に間隔を空けて実行されます。
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens -= 1.0
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def acquire(self, max_wait: float = 60.0, sleep: Callable[[float], None] = time.sleep):
+        """トークンを取得（必要なら待機）。待ち時間がmax_waitを超える場合はRateLimitTimeout"""
+        wait = self.reserve()
+        if wait > max_wait:
+            with self._lock:
+                self.tokens += 1.0
+            raise RateLimitTimeout(f"レート制限の待ち時間が長すぎます（{wait:.1f}秒）")
+        if wait > 0:
+            sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """今すぐ使えるトークンがあれば取得してTrue（待機せず、なければ何も消費せずFalse）"""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            if self.tokens < 1.0 or now < self.paused_until:
+                return False
+            self.tokens -= 1.0
+            return True
+
+    def on_success(self):
+        """成功時にレートを少しずつ回復"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_throttle(self, retry_after: float = None):
+        """スロットリング時にレートを半減し、ヒントがあればその時刻まで停止"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.paused_until = max(self.paused_until, self.clock() + retry_after)
+
+
+class CircuitBreaker:
+    """
+    サーキットブレーカー
+
+    再試行可能なエラーがfailure_threshold回連続すると開き（open）、reset_timeout秒間は
+    呼び出しを即座に失敗させます。その後1件だけ試行を許可し（half-open）、成功すれば閉じます。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, key: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """呼び出し前に状態を確認（開いている場合はCircuitOpenError）"""
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = self.clock() - self.opened_at
+                if elapsed < self.reset_timeout:
+                    raise CircuitOpenError(self.key, self.reset_timeout - elapsed)
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(self.key, self.reset_timeout)
+                self._trial_in_flight = True
+
+    def on_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """結果を判定できなかった試行（呼び出し前の待機の失敗・再試行不可能なエラー）の枠を返す
+
+        状態と連続失敗回数は変えず、half-open の場合は次の呼び出しが改めて試行します。
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+            self._trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == self.OPEN and self.clock() - self.opened_at < self.reset_timeout
+
+
+# プロバイダー/モデルごとに共有する状態
+_buckets: Dict[str, TokenBucket] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(key: str, requests_per_minute: float, capacity: int = 5) -> TokenBucket:
+    """キーごとに共有されるトークンバケットを取得（初回のみ作成）"""
+    with _registry_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(requests_per_minute, capacity)
+        return _buckets[key]
+
+
+def get_circuit_breaker(key: str, failure_threshold: int = 5,
+                        reset_timeout: float = 30.0) -> CircuitBreaker:
+    """キーごとに共有されるサーキットブレーカーを取得（初回のみ作成）"""
+    with _registry_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(key, failure_threshold, reset_timeout)
+        return _breakers[key]
+
+
+def is_provider_healthy(key: str) -> bool:
+    """サーキットブレーカーが開いていなければTrue"""
+    breaker = _breakers.get(key)
+    return breaker is None or not breaker.is_open
+
+
+def reset_registries():
+    """共有状態をリセット（テスト用）"""
+    with _registry_lock:
+        _buckets.clear()
+        _breakers.clear()
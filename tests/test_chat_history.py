@@ -3,11 +3,16 @@ import sys
 import os
 from pathlib import Path
 import tempfile
+import json
+import threading
+import sqlite3
+import shutil
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
 
-from utils.chat_history import ChatHistoryManager
+from utils.chat_history import (ChatHistoryManager, anonymous_session_id, load_session_secret,
+                                new_anonymous_token, user_session_id)
 
 
 class TestChatHistory(unittest.TestCase):
@@ -22,8 +27,10 @@ class TestChatHistory(unittest.TestCase):
 
     def tearDown(self):
         """テストのクリーンアップ"""
-        if os.path.exists(self.temp_file.name):
-            os.unlink(self.temp_file.name)
+        base = os.path.splitext(self.temp_file.name)[0]
+        for path in (self.temp_file.name, base + '.db', base + '.db-wal', base + '.db-shm'):
+            if os.path.exists(path):
+                os.unlink(path)
 
     def test_add_message(self):
         """メッセージ追加のテスト"""
@@ -88,6 +95,151 @@ class TestChatHistory(unittest.TestCase):
 
         self.assertEqual(self.manager.get_message_count(), 2)
 
+    def test_compaction_removes_old_messages(self):
+        """コンパクション後も最新のメッセージが保持されることを確認"""
+        for i in range(25):
+            self.manager.add_message('user', f'メッセージ {i}')
+
+        # 上限10 + 余裕10 を超えた時点でコンパクションされている
+        with self.manager._connect() as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        self.assertLessEqual(stored, 20)
+        self.assertEqual(self.manager.get_message_count(), 10)
+
+        messages = self.manager.load_history()
+        self.assertEqual(messages[0]['content'], 'メッセージ 15')
+        self.assertEqual(messages[-1]['content'], 'メッセージ 24')
+
+    def test_concurrent_add_message(self):
+        """複数スレッドからの同時追加でメッセージが失われないことを確認"""
+        manager = ChatHistoryManager(history_file=self.temp_file.name, max_messages=1000)
+
+        def writer(worker_id):
+            for i in range(20):
+                manager.add_message('user', f'{worker_id}-{i}')
+
+        threads = [threading.Thread(target=writer, args=(w,)) for w in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(manager.get_message_count(), 100)
+        self.assertEqual(len({m['content'] for m in manager.load_history()}), 100)
+
+    def test_import_legacy_json(self):
+        """旧形式のJSON履歴が取り込まれることを確認"""
+        legacy_file = tempfile.NamedTemporaryFile(delete=False, suffix='.json', mode='w',
+                                                  encoding='utf-8')
+        json.dump([
+            {'role': 'user', 'content': '旧質問', 'timestamp': '2025-01-01T00:00:00'},
+            {'role': 'assistant', 'content': '旧回答', 'timestamp': '2025-01-01T00:00:01',
+             'sources': ['page 1']}
+        ], legacy_file, ensure_ascii=False)
+        legacy_file.close()
+        base = os.path.splitext(legacy_file.name)[0]
+
+        try:
+            manager = ChatHistoryManager(history_file=legacy_file.name, max_messages=10)
+            messages = manager.load_history()
+            self.assertEqual([m['content'] for m in messages], ['旧質問', '旧回答'])
+            self.assertEqual(messages[1]['sources'], ['page 1'])
+
+            # 2回目以降は取り込まない
+            manager = ChatHistoryManager(history_file=legacy_file.name, max_messages=10)
+            self.assertEqual(manager.get_message_count(), 2)
+        finally:
+            for path in (legacy_file.name, base + '.db', base + '.db-wal', base + '.db-shm'):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def test_sessions_are_isolated(self):
+        """セッションごとに履歴が分割されることを確認"""
+        alice = ChatHistoryManager(history_file=self.temp_file.name, max_messages=10,
+                                   session_id='alice')
+        bob = ChatHistoryManager(history_file=self.temp_file.name, max_messages=10,
+                                 session_id='bob')
+        for i in range(15):
+            alice.add_message('user', f'alice {i}')
+        bob.add_message('user', 'bob 0')
+
+        self.assertEqual(alice.get_message_count(), 10)
+        self.assertEqual(bob.get_message_count(), 1)
+        self.assertEqual([m['content'] for m in bob.load_history()], ['bob 0'])
+
+        bob.clear_history()
+        self.assertEqual(bob.get_message_count(), 0)
+        self.assertEqual(alice.get_message_count(), 10)
+
+    def test_anonymous_session_ids_are_signed(self):
+        """匿名のトークンは署名を検証し、ログインユーザーの名前空間を指定できない"""
+        token = new_anonymous_token("secret")
+        session_id = anonymous_session_id(token, "secret")
+        self.assertTrue(session_id.startswith("anon:"))
+        self.assertEqual(anonymous_session_id(token, "secret"), session_id)
+
+        self.assertIsNone(anonymous_session_id(token, "other-secret"))
+        self.assertIsNone(anonymous_session_id(token.split(".")[0], "secret"))
+        self.assertIsNone(anonymous_session_id("user:alice@example.com", "secret"))
+        self.assertIsNone(anonymous_session_id(None, "secret"))
+        self.assertEqual(user_session_id("Alice@Example.com"), "user:alice@example.com")
+
+    def test_session_secret_is_persisted(self):
+        """署名鍵は一度作成したら再起動後も同じものを使う"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, "session_secret")
+            secret = load_session_secret(path)
+            self.assertEqual(load_session_secret(path), secret)
+            self.assertEqual(load_session_secret(path, "configured"), "configured")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def test_get_messages_before(self):
+        """古いメッセージのページングを確認"""
+        for i in range(8):
+            self.manager.add_message('user', f'メッセージ {i}')
+
+        page = self.manager.get_recent_messages(count=3)
+        self.assertEqual([m['content'] for m in page], ['メッセージ 5', 'メッセージ 6', 'メッセージ 7'])
+
+        older = self.manager.get_messages_before(page[0]['id'], count=3)
+        self.assertEqual([m['content'] for m in older], ['メッセージ 2', 'メッセージ 3', 'メッセージ 4'])
+
+        oldest = self.manager.get_messages_before(older[0]['id'], count=3)
+        self.assertEqual([m['content'] for m in oldest], ['メッセージ 0', 'メッセージ 1'])
+        self.assertEqual(self.manager.get_messages_before(oldest[0]['id'], count=3), [])
+
+    def test_migrate_schema_without_sessions(self):
+        """セッション列のない旧スキーマが既定セッションに移行されることを確認"""
+        db_file = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        db_file.close()
+        os.unlink(db_file.name)
+        conn = sqlite3.connect(db_file.name)
+        conn.executescript("""
+            CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                role TEXT NOT NULL, content TEXT NOT NULL, timestamp TEXT NOT NULL, sources TEXT
+            );
+            CREATE TABLE message_count (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL);
+            INSERT INTO message_count VALUES (0, 2);
+            INSERT INTO messages (role, content, timestamp) VALUES ('user', '質問', '2025-01-01');
+            INSERT INTO messages (role, content, timestamp) VALUES ('assistant', '回答', '2025-01-01');
+        """)
+        conn.commit()
+        conn.close()
+
+        try:
+            manager = ChatHistoryManager(history_file=db_file.name, max_messages=10)
+            self.assertEqual(manager.get_message_count(), 2)
+            manager.add_message('user', '新しい質問')
+            self.assertEqual([m['content'] for m in manager.load_history()],
+                             ['質問', '回答', '新しい質問'])
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db_file.name + suffix):
+                    os.unlink(db_file.name + suffix)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,89 @@
+"""
+コンテキストの詰め込み（入力トークン予算）のテスト
+"""
+import unittest
+import os
+import sys
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.generation.context import (
+    BLOCK_OVERHEAD_TOKENS,
+    estimate_tokens,
+    format_context,
+    merge_overlapping,
+    pack_context,
+)
+
+
+def _result(content, page, chunk_id, source="doc.pdf"):
+    return {"content": content, "metadata": {"source": source, "page": page, "chunk_id": chunk_id}}
+
+
+class TestContextPacking(unittest.TestCase):
+    """コンテキストの詰め込みのテストクラス"""
+
+    def test_estimate_tokens(self):
+        """日本語は1文字1トークン、英数字は4文字1トークン、空白は数えない"""
+        self.assertEqual(estimate_tokens("資料です。"), 5)
+        self.assertEqual(estimate_tokens("abcd efgh"), 2)
+        self.assertEqual(estimate_tokens("ナアマンabc"), 5)
+        self.assertEqual(estimate_tokens(""), 0)
+
+    def test_merge_overlapping(self):
+        """末尾と先頭の重なりは1回だけ残す"""
+        self.assertEqual(merge_overlapping("ヨルダン川で7回身を浸した", "7回身を浸した。すると"),
+                         "ヨルダン川で7回身を浸した。すると")
+        self.assertEqual(merge_overlapping("前半", "後半"), "前半\n後半")
+
+    def test_adjacent_chunks_merged(self):
+        """同じページの連続したチャンクは重なりを除いて1つの資料になる（順序は chunk_id 順）"""
+        results = [
+            _result("身を浸した。すると皮膚が治った。", page=3, chunk_id=1),
+            _result("ナアマンはヨルダン川で身を浸した。", page=3, chunk_id=0),
+            _result("別のページ", page=4, chunk_id=1),
+        ]
+        packed = pack_context(results, budget_tokens=0)
+        self.assertEqual(len(packed.blocks), 2)
+        self.assertEqual(packed.blocks[0].content, "ナアマンはヨルダン川で身を浸した。すると皮膚が治った。")
+        self.assertEqual(len(packed.blocks[0].results), 2)
+        self.assertEqual(packed.tokens, sum(block.tokens for block in packed.blocks))
+
+    def test_gap_filling_chunk_joins_blocks(self):
+        """間のチャンクが入ると前後の資料が1つにまとまる"""
+        results = [
+            _result("第一の文。", page=1, chunk_id=0),
+            _result("第三の文。", page=1, chunk_id=2),
+            _result("第二の文。", page=1, chunk_id=1),
+        ]
+        packed = pack_context(results, budget_tokens=0)
+        self.assertEqual(len(packed.blocks), 1)
+        self.assertEqual(packed.blocks[0].content, "第一の文。\n第二の文。\n第三の文。")
+
+    def test_budget(self):
+        """予算に収まらない結果は除き、後続の小さい結果で埋める"""
+        results = [
+            _result("あ" * 100, page=1, chunk_id=0),
+            _result("い" * 100, page=2, chunk_id=0),
+            _result("う" * 10, page=3, chunk_id=0),
+        ]
+        budget = 100 + 10 + 2 * BLOCK_OVERHEAD_TOKENS
+        packed = pack_context(results, budget_tokens=budget)
+        self.assertEqual([block.page for block in packed.blocks], [1, 3])
+        self.assertEqual(packed.dropped, 1)
+        self.assertLessEqual(packed.tokens, budget)
+
+    def test_first_result_always_included(self):
+        """予算より大きくても最上位の結果は入れる"""
+        packed = pack_context([_result("あ" * 100, page=1, chunk_id=0)], budget_tokens=10)
+        self.assertEqual(len(packed.blocks), 1)
+
+    def test_format_context(self):
+        """資料番号は関連度の高い順"""
+        packed = pack_context([_result("A", 2, 0), _result("B", 1, 0)], budget_tokens=0)
+        self.assertEqual(format_context(packed), "\n--- 資料 1 ---\nA\n\n--- 資料 2 ---\nB\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
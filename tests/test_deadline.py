@@ -0,0 +1,155 @@
+"""
+レイテンシ予算（デッドライン）とヘッジリクエストのテスト
+"""
+import unittest
+import os
+import sys
+import threading
+import time
+from unittest import mock
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    LatencyTracker,
+    call_with_deadline,
+)
+from src.utils.error_handler import APIRetryHandler, classify_error
+from src.utils.rate_limit import reset_registries
+from src.retrieval.reranker import rerank_with_llm
+
+
+class TestDeadline(unittest.TestCase):
+    """Deadlineのテストクラス"""
+
+    def test_remaining_share_and_marks(self):
+        now = [100.0]
+        deadline = Deadline(10.0, clock=lambda: now[0])
+        now[0] += 4
+        deadline.mark('search_ms')
+        self.assertAlmostEqual(deadline.remaining(), 6.0)
+        self.assertAlmostEqual(deadline.share(0.3), 3.0)
+        self.assertAlmostEqual(deadline.share(0.9), 6.0)
+        self.assertEqual(deadline.timings, {'search_ms': 4000.0})
+
+        now[0] += 7
+        self.assertTrue(deadline.expired)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.check("generation")
+
+    def test_latency_tracker_percentile(self):
+        tracker = LatencyTracker(min_samples=5)
+        self.assertIsNone(tracker.percentile(95))
+        for seconds in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]:
+            tracker.record(seconds)
+        self.assertEqual(tracker.percentile(90), 9)
+        self.assertEqual(tracker.percentile(100), 10)
+
+
+class TestCallWithDeadline(unittest.TestCase):
+    """call_with_deadlineのテストクラス"""
+
+    def test_timeout(self):
+        release = threading.Event()
+        with self.assertRaises(DeadlineExceeded):
+            call_with_deadline(lambda: release.wait(5), timeout=0.05)
+        release.set()
+
+    def test_hedged_request_returns_first_response(self):
+        """最初の呼び出しが遅い場合、ヘッジした呼び出しの結果を使う"""
+        calls = []
+        release = threading.Event()
+
+        def slow_then_fast():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        started_at = time.monotonic()
+        result = call_with_deadline(slow_then_fast, timeout=2.0, hedge_after=0.05)
+        release.set()
+        self.assertEqual(result, "fast")
+        self.assertEqual(len(calls), 2)
+        self.assertLess(time.monotonic() - started_at, 1.0)
+
+    def test_no_hedge_when_fast(self):
+        calls = []
+        result = call_with_deadline(lambda: calls.append(1) or "ok", timeout=1.0, hedge_after=0.5)
+        self.assertEqual(result, "ok")
+        self.assertEqual(len(calls), 1)
+
+
+class TestDeadlineRetry(unittest.TestCase):
+    """APIリトライハンドラーとデッドラインの組み合わせのテストクラス"""
+
+    def setUp(self):
+        reset_registries()
+
+    def tearDown(self):
+        reset_registries()
+
+    def test_hedge_uses_a_rate_limit_token(self):
+        """ヘッジはトークンを1つ使い、トークンがなければヘッジしない"""
+        def slow_then_fast(calls, release):
+            def call():
+                calls.append(len(calls))
+                if len(calls) == 1:
+                    release.wait(5)
+                    return "slow"
+                return "fast"
+            return call
+
+        handler = APIRetryHandler(max_retries=1, provider="fake:hedge", requests_per_minute=60, burst=2,
+                                  hedge_percentile=50, sleep=lambda _: None)
+        with mock.patch.object(handler.latency_tracker, "percentile", return_value=0.05):
+            calls, release = [], threading.Event()
+            self.assertEqual(handler.execute(slow_then_fast(calls, release)), "fast")
+            release.set()
+            self.assertEqual(len(calls), 2)
+            self.assertLess(handler.rate_limiter.tokens, 0.5)
+
+            # バケットが空ならヘッジせず、最初の呼び出しの応答を待つ
+            handler.rate_limiter.tokens = 0.0
+            calls, release = [], threading.Event()
+            threading.Timer(0.2, release.set).start()
+            self.assertEqual(handler.execute(slow_then_fast(calls, release)), "slow")
+            self.assertEqual(len(calls), 1)
+
+    def test_slow_call_is_cut_off(self):
+        release = threading.Event()
+        handler = APIRetryHandler(max_retries=3, provider="fake:slow",
+                                  deadline=Deadline(0.1), sleep=lambda _: None)
+        with self.assertRaises(DeadlineExceeded) as context:
+            handler.execute(lambda: release.wait(5))
+        release.set()
+        self.assertEqual(classify_error(context.exception), "deadline")
+
+    def test_no_retry_beyond_budget(self):
+        """バックオフが残り時間を超える場合はリトライしない"""
+        calls = []
+
+        def failing():
+            calls.append(1)
+            raise Exception("429 quota exceeded. Please retry in 30s")
+
+        handler = APIRetryHandler(max_retries=3, provider="fake:quota",
+                                  deadline=Deadline(1.0), sleep=lambda _: None)
+        with self.assertRaises(Exception):
+            handler.execute(failing)
+        self.assertEqual(len(calls), 1)
+
+    def test_rerank_without_budget_keeps_vector_order(self):
+        """リランキングの予算がない場合はベクトル検索の順序を返す"""
+        results = [{"content": f"chunk {i}", "metadata": {"page": i}, "distance": i / 10}
+                   for i in range(5)]
+        reranked = rerank_with_llm("質問", results, top_k=3, timeout=0)
+        self.assertEqual(reranked, results[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+"""
+ほぼ重複したチャンクの検出（MinHash）のテスト
+"""
+import unittest
+import os
+import sys
+import json
+import tempfile
+import shutil
+from unittest import mock
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config import settings
+from src.ingestion.dedup import (
+    DedupIndex,
+    MinHasher,
+    collapse_duplicates,
+    dedup_plan_path,
+    estimate_similarity,
+    load_dedup_plan,
+    plan_dedup,
+    save_dedup_plan,
+)
+from src.pipeline.resources import PipelineResources, get_pipeline_resources
+from tests.test_job_queue import KeywordEmbeddingFunction
+
+BOILERPLATE = ("本書の内容の一部または全部を無断で複製・転載することを禁じます。"
+               "お問い合わせは発行元までお願いいたします。本書に記載の情報は発行時点のものです。")
+
+
+def _chunk(content, source, page):
+    return {"content": content, "metadata": {"source": source, "page": page}}
+
+
+class TestMinHash(unittest.TestCase):
+    """MinHash署名のテストクラス"""
+
+    def setUp(self):
+        self.hasher = MinHasher(num_perm=64)
+
+    def test_identical_texts(self):
+        """同じテキスト（空白の違いのみ）は類似度1"""
+        a = self.hasher.signature(BOILERPLATE)
+        b = self.hasher.signature(BOILERPLATE.replace("。", "。 \n"))
+        self.assertEqual(estimate_similarity(a, b), 1.0)
+
+    def test_near_and_different_texts(self):
+        """1文字違いは高く、無関係なテキストは低い"""
+        a = self.hasher.signature(BOILERPLATE)
+        near = self.hasher.signature(BOILERPLATE.replace("発行時点", "発行当時"))
+        other = self.hasher.signature("ナアマンは重い皮膚病を患っていたが、ヨルダン川で7回身を浸して癒やされた。")
+        self.assertGreater(estimate_similarity(a, near), 0.7)
+        self.assertLess(estimate_similarity(a, other), 0.2)
+
+    def test_deterministic(self):
+        """同じシードなら署名は同じ"""
+        self.assertTrue((MinHasher(seed=3).signature(BOILERPLATE) ==
+                         MinHasher(seed=3).signature(BOILERPLATE)).all())
+
+
+class TestPlanDedup(unittest.TestCase):
+    """重複グループ化と重複インデックスのテストクラス"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = DedupIndex(os.path.join(self.temp_dir, "dedup", "docs.db"))
+        self.hasher = MinHasher()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _ingest(self, source, contents):
+        ids = [f"{source}_{i}" for i in range(len(contents))]
+        chunks = [_chunk(content, source, i + 1) for i, content in enumerate(contents)]
+        plan = plan_dedup(ids, chunks, self.index, source, self.hasher)
+        promoted = self.index.replace_source(source, ids, chunks, plan)
+        return plan, promoted
+
+    def test_within_document(self):
+        """同じ文書内の重複は最初のチャンクが代表になる"""
+        plan, _ = self._ingest("a.pdf", [BOILERPLATE, "固有の本文です。" * 5, BOILERPLATE])
+        self.assertEqual(plan.representatives, [0, 1])
+        self.assertEqual(plan.groups, ["a.pdf_0", "a.pdf_1", "a.pdf_0"])
+
+    def test_across_documents_with_provenance(self):
+        """他の文書の代表と重複するチャンクは埋め込まず、出典はすべて残る"""
+        self._ingest("v1.pdf", [BOILERPLATE, "第1版の本文。" * 5])
+        plan, _ = self._ingest("v2.pdf", [BOILERPLATE, "第2版で書き換えた本文。" * 5])
+        self.assertEqual(plan.representatives, [1])
+        self.assertEqual(plan.groups[0], "v1.pdf_0")
+
+        copies = self.index.copies(["v1.pdf_0"])["v1.pdf_0"]
+        self.assertEqual(copies, [{"source": "v1.pdf", "page": 1}, {"source": "v2.pdf", "page": 1}])
+
+    def test_reingest_does_not_match_itself(self):
+        """取り込み直しでは自分自身の古い記録と重複扱いしない"""
+        self._ingest("a.pdf", [BOILERPLATE])
+        plan, promoted = self._ingest("a.pdf", [BOILERPLATE])
+        self.assertEqual(plan.representatives, [0])
+        self.assertEqual(promoted, [])
+
+    def test_promote_on_delete(self):
+        """代表の文書を削除すると、他の文書のコピーが代表に昇格する"""
+        self._ingest("v1.pdf", [BOILERPLATE])
+        self._ingest("v2.pdf", [BOILERPLATE])
+        promoted = self.index.replace_source("v1.pdf", [], [])
+
+        self.assertEqual([p["id"] for p in promoted], ["v2.pdf_0"])
+        self.assertEqual(promoted[0]["metadata"], {"source": "v2.pdf", "page": 1, "dup_group": "v2.pdf_0"})
+        self.assertEqual(promoted[0]["content"], BOILERPLATE)
+        # 昇格したチャンクは以降の取り込みで代表として見つかる
+        plan, _ = self._ingest("v3.pdf", [BOILERPLATE])
+        self.assertEqual(plan.groups, ["v2.pdf_0"])
+
+    def test_reingest_keeps_group_with_new_representative(self):
+        """取り込み直しでチャンクの位置が変わっても、他の文書のコピーを昇格させず代表を引き継ぐ"""
+        self._ingest("v1.pdf", [BOILERPLATE])
+        self._ingest("v2.pdf", [BOILERPLATE])
+        plan, promoted = self._ingest("v1.pdf", ["新しく追加した序文です。" * 5, BOILERPLATE])
+
+        self.assertEqual(plan.representatives, [0, 1])
+        self.assertEqual(plan.adopted, {"v1.pdf_1": "v1.pdf_0"})
+        self.assertEqual(promoted, [])
+        copies = self.index.copies(["v1.pdf_1"])["v1.pdf_1"]
+        self.assertEqual(copies, [{"source": "v1.pdf", "page": 2}, {"source": "v2.pdf", "page": 1}])
+
+    def test_reingest_with_changed_content_promotes_copy(self):
+        """古い代表と同じIDのチャンクの内容が変わった場合は、他の文書のコピーが代表に昇格する"""
+        self._ingest("v1.pdf", [BOILERPLATE])
+        self._ingest("v2.pdf", [BOILERPLATE])
+        plan, promoted = self._ingest("v1.pdf", ["書き換えた本文です。" * 5])
+
+        self.assertEqual(plan.adopted, {})
+        self.assertEqual([p["id"] for p in promoted], ["v2.pdf_0"])
+        self.assertEqual(self.index.copies(["v1.pdf_0"])["v1.pdf_0"], [{"source": "v1.pdf", "page": 1}])
+
+    def test_plan_uses_one_connection(self):
+        """重複インデックスの候補は文書ごとに1つの接続でまとめて検索する"""
+        self._ingest("v1.pdf", [BOILERPLATE, "第1版の本文。" * 5])
+        contents = [f"第{i}章の本文です。" * 5 for i in range(30)] + [BOILERPLATE]
+        ids = [f"v2.pdf_{i}" for i in range(len(contents))]
+        chunks = [_chunk(content, "v2.pdf", i + 1) for i, content in enumerate(contents)]
+
+        with mock.patch.object(self.index, "_connect", wraps=self.index._connect) as connect:
+            plan = plan_dedup(ids, chunks, self.index, "v2.pdf", self.hasher)
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(plan.groups[-1], "v1.pdf_0")
+
+    def test_collapse_duplicates(self):
+        """検索結果はグループごとに最上位だけ残し、他の出典を付ける"""
+        self._ingest("v1.pdf", [BOILERPLATE])
+        self._ingest("v2.pdf", [BOILERPLATE])
+        results = [
+            {"content": BOILERPLATE, "metadata": {"source": "v1.pdf", "page": 1, "dup_group": "v1.pdf_0"},
+             "distance": 0.1},
+            {"content": "x", "metadata": {"source": "old.pdf", "page": 2}, "distance": 0.2},
+            {"content": BOILERPLATE, "metadata": {"source": "v1.pdf", "page": 1, "dup_group": "v1.pdf_0"},
+             "distance": 0.3},
+        ]
+        collapsed = collapse_duplicates(results, self.index)
+        self.assertEqual([r["distance"] for r in collapsed], [0.1, 0.2])
+        self.assertEqual(collapsed[0]["duplicates"], [{"source": "v2.pdf", "page": 1}])
+        self.assertNotIn("duplicates", collapsed[1])
+
+    def test_plan_roundtrip(self):
+        """保存した計画は同じ代表・グループで読み込め、チャンク数が変わった場合は使わない"""
+        self._ingest("v1.pdf", [BOILERPLATE])
+        ids = ["v2.pdf_0", "v2.pdf_1"]
+        chunks = [_chunk(BOILERPLATE, "v2.pdf", 1), _chunk("固有の内容です。", "v2.pdf", 2)]
+        plan = plan_dedup(ids, chunks, self.index, "v2.pdf", self.hasher)
+        path = dedup_plan_path(os.path.join(self.temp_dir, "v2.json"))
+        save_dedup_plan(path, plan)
+
+        loaded = load_dedup_plan(path, chunks, self.hasher)
+        self.assertEqual((loaded.representatives, loaded.groups, loaded.adopted),
+                         (plan.representatives, plan.groups, plan.adopted))
+        self.assertTrue((loaded.signatures == plan.signatures).all())
+        self.assertIsNone(load_dedup_plan(path, chunks[:1], self.hasher))
+        self.assertIsNone(load_dedup_plan(path + ".missing", chunks, self.hasher))
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestResumeWithDedup(unittest.TestCase):
+    """重複除去を有効にした登録の再開のテストクラス"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.patches = [
+            mock.patch.object(PipelineResources, "embedding_function",
+                              lambda self, task_type, model_name=None: KeywordEmbeddingFunction()),
+            mock.patch.object(settings.embedding, "api_key", "test-key"),
+            mock.patch.object(settings.ingestion, "dedup_enabled", True),
+            mock.patch.object(settings.storage, "vector_quantization", "none"),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        get_pipeline_resources().invalidate(self.storage_path, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write(self, name, contents):
+        path = os.path.join(self.temp_dir, f"{name}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([_chunk(content, f"{name}.pdf", i + 1) for i, content in enumerate(contents)], f,
+                      ensure_ascii=False)
+        return path
+
+    def test_resume_uses_saved_plan(self):
+        """中断中に他の文書が取り込まれても、再開時は中断前の計画の代表を登録する"""
+        from src.embedding.store import store_embeddings
+
+        a = self._write("a", [BOILERPLATE, "ナアマンはヨルダン川で7回身を浸した。"])
+
+        def interrupt(done, total):
+            raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            store_embeddings(a, self.storage_path, progress_callback=interrupt, batch_size=1,
+                             collection_name="docs")
+        self.assertTrue(os.path.exists(dedup_plan_path(a)))
+
+        # 中断中に同じ定型文を含む文書が取り込まれ、共有の重複インデックスが変わる
+        store_embeddings(self._write("b", [BOILERPLATE]), self.storage_path, collection_name="docs")
+
+        self.assertEqual(store_embeddings(a, self.storage_path, start_index=1, batch_size=1,
+                                          collection_name="docs"), 2)
+        ids = get_pipeline_resources().client(self.storage_path).get_collection("docs").get(include=[])["ids"]
+        self.assertIn("a.json_1", ids)
+        self.assertFalse(os.path.exists(dedup_plan_path(a)))
+
+    def test_resume_without_plan_restarts(self):
+        """計画が残っていない場合は最初のチャンクから登録し直す"""
+        from src.embedding.store import store_embeddings
+
+        a = self._write("a", [BOILERPLATE, "ナアマンはヨルダン川で7回身を浸した。"])
+        self.assertEqual(store_embeddings(a, self.storage_path, start_index=1, batch_size=1,
+                                          collection_name="docs"), 2)
+        ids = get_pipeline_resources().client(self.storage_path).get_collection("docs").get(include=[])["ids"]
+        self.assertEqual(sorted(ids), ["a.json_0", "a.json_1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+埋め込みモデルの記録・振り分けと移行のテスト
+"""
+import unittest
+import os
+import sys
+import json
+import tempfile
+import shutil
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.embedding.model_info import (
+    collection_metadata,
+    record_embedding_model,
+    recorded_dimensions,
+    recorded_model,
+    resolve_embedding_model,
+)
+from src.pipeline.aliases import resolve_collection
+from src.pipeline.migration import active_embedding_model, migrate_embedding_model
+from src.pipeline.resources import PipelineResources, get_pipeline_resources
+from src.pipeline.tenants import collection_name_for
+from src.utils.error_handler import EmbeddingModelMismatch, classify_error, is_retryable_error
+
+
+class RecordingResources(PipelineResources):
+    """埋め込み関数を作らずに、要求されたモデルを記録する"""
+
+    def __init__(self):
+        super().__init__()
+        self.requested_models = []
+
+    def embedding_function(self, task_type, model_name=None):
+        self.requested_models.append(model_name)
+        return None
+
+
+class TestEmbeddingModel(unittest.TestCase):
+    """埋め込みモデルの記録と振り分けのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.resources = RecordingResources()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.resources.invalidate(self.storage_path, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_resolve_embedding_model(self):
+        """記録と異なるモデルは記録されたモデルに振り分けるか、拒否する"""
+        self.assertEqual(resolve_embedding_model("docs", None, "m-new", "refuse"), "m-new")
+        self.assertEqual(resolve_embedding_model("docs", "m-new", "m-new", "refuse"), "m-new")
+        self.assertEqual(resolve_embedding_model("docs", "m-old", "m-new", "route"), "m-old")
+        with self.assertRaises(EmbeddingModelMismatch) as context:
+            resolve_embedding_model("docs", "m-old", "m-new", "refuse")
+        self.assertEqual(classify_error(context.exception), "model")
+        self.assertFalse(is_retryable_error(context.exception))
+
+    def test_record_model_and_dimensions(self):
+        """作成時にモデルを記録し、次元数を後から追記できる"""
+        client = self.resources.client(self.storage_path)
+        collection = client.get_or_create_collection("docs", metadata=collection_metadata("m-old"))
+        collection.add(ids=["a"], embeddings=[[1.0, 0.0, 0.5]], documents=["本文"])
+        self.assertEqual(recorded_model(collection), "m-old")
+        self.assertIsNone(recorded_dimensions(collection))
+
+        self.assertTrue(record_embedding_model(collection, "m-old", 3))
+        self.assertFalse(record_embedding_model(collection, "m-old", 3))
+        reopened = client.get_collection("docs")
+        self.assertEqual((recorded_model(reopened), recorded_dimensions(reopened)), ("m-old", 3))
+
+    def test_collection_routes_to_recorded_model(self):
+        """設定と異なるモデルで作成されたコレクションは、記録されたモデルの埋め込み関数で開く"""
+        client = self.resources.client(self.storage_path)
+        client.get_or_create_collection("docs", metadata=collection_metadata("m-old"))
+        client.get_or_create_collection("legacy")
+
+        self.resources.collection(self.storage_path, "docs", model_name="m-new")
+        self.assertEqual(self.resources.requested_models[-1], "m-old")
+        self.resources.collection(self.storage_path, "legacy", model_name="m-new")
+        self.assertEqual(self.resources.requested_models[-1], "m-new")
+
+
+class FakeStore:
+    """store_embeddings の代わりに、モデルを記録したコレクションに決まった埋め込みで登録する"""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def __call__(self, processed_path, storage_path, collection_name):
+        with open(processed_path, encoding="utf-8") as f:
+            chunks = json.load(f)
+        collection = get_pipeline_resources().client(storage_path).get_or_create_collection(
+            collection_name, metadata=collection_metadata(self.model_name))
+        collection.upsert(ids=[f"{os.path.basename(processed_path)}_{i}" for i in range(len(chunks))],
+                          documents=[c["content"] for c in chunks],
+                          metadatas=[c["metadata"] for c in chunks],
+                          embeddings=[c["embedding"] for c in chunks])
+        return len(chunks)
+
+
+class TestMigration(unittest.TestCase):
+    """埋め込みモデルの移行のテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.processed_dir = os.path.join(self.temp_dir, "processed")
+        os.makedirs(self.processed_dir)
+        self.logical = collection_name_for(None)
+        chunks = [{"content": f"本文 {i}", "embedding": [float(i), 1.0, 0.5],
+                   "metadata": {"source": "doc.pdf", "page": 1, "chunk_id": i}} for i in range(5)]
+        with open(os.path.join(self.processed_dir, "doc.json"), "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+        FakeStore("m-old")(os.path.join(self.processed_dir, "doc.json"), self.storage_path, self.logical)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        get_pipeline_resources().invalidate(self.storage_path, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _migrate(self, model_name):
+        return migrate_embedding_model(model_name, self.storage_path, store=FakeStore(model_name),
+                                       processed_dir=self.processed_dir, sample_size=5, min_recall=0.5,
+                                       gc_grace_seconds=3600)
+
+    def test_migrate_and_cut_over(self):
+        """新しいモデルの版を作ってから切り替え、移行済みなら何もしない"""
+        self.assertEqual(active_embedding_model(self.storage_path), "m-old")
+
+        result = self._migrate("m-new")
+        self.assertTrue(result.switched)
+        self.assertEqual(result.previous, self.logical)
+        self.assertEqual(resolve_collection(self.storage_path, self.logical), result.target)
+        self.assertEqual(active_embedding_model(self.storage_path), "m-new")
+
+        self.assertIsNone(self._migrate("m-new"))
+
+
+if __name__ == '__main__':
+    unittest.main()
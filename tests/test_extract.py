@@ -1,7 +1,10 @@
 import unittest
 import sys
 import os
+import tempfile
+import shutil
 from pathlib import Path
+from unittest import mock
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
@@ -43,5 +46,52 @@ class TestExtract(unittest.TestCase):
             extract_text_from_pdf(nonexistent_path)
 
 
+class TestParallelExtract(unittest.TestCase):
+    """ページ範囲の並列抽出のテスト"""
+
+    def setUp(self):
+        import fitz
+
+        from src.config import settings
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.pdf_path = os.path.join(self.temp_dir, "manual.pdf")
+        # レイアウト解析のキャッシュを使わないよう、呼び出しごとに別のキャッシュディレクトリにする
+        self.cache_index = 0
+        patcher = mock.patch.object(type(settings.ingestion), "layout_cache_dir",
+                                    property(self._next_cache_dir), create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        doc = fitz.open()
+        for i in range(12):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Section {i + 1}")
+            page.insert_text((72, 120), f"Body text of page {i + 1}.")
+        doc.save(self.pdf_path)
+        doc.close()
+
+    def _next_cache_dir(self, _):
+        self.cache_index += 1
+        return os.path.join(self.temp_dir, f"layout_cache_{self.cache_index}")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_parallel_matches_serial(self):
+        """複数プロセスで抽出してもページ順・内容は逐次抽出と同じ"""
+        serial = extract_text_from_pdf(self.pdf_path, workers=1)
+        parallel = extract_text_from_pdf(self.pdf_path, workers=3, min_pages_per_worker=1)
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual([p['page'] for p in parallel], list(range(1, 13)))
+        self.assertIn("Section 5", parallel[4]['content'])
+        self.assertEqual(parallel[0]['metadata'], {"source": "manual.pdf", "total_pages": 12})
+
+    def test_small_document_is_not_split(self):
+        """1プロセスあたりのページ数が少なすぎる場合は分割しない"""
+        result = extract_text_from_pdf(self.pdf_path, workers=4, min_pages_per_worker=50)
+        self.assertEqual(len(result), 12)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,74 @@
+"""
+遅延インポートと遅延設定構築のテスト
+"""
+import unittest
+import os
+import sys
+import subprocess
+import tempfile
+import shutil
+import textwrap
+
+# プロジェクトルートをパスに追加
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.bench_importtime import HEAVY_MODULES, parse_importtime
+
+
+def run_python(code: str, cwd: str) -> str:
+    """新しいプロセスでコードを実行して標準出力を返す"""
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT)
+    result = subprocess.run([sys.executable, "-c", textwrap.dedent(code)], cwd=cwd, env=env,
+                            capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return result.stdout.strip()
+
+
+class TestLazyImports(unittest.TestCase):
+    """インポート時に重い処理が行われないことのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_helpers_do_not_load_heavy_dependencies(self):
+        """UIヘルパーのインポートでは chromadb などを読み込まない"""
+        output = run_python(f"""
+            import sys
+            import src.ui.streamlit_helpers
+            print(",".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))
+        """, cwd=self.work_dir)
+        self.assertEqual(output, "")
+
+    def test_settings_import_has_no_side_effects(self):
+        """設定のインポートではディレクトリ作成も.envの読み込みも行わない"""
+        with open(os.path.join(self.work_dir, ".env"), "w", encoding="utf-8") as f:
+            f.write("CHAT_PAGE_SIZE=7\n")
+        output = run_python("""
+            import os
+            from src.config import settings
+            from src.utils.logger import setup_logger
+            setup_logger("lazy_test")
+            print(sorted(os.listdir(".")))
+            print(settings.app.chat_page_size)
+        """, cwd=self.work_dir)
+        listing, page_size = output.splitlines()
+        self.assertEqual(listing, "['.env']")
+        self.assertEqual(page_size, "7")
+
+    def test_parse_importtime(self):
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        120 |   json.decoder\n"
+                  "import time:       300 |        420 | json\n")
+        self.assertEqual(parse_importtime(stderr),
+                         [("json.decoder", 120, 120), ("json", 300, 420)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+"""
+取り込みジョブキューとワーカーのテスト
+"""
+import unittest
+import os
+import sys
+import json
+import time
+import tempfile
+import shutil
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.ingestion.job_queue import JobQueue, QUEUED, RUNNING, DONE, FAILED
+from src.ingestion.worker import process_job, run_worker
+
+
+def fake_extract(pdf_path, metrics):
+    return [{"page": i + 1, "content": f"page {i + 1}", "metadata": {"source": os.path.basename(pdf_path)}}
+            for i in range(3)]
+
+
+def fake_chunk(extracted_data):
+    return [{"content": page["content"], "metadata": page["metadata"]} for page in extracted_data]
+
+
+class FakeStore:
+    """store_embeddings の代わりに登録位置を記録し、指定した位置で失敗する"""
+
+    def __init__(self, fail_at=None, batch_size=1):
+        self.fail_at = fail_at
+        self.batch_size = batch_size
+        self.start_indexes = []
+
+    def __call__(self, processed_path, storage_path, progress_callback, start_index, collection_name=None):
+        self.start_indexes.append(start_index)
+        with open(processed_path, encoding="utf-8") as f:
+            total = len(json.load(f))
+        for end in range(start_index + self.batch_size, total + 1, self.batch_size):
+            if self.fail_at is not None and end > self.fail_at:
+                self.fail_at = None
+                raise ConnectionError("network error")
+            progress_callback(end, total)
+        return total
+
+
+def text_extract(pdf_path, metrics):
+    """PDFの代わりに保存したテキストを1ページとして読む"""
+    with open(pdf_path, encoding="utf-8") as f:
+        return [{"page": 1, "content": f.read(), "metadata": {"source": os.path.basename(pdf_path)}}]
+
+
+class KeywordEmbeddingFunction:
+    """単語のハッシュによる埋め込み（APIを呼ばずに検索まで確認するため）"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, input):
+        import zlib
+
+        vectors = []
+        for text in input:
+            vector = [0.0] * 32
+            for word in text.split():
+                vector[zlib.crc32(word.encode("utf-8")) % 32] += 1.0
+            vectors.append(vector)
+        return vectors
+
+    def embed_query(self, input):
+        return self(input)
+
+    @staticmethod
+    def name():
+        return "keyword_test"
+
+    def get_config(self):
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return KeywordEmbeddingFunction()
+
+    def is_legacy(self):
+        return False
+
+
+WORKER_SCRIPT = """
+import sys
+from unittest import mock
+sys.path.insert(0, {root!r})
+
+from src.config import settings
+from src.ingestion.job_queue import JobQueue
+from src.ingestion.worker import run_worker
+from src.pipeline.resources import PipelineResources
+from tests.test_job_queue import KeywordEmbeddingFunction, fake_chunk, text_extract
+
+with mock.patch.object(PipelineResources, "embedding_function",
+                       lambda self, task_type, model_name=None: KeywordEmbeddingFunction()), \
+        mock.patch.object(settings.embedding, "api_key", "test-key"):
+    run_worker(JobQueue({queue_path!r}), "worker-process", poll_interval=0, exit_when_idle=True,
+               extract=text_extract, chunk=fake_chunk)
+"""
+
+
+class TestJobQueue(unittest.TestCase):
+    """JobQueueのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.queue = JobQueue(os.path.join(self.temp_dir, "jobs.db"), lease_seconds=60, max_attempts=2)
+        self.processed_dir = os.path.join(self.temp_dir, "processed")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _enqueue(self, name="doc.pdf", owner="s1"):
+        return self.queue.enqueue(os.path.join(self.temp_dir, name), owner=owner,
+                                  processed_dir=self.processed_dir,
+                                  storage_path=os.path.join(self.temp_dir, "chroma"))
+
+    def test_claim_in_order_and_only_once(self):
+        """ジョブは登録順に1回だけ取得される"""
+        first = self._enqueue("a.pdf")
+        second = self._enqueue("b.pdf")
+
+        job = self.queue.claim("w1")
+        self.assertEqual(job['id'], first)
+        self.assertEqual(job['status'], RUNNING)
+        self.assertEqual(job['attempts'], 1)
+        self.assertEqual(self.queue.claim("w2")['id'], second)
+        self.assertIsNone(self.queue.claim("w3"))
+
+    def test_stale_job_is_reclaimed_then_failed(self):
+        """ハートビートが途絶えたジョブは引き継がれ、試行回数の上限で失敗になる"""
+        job_id = self._enqueue()
+        self.queue.claim("w1")
+        self.assertIsNone(self.queue.claim("w2"))
+
+        self.queue.lease_seconds = -1
+        reclaimed = self.queue.claim("w2")
+        self.assertEqual(reclaimed['id'], job_id)
+        self.assertEqual(reclaimed['worker_id'], "w2")
+        self.assertEqual(reclaimed['attempts'], 2)
+
+        self.assertIsNone(self.queue.claim("w3"))
+        self.assertEqual(self.queue.get(job_id)['status'], FAILED)
+
+    def test_fail_with_retry(self):
+        """再試行可能なエラーは上限まで待機中に戻る"""
+        job_id = self._enqueue()
+        self.queue.claim("w1")
+        self.queue.fail(job_id, "network error", retry=True)
+        self.assertEqual(self.queue.get(job_id)['status'], QUEUED)
+
+        self.queue.claim("w1")
+        self.queue.fail(job_id, "network error", retry=True)
+        self.assertEqual(self.queue.get(job_id)['status'], FAILED)
+
+    def test_list_jobs_by_owner(self):
+        self._enqueue("a.pdf", owner="s1")
+        self._enqueue("b.pdf", owner="s2")
+        self.assertEqual([job['filename'] for job in self.queue.list_jobs("s1")], ["a.pdf"])
+        self.assertEqual(len(self.queue.list_jobs()), 2)
+
+    def test_tenant_concurrency_limit(self):
+        """同時実行数の上限に達したテナントのジョブは飛ばし、他のテナントのジョブを先に処理する"""
+        queue = JobQueue(os.path.join(self.temp_dir, "tenant_jobs.db"), max_jobs_per_tenant=1)
+        big = [queue.enqueue(f"big{i}.pdf", tenant="team-a") for i in range(3)]
+        small = queue.enqueue("small.pdf", tenant="team-b")
+        default = [queue.enqueue(f"default{i}.pdf") for i in range(2)]
+
+        self.assertEqual(queue.claim("w1")['id'], big[0])
+        self.assertEqual(queue.claim("w2")['id'], small)
+        # 既定のテナント（一括取り込み・監視フォルダ）のジョブは上限の対象外
+        self.assertEqual(queue.claim("w3")['id'], default[0])
+        self.assertEqual(queue.claim("w4")['id'], default[1])
+        self.assertIsNone(queue.claim("w5"))
+        self.assertEqual(queue.pending_count("team-a"), 3)
+
+        queue.complete(big[0])
+        self.assertEqual(queue.claim("w1")['id'], big[1])
+
+    def test_worker_liveness(self):
+        self.assertEqual(self.queue.live_worker_count(), 0)
+        self.queue.worker_heartbeat("w1")
+        self.assertEqual(self.queue.live_worker_count(), 1)
+        self.queue.remove_worker("w1")
+        self.assertEqual(self.queue.live_worker_count(), 0)
+
+    def test_process_job_records_progress(self):
+        """各段階を実行し、進捗・所要時間を記録して完了する"""
+        job_id = self._enqueue()
+        job = self.queue.claim("w1")
+        self.assertEqual(process_job(self.queue, job, extract=fake_extract, chunk=fake_chunk,
+                                     store=FakeStore()), 3)
+
+        done = self.queue.get(job_id)
+        self.assertEqual(done['status'], DONE)
+        self.assertEqual(done['stage'], "done")
+        self.assertEqual(done['embedded_count'], 3)
+        self.assertTrue(os.path.exists(done['processed_path']))
+        self.assertEqual(set(done['stage_timings']), {"extract_ms", "chunk_ms", "embed_ms"})
+
+    def test_resume_after_failure(self):
+        """再試行では抽出・チャンク化を省略し、登録済みの位置から埋め込みを再開する"""
+        job_id = self._enqueue()
+        store = FakeStore(fail_at=2)
+        extract_calls = []
+
+        def counting_extract(pdf_path, metrics):
+            extract_calls.append(pdf_path)
+            return fake_extract(pdf_path, metrics)
+
+        stages = dict(extract=counting_extract, chunk=fake_chunk, store=store)
+        self.assertEqual(run_worker(self.queue, "w1", poll_interval=0, max_jobs=1, **stages), 1)
+        failed = self.queue.get(job_id)
+        self.assertEqual(failed['status'], QUEUED)
+        self.assertEqual(failed['embedded_count'], 2)
+
+        run_worker(self.queue, "w1", poll_interval=0, max_jobs=1, **stages)
+        self.assertEqual(self.queue.get(job_id)['status'], DONE)
+        self.assertEqual(len(extract_calls), 1)
+        self.assertEqual(store.start_indexes, [0, 2])
+
+    def test_default_store_does_not_retry_whole_file(self):
+        """埋め込みの失敗はファイル全体を最初から登録し直さず、ジョブの再試行で登録済みの位置から再開する"""
+        from unittest import mock
+
+        from src.ingestion import worker
+
+        calls = []
+
+        def failing_store(processed_path, storage_path, progress_callback=None, start_index=0,
+                          collection_name=None):
+            calls.append(start_index)
+            progress_callback(2, 3)
+            raise ConnectionError("network error")
+
+        with mock.patch("src.embedding.store.store_embeddings", failing_store):
+            with self.assertRaises(ConnectionError):
+                worker._default_store("chunks.json", self.temp_dir, lambda done, total: None, 1)
+        self.assertEqual(calls, [1])
+
+
+class TestWorkerToSearch(unittest.TestCase):
+    """別プロセスのワーカーが取り込んだチャンクを、起動中のアプリの検索で見つけられることのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        from unittest import mock
+
+        from src.config import settings
+        from src.pipeline.resources import PipelineResources
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.queue_path = os.path.join(self.temp_dir, "jobs.db")
+        self.queue = JobQueue(self.queue_path)
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.processed_dir = os.path.join(self.temp_dir, "processed")
+        self.patches = [
+            mock.patch.object(PipelineResources, "embedding_function",
+                              lambda resources, task_type, model_name=None: KeywordEmbeddingFunction()),
+            mock.patch.object(settings.embedding, "api_key", "test-key"),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        from src.pipeline.resources import get_pipeline_resources
+
+        for patch in self.patches:
+            patch.stop()
+        get_pipeline_resources().invalidate(self.storage_path, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _ingest_in_worker_process(self, filename, text):
+        import subprocess
+
+        pdf_path = os.path.join(self.temp_dir, filename)
+        with open(pdf_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        job_id = self.queue.enqueue(pdf_path, processed_dir=self.processed_dir, storage_path=self.storage_path)
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        subprocess.run([sys.executable, "-c", WORKER_SCRIPT.format(root=root, queue_path=self.queue_path)],
+                       check=True, timeout=120, cwd=root)
+        self.assertEqual(self.queue.get(job_id)['status'], DONE)
+
+    def _top_source(self, query):
+        from src.retrieval.search import semantic_search
+
+        results = semantic_search(query, self.storage_path, top_k=1)
+        return results[0]["metadata"]["source"] if results else None
+
+    def test_worker_ingest_is_searchable_without_restart(self):
+        """ジョブの登録 → ワーカーの完了 → 起動中のアプリの検索で新しいチャンクが見つかる"""
+        self._ingest_in_worker_process("apples.pdf", "apple banana cherry orchard harvest")
+        self.assertEqual(self._top_source("apple orchard"), "apples.pdf")
+
+        self._ingest_in_worker_process("zoo.pdf", "zebra walrus yak penguin keeper")
+        self.assertEqual(self._top_source("zebra walrus penguin"), "zoo.pdf")
+
+
+if __name__ == '__main__':
+    unittest.main()
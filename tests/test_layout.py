@@ -0,0 +1,110 @@
+"""
+レイアウト解析（読み順・表・ヘッダー/フッター・キャッシュ）のテスト
+"""
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+from unittest import mock
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import fitz
+
+from src.config import settings
+from src.ingestion.extract import extract_text_from_pdf
+from src.ingestion.layout import order_blocks, remove_repeated_margins, table_to_text
+
+
+def _block(x0, y0, x1, y1, text):
+    return {"bbox": [x0, y0, x1, y1], "text": text, "type": "text"}
+
+
+class TestLayout(unittest.TestCase):
+    """レイアウト解析のテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(settings.ingestion, "layout_cache_dir",
+                                    os.path.join(self.temp_dir, "layout_cache"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_order_two_columns_with_heading(self):
+        """見出しの下の2段組みは左の段を読み終えてから右の段へ"""
+        blocks = [
+            _block(300, 100, 540, 140, "R1"),
+            _block(50, 100, 280, 140, "L1"),
+            _block(50, 40, 540, 70, "Title"),
+            _block(300, 160, 540, 200, "R2"),
+            _block(50, 160, 280, 200, "L2"),
+            _block(50, 400, 540, 430, "Figure caption"),
+            _block(50, 450, 280, 480, "L3"),
+            _block(300, 450, 540, 480, "R3"),
+        ]
+        ordered = [b["text"] for b in order_blocks(blocks, page_width=595)]
+        self.assertEqual(ordered, ["Title", "L1", "L2", "R1", "R2", "Figure caption", "L3", "R3"])
+
+    def test_table_to_text(self):
+        self.assertEqual(table_to_text([["品目", "価格"], ["りんご", None], [None, None]]),
+                         "| 品目 | 価格 |\n| りんご |  |")
+
+    def test_remove_repeated_margins(self):
+        """複数ページの上下端に繰り返し現れるブロックだけを除去"""
+        layouts = []
+        for page in range(1, 5):
+            layouts.append({"page": page, "width": 595, "height": 842, "blocks": [
+                _block(50, 20, 300, 40, "社内マニュアル 2024"),
+                _block(50, 100, 540, 400, f"本文 {page}"),
+                _block(280, 810, 320, 830, f"- {page} -"),
+            ]})
+        stripped = remove_repeated_margins(layouts)
+        self.assertEqual([[b["text"] for b in layout["blocks"]] for layout in stripped],
+                         [[f"本文 {page}"] for page in range(1, 5)])
+        # ページ数が少ない場合は除去しない
+        self.assertEqual(remove_repeated_margins(layouts[:2]), layouts[:2])
+
+    def test_extract_pdf_with_columns_table_and_footer(self):
+        """段組み・表・フッターのあるPDFの抽出とレイアウトキャッシュ"""
+        pdf_path = os.path.join(self.temp_dir, "report.pdf")
+        doc = fitz.open()
+        for page_num in range(1, 4):
+            page = doc.new_page()
+            # 左右の段を交互に描画（描画順のままだと段が入り混じる）
+            for row in range(2):
+                page.insert_textbox(fitz.Rect(50, 100 + row * 60, 280, 150 + row * 60), f"Left {page_num}.{row}")
+                page.insert_textbox(fitz.Rect(310, 100 + row * 60, 540, 150 + row * 60), f"Right {page_num}.{row}")
+            page.insert_text((290, 825), f"Page {page_num}")
+        table_page = doc[0]
+        for r in range(4):
+            table_page.draw_line((72, 400 + r * 20), (372, 400 + r * 20))
+        for c in range(4):
+            table_page.draw_line((72 + c * 100, 400), (72 + c * 100, 460))
+        for r in range(3):
+            for c in range(3):
+                table_page.insert_text((77 + c * 100, 414 + r * 20), f"c{r}{c}")
+        doc.save(pdf_path)
+        doc.close()
+
+        metrics = {}
+        pages = extract_text_from_pdf(pdf_path, workers=1, ocr=False, metrics=metrics)
+        self.assertFalse(metrics["layout_cached"])
+        self.assertEqual(pages[1]["content"].split("\n\n"),
+                         ["Left 2.0", "Left 2.1", "Right 2.0", "Right 2.1"])
+        self.assertIn("| c00 | c01 | c02 |\n| c10 | c11 | c12 |", pages[0]["content"])
+        self.assertNotIn("Page 1", pages[0]["content"])
+
+        metrics = {}
+        self.assertEqual(extract_text_from_pdf(pdf_path, workers=1, ocr=False, metrics=metrics), pages)
+        self.assertTrue(metrics["layout_cached"])
+
+
+if __name__ == '__main__':
+    unittest.main()
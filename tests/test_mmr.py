@@ -0,0 +1,65 @@
+"""
+MMRによる候補選択のテスト
+"""
+import unittest
+import os
+import sys
+
+import numpy as np
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.retrieval.mmr import mmr_rerank, mmr_select
+
+
+class TestMMR(unittest.TestCase):
+    """MMR選択のテストクラス"""
+
+    def setUp(self):
+        """同じページの重なったチャンク2件と、別の話題のチャンク1件"""
+        self.embeddings = np.array([
+            [1.0, 0.0, 0.0],
+            [0.99, 0.14, 0.0],  # 0とほぼ同じ内容
+            [0.6, 0.0, 0.8],    # 別の話題
+        ])
+        self.relevance = [0.9, 0.85, 0.6]
+
+    def test_relevance_only(self):
+        """λ=1 では関連度順"""
+        self.assertEqual(mmr_select(self.embeddings, self.relevance, 3, lambda_mult=1.0), [0, 1, 2])
+
+    def test_diversity(self):
+        """λ<1 では重複するチャンクより別の話題を先に選ぶ"""
+        self.assertEqual(mmr_select(self.embeddings, self.relevance, 2, lambda_mult=0.5), [0, 2])
+
+    def test_k_larger_than_candidates(self):
+        """候補数より多い k は候補数に切り詰める"""
+        self.assertEqual(sorted(mmr_select(self.embeddings, self.relevance, 10)), [0, 1, 2])
+        self.assertEqual(mmr_select(np.zeros((0, 3)), [], 3), [])
+
+    def test_mmr_rerank(self):
+        """検索結果の選択（リランクスコアを関連度に使用）"""
+        results = [
+            {"content": str(i), "embedding": list(e), "rerank_score": r}
+            for i, (e, r) in enumerate(zip(self.embeddings, self.relevance))
+        ]
+        self.assertEqual([r["content"] for r in mmr_rerank(results, 2, 0.5)], ["0", "2"])
+        # 無効化・埋め込みなしの場合は先頭から
+        self.assertEqual([r["content"] for r in mmr_rerank(results, 2, 1.0)], ["0", "1"])
+        self.assertEqual([r["content"] for r in mmr_rerank(results, 2, None)], ["0", "1"])
+        for result in results:
+            del result["embedding"]
+        self.assertEqual([r["content"] for r in mmr_rerank(results, 2, 0.5)], ["0", "1"])
+
+    def test_distance_relevance(self):
+        """リランクスコアがない場合は距離の小さい順を関連度とする"""
+        results = [
+            {"content": str(i), "embedding": list(e), "distance": d}
+            for i, (e, d) in enumerate(zip(self.embeddings, [0.2, 0.1, 0.5]))
+        ]
+        self.assertEqual(mmr_rerank(results, 1, 0.5)[0]["content"], "1")
+
+
+if __name__ == '__main__':
+    unittest.main()
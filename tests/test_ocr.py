@@ -0,0 +1,107 @@
+"""
+テキストのないページのOCRのテスト
+"""
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+from unittest import mock
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import fitz
+
+from src.config import settings
+from src.ingestion.extract import extract_text_from_pdf
+from src.ingestion.ocr import OCRCache, apply_ocr, is_textless, ocr_pages, tesseract_available
+
+
+def fake_engine(pixmap, language):
+    """Tesseractの代わりに画像サイズを返すOCRエンジン"""
+    return f"scanned {pixmap.width}x{pixmap.height} {language}"
+
+
+class TestOCR(unittest.TestCase):
+    """OCRフォールバックのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備（2ページ目と3ページ目が画像のみのPDF）"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, "ocr_cache")
+        self.pdf_path = os.path.join(self.temp_dir, "scan.pdf")
+        # レイアウト解析のキャッシュを storage/ に書き込まないよう一時ディレクトリに向ける
+        patcher = mock.patch.object(settings.ingestion, "layout_cache_dir",
+                                    os.path.join(self.temp_dir, "layout_cache"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        doc = fitz.open()
+        doc.new_page().insert_text((72, 72), "This page has a text layer.")
+        for shade in (0.2, 0.6):
+            pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 60, 80), False)
+            pixmap.set_rect(pixmap.irect, tuple(int(255 * shade) for _ in range(3)))
+            doc.new_page().insert_image(fitz.Rect(72, 72, 300, 400), pixmap=pixmap)
+        doc.save(self.pdf_path)
+        doc.close()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _options(self, **overrides):
+        options = dict(workers=2, dpi=36, language="jpn", cache_dir=self.cache_dir)
+        options.update(overrides)
+        return options
+
+    def test_is_textless(self):
+        self.assertTrue(is_textless(""))
+        self.assertTrue(is_textless(" \n 12 \n"))
+        self.assertFalse(is_textless("十分な長さの本文テキストです。"))
+
+    def test_cache_roundtrip(self):
+        cache = OCRCache(self.cache_dir)
+        self.assertIsNone(cache.get("ab" * 32))
+        cache.put("ab" * 32, "認識結果")
+        self.assertEqual(cache.get("ab" * 32), "認識結果")
+
+    def test_apply_ocr_fills_textless_pages_once(self):
+        """テキストのないページだけをOCRし、再取り込みではキャッシュを使う"""
+        extracted = extract_text_from_pdf(self.pdf_path, workers=1, ocr=False)
+        self.assertEqual([is_textless(p['content']) for p in extracted], [False, True, True])
+
+        metrics = {}
+        apply_ocr(self.pdf_path, extracted, metrics=metrics, engine=fake_engine, **self._options())
+        self.assertEqual(extracted[0]['content'], "This page has a text layer.")
+        self.assertNotIn('ocr', extracted[0]['metadata'])
+        self.assertEqual(extracted[1]['content'], "scanned 298x421 jpn")
+        self.assertTrue(extracted[2]['metadata']['ocr'])
+        self.assertEqual((metrics['ocr_pages'], metrics['ocr_cached']), (2, 0))
+        self.assertEqual(set(metrics['ocr_page_ms']), {"2", "3"})
+
+        # 再取り込み（同じページ画像）はOCRしない
+        again = extract_text_from_pdf(self.pdf_path, workers=1, ocr=False)
+        metrics = {}
+        apply_ocr(self.pdf_path, again, metrics=metrics, engine=fake_engine, **self._options(workers=1))
+        self.assertEqual(metrics['ocr_cached'], 2)
+        self.assertEqual(again, extracted)
+
+    def test_cache_key_depends_on_image(self):
+        """画像が異なるページは別々にOCRされる"""
+        results = ocr_pages(self.pdf_path, [2, 3], engine=fake_engine, **self._options(workers=1))
+        self.assertEqual([r.cached for r in results], [False, False])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    @unittest.skipIf(tesseract_available(), "Tesseractがインストールされている")
+    def test_skips_without_engine(self):
+        """Tesseractがない場合はOCRせずにそのまま返す"""
+        extracted = extract_text_from_pdf(self.pdf_path, workers=1, ocr=False)
+        metrics = {}
+        apply_ocr(self.pdf_path, extracted, metrics=metrics, **self._options())
+        self.assertEqual(extracted[1]['content'], "")
+        self.assertEqual(metrics, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
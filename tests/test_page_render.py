@@ -0,0 +1,86 @@
+"""
+ページレンダリングとキャッシュのテスト
+"""
+import unittest
+import os
+import sys
+import time
+import tempfile
+import shutil
+
+import fitz
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.serving.page_render import PageRenderCache, PageRenderer, render_page
+
+
+def make_test_pdf(path: str, pages: int = 3):
+    """テスト用PDFを作成"""
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {i + 1}")
+    doc.save(path)
+    doc.close()
+
+
+class TestPageRender(unittest.TestCase):
+    """ページレンダリングのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.pdf_dir = os.path.join(self.temp_dir, "raw")
+        os.makedirs(self.pdf_dir)
+        make_test_pdf(os.path.join(self.pdf_dir, "test.pdf"))
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir)
+
+    def test_render_formats(self):
+        """各フォーマットでレンダリングできることを確認"""
+        pdf_path = os.path.join(self.pdf_dir, "test.pdf")
+        self.assertTrue(render_page(pdf_path, 1, dpi=50, fmt="png").startswith(b"\x89PNG"))
+        self.assertEqual(render_page(pdf_path, 2, dpi=50, fmt="webp")[8:12], b"WEBP")
+        with self.assertRaises(ValueError):
+            render_page(pdf_path, 4, dpi=50, fmt="png")
+
+    def test_get_or_render_uses_cache(self):
+        """2回目はキャッシュから返されることを確認"""
+        renderer = PageRenderer(self.pdf_dir, PageRenderCache(self.cache_dir, 10 * 1024 * 1024))
+        path, key = renderer.get_or_render("test.pdf", 1, dpi=50, fmt="png")
+        mtime = os.path.getmtime(path)
+
+        path2, key2 = renderer.get_or_render("test.pdf", 1, dpi=50, fmt="png")
+        self.assertEqual((path, key), (path2, key2))
+        self.assertGreaterEqual(os.path.getmtime(path2), mtime)
+
+        with self.assertRaises(FileNotFoundError):
+            renderer.get_or_render("../test.pdf", 1)
+        with self.assertRaises(ValueError):
+            renderer.get_or_render("test.pdf", 1, fmt="gif")
+
+    def test_cache_eviction(self):
+        """上限を超えたら最終利用時刻の古いものから削除されることを確認"""
+        cache = PageRenderCache(self.cache_dir, max_bytes=250)
+        cache.put("a", "png", b"x" * 100)
+        time.sleep(0.01)
+        cache.put("b", "png", b"x" * 100)
+        time.sleep(0.01)
+        # a を参照して最近使ったことにする
+        self.assertIsNotNone(cache.get("a", "png"))
+        time.sleep(0.01)
+        cache.put("c", "png", b"x" * 100)
+
+        self.assertIsNotNone(cache.get("a", "png"))
+        self.assertIsNone(cache.get("b", "png"))
+        self.assertIsNotNone(cache.get("c", "png"))
+        self.assertLessEqual(cache.total_bytes(), 250)
+
+
+if __name__ == '__main__':
+    unittest.main()
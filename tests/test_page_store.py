@@ -0,0 +1,76 @@
+"""
+ページストアと親の範囲への拡張（small-to-big）のテスト
+"""
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.retrieval.page_store import PageStore, expand_results
+
+
+def _chunk(content, page, chunk_id, source="doc.pdf"):
+    return {"content": content, "metadata": {"source": source, "page": page, "chunk_id": chunk_id}}
+
+
+class TestPageStore(unittest.TestCase):
+    """ページストアのテストクラス"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = PageStore(os.path.join(self.temp_dir, "pages", "docs.db"))
+        # 隣り合うチャンクは末尾と先頭が重なっている
+        self.chunks = [
+            _chunk("第一文。第二文。", 1, 0),
+            _chunk("第二文。第三文。", 1, 1),
+            _chunk("第三文。第四文。", 1, 2),
+            _chunk("第四文。第五文。", 1, 3),
+            _chunk("次のページ。", 2, 0),
+        ]
+        self.store.replace_source("doc.pdf", self.chunks)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_window(self):
+        """前後1チャンクに広げ、重なりを除いて連結"""
+        results = expand_results([dict(self.chunks[1], distance=0.1)], self.store, "window", radius=1)
+        self.assertEqual(results[0]["content"], "第一文。第二文。第三文。第四文。")
+        self.assertEqual(results[0]["chunk_content"], "第二文。第三文。")
+        self.assertEqual(results[0]["metadata"]["parent_range"], "0-2")
+        self.assertEqual(results[0]["distance"], 0.1)
+
+    def test_page(self):
+        """ページ全体に広げる"""
+        results = expand_results([self.chunks[3]], self.store, "page")
+        self.assertEqual(results[0]["content"], "第一文。第二文。第三文。第四文。第五文。")
+
+    def test_overlapping_hits_merged(self):
+        """同じページで範囲が重なるヒットは関連度の高い方にまとめる"""
+        results = expand_results([self.chunks[3], self.chunks[0], self.chunks[4]], self.store, "window", radius=1)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["chunk_content"], "第四文。第五文。")
+        self.assertEqual(results[0]["metadata"]["parent_range"], "0-3")
+        self.assertEqual(results[0]["merged_hits"], 2)
+        self.assertEqual(results[1]["content"], "次のページ。")
+
+    def test_missing_and_none(self):
+        """ページストアにない結果と none モードはそのまま"""
+        other = _chunk("未登録", 9, 0, source="other.pdf")
+        self.assertIs(expand_results([other], self.store)[0], other)
+        self.assertEqual(expand_results([self.chunks[1]], self.store, "none"), [self.chunks[1]])
+
+    def test_replace_source(self):
+        """文書の置き換え・削除"""
+        self.store.replace_source("doc.pdf", [_chunk("新しい本文", 1, 0)])
+        self.assertEqual(self.store.page_chunks("doc.pdf", 1), [(0, "新しい本文")])
+        self.store.replace_source("doc.pdf", [])
+        self.assertEqual(self.store.page_chunks("doc.pdf", 1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
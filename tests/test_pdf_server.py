@@ -0,0 +1,130 @@
+"""
+PDF配信サーバーのテスト
+"""
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import threading
+import http.client
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.serving.pdf_server import create_server, parse_range
+from tests.test_page_render import make_test_pdf
+
+
+class TestPDFServer(unittest.TestCase):
+    """PDF配信サーバーのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.content = bytes(range(256)) * 40
+        with open(os.path.join(self.temp_dir, "テスト.pdf"), "wb") as f:
+            f.write(self.content)
+        make_test_pdf(os.path.join(self.temp_dir, "manual.pdf"))
+
+        self.server = create_server(self.temp_dir, port=0, host="127.0.0.1",
+                                    page_cache_dir=os.path.join(self.temp_dir, ".cache"))
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def _request(self, method="GET", path="/%E3%83%86%E3%82%B9%E3%83%88.pdf", headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        conn.request(method, path, headers=headers or {})
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return response, body
+
+    def test_full_download(self):
+        """全体取得とキャッシュ関連ヘッダを確認"""
+        response, body = self._request()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response.getheader("Accept-Ranges"), "bytes")
+        self.assertEqual(response.getheader("Content-Type"), "application/pdf")
+        self.assertIsNotNone(response.getheader("ETag"))
+        self.assertIsNotNone(response.getheader("Last-Modified"))
+        self.assertIn("max-age", response.getheader("Cache-Control"))
+
+    def test_range_request(self):
+        """Rangeリクエストで部分取得できることを確認"""
+        response, body = self._request(headers={"Range": "bytes=100-199"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, self.content[100:200])
+        self.assertEqual(response.getheader("Content-Range"), f"bytes 100-199/{len(self.content)}")
+
+        response, body = self._request(headers={"Range": "bytes=-10"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, self.content[-10:])
+
+    def test_unsatisfiable_range(self):
+        """範囲外のRangeは416を返す"""
+        response, _ = self._request(headers={"Range": f"bytes={len(self.content)}-"})
+        self.assertEqual(response.status, 416)
+
+    def test_conditional_request(self):
+        """ETagが一致する場合は304を返す"""
+        response, _ = self._request()
+        etag = response.getheader("ETag")
+
+        response, body = self._request(headers={"If-None-Match": etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, b"")
+
+        # If-Range が一致しない場合は全体を返す
+        response, body = self._request(headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, self.content)
+
+    def test_head_and_not_found(self):
+        """HEADは本文なし、ディレクトリ外へのアクセスは404"""
+        response, body = self._request(method="HEAD")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, b"")
+        self.assertEqual(int(response.getheader("Content-Length")), len(self.content))
+
+        response, _ = self._request(path="/../../etc/passwd")
+        self.assertEqual(response.status, 404)
+        response, _ = self._request(path="/missing.pdf")
+        self.assertEqual(response.status, 404)
+
+    def test_render_page_endpoint(self):
+        """1ページをレンダリングした画像が返ることを確認"""
+        response, body = self._request(path="/render/manual.pdf?page=2&dpi=50&format=png")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"), "image/png")
+        self.assertTrue(body.startswith(b"\x89PNG"))
+
+        etag = response.getheader("ETag")
+        response, _ = self._request(path="/render/manual.pdf?page=2&dpi=50&format=png",
+                                    headers={"If-None-Match": etag})
+        self.assertEqual(response.status, 304)
+
+        response, _ = self._request(path="/render/manual.pdf?page=99")
+        self.assertEqual(response.status, 400)
+        response, _ = self._request(path="/render/missing.pdf?page=1")
+        self.assertEqual(response.status, 404)
+
+    def test_parse_range(self):
+        """Rangeヘッダの解析"""
+        self.assertEqual(parse_range("bytes=0-", 100), (0, 99))
+        self.assertEqual(parse_range("bytes=10-500", 100), (10, 99))
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 100))
+        with self.assertRaises(ValueError):
+            parse_range("bytes=200-300", 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+RAGパイプラインのエンジン（段階の組み合わせ・計測）のテスト
+"""
+import unittest
+import os
+import sys
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.pipeline.engine import (
+    GenerateStage,
+    PackStage,
+    RAGPipeline,
+    RerankStage,
+    RetrieveStage,
+    SelectStage,
+    build_pipeline,
+    stage_latency_percentiles,
+)
+from src.pipeline.tenants import collection_name_for
+
+
+def _results(count):
+    return [{"content": f"本文 {i}", "distance": i / 10,
+             "metadata": {"source": "doc.pdf", "page": i + 1, "chunk_id": i}} for i in range(count)]
+
+
+class TestPipelineEngine(unittest.TestCase):
+    """パイプラインエンジンのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.calls = []
+
+    def _search(self, query, storage_path, top_k, deadline, include_embeddings, collection_name):
+        self.calls.append(("search", query, top_k, collection_name))
+        return _results(top_k)
+
+    def _rerank(self, query, results, top_k, timeout):
+        self.calls.append(("rerank", len(results), top_k))
+        return list(reversed(results))[:top_k]
+
+    def _generate(self, prompt):
+        self.calls.append(("generate", prompt))
+        return "回答"
+
+    def _pipeline(self):
+        return RAGPipeline([
+            RetrieveStage(10, search=self._search),
+            RerankStage(5, budget_fraction=1.0, min_seconds=0, rerank=self._rerank),
+            SelectStage(2),
+            PackStage(token_budget=0),
+            GenerateStage(generate=self._generate),
+        ], budget_seconds=30)
+
+    def test_stages_run_in_order(self):
+        """段階を順に実行し、前の段階の結果を次の段階に渡す"""
+        context = self._pipeline().run("質問", "storage", tenant="team-a")
+        self.assertEqual(self.calls[0], ("search", "質問", 10, collection_name_for("team-a")))
+        self.assertEqual(self.calls[1], ("rerank", 10, 5))
+        self.assertEqual([r["metadata"]["chunk_id"] for r in context.results], [9, 8])
+        self.assertIn("本文 9", self.calls[2][1])
+        self.assertEqual(context.answer, "回答")
+
+    def test_trace_has_per_stage_metrics(self):
+        """段階ごとの所要時間と件数をトレースに記録する"""
+        trace = self._pipeline().run("質問", "storage").trace()
+        for name in ("search", "rerank", "select", "pack", "generation"):
+            self.assertIn(f"{name}_ms", trace)
+        self.assertEqual(trace["result_counts"], {"search": 10, "rerank": 5, "select": 2, "pack": 2,
+                                                  "generation": 2})
+        self.assertEqual(trace["context_blocks"], 2)
+        self.assertIn("search", stage_latency_percentiles(50))
+
+    def test_build_pipeline_options(self):
+        """オプションに応じて段階を組み立てる"""
+        full = build_pipeline(rerank=True, mmr_lambda=0.5, parent_mode="window", rewrite=True)
+        self.assertEqual(full.stage_names, ["rewrite", "search", "rerank", "select", "expand", "pack", "generation"])
+        self.assertTrue(full.stages[1].include_embeddings)
+
+        search_only = build_pipeline(rerank=False, mmr_lambda=1.0, parent_mode="none", rewrite=False,
+                                     generate=False)
+        self.assertEqual(search_only.stage_names, ["search", "select"])
+        self.assertFalse(search_only.stages[0].include_embeddings)
+
+
+if __name__ == '__main__':
+    unittest.main()
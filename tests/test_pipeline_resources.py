@@ -0,0 +1,231 @@
+"""
+パイプライン共有リソース（キャッシュ・コレクションバージョン）のテスト
+"""
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import subprocess
+import textwrap
+from unittest import mock
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config import settings
+from src.pipeline.resources import (
+    PipelineResources,
+    bump_collection_version,
+    get_pipeline_resources,
+    read_collection_version,
+)
+from src.ui.streamlit_helpers import warm_up_vector_store
+
+COLLECTION = "resource_test"
+
+
+class TestPipelineResources(unittest.TestCase):
+    """PipelineResourcesのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.resources = PipelineResources()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.resources.invalidate(self.storage_path, COLLECTION, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _add(self, start: int, count: int):
+        collection = self.resources.client(self.storage_path).get_or_create_collection(COLLECTION)
+        collection.add(ids=[str(i) for i in range(start, start + count)],
+                       embeddings=[[float(i), 1.0, 0.0] for i in range(start, start + count)],
+                       documents=[f"doc {i}" for i in range(start, start + count)])
+
+    def test_version_counter(self):
+        """バージョンは取り込みのたびに増え、ファイルがなければ0"""
+        self.assertEqual(read_collection_version(self.storage_path, COLLECTION), (0, 0))
+        self.assertEqual(bump_collection_version(self.storage_path, COLLECTION), 1)
+        self.assertEqual(bump_collection_version(self.storage_path, COLLECTION), 2)
+        self.assertEqual(read_collection_version(self.storage_path, COLLECTION)[0], 2)
+
+    def test_client_is_shared(self):
+        self.assertIs(self.resources.client(self.storage_path),
+                      self.resources.client(self.storage_path))
+
+    def test_document_count_is_cached_until_version_changes(self):
+        """バージョンが変わらない限りDBを開かずにキャッシュした件数を返す"""
+        self._add(0, 3)
+        self.assertEqual(self.resources.document_count(self.storage_path, COLLECTION), 3)
+
+        # バージョンを進めずに追加した分はキャッシュに反映されない
+        self._add(3, 2)
+        self.assertEqual(self.resources.document_count(self.storage_path, COLLECTION), 3)
+
+        self.resources.notify_ingested(self.storage_path, COLLECTION)
+        self.assertEqual(self.resources.document_count(self.storage_path, COLLECTION), 5)
+
+        # 別プロセスでの取り込み（バージョンファイルの更新のみ）も検出する
+        self._add(5, 1)
+        bump_collection_version(self.storage_path, COLLECTION)
+        self.assertEqual(self.resources.document_count(self.storage_path, COLLECTION), 6)
+
+    def test_clear_and_rebuild(self):
+        """クライアントを閉じて削除した後、同じパスで作り直せる"""
+        self._add(0, 3)
+        self.resources.notify_ingested(self.storage_path, COLLECTION)
+        self.assertEqual(self.resources.document_count(self.storage_path, COLLECTION), 3)
+
+        self.resources.invalidate(self.storage_path, COLLECTION, close_client=True)
+        shutil.rmtree(self.storage_path)
+
+        self._add(0, 1)
+        self.resources.notify_ingested(self.storage_path, COLLECTION)
+        self.assertEqual(self.resources.document_count(self.storage_path, COLLECTION), 1)
+
+
+class NoEmbeddingResources(PipelineResources):
+    """埋め込み関数を作らない（APIキーなしでコレクションを作成するため）"""
+
+    def embedding_function(self, task_type, model_name=None):
+        return None
+
+
+class TestCrossProcessIngest(unittest.TestCase):
+    """別プロセスでの取り込みが検索に反映されることのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.resources = NoEmbeddingResources()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.resources.invalidate(self.storage_path, COLLECTION, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _query(self, embedding, n_results=5):
+        collection = self.resources.collection(self.storage_path, COLLECTION)
+        return collection.query(query_embeddings=[embedding], n_results=n_results)["ids"][0]
+
+    def test_vectors_added_by_another_process_are_searchable(self):
+        """別プロセスが追加・バージョン更新したベクトルは、件数だけでなく検索結果にも現れる"""
+        collection = self.resources.collection(self.storage_path, COLLECTION, create=True)
+        collection.add(ids=[f"a{i}" for i in range(300)],
+                       embeddings=[[1.0, 0.0, float(i) / 300] for i in range(300)],
+                       documents=[f"a {i}" for i in range(300)])
+        self.resources.notify_ingested(self.storage_path, COLLECTION)
+        self.assertTrue(all(hit.startswith("a") for hit in self._query([0.0, 1.0, 0.0])))
+
+        script = textwrap.dedent(f"""
+            import sys
+            sys.path.insert(0, {os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))!r})
+            import chromadb
+            from src.pipeline.resources import bump_collection_version
+
+            client = chromadb.PersistentClient(path={self.storage_path!r})
+            client.get_collection({COLLECTION!r}).add(
+                ids=[f"b{{i}}" for i in range(300)],
+                embeddings=[[0.0, 1.0, float(i) / 300] for i in range(300)],
+                documents=[f"b {{i}}" for i in range(300)])
+            bump_collection_version({self.storage_path!r}, {COLLECTION!r})
+        """)
+        subprocess.run([sys.executable, "-c", script], check=True, timeout=120)
+
+        self.assertEqual(self.resources.document_count(self.storage_path, COLLECTION), 600)
+        hits = self._query([0.0, 1.0, 0.0])
+        self.assertEqual(len(hits), 5)
+        self.assertTrue(all(hit.startswith("b") for hit in hits), hits)
+
+    def test_own_ingest_keeps_client(self):
+        """同じプロセスでの取り込みではクライアントを開き直さない"""
+        collection = self.resources.collection(self.storage_path, COLLECTION, create=True)
+        client = self.resources.client(self.storage_path)
+        collection.add(ids=["a0"], embeddings=[[1.0, 0.0, 0.0]], documents=["a"])
+        self.resources.notify_ingested(self.storage_path, COLLECTION)
+        self.assertEqual(self._query([1.0, 0.0, 0.0], n_results=1), ["a0"])
+        self.assertIs(self.resources.client(self.storage_path), client)
+
+
+class TestHNSWAndWarmUp(unittest.TestCase):
+    """HNSWの設定とウォームアップのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        get_pipeline_resources().invalidate(self.storage_path, COLLECTION, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_hnsw_metadata_is_applied_on_creation(self):
+        """設定したHNSWのパラメータでコレクションを作成する"""
+        with mock.patch.object(settings.storage, "hnsw_m", 32), \
+                mock.patch.object(settings.storage, "hnsw_search_ef", 64):
+            metadata = settings.storage.hnsw_metadata()
+            resources = NoEmbeddingResources()
+            try:
+                collection = resources.collection(self.storage_path, COLLECTION, create=True)
+                self.assertEqual(metadata["hnsw:M"], 32)
+                self.assertEqual(metadata["hnsw:search_ef"], 64)
+                for key, value in metadata.items():
+                    self.assertEqual(collection.metadata[key], value)
+            finally:
+                resources.invalidate(self.storage_path, COLLECTION, close_client=True)
+
+    def test_warm_up_empty_and_missing_store(self):
+        """空のコレクションでも例外にならず、保存先がなければ失敗として返す"""
+        missing = warm_up_vector_store(self.storage_path)
+        self.assertFalse(missing['success'])
+        self.assertEqual(missing['error'], 'storage not found')
+
+        client = get_pipeline_resources().client(self.storage_path)
+        client.get_or_create_collection(settings.storage.collection_name)
+        result = warm_up_vector_store(self.storage_path)
+        self.assertTrue(result['success'], result['error'])
+        self.assertEqual(result['document_count'], 0)
+
+        client.get_collection(settings.storage.collection_name).add(
+            ids=["1"], embeddings=[[1.0, 0.0, 0.0]], documents=["doc"])
+        result = warm_up_vector_store(self.storage_path)
+        self.assertTrue(result['success'], result['error'])
+        self.assertEqual(result['document_count'], 1)
+
+    def test_warm_up_loads_quantized_index_instead_of_hnsw(self):
+        """学習済みの量子化インデックスで検索する場合は、HNSWを読み込まず量子化インデックスを読み込む"""
+        from chromadb.api.models.Collection import Collection
+        from src.embedding import quantization
+        from src.embedding.quantization import update_quantized_index
+
+        client = get_pipeline_resources().client(self.storage_path)
+        collection = client.get_or_create_collection(settings.storage.collection_name)
+        ids, embeddings = ["1", "2"], [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+        collection.add(ids=ids, embeddings=embeddings, documents=["a", "b"])
+
+        with mock.patch.object(settings.storage, "vector_quantization", "int8"), \
+                mock.patch.object(Collection, "query") as query:
+            # 未学習の間はChroma（HNSW）で検索するため、HNSWを読み込む
+            update_quantized_index(self.storage_path, settings.storage.collection_name, ids, embeddings,
+                                   method="int8", min_train=10)
+            self.assertTrue(warm_up_vector_store(self.storage_path)['success'])
+            self.assertEqual(query.call_count, 1)
+
+            update_quantized_index(self.storage_path, settings.storage.collection_name, ids, embeddings,
+                                   method="int8")
+            with mock.patch.object(quantization, "load_quantized_index",
+                                   wraps=quantization.load_quantized_index) as load:
+                result = warm_up_vector_store(self.storage_path)
+            self.assertTrue(result['success'], result['error'])
+            self.assertEqual(result['document_count'], 2)
+            self.assertEqual(query.call_count, 1)
+            load.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
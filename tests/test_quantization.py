@@ -0,0 +1,265 @@
+"""
+埋め込み量子化のテスト
+"""
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import json
+import multiprocessing
+from unittest import mock
+
+import numpy as np
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.embedding import quantization
+from src.embedding.quantization import (
+    ScalarQuantizer,
+    ProductQuantizer,
+    QuantizedIndex,
+    update_quantized_index,
+    remove_from_quantized_index,
+    quantized_index_dir,
+)
+
+
+def _add_in_process(storage_path, start, count):
+    """別プロセスからベクトルを追加（同時に取り込むワーカーの代わり）"""
+    rng = np.random.default_rng(start)
+    for offset in range(0, count, 10):
+        ids = [f"doc_{start + offset + i}" for i in range(10)]
+        update_quantized_index(storage_path, "test_collection", ids,
+                               rng.normal(size=(10, 64)).astype(np.float32), method="int8", min_train=50)
+
+
+def _exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int) -> set:
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = query / np.linalg.norm(query)
+    return set(np.argsort(-(vectors @ query))[:k].tolist())
+
+
+class TestQuantization(unittest.TestCase):
+    """量子化インデックスのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        rng = np.random.default_rng(42)
+        self.vectors = rng.normal(size=(600, 64)).astype(np.float32)
+        self.ids = [f"doc_{i}" for i in range(len(self.vectors))]
+        self.query = self.vectors[10] + rng.normal(scale=0.1, size=64).astype(np.float32)
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir)
+
+    def test_scalar_quantizer_roundtrip(self):
+        """int8量子化の復元誤差が量子化幅以内であることを確認"""
+        quantizer = ScalarQuantizer().fit(self.vectors)
+        codes = quantizer.encode(self.vectors)
+        self.assertEqual(codes.dtype, np.uint8)
+        restored = quantizer.decode(codes)
+        self.assertTrue(np.all(np.abs(restored - self.vectors) <= quantizer.scale / 2 + 1e-5))
+
+    def test_product_quantizer_code_shape(self):
+        """PQコードが部分空間数の1バイトコードであることを確認"""
+        quantizer = ProductQuantizer(n_subvectors=8, n_iter=5).fit(self.vectors)
+        codes = quantizer.encode(self.vectors)
+        self.assertEqual(codes.shape, (600, 8))
+        self.assertEqual(codes.dtype, np.uint8)
+
+    def test_product_quantizer_invalid_split(self):
+        """次元数が割り切れない分割数はエラー"""
+        with self.assertRaises(ValueError):
+            ProductQuantizer(n_subvectors=7).fit(self.vectors)
+
+    def test_search_with_rescoring_matches_exact(self):
+        """再スコアリング後の上位結果が厳密検索と一致することを確認"""
+        expected = _exact_top_k(self.vectors, self.query, 5)
+        for method in ("int8", "pq"):
+            index = QuantizedIndex.build(self.ids, self.vectors, method=method, pq_subvectors=8)
+            hits = index.search(self.query, top_k=5, rescore_k=100)
+            found = {int(hit_id.split("_")[1]) for hit_id, _ in hits}
+            self.assertEqual(found, expected, method)
+            distances = [d for _, d in hits]
+            self.assertEqual(distances, sorted(distances))
+
+    def test_save_load_and_upsert(self):
+        """保存・読み込みと既存IDの上書きを確認"""
+        directory = quantized_index_dir(self.temp_dir, "test_collection")
+        update_quantized_index(self.temp_dir, "test_collection", self.ids[:300],
+                               self.vectors[:300], method="int8")
+        index = update_quantized_index(self.temp_dir, "test_collection", self.ids[200:],
+                                       self.vectors[200:], method="int8")
+        self.assertEqual(len(index), 600)
+
+        loaded = QuantizedIndex.load(directory)
+        self.assertEqual(len(loaded), 600)
+        self.assertEqual(loaded.code_bytes, 600 * 64)
+        hit_id, distance = loaded.search(self.vectors[450], top_k=1)[0]
+        self.assertEqual(hit_id, "doc_450")
+        self.assertAlmostEqual(distance, 0.0, places=5)
+
+    def test_remove(self):
+        """削除したIDは検索結果に現れない"""
+        directory = quantized_index_dir(self.temp_dir, "test_collection")
+        self.assertEqual(remove_from_quantized_index(self.temp_dir, "test_collection", ["doc_1"]), 0)
+        update_quantized_index(self.temp_dir, "test_collection", self.ids, self.vectors, method="int8")
+
+        removed = remove_from_quantized_index(self.temp_dir, "test_collection",
+                                              ["doc_10", "doc_11", "missing"])
+        self.assertEqual(removed, 2)
+        loaded = QuantizedIndex.load(directory)
+        self.assertEqual(len(loaded), 598)
+        self.assertEqual(len(loaded.vectors), 598)
+        self.assertNotIn("doc_10", [hit for hit, _ in loaded.search(self.query, top_k=5)])
+
+    def test_training_waits_for_min_train(self):
+        """最小件数に達するまでは未学習で、達した時点で保存済みの全ベクトルで学習する"""
+        directory = quantized_index_dir(self.temp_dir, "test_collection")
+        index = update_quantized_index(self.temp_dir, "test_collection", self.ids[:100],
+                                       self.vectors[:100], method="int8", min_train=500)
+        self.assertFalse(index.is_trained)
+        self.assertEqual(index.code_bytes, 0)
+        self.assertFalse(QuantizedIndex.load(directory).is_trained)
+        # 未学習の間もfloat32ベクトルで正確に検索できる
+        self.assertEqual(index.search(self.vectors[50], top_k=1)[0][0], "doc_50")
+
+        index = update_quantized_index(self.temp_dir, "test_collection", self.ids[100:],
+                                       self.vectors[100:], method="int8", min_train=500)
+        self.assertTrue(index.is_trained)
+        self.assertEqual(index.trained_size, 600)
+        normalized = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        np.testing.assert_allclose(index.quantizer.lower, normalized.min(axis=0), rtol=1e-6)
+
+    def test_pq_waits_for_full_codebook(self):
+        """PQは256セントロイドを学習できる件数に達するまで学習しない"""
+        index = QuantizedIndex.build(self.ids[:100], self.vectors[:100], method="pq", pq_subvectors=8)
+        self.assertFalse(index.is_trained)
+        index.add(self.ids[100:], self.vectors[100:])
+        self.assertTrue(index.needs_training())
+        index.train(pq_subvectors=8)
+        self.assertEqual(index.quantizer.n_centroids, 256)
+
+    def test_retrain_when_index_grows(self):
+        """学習時の件数のretrain_factor倍に増えたら全ベクトルで学習し直す"""
+        options = dict(method="int8", min_train=100, retrain_factor=2.0)
+        index = update_quantized_index(self.temp_dir, "test_collection", self.ids[:100],
+                                       self.vectors[:100], **options)
+        self.assertEqual(index.trained_size, 100)
+        index = update_quantized_index(self.temp_dir, "test_collection", self.ids[100:150],
+                                       self.vectors[100:150], **options)
+        self.assertEqual(index.trained_size, 100)
+        index = update_quantized_index(self.temp_dir, "test_collection", self.ids[150:],
+                                       self.vectors[150:], **options)
+        self.assertEqual(index.trained_size, 600)
+        loaded = QuantizedIndex.load(quantized_index_dir(self.temp_dir, "test_collection"))
+        self.assertEqual(loaded.trained_size, 600)
+
+    def test_method_change_keeps_stored_vectors(self):
+        """量子化方式を変えても既存のベクトルを含めて学習し直す"""
+        update_quantized_index(self.temp_dir, "test_collection", self.ids[:300],
+                               self.vectors[:300], method="int8")
+        index = update_quantized_index(self.temp_dir, "test_collection", self.ids[300:],
+                                       self.vectors[300:], method="pq", pq_subvectors=8)
+        self.assertEqual(index.method, "pq")
+        self.assertTrue(index.is_trained)
+        self.assertEqual(len(index), 600)
+
+    def test_search_filters_before_scoring(self):
+        """絞り込みはスコア計算の前に行い、対象内の上位top_k件を返す"""
+        index = QuantizedIndex.build(self.ids, self.vectors, method="int8")
+        allowed = [f"doc_{i}" for i in range(300, 600)]
+        hits = index.search(self.query, top_k=5, rescore_k=50, allowed_ids=allowed)
+        self.assertEqual(len(hits), 5)
+        self.assertTrue(all(hit_id in allowed for hit_id, _ in hits))
+        expected = {300 + i for i in _exact_top_k(self.vectors[300:], self.query, 5)}
+        self.assertEqual({int(hit_id.split("_")[1]) for hit_id, _ in hits}, expected)
+        self.assertEqual(index.search(self.query, top_k=5, allowed_ids=[]), [])
+
+    def test_quantized_search_applies_where(self):
+        """量子化インデックスでの検索にもwhere条件が適用される"""
+        from src.retrieval.search import _quantized_search
+
+        directory = quantized_index_dir(self.temp_dir, "test_collection")
+        QuantizedIndex.build(self.ids, self.vectors, method="int8").save(directory)
+        allowed = [f"doc_{i}" for i in range(0, 600, 2)]
+
+        class FakeCollection:
+            def get(self, ids=None, where=None, include=None):
+                if where is not None:
+                    return {"ids": allowed}
+                return {"ids": ids, "documents": ids, "metadatas": [{} for _ in ids]}
+
+        results = _quantized_search("q", FakeCollection(), lambda texts: [self.query], directory,
+                                    top_k=3, where={"source": "a.pdf"})
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result["content"] in allowed for result in results))
+
+    def _manifest(self):
+        directory = quantized_index_dir(self.temp_dir, "test_collection")
+        with open(os.path.join(directory, QuantizedIndex.MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_updates_append_deltas(self):
+        """学習し直さない追加・削除は差分ファイルだけを書き、保存済みのfloat32行列は書き換えない"""
+        directory = quantized_index_dir(self.temp_dir, "test_collection")
+        update_quantized_index(self.temp_dir, "test_collection", self.ids[:400], self.vectors[:400], method="int8")
+        base = self._manifest()["vectors"]
+        base_mtime = os.stat(os.path.join(directory, base)).st_mtime_ns
+
+        update_quantized_index(self.temp_dir, "test_collection", self.ids[300:], self.vectors[300:], method="int8")
+        remove_from_quantized_index(self.temp_dir, "test_collection", ["doc_5", "doc_450"])
+        manifest = self._manifest()
+        self.assertEqual(manifest["vectors"], base)
+        self.assertEqual(len(manifest["deltas"]), 2)
+        self.assertEqual(os.stat(os.path.join(directory, base)).st_mtime_ns, base_mtime)
+
+        loaded = QuantizedIndex.load(directory)
+        self.assertEqual(len(loaded), 598)
+        self.assertEqual(len(loaded.vectors), 598)
+        self.assertNotIn("doc_450", loaded.ids.tolist())
+        hit_id, distance = loaded.search(self.vectors[500], top_k=1)[0]
+        self.assertEqual(hit_id, "doc_500")
+        self.assertAlmostEqual(distance, 0.0, places=5)
+        # 上書きしたIDは差分のベクトルで再スコアリングされる
+        self.assertEqual(loaded.search(self.vectors[350], top_k=1)[0][0], "doc_350")
+
+    def test_deltas_are_compacted_into_new_generation(self):
+        """差分が上限に達したら全体を新しい世代に書き直し、2世代前のファイルを削除する"""
+        directory = quantized_index_dir(self.temp_dir, "test_collection")
+        with mock.patch.object(quantization, "MAX_DELTAS", 2):
+            for start in range(0, 600, 50):
+                update_quantized_index(self.temp_dir, "test_collection", self.ids[start:start + 50],
+                                       self.vectors[start:start + 50], method="int8")
+        manifest = self._manifest()
+        self.assertEqual(manifest["generation"], 4)
+        self.assertEqual(len(manifest["deltas"]), 2)
+        generations = {int(name.split("-")[1].split(".")[0]) for name in os.listdir(directory)
+                       if name.startswith(("base-", "delta-"))}
+        self.assertEqual(generations, {manifest["generation"] - 1, manifest["generation"]})
+        self.assertEqual(len(QuantizedIndex.load(directory)), 600)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork が使えない環境")
+    def test_concurrent_writers_keep_all_vectors(self):
+        """複数のプロセスが同時に追加しても、互いのベクトルを上書きしない"""
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=_add_in_process, args=(self.temp_dir, start, 100))
+                     for start in range(0, 400, 100)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=120)
+            self.assertEqual(process.exitcode, 0)
+
+        loaded = QuantizedIndex.load(quantized_index_dir(self.temp_dir, "test_collection"))
+        self.assertEqual(sorted(loaded.ids.tolist()), sorted(f"doc_{i}" for i in range(400)))
+        self.assertEqual(len(loaded.vectors), 400)
+        self.assertEqual(len(loaded.codes), 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+会話履歴を使った質問の書き換えのテスト
+"""
+import unittest
+import os
+import sys
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.retrieval.query_rewrite import (
+    RewriteCache,
+    build_rewrite_prompt,
+    needs_rewrite,
+    recent_turns,
+    rewrite_query,
+)
+
+HISTORY = [
+    {'role': 'user', 'content': 'ナアマンはどんな人物ですか'},
+    {'role': 'assistant', 'content': 'ナアマンはシリアの軍の長で、重い皮膚病を患っていました。[資料 1]'},
+]
+
+
+class FakeGenerate:
+    """呼び出し回数を記録する書き換え関数"""
+
+    def __init__(self, output="ナアマンの皮膚病が治った経緯を詳しく教えてください", error=None):
+        self.output = output
+        self.error = error
+        self.prompts = []
+
+    def __call__(self, prompt, timeout):
+        self.prompts.append(prompt)
+        if self.error:
+            raise self.error
+        return self.output
+
+
+class TestQueryRewrite(unittest.TestCase):
+    """質問の書き換えのテストクラス"""
+
+    def test_needs_rewrite(self):
+        """指示語を含む・短い質問だけ書き換える（履歴がなければ書き換えない）"""
+        self.assertTrue(needs_rewrite("それについてもっと詳しく", HISTORY))
+        self.assertTrue(needs_rewrite("理由は？", HISTORY))
+        self.assertTrue(needs_rewrite("What happened to him after that?", HISTORY))
+        self.assertFalse(needs_rewrite("エホバを信頼することの大切さを教えてください", HISTORY))
+        self.assertFalse(needs_rewrite("それについてもっと詳しく", []))
+
+    def test_rewrite_and_cache(self):
+        """書き換え結果は（履歴, 質問）ごとにキャッシュされる"""
+        generate = FakeGenerate()
+        cache = RewriteCache()
+        first = rewrite_query("それについてもっと詳しく", HISTORY, generate=generate, cache=cache)
+        second = rewrite_query("それについてもっと詳しく", HISTORY, generate=generate, cache=cache)
+
+        self.assertEqual(first.query, "ナアマンの皮膚病が治った経緯を詳しく教えてください")
+        self.assertTrue(first.rewritten)
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(len(generate.prompts), 1)
+        self.assertIn("ナアマンはどんな人物ですか", generate.prompts[0])
+
+        # 履歴が変われば別のキー
+        rewrite_query("それについてもっと詳しく", HISTORY[:1], generate=generate, cache=cache)
+        self.assertEqual(len(generate.prompts), 2)
+
+    def test_standalone_skips_llm(self):
+        """単独で意味が通る質問はLLMを呼ばない"""
+        generate = FakeGenerate()
+        result = rewrite_query("エホバを信頼することの大切さを教えてください", HISTORY,
+                               generate=generate, cache=RewriteCache())
+        self.assertFalse(result.rewritten)
+        self.assertEqual(generate.prompts, [])
+
+    def test_failure_falls_back(self):
+        """失敗・予算切れの場合は元の質問"""
+        failing = FakeGenerate(error=RuntimeError("quota"))
+        result = rewrite_query("その続きは？", HISTORY, generate=failing, cache=RewriteCache())
+        self.assertEqual(result.query, "その続きは？")
+        self.assertFalse(result.rewritten)
+
+        generate = FakeGenerate()
+        result = rewrite_query("その続きは？", HISTORY, timeout=0, generate=generate, cache=RewriteCache())
+        self.assertFalse(result.rewritten)
+        self.assertEqual(generate.prompts, [])
+
+    def test_output_cleaned(self):
+        """出力の括弧・空行を取り除く"""
+        generate = FakeGenerate(output="\n「ナアマンの病気はどう治ったか」\n補足")
+        result = rewrite_query("どうなった？", HISTORY, generate=generate, cache=RewriteCache())
+        self.assertEqual(result.query, "ナアマンの病気はどう治ったか")
+
+    def test_recent_turns_and_prompt(self):
+        """直近 N 往復のみ使い、長い回答は切り詰める"""
+        history = HISTORY * 5 + [{'role': 'assistant', 'content': 'あ' * 1000}]
+        self.assertEqual(len(recent_turns(history, 2)), 4)
+        prompt = build_rewrite_prompt("それは？", recent_turns(history, 1))
+        self.assertNotIn('あ' * 301, prompt)
+
+
+class TestRewriteCache(unittest.TestCase):
+    """LRUキャッシュのテストクラス"""
+
+    def test_lru(self):
+        cache = RewriteCache(max_entries=2)
+        cache.put(("h", "a"), "A")
+        cache.put(("h", "b"), "B")
+        cache.get(("h", "a"))
+        cache.put(("h", "c"), "C")
+        self.assertEqual(cache.get(("h", "a")), "A")
+        self.assertIsNone(cache.get(("h", "b")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+"""
+レート制限・サーキットブレーカー・APIリトライ処理のテスト
+"""
+import unittest
+import os
+import sys
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils.rate_limit import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RateLimitTimeout,
+    TokenBucket,
+    get_circuit_breaker,
+    get_rate_limiter,
+    is_provider_healthy,
+    reset_registries,
+)
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.error_handler import (
+    APIRetryHandler,
+    classify_error,
+    get_retry_after,
+    get_user_friendly_error_message,
+)
+
+
+class FakeClock:
+    """テスト用の時計（sleepで時間が進む）"""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeProvider:
+    """指定した順にエラーを返し、その後は成功するAPIの代わり"""
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, prompt: str = "") -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"ok:{prompt}"
+
+
+class TestTokenBucket(unittest.TestCase):
+    """トークンバケットのテストクラス"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_then_paced(self):
+        """容量分は即座に、それ以降はレートに従って待機する"""
+        bucket = TokenBucket(requests_per_minute=60, capacity=2, clock=self.clock)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+        self.assertAlmostEqual(bucket.reserve(), 2.0)
+
+    def test_throttle_halves_rate_and_honours_retry_after(self):
+        """429でレートが半減し、retry-afterまで全員が待機する"""
+        bucket = TokenBucket(requests_per_minute=60, capacity=1, clock=self.clock)
+        bucket.on_throttle(retry_after=10)
+        self.assertAlmostEqual(bucket.rate, 0.5)
+        self.assertGreaterEqual(bucket.reserve(), 10.0)
+
+        for _ in range(100):
+            bucket.on_success()
+        self.assertAlmostEqual(bucket.rate, 1.0)
+
+    def test_acquire_timeout(self):
+        """待ち時間が上限を超える場合はRateLimitTimeout"""
+        bucket = TokenBucket(requests_per_minute=60, capacity=1, clock=self.clock)
+        bucket.on_throttle(retry_after=120)
+        with self.assertRaises(RateLimitTimeout):
+            bucket.acquire(max_wait=5, sleep=self.clock.sleep)
+        self.assertEqual(self.clock.sleeps, [])
+
+
+    def test_try_acquire_does_not_wait(self):
+        """トークンがなければ待たずにFalseを返し、何も消費しない"""
+        bucket = TokenBucket(requests_per_minute=60, capacity=1, clock=self.clock)
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.clock.now += 1.0
+        self.assertTrue(bucket.try_acquire())
+
+        bucket.on_throttle(retry_after=10)
+        self.clock.now += 5.0
+        self.assertFalse(bucket.try_acquire())
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """サーキットブレーカーのテストクラス"""
+
+    def test_open_half_open_close(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30, clock=clock)
+        breaker.before_call()
+        breaker.on_failure()
+        breaker.on_failure()
+        self.assertTrue(breaker.is_open)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        # 回復待ち後は1件だけ試行を許可
+        clock.now += 31
+        breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.on_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+
+    def test_release_trial_keeps_half_open(self):
+        """結果を判定できなかった試行は枠を返すだけで、状態は変えない"""
+        clock = FakeClock()
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, clock=clock)
+        breaker.on_failure()
+        clock.now += 31
+        breaker.before_call()
+        breaker.release_trial()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.before_call()
+
+
+class TestAPIRetryHandler(unittest.TestCase):
+    """APIリトライハンドラーのテストクラス"""
+
+    def setUp(self):
+        reset_registries()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        reset_registries()
+
+    def _handler(self, **kwargs) -> APIRetryHandler:
+        options = dict(max_retries=3, provider="fake:model", requests_per_minute=600,
+                       failure_threshold=3, sleep=self.clock.sleep)
+        options.update(kwargs)
+        return APIRetryHandler(**options)
+
+    def test_retry_after_hint_is_honoured(self):
+        """429のretry-afterヒントより短くは待たない"""
+        provider = FakeProvider([Exception("429 Resource has been exhausted. Please retry in 7.5s")])
+        result = self._handler().execute(provider, "q")
+        self.assertEqual(result, "ok:q")
+        self.assertEqual(provider.calls, 2)
+        self.assertGreaterEqual(sum(self.clock.sleeps), 7.5)
+
+    def test_non_retryable_error_is_raised_immediately(self):
+        """認証エラーは再試行しない"""
+        provider = FakeProvider([Exception("403 API key not valid")])
+        with self.assertRaises(Exception):
+            self._handler().execute(provider)
+        self.assertEqual(provider.calls, 1)
+        self.assertTrue(is_provider_healthy("fake:model"))
+
+    def test_circuit_opens_and_fails_fast(self):
+        """サーバーエラーが続くとブレーカーが開き、以降の呼び出しはAPIに届かない"""
+        provider = FakeProvider([Exception("503 Service Unavailable")] * 10)
+        with self.assertRaises(Exception):
+            self._handler().execute(provider)
+        self.assertEqual(provider.calls, 3)
+        self.assertFalse(is_provider_healthy("fake:model"))
+
+        # 別のハンドラーでも状態は共有される
+        with self.assertRaises(CircuitOpenError) as context:
+            self._handler().execute(provider)
+        self.assertEqual(provider.calls, 3)
+        self.assertIn("一時的に停止", get_user_friendly_error_message(context.exception))
+
+    def _open_breaker(self):
+        """ブレーカーを開いて回復待ちを過ぎた（half-open）状態にする"""
+        breaker = get_circuit_breaker("fake:model", failure_threshold=1, reset_timeout=30)
+        breaker.on_failure()
+        breaker.opened_at -= 31
+        return breaker
+
+    def test_rate_limit_timeout_releases_half_open_trial(self):
+        """half-open の試行がレート制限の待機で打ち切られても、次の呼び出しが回復を試せる"""
+        breaker = self._open_breaker()
+        bucket = get_rate_limiter("fake:model", 600)
+        bucket.on_throttle(retry_after=120)
+        provider = FakeProvider([])
+        with self.assertRaises(DeadlineExceeded):
+            self._handler(deadline=Deadline(2.0)).execute(provider)
+        self.assertEqual(provider.calls, 0)
+
+        bucket.paused_until = 0.0
+        self.assertEqual(self._handler().execute(provider, "q"), "ok:q")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_non_retryable_error_does_not_close_half_open_breaker(self):
+        """認証エラーは回復の証拠にならないため、half-open のブレーカーを閉じない"""
+        breaker = self._open_breaker()
+        with self.assertRaises(Exception):
+            self._handler().execute(FakeProvider([Exception("403 API key not valid")]))
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(self._handler().execute(FakeProvider([]), "q"), "ok:q")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_execute_with_fallback(self):
+        """失敗時はフォールバックの戻り値を返す"""
+        provider = FakeProvider([Exception("500 Internal error")])
+        handler = self._handler(max_retries=1)
+        self.assertEqual(handler.execute_with_fallback(provider, lambda: "fallback"), "fallback")
+        self.assertEqual(handler.execute_with_fallback(provider, lambda: "fallback"), "ok:")
+
+
+class FakeGenAI:
+    """google.generativeai の embed_content の代わり（呼び出しを記録）"""
+    def __init__(self):
+        self.calls = []
+
+    def embed_content(self, model: str, content, task_type: str):
+        self.calls.append(content)
+        return {"embedding": [[float(len(text)), 1.0] for text in content]}
+
+
+class TestRateLimitedEmbeddingFunction(unittest.TestCase):
+    """レート制限付きの埋め込み関数のテストクラス"""
+
+    def setUp(self):
+        reset_registries()
+
+    def tearDown(self):
+        reset_registries()
+        from src.pipeline.resources import set_embedding_rate_share
+
+        set_embedding_rate_share(1)
+
+    def _function(self):
+        from src.embedding.rate_limited import RateLimitedGeminiEmbeddingFunction
+
+        # APIキーなしで作成し、API呼び出しだけを差し替える
+        function = RateLimitedGeminiEmbeddingFunction.__new__(RateLimitedGeminiEmbeddingFunction)
+        function.model_name, function.task_type, function.dimension = "fake-embedding", "RETRIEVAL_DOCUMENT", None
+        function._genai = FakeGenAI()
+        return function
+
+    def test_one_token_per_batch_call(self):
+        """最大100テキストを1回のAPI呼び出しにまとめ、呼び出しごとにトークンを1つ消費する"""
+        function = self._function()
+        bucket = get_rate_limiter("gemini:fake-embedding", 6000, capacity=100)
+
+        texts = ["x" * (i % 7 + 1) for i in range(250)]
+        embeddings = function(texts)
+        self.assertEqual([e[0] for e in embeddings], [float(len(text)) for text in texts])
+        self.assertEqual([len(call) for call in function._genai.calls], [100, 100, 50])
+        self.assertGreater(bucket.tokens, 96.5)
+        self.assertLess(bucket.tokens, 97.5)
+        self.assertEqual(function.name(), "google_generative_ai")
+
+    def test_embedding_rate_is_separate_and_shared_by_workers(self):
+        """埋め込みは生成とは別の EMBEDDING_REQUESTS_PER_MINUTE を、ワーカー数で分け合う"""
+        from unittest import mock
+
+        from src.config import settings
+        from src.pipeline.resources import get_embedding_handler, set_embedding_rate_share
+
+        with mock.patch.object(settings.resilience, "embedding_requests_per_minute", 120.0), \
+                mock.patch.object(settings.resilience, "requests_per_minute", 60.0):
+            set_embedding_rate_share(4)
+            handler = get_embedding_handler("fake-embedding")
+        self.assertAlmostEqual(handler.rate_limiter.max_rate, 30.0 / 60.0)
+
+
+class TestErrorClassification(unittest.TestCase):
+    """エラー分類のテストクラス"""
+
+    def test_classify_error(self):
+        self.assertEqual(classify_error(Exception("429 quota exceeded")), "quota")
+        self.assertEqual(classify_error(Exception("401 Unauthorized")), "auth")
+        self.assertEqual(classify_error(Exception("502 Bad Gateway")), "server")
+        self.assertEqual(classify_error(TimeoutError("read timed out")), "network")
+        self.assertEqual(classify_error(ValueError("invalid argument")), "unknown")
+
+    def test_get_retry_after(self):
+        self.assertEqual(get_retry_after(Exception("retry_delay { seconds: 12 }")), 12.0)
+        self.assertEqual(get_retry_after(Exception("Please retry in 3.2s")), 3.2)
+        self.assertIsNone(get_retry_after(Exception("500 Internal error")))
+
+        error = Exception("429")
+        error.retry_after = 4
+        self.assertEqual(get_retry_after(error), 4.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+コレクションのエイリアスと無停止再構築のテスト
+"""
+import unittest
+import os
+import sys
+import json
+import tempfile
+import shutil
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.pipeline.aliases import (
+    SwapInProgress,
+    SwapLock,
+    collect_retired,
+    next_version_name,
+    read_alias,
+    resolve_collection,
+    switch_alias,
+)
+from src.pipeline.rebuild import rebuild_collection
+from src.pipeline.resources import get_pipeline_resources
+from src.pipeline.tenants import collection_name_for
+from src.retrieval.page_store import PageStore, page_store_path
+
+
+class FakeStore:
+    """store_embeddings の代わりに、文書ごとに決まった埋め込みでコレクションとページストアに登録する"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = []
+
+    def __call__(self, processed_path, storage_path, collection_name):
+        self.calls.append((os.path.basename(processed_path), collection_name))
+        if self.fail_on and processed_path.endswith(self.fail_on):
+            raise ConnectionError("network error")
+        with open(processed_path, encoding="utf-8") as f:
+            chunks = json.load(f)
+        ids = [f"{os.path.basename(processed_path)}_{i}" for i in range(len(chunks))]
+        collection = get_pipeline_resources().client(storage_path).get_or_create_collection(collection_name)
+        collection.upsert(ids=ids, documents=[c["content"] for c in chunks],
+                          metadatas=[c["metadata"] for c in chunks],
+                          embeddings=[c["embedding"] for c in chunks])
+        source = chunks[0]["metadata"]["source"]
+        PageStore(page_store_path(storage_path, collection_name)).replace_source(source, chunks)
+        return len(ids)
+
+
+class TestRebuild(unittest.TestCase):
+    """再構築のテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.processed_dir = os.path.join(self.temp_dir, "processed")
+        os.makedirs(self.processed_dir)
+        self.logical = collection_name_for(None)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        get_pipeline_resources().invalidate(self.storage_path, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write(self, name, count, offset=0):
+        chunks = [{"content": f"{name} {i}", "embedding": [float(offset + i), 1.0, 0.5],
+                   "metadata": {"source": f"{name}.pdf", "page": 1, "chunk_id": i}} for i in range(count)]
+        with open(os.path.join(self.processed_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+
+    def _rebuild(self, store, **kwargs):
+        return rebuild_collection(self.storage_path, self.processed_dir, store=store, sample_size=10,
+                                  min_recall=0.5, gc_grace_seconds=3600, **kwargs)
+
+    def test_alias_switch_and_gc(self):
+        """切り替えると旧版は退役し、猶予時間を過ぎてから削除される"""
+        self.assertEqual(resolve_collection(self.storage_path, "docs"), "docs")
+        self.assertEqual(next_version_name(self.storage_path, "docs"), "docs.v1")
+
+        self.assertEqual(switch_alias(self.storage_path, "docs", "docs.v1"), "docs")
+        self.assertEqual(resolve_collection(self.storage_path, "docs"), "docs.v1")
+        self.assertEqual(next_version_name(self.storage_path, "docs"), "docs.v2")
+
+        retired_at = read_alias(self.storage_path, "docs")["retired"][0]["retired_at"]
+        self.assertEqual(collect_retired(self.storage_path, "docs", 60, now=retired_at + 1), [])
+        self.assertEqual(collect_retired(self.storage_path, "docs", 60, now=retired_at + 61), ["docs"])
+        self.assertEqual(read_alias(self.storage_path, "docs")["retired"], [])
+
+    def test_rebuild_switches_after_validation(self):
+        """新しい版に登録して検証し、エイリアスを切り替える（旧版は猶予時間まで残る）"""
+        self._write("a", 5)
+        self._write("b", 5, offset=10)
+        FakeStore()(os.path.join(self.processed_dir, "a.json"), self.storage_path, self.logical)
+        FakeStore()(os.path.join(self.processed_dir, "b.json"), self.storage_path, self.logical)
+
+        result = self._rebuild(FakeStore())
+        self.assertTrue(result.switched, result.problems)
+        self.assertEqual(result.previous, self.logical)
+        self.assertEqual(result.target, f"{self.logical}.v1")
+        self.assertEqual(result.chunks, 10)
+        self.assertGreaterEqual(result.recall, 0.5)
+        self.assertEqual(resolve_collection(self.storage_path, self.logical), result.target)
+
+        # 旧版はまだ削除されていない（実行中の検索が読み終わるまで）
+        client = get_pipeline_resources().client(self.storage_path)
+        self.assertEqual(client.get_collection(self.logical).count(), 10)
+
+    def test_missing_document_aborts(self):
+        """旧版にある文書が新しい版にない場合は切り替えず、作りかけの版を削除する"""
+        self._write("a", 3)
+        FakeStore()(os.path.join(self.processed_dir, "a.json"), self.storage_path, self.logical)
+        self._write("b", 3, offset=10)
+        FakeStore()(os.path.join(self.processed_dir, "b.json"), self.storage_path, self.logical)
+        os.remove(os.path.join(self.processed_dir, "b.json"))
+
+        result = self._rebuild(FakeStore())
+        self.assertFalse(result.switched)
+        self.assertIn("b.pdf", result.problems[0])
+        self.assertEqual(resolve_collection(self.storage_path, self.logical), self.logical)
+        client = get_pipeline_resources().client(self.storage_path)
+        names = {c if isinstance(c, str) else c.name for c in client.list_collections()}
+        self.assertNotIn(result.target, names)
+
+    def test_document_not_in_previous_version_aborts(self):
+        """旧版にない文書（削除したPDFの処理済みJSONなど）が新しい版に入る場合は切り替えない"""
+        self._write("a", 3)
+        FakeStore()(os.path.join(self.processed_dir, "a.json"), self.storage_path, self.logical)
+        self._write("deleted", 3, offset=10)
+
+        result = self._rebuild(FakeStore())
+        self.assertFalse(result.switched)
+        self.assertIn("deleted.pdf", result.problems[0])
+        self.assertEqual(resolve_collection(self.storage_path, self.logical), self.logical)
+
+    def test_store_failure_aborts(self):
+        self._write("a", 3)
+        result = self._rebuild(FakeStore(fail_on="a.json"))
+        self.assertFalse(result.switched)
+        self.assertEqual(resolve_collection(self.storage_path, self.logical), self.logical)
+
+    def test_query_overlap(self):
+        """検証用クエリの上位結果が旧版と重ならなければ切り替えない"""
+        self._write("a", 3)
+        FakeStore()(os.path.join(self.processed_dir, "a.json"), self.storage_path, self.logical)
+
+        def search(collection_name, query, k):
+            page = 1 if collection_name == self.logical else 2
+            return [{"metadata": {"source": "a.pdf", "page": page}}]
+
+        result = self._rebuild(FakeStore(), queries=["質問"], search=search, min_query_overlap=0.5)
+        self.assertFalse(result.switched)
+        self.assertEqual(result.query_overlap, 0.0)
+
+    def test_concurrent_rebuild_refused(self):
+        with SwapLock(self.storage_path, self.logical):
+            with self.assertRaises(SwapInProgress):
+                self._rebuild(FakeStore())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+スナップショットの書き出し・復元のテスト
+"""
+import unittest
+import os
+import sys
+import json
+import tempfile
+import shutil
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.pipeline.aliases import SwapInProgress, SwapLock, read_alias, resolve_collection
+from src.pipeline.resources import get_pipeline_resources
+from src.pipeline.snapshot import MANIFEST_FILE, export_snapshot, import_snapshot, read_manifest
+from src.pipeline.tenants import collection_name_for
+from src.retrieval.page_store import PageStore, page_store_path
+
+
+class TestSnapshot(unittest.TestCase):
+    """スナップショットのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.snapshot_dir = os.path.join(self.temp_dir, "snapshot")
+        self.logical = collection_name_for(None)
+        self.client = get_pipeline_resources().client(self.storage_path)
+
+        collection = self.client.get_or_create_collection(self.logical)
+        self.ids = [f"doc.json_{i}" for i in range(7)]
+        self.embeddings = [[float(i), 1.0, 0.5] for i in range(7)]
+        chunks = [{"content": f"本文 {i}", "metadata": {"source": "doc.pdf", "page": i + 1, "chunk_id": i}}
+                  for i in range(7)]
+        collection.add(ids=self.ids, embeddings=self.embeddings,
+                       documents=[c["content"] for c in chunks], metadatas=[c["metadata"] for c in chunks])
+        PageStore(page_store_path(self.storage_path, self.logical)).replace_source("doc.pdf", chunks)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        get_pipeline_resources().invalidate(self.storage_path, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _open_collection(self, name):
+        # 埋め込み関数なしで作成（テストではAPIを使わない）
+        return self.client.get_or_create_collection(name)
+
+    def test_export_and_restore(self):
+        """書き出したスナップショットを新しい版に復元して切り替える"""
+        info = export_snapshot(self.snapshot_dir, storage_path=self.storage_path, page_size=3)
+        self.assertEqual((info.count, info.dimensions), (7, 3))
+        self.assertEqual(read_manifest(self.snapshot_dir)["count"], 7)
+
+        result = import_snapshot(self.snapshot_dir, storage_path=self.storage_path, batch_size=2,
+                                 open_collection=self._open_collection)
+        self.assertEqual(result.previous, self.logical)
+        self.assertEqual(result.target, resolve_collection(self.storage_path, self.logical))
+        self.assertEqual([r["name"] for r in read_alias(self.storage_path, self.logical)["retired"]],
+                         [self.logical])
+
+        restored = self.client.get_collection(result.target).get(ids=self.ids, include=["embeddings", "metadatas"])
+        by_id = dict(zip(restored["ids"], restored["embeddings"]))
+        for chunk_id, embedding in zip(self.ids, self.embeddings):
+            self.assertEqual(list(by_id[chunk_id]), embedding)
+        self.assertEqual(PageStore(page_store_path(self.storage_path, result.target)).source_count(), 1)
+
+    def test_refuses_mismatched_settings(self):
+        """埋め込みモデルが異なるスナップショットは force なしでは復元しない"""
+        export_snapshot(self.snapshot_dir, storage_path=self.storage_path)
+        manifest_path = os.path.join(self.snapshot_dir, MANIFEST_FILE)
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest["fingerprint"]["embedding_model"] = "models/other-embedding"
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        with self.assertRaises(ValueError):
+            import_snapshot(self.snapshot_dir, storage_path=self.storage_path,
+                            open_collection=self._open_collection)
+        self.assertEqual(resolve_collection(self.storage_path, self.logical), self.logical)
+
+        result = import_snapshot(self.snapshot_dir, storage_path=self.storage_path, force=True,
+                                 open_collection=self._open_collection)
+        self.assertEqual(result.count, 7)
+
+    def test_refuses_corrupted_file(self):
+        """ファイルが壊れている場合は復元しない"""
+        export_snapshot(self.snapshot_dir, storage_path=self.storage_path)
+        with open(os.path.join(self.snapshot_dir, "ids.json.gz"), "ab") as f:
+            f.write(b"broken")
+        with self.assertRaises(ValueError):
+            import_snapshot(self.snapshot_dir, storage_path=self.storage_path,
+                            open_collection=self._open_collection)
+
+    def test_refuses_while_swap_running(self):
+        """再構築・復元が実行中の場合は復元しない"""
+        export_snapshot(self.snapshot_dir, storage_path=self.storage_path)
+        with SwapLock(self.storage_path, self.logical):
+            with self.assertRaises(SwapInProgress):
+                import_snapshot(self.snapshot_dir, storage_path=self.storage_path,
+                                open_collection=self._open_collection)
+
+
+if __name__ == '__main__':
+    unittest.main()
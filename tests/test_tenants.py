@@ -0,0 +1,125 @@
+"""
+テナントごとのコレクション・上限・クリアのテスト
+"""
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config import settings
+from src.pipeline.resources import get_pipeline_resources
+from src.pipeline.tenants import (
+    check_chunk_quota,
+    check_document_quota,
+    clear_tenant,
+    collection_name_for,
+    job_tenant,
+    parse_tenant_assignments,
+    resolve_tenant,
+    source_path_for,
+    tenant_dirs,
+    tenant_for_user,
+)
+from src.retrieval.page_store import PageStore, page_store_path
+from src.utils.error_handler import TenantLimitExceeded, classify_error, is_retryable_error
+
+
+def _chunk(source, page=1, chunk_id=0):
+    return {"content": f"{source} {chunk_id}", "metadata": {"source": source, "page": page, "chunk_id": chunk_id}}
+
+
+class TestTenants(unittest.TestCase):
+    """テナントのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "chroma")
+        self.default = settings.tenants.default_tenant
+        self.base = settings.storage.collection_name
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        get_pipeline_resources().invalidate(self.storage_path, close_client=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_default_tenant_keeps_existing_names(self):
+        """既定のテナントは従来のコレクション名・パスを使う"""
+        self.assertEqual(collection_name_for(None), self.base)
+        self.assertEqual(collection_name_for(self.default), self.base)
+        self.assertEqual(source_path_for("doc.pdf"), "doc.pdf")
+        self.assertIsNone(job_tenant(self.default))
+
+    def test_other_tenant_is_namespaced(self):
+        self.assertEqual(collection_name_for("team-a"), f"{self.base}__team-a")
+        self.assertEqual(source_path_for("doc.pdf", "team-a"), "tenants/team-a/doc.pdf")
+        raw_dir, processed_dir = tenant_dirs("team-a", "raw", "processed")
+        self.assertEqual(raw_dir, os.path.join("raw", "tenants", "team-a"))
+        self.assertEqual(processed_dir, os.path.join("processed", "tenants", "team-a"))
+        self.assertEqual(job_tenant("team-a"), "team-a")
+
+    def test_invalid_tenant(self):
+        """パスやコレクション名を壊す名前は使えない"""
+        for name in ("../etc", "a/b", "-a", "a" * 64):
+            with self.assertRaises(ValueError):
+                resolve_tenant(name)
+
+    def test_tenant_is_assigned_server_side(self):
+        """テナントはログインユーザーの割り当てで決まり、未ログイン・割り当てなしは既定のテナント"""
+        assignments = parse_tenant_assignments("Alice@Example.com=team-a, @example.org=team-b")
+        self.assertEqual(tenant_for_user("alice@example.com", assignments), "team-a")
+        self.assertEqual(tenant_for_user("carol@example.org", assignments), "team-b")
+        self.assertEqual(tenant_for_user("mallory@evil.test", assignments), self.default)
+        self.assertEqual(tenant_for_user(None, assignments), self.default)
+        for value in ("team-a", "alice@example.com=../etc"):
+            with self.assertRaises(ValueError):
+                parse_tenant_assignments(value)
+
+    def test_chunk_quota(self):
+        """再取り込みは置き換わるチャンクを差し引いて数える"""
+        check_chunk_quota(current=80, replaced=30, added=50, max_chunks=100)
+        check_chunk_quota(current=10 ** 6, replaced=0, added=1, max_chunks=0)
+        with self.assertRaises(TenantLimitExceeded):
+            check_chunk_quota(current=80, replaced=0, added=30, max_chunks=100)
+
+    def test_document_quota_counts_pending_jobs(self):
+        store = PageStore(page_store_path(self.storage_path, collection_name_for("team-a")))
+        store.replace_source("a.pdf", [_chunk("a.pdf")])
+        check_document_quota(self.storage_path, "team-a", max_documents=2)
+        with self.assertRaises(TenantLimitExceeded):
+            check_document_quota(self.storage_path, "team-a", pending=1, max_documents=2)
+        # 他のテナントの文書は数えない
+        check_document_quota(self.storage_path, "team-b", max_documents=1)
+
+    def test_limit_is_not_retried(self):
+        error = TenantLimitExceeded("上限")
+        self.assertEqual(classify_error(error), "limit")
+        self.assertFalse(is_retryable_error(error))
+
+    def test_clear_only_drops_that_tenant(self):
+        """クリアはそのテナントのコレクションとページストアだけを削除する"""
+        client = get_pipeline_resources().client(self.storage_path)
+        for tenant in ("team-a", "team-b"):
+            client.get_or_create_collection(collection_name_for(tenant)).add(
+                ids=["1"], embeddings=[[1.0, 0.0]], documents=["doc"])
+            PageStore(page_store_path(self.storage_path, collection_name_for(tenant))).replace_source(
+                "a.pdf", [_chunk("a.pdf")])
+
+        self.assertTrue(clear_tenant(self.storage_path, "team-a"))
+        names = {c.name if hasattr(c, "name") else c for c in client.list_collections()}
+        self.assertNotIn(collection_name_for("team-a"), names)
+        self.assertIn(collection_name_for("team-b"), names)
+        self.assertFalse(os.path.exists(page_store_path(self.storage_path, collection_name_for("team-a"))))
+        self.assertTrue(os.path.exists(page_store_path(self.storage_path, collection_name_for("team-b"))))
+        self.assertEqual(client.get_collection(collection_name_for("team-b")).count(), 1)
+
+        # 2回目は削除するものがない
+        self.assertFalse(clear_tenant(self.storage_path, "team-a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+監視フォルダからの自動取り込みのテスト
+"""
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import threading
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.ingestion.job_queue import JobQueue
+from src.ingestion.watcher import FolderWatcher, InotifyNotifier, create_notifier
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFolderWatcher(unittest.TestCase):
+    """FolderWatcherのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.raw_dir = os.path.join(self.temp_dir, "raw")
+        os.makedirs(self.raw_dir)
+        self.queue = JobQueue(os.path.join(self.temp_dir, "jobs.db"))
+        self.clock = FakeClock()
+        self.deleted = []
+        self.watcher = FolderWatcher(
+            self.queue, raw_dir=self.raw_dir, debounce_seconds=2.0,
+            delete_document=lambda source, storage_path: self.deleted.append(source) or 1,
+            clock=self.clock
+        )
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write(self, name, content, mtime=None):
+        path = os.path.join(self.raw_dir, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return os.path.abspath(path)
+
+    def _settle(self):
+        """書き込み完了の判定を待って走査"""
+        events = self.watcher.scan()
+        self.clock.now += 3
+        return events + self.watcher.scan()
+
+    def test_new_file_is_debounced(self):
+        """サイズ・更新時刻が変化しなくなるまで登録しない"""
+        path = self._write("a.pdf", b"part", mtime=1000)
+        self.assertEqual(self.watcher.scan(), [])
+        self.assertTrue(self.watcher.has_unsettled)
+
+        # 書き込みが続いている
+        self.clock.now += 1
+        self._write("a.pdf", b"partial", mtime=1001)
+        self.assertEqual(self.watcher.scan(), [])
+        self.clock.now += 1.5
+        self.assertEqual(self.watcher.scan(), [])
+
+        self.clock.now += 1
+        self.assertEqual(self.watcher.scan(), [("new", path)])
+        self.assertFalse(self.watcher.has_unsettled)
+        self.assertEqual(self.queue.pending_count(), 1)
+        self.assertEqual(self.queue.list_jobs()[0]['pdf_path'], path)
+
+    def test_ignores_non_pdf(self):
+        self._write("notes.txt", b"x")
+        self.assertEqual(self._settle(), [])
+
+    def test_changed_and_touched_files(self):
+        """内容が変わったら再登録し、更新時刻だけの変化では登録しない"""
+        path = self._write("a.pdf", b"v1", mtime=1000)
+        self.assertEqual(self._settle(), [("new", path)])
+        self.assertEqual(self._settle(), [])
+        self.queue.claim("w1")
+
+        self._write("a.pdf", b"v1", mtime=2000)
+        self.assertEqual(self._settle(), [])
+        self.assertEqual(self.queue.get_source_files()[path]['mtime_ns'], 2000 * 10**9)
+
+        self._write("a.pdf", b"v2", mtime=3000)
+        self.assertEqual(self._settle(), [("changed", path)])
+        self.assertEqual(self.queue.pending_count(), 2)
+
+    def test_deleted_file(self):
+        """削除されたPDFのチャンクを削除して記録から外す"""
+        path = self._write("a.pdf", b"v1", mtime=1000)
+        self._settle()
+        os.remove(path)
+        self.assertEqual(self.watcher.scan(), [("deleted", path)])
+        self.assertEqual(self.deleted, ["a.pdf"])
+        self.assertEqual(self.queue.get_source_files(), {})
+
+    def test_deleted_file_removes_processed_json(self):
+        """削除されたPDFの処理済みJSONも削除する（再構築で文書が戻らないように）"""
+        path = self._write("a.pdf", b"v1", mtime=1000)
+        self._settle()
+        job = self.queue.claim("w1")
+        processed_path = os.path.join(self.temp_dir, "a.json")
+        with open(processed_path, "w", encoding="utf-8") as f:
+            f.write("[]")
+        self.queue.update(job['id'], processed_path=processed_path)
+
+        os.remove(path)
+        self.assertEqual(self.watcher.scan(), [("deleted", path)])
+        self.assertFalse(os.path.exists(processed_path))
+
+    def test_failed_job_is_retried(self):
+        """取り込みに失敗したファイルは、変わっていなくても待ち時間の後に再登録する"""
+        self.watcher.retry_failed_seconds = 60
+        path = self._write("a.pdf", b"v1", mtime=1000)
+        self._settle()
+        job = self.queue.claim("w1")
+        self.queue.fail(job['id'], "壊れたPDF")
+
+        self.assertEqual(self.watcher.scan(), [])
+        self.clock.now += 61
+        self.assertEqual(self.watcher.scan(), [("retry", path)])
+        self.assertEqual(self.queue.pending_count(), 1)
+        self.assertNotEqual(self.queue.get_source_files()[path]['job_id'], job['id'])
+        self.assertEqual(self.watcher.scan(), [])
+
+    def test_file_with_active_job_is_not_enqueued_again(self):
+        """UIのアップロードなど、まだ開始していないジョブがあるファイルは登録しない"""
+        path = self._write("upload.pdf", b"v1", mtime=1000)
+        job_id = self.queue.enqueue(path, owner="session")
+        self.assertEqual(self._settle(), [])
+        self.assertEqual(self.queue.pending_count(), 1)
+        self.assertEqual(self.queue.get_source_files()[path]['job_id'], job_id)
+
+    def test_records_of_other_folders_are_ignored(self):
+        """監視フォルダ以外の記録は削除されたファイルとして扱わない"""
+        other = os.path.join(self.temp_dir, "raw", "tenants", "team-a", "a.pdf")
+        self.queue.record_source_file(other, "hash", 1, 1)
+        self.assertEqual(self.watcher.scan(), [])
+        self.assertEqual(self.deleted, [])
+
+    def test_without_debounce(self):
+        """debounce 0 なら1回の走査で登録（一括取り込み）"""
+        self.watcher.debounce_seconds = 0
+        paths = [self._write(f"{i}.pdf", bytes([i])) for i in range(5)]
+        self.assertEqual(self.watcher.scan(), [("new", path) for path in sorted(paths)])
+
+    def test_run_stops(self):
+        stop_event = threading.Event()
+        stop_event.set()
+        self.watcher.run(stop_event, poll_interval=0.01, use_inotify=False)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotifyはLinuxのみ")
+    def test_inotify_wakes_on_change(self):
+        notifier = create_notifier(self.raw_dir)
+        try:
+            self.assertIsInstance(notifier, InotifyNotifier)
+            self.assertFalse(notifier.wait(0.01))
+            self._write("a.pdf", b"x")
+            self.assertTrue(notifier.wait(1.0))
+        finally:
+            notifier.close()
+
+
+if __name__ == '__main__':
+    unittest.main()